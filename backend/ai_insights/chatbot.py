@@ -0,0 +1,266 @@
+import re
+import time
+from datetime import date, timedelta
+
+from django.utils import timezone
+
+from rfm.lazy import LazyModule
+
+from .llm import get_model
+
+pd = LazyModule('pandas')
+
+
+# Rolling windows, same meaning as RevenueAnalyticsView's `period` parameter.
+PERIOD_DAYS = {
+    'today': 0,
+    'week': 7,
+    'month': 30,
+    'quarter': 90,
+    'year': 365,
+}
+
+MONTHS = {
+    name: index
+    for index, names in enumerate(
+        [('jan', 'january'), ('feb', 'february'), ('mar', 'march'), ('apr', 'april'), ('may',), ('jun', 'june'),
+         ('jul', 'july'), ('aug', 'august'), ('sep', 'sept', 'september'), ('oct', 'october'), ('nov', 'november'),
+         ('dec', 'december')],
+        start=1,
+    )
+    for name in names
+}
+
+NUMBER_WORDS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10}
+
+MAX_TOP_K = 50
+CHAT_ANSWER_CACHE_SIZE = 64
+
+
+def _money(value):
+    return f'{value:,.2f}'
+
+
+def _records(df):
+    """Small result frames -> JSON-friendly records (dates as ISO strings)."""
+    out = df.copy()
+    for column in out.columns:
+        if pd.api.types.is_datetime64_any_dtype(out[column]):
+            out[column] = out[column].dt.date.astype(str)
+    return out.to_dict('records')
+
+
+class InvalidPeriod(ValueError):
+    """A question names a date that doesn't exist, e.g. 2025-02-30."""
+
+
+def parse_period(text, today):
+    """
+    Extracts a (start, end, label) date range from a question; (None, None, 'all time') if none.
+    Understands 'today', 'yesterday', 'this/last week|month|quarter|year', 'last N days|weeks|months',
+    'in 2024', 'in March 2024', 'since 2024-01-01' and 'between 2024-01-01 and 2024-03-31'.
+    Raises InvalidPeriod for dates that don't exist.
+    """
+    try:
+        return _parse_period(text, today)
+    except ValueError as e:
+        raise InvalidPeriod(f"Couldn't read the dates in your question ({e}); use real dates such as 2024-01-31.")
+
+
+def _parse_period(text, today):
+    between = re.search(r'between\s+(\d{4}-\d{2}-\d{2})\s+and\s+(\d{4}-\d{2}-\d{2})', text)
+    if between:
+        start, end = date.fromisoformat(between.group(1)), date.fromisoformat(between.group(2))
+        return start, end, f'{start} to {end}'
+
+    since = re.search(r'since\s+(\d{4}-\d{2}-\d{2})', text)
+    if since:
+        start = date.fromisoformat(since.group(1))
+        return start, today, f'since {start}'
+
+    if re.search(r'\btoday\b', text):
+        return today, today, 'today'
+    if re.search(r'\byesterday\b', text):
+        yesterday = today - timedelta(days=1)
+        return yesterday, yesterday, 'yesterday'
+
+    last_n = re.search(r'(?:last|past)\s+(\d+|' + '|'.join(NUMBER_WORDS) + r')\s+(day|week|month|year)s?', text)
+    if last_n:
+        count = NUMBER_WORDS.get(last_n.group(1)) or int(last_n.group(1))
+        days = count * {'day': 1, 'week': 7, 'month': 30, 'year': 365}[last_n.group(2)]
+        return today - timedelta(days=days), today, f'last {count} {last_n.group(2)}{"s" if count != 1 else ""}'
+
+    rolling = re.search(r'(?:this|last|past)\s+(week|month|quarter|year)', text)
+    if rolling:
+        days = PERIOD_DAYS[rolling.group(1)]
+        return today - timedelta(days=days), today, f'last {days} days'
+
+    month_year = re.search(r'\b(' + '|'.join(sorted(MONTHS, key=len, reverse=True)) + r')\s+(\d{4})\b', text)
+    if month_year:
+        month, year = MONTHS[month_year.group(1)], int(month_year.group(2))
+        start = date(year, month, 1)
+        end = (date(year + (month == 12), month % 12 + 1, 1)) - timedelta(days=1)
+        return start, end, start.strftime('%B %Y')
+
+    year = re.search(r'\b(?:in|during|for)\s+(\d{4})\b', text)
+    if year:
+        value = int(year.group(1))
+        return date(value, 1, 1), date(value, 12, 31), str(value)
+
+    return None, None, 'all time'
+
+
+class QueryRouter:
+    """
+    Answers common structured questions directly from UserAggregates.
+
+    Each intent is a method returning an answer dict, or None when the question is not
+    for it; intents are tried in order and the first match wins. A named customer comes
+    first, so "how much has customer C1 made" is about C1 and not total revenue, and revenue
+    comes before segments, whose names ('Other') can be ordinary words. Anything unmatched is
+    left to the model fallback in answer_question().
+    """
+
+    intents = ('customer_history', 'top_customers', 'revenue', 'segments', 'customer_count', 'cities')
+
+    def route(self, question, aggregates):
+        text = ' '.join(question.lower().split())
+        for intent in self.intents:
+            answer = getattr(self, intent)(text, question, aggregates)
+            if answer is not None:
+                answer['intent'] = intent
+                return answer
+        return None
+
+    def top_customers(self, text, question, aggregates):
+        if not re.search(r'\b(top|best|biggest|largest|highest|most valuable)\b.*\bcustomers?\b', text):
+            return None
+        count = re.search(r'\btop\s+(\d+|' + '|'.join(NUMBER_WORDS) + r')\b', text)
+        k = 10
+        if count:
+            k = NUMBER_WORDS.get(count.group(1)) or int(count.group(1))
+        k = max(1, min(k, MAX_TOP_K))
+
+        # Only a city in the data counts: "top customers in the last month" isn't about a city
+        city = None
+        city_match = re.search(r'\b(?:in|from|at)\s+([a-z][a-z .\'-]*?)\s*\??$', text)
+        if city_match:
+            city = aggregates.city_names.get(city_match.group(1).strip())
+
+        top = aggregates.top_customers(k=k, city=city)
+        where = f' in {city}' if city else ''
+        if top.empty:
+            return {'answer': f'There are no customers{where}.', 'data': []}
+        lines = [f'{i}. {row.customer_id} - {_money(row.total_paid)}' for i, row in enumerate(top.itertuples(), start=1)]
+        return {'answer': f'Top {len(top)} customers{where} by total paid:\n' + '\n'.join(lines), 'data': _records(top)}
+
+    def segments(self, text, question, aggregates):
+        counts = aggregates.segment_counts
+        named = [segment for segment in counts if re.search(rf'\b{re.escape(segment.lower())}\b', text)]
+        if named:
+            segment = max(named, key=len)
+            return {
+                'answer': f"{counts[segment]} customers are in the '{segment}' segment.",
+                'data': {segment: counts[segment]},
+            }
+        if not re.search(r'\bsegment', text):
+            return None
+        lines = [f'- {segment}: {count}' for segment, count in counts.items()]
+        return {'answer': 'Customers per segment:\n' + '\n'.join(lines), 'data': counts}
+
+    def revenue(self, text, question, aggregates):
+        if not re.search(r'\b(revenue|sales|income|earn(?:ed|ings)?|turnover|made)\b', text):
+            return None
+        start, end, label = parse_period(text, timezone.now().date())
+        total = aggregates.revenue_between(start, end)
+        return {
+            'answer': f'Revenue for {label}: {_money(total)}.',
+            'data': {'start': start, 'end': end, 'revenue': round(total, 2)},
+        }
+
+    def customer_history(self, text, question, aggregates):
+        # Match against the original question so ids keep their case.
+        match = re.search(r'\bcustomer\s+(?:id\s+)?#?([A-Za-z0-9_.\-]+)', question, re.IGNORECASE)
+        if not match:
+            return None
+        customer_id = aggregates.find_customer_id(match.group(1))
+        if customer_id is None:
+            return None
+        history = aggregates.customer_history(customer_id)
+        stats = aggregates.customers.loc[customer_id]
+        recent = history.tail(10).iloc[::-1][['purchase_date', 'amount', 'city', 'product_type']]
+        lines = [f'- {row.purchase_date.date()}: {_money(row.amount)}' for row in recent.itertuples()]
+        return {
+            'answer': (
+                f'Customer {customer_id} made {int(stats.order_count)} purchases totalling {_money(stats.total_paid)} '
+                f'between {stats.first_purchase.date()} and {stats.last_purchase.date()}'
+                f' ({int(stats.loyalty_points)} loyalty points). Most recent:\n' + '\n'.join(lines)
+            ),
+            'data': {'customer_id': customer_id, 'transactions': _records(recent)},
+        }
+
+    def customer_count(self, text, question, aggregates):
+        if not re.search(r'\bhow many\b.*\bcustomers\b', text):
+            return None
+        total = len(aggregates.customers)
+        return {'answer': f'You have {total} customers.', 'data': {'total_customers': total}}
+
+    def cities(self, text, question, aggregates):
+        if not re.search(r'\b(which|what|list)\b.*\bcities\b', text):
+            return None
+        cities = sorted(aggregates.city_names.values())
+        return {'answer': 'Cities in your data: ' + ', '.join(cities) + '.', 'data': cities}
+
+
+def compact_context(aggregates):
+    """
+    A short textual summary of the dataset for model fallbacks, memoized per dataset version.
+    It stays a few hundred tokens regardless of dataset size.
+    """
+    cached = aggregates.derived.get('chat_context')
+    if cached is not None:
+        return cached
+
+    top = aggregates.top_customers(k=5)
+    cities = aggregates.customers.groupby('city')['total_paid'].sum().sort_values(ascending=False).head(5)
+    today = timezone.now().date()
+    lines = [
+        f'Total customers: {len(aggregates.customers)}',
+        f'Total transactions: {len(aggregates.transactions)}',
+        f'Total revenue: {_money(aggregates.revenue_between())}',
+        f'Revenue last 30 days: {_money(aggregates.revenue_between(today - timedelta(days=30), today))}',
+        f'Date range: {aggregates.transactions["purchase_date"].min().date()} to {aggregates.transactions["purchase_date"].max().date()}',
+        'Segments: ' + ', '.join(f'{segment}={count}' for segment, count in aggregates.segment_counts.items()),
+        'Top cities by revenue: ' + ', '.join(f'{city or "unknown"}={_money(total)}' for city, total in cities.items()),
+        'Top customers: ' + ', '.join(f'{row.customer_id}={_money(row.total_paid)}' for row in top.itertuples()),
+    ]
+    context = '\n'.join(lines)
+    aggregates.derived['chat_context'] = context
+    return context
+
+
+def answer_question(question, aggregates, router=None):
+    """
+    Answers a chat message: locally via the QueryRouter when possible, otherwise by asking the
+    configured model with the compact context. Model answers are memoized per dataset version.
+    """
+    started = time.perf_counter()
+    answer = (router or QueryRouter()).route(question, aggregates)
+    if answer is not None:
+        answer['source'] = 'local'
+    else:
+        answers = aggregates.derived.setdefault('chat_answers', {})
+        key = ' '.join(question.lower().split())
+        if key not in answers:
+            prompt = (
+                'You are a data assistant for a customer analytics dashboard. Answer the question '
+                'concisely using only the dataset summary below. If the summary does not contain the '
+                'answer, say what information is missing.\n\n'
+                f'Dataset summary:\n{compact_context(aggregates)}\n\nQuestion: {question}'
+            )
+            if len(answers) >= CHAT_ANSWER_CACHE_SIZE:
+                answers.pop(next(iter(answers)))
+            answers[key] = get_model().generate(prompt)
+        answer = {'answer': answers[key], 'data': None, 'intent': 'fallback', 'source': 'model'}
+    answer['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return answer
@@ -0,0 +1,70 @@
+import os
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from rfm.lazy import LazyModule
+
+# The SDK pulls in grpc/protobuf (~0.5s); import it on the first Gemini call only
+genai = LazyModule('google.generativeai')
+
+
+class ModelUnavailable(Exception):
+    """Raised when the configured text model cannot be used (e.g. missing API key)."""
+
+
+class GeminiModel:
+    """
+    Google Gemini text model. Configured from GEMINI_API_KEY the first time it is used.
+    """
+    model_name = 'gemini-pro'
+    _configured_key = None
+
+    def __init__(self):
+        self.api_key = os.getenv('GEMINI_API_KEY')
+
+    def is_available(self):
+        return bool(self.api_key)
+
+    def generate(self, prompt):
+        if not self.api_key:
+            raise ModelUnavailable('AI service is not configured. Missing API key.')
+        if GeminiModel._configured_key != self.api_key:
+            genai.configure(api_key=self.api_key)
+            GeminiModel._configured_key = self.api_key
+
+        response = genai.GenerativeModel(self.model_name).generate_content(prompt)
+        # Basic error handling for the response object
+        if response.text:
+            return response.text
+        # Check parts if text is empty, sometimes content is in parts
+        if response.parts:
+            return ''.join(part.text for part in response.parts)
+        print(f"Gemini API response issue: {response}")
+        raise Exception('Received empty response from AI service')
+
+
+class StubModel:
+    """
+    Local stand-in for the Gemini model: no network, no key, deterministic output.
+    Select it with AI_MODEL_BACKEND=ai_insights.llm.StubModel for development and load tests.
+    """
+
+    def is_available(self):
+        return True
+
+    def generate(self, prompt):
+        return (
+            'Insights\n'
+            f'- (stub model) Received a {len(prompt)}-character prompt.\n\n'
+            'Action Tips\n'
+            '1. Re-engage customers that have not purchased recently.\n'
+            '2. Reward the most loyal customers.\n'
+            '3. Nurture new customers into repeat buyers.\n'
+        )
+
+
+def get_model():
+    """Instantiates the text model configured by settings.AI_MODEL_BACKEND (a dotted path)."""
+    backend = getattr(settings, 'AI_MODEL_BACKEND', 'ai_insights.llm.GeminiModel')
+    return import_string(backend)()
@@ -1,3 +1,123 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from rfm.aggregates import clear_user_aggregates
+from rfm.models import Transaction
+from rfm.versioning import bump_dataset_version
+
+
+class FakeModel:
+    """Local fake text model; records every prompt it receives."""
+    prompts = []
+
+    def is_available(self):
+        return True
+
+    def generate(self, prompt):
+        FakeModel.prompts.append(prompt)
+        return 'fake answer'
+
+
+@override_settings(AI_MODEL_BACKEND='ai_insights.tests.FakeModel')
+class ChatbotTests(APITestCase):
+
+    def setUp(self):
+        FakeModel.prompts = []
+        clear_user_aggregates()
+        self.user = User.objects.create_user('alice', password='pw')
+        today = date.today()
+        rows = [
+            ('C1', 1, '120.00', 'Lagos'),
+            ('C1', 45, '80.00', 'Lagos'),
+            ('C2', 3, '300.00', 'Abuja'),
+            ('C3', 10, '50.00', 'Lagos'),
+            ('C4', 400, '75.00', 'Kano'),
+        ]
+        Transaction.objects.bulk_create([
+            Transaction(user=self.user, customer_id=cid, purchase_date=today - timedelta(days=days_ago),
+                        amount=Decimal(amount), city=city, product_type='Russet', loyalty_points=1)
+            for cid, days_ago, amount, city in rows
+        ])
+        bump_dataset_version(self.user)
+        self.client.force_authenticate(self.user)
+        self.url = reverse('ai_insights:chatbot')
+
+    def ask(self, message):
+        response = self.client.post(self.url, {'message': message}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_top_customers_in_city_answered_locally(self):
+        answer = self.ask('Who are the top 2 customers in lagos?')
+        self.assertEqual(answer['intent'], 'top_customers')
+        self.assertEqual(answer['source'], 'local')
+        self.assertEqual([row['customer_id'] for row in answer['data']], ['C1', 'C3'])
+        self.assertEqual(FakeModel.prompts, [])
+
+    def test_revenue_for_period(self):
+        answer = self.ask('What was our revenue in the last 30 days?')
+        self.assertEqual(answer['intent'], 'revenue')
+        self.assertEqual(answer['data']['revenue'], 470.0)
+        self.assertEqual(self.ask('total sales')['data']['revenue'], 625.0)
+
+    def test_segment_sizes_and_customer_history(self):
+        segments = self.ask('How big is each segment?')
+        self.assertEqual(segments['intent'], 'segments')
+        self.assertEqual(sum(segments['data'].values()), 4)
+
+        history = self.ask('Show me the history of customer c1')
+        self.assertEqual(history['intent'], 'customer_history')
+        self.assertEqual(history['data']['customer_id'], 'C1')
+        self.assertEqual(len(history['data']['transactions']), 2)
+
+    def test_named_customer_wins_over_revenue_and_cities_must_exist(self):
+        answer = self.ask('How much has customer C1 made?')
+        self.assertEqual(answer['intent'], 'customer_history')
+        self.assertEqual(answer['data']['customer_id'], 'C1')
+        self.assertIn('totalling', answer['answer'])
+
+        answer = self.ask('Who were the top customers in the last month?')
+        self.assertEqual(answer['intent'], 'top_customers')
+        self.assertEqual([row['customer_id'] for row in answer['data']], ['C2', 'C1', 'C4', 'C3'])
+
+    def test_segment_names_are_whole_words_and_dates_must_exist(self):
+        answer = self.ask('What was revenue in another month?')
+        self.assertEqual(answer['intent'], 'revenue')
+        self.assertEqual(self.ask('Why do some customers look unpromising?')['intent'], 'fallback')
+        self.assertEqual(self.ask('How many customers are promising?')['data'], {'Promising': 1})
+
+        response = self.client.post(self.url, {'message': 'revenue between 2025-02-30 and 2025-03-01'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('2024-01-31', response.json()['error'])
+
+    def test_repeated_questions_do_not_rescan_transactions(self):
+        self.ask('top customers')
+        with CaptureQueriesContext(connection) as queries:
+            self.ask('top 3 customers in Abuja')
+        self.assertFalse([q for q in queries.captured_queries if 'rfm_transaction' in q['sql']])
+
+    def test_unmatched_questions_fall_back_to_model_with_cached_context(self):
+        answer = self.ask('Why are customers in Kano churning?')
+        self.assertEqual(answer['source'], 'model')
+        self.assertEqual(answer['answer'], 'fake answer')
+        self.assertEqual(len(FakeModel.prompts), 1)
+        self.assertIn('Total customers: 4', FakeModel.prompts[0])
+
+        self.ask('why are customers in kano churning?')
+        self.assertEqual(len(FakeModel.prompts), 1)
+
+    def test_empty_message_is_rejected(self):
+        self.assertEqual(self.client.post(self.url, {'message': ' '}, format='json').status_code, 400)
+
+    def test_generate_insights_uses_configured_model(self):
+        response = self.client.get(reverse('ai_insights:generate_insights'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['insights'], 'fake answer')
+        self.assertIn('Customer Segmentation Summary', FakeModel.prompts[0])
@@ -1,28 +1,15 @@
-import os
-import google.generativeai as genai
-import pandas as pd
-from dotenv import load_dotenv
+import hashlib
+
 from rest_framework import views, status, permissions
 from rest_framework.response import Response
-from django.core.exceptions import ImproperlyConfigured
-
-from rfm.rfm_analysis import calculate_rfm # Import the RFM calculation function
-
-# Load environment variables (especially GEMINI_API_KEY)
-load_dotenv()
-
-# Configure the Gemini API client
-try:
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        # Log a warning or raise an error if the key is essential for the app to function
-        print("Warning: GEMINI_API_KEY not found in environment variables. AI features will be disabled.")
-        # raise ImproperlyConfigured("GEMINI_API_KEY environment variable not set.")
-    else:
-        genai.configure(api_key=gemini_api_key)
-except Exception as e:
-    print(f"Error configuring Gemini API: {e}")
-    # Handle configuration error appropriately, maybe disable AI features
+
+from rfm.aggregates import get_user_aggregates
+from rfm.events import publish
+from rfm.replicas import read_from_replica
+from rfm.panels import insights_summary # from calculate_rfm, cached per dataset (warmed after upload)
+from rfm.singleflight import coalesce
+from .chatbot import InvalidPeriod, answer_question
+from .llm import ModelUnavailable, get_model
 
 class GenerateInsightsView(views.APIView):
     """
@@ -30,42 +17,25 @@ class GenerateInsightsView(views.APIView):
     Requires authentication.
     """
     permission_classes = [permissions.IsAuthenticated]
+    throttle_cost = 10  # a model call
 
+    @read_from_replica
     def get(self, request, *args, **kwargs):
         user = request.user
-        gemini_api_key = os.getenv("GEMINI_API_KEY") # Re-check key presence
+        model = get_model() # Configured by settings.AI_MODEL_BACKEND (Gemini by default)
 
-        if not gemini_api_key:
+        if not model.is_available():
              # Return a specific status if the service is unavailable due to configuration
              return Response({"error": "AI service is not configured. Missing API key."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
         try:
-            # 1. Get RFM data
-            rfm_results_df = calculate_rfm(user)
+            # 1. Summarize the RFM data for the prompt (cached per dataset, like the panels)
+            prompt_data = insights_summary(user)
 
-            if rfm_results_df is None:
+            if prompt_data is None:
                 return Response({"message": "No transaction data found to generate insights."}, status=status.HTTP_404_NOT_FOUND)
 
-            # 2. Prepare data summary for the prompt
-            # Convert relevant parts of the DataFrame to a string format for the prompt
-            # Example: Segment counts and maybe average R/F/M per segment
-            segment_counts = rfm_results_df['segment'].value_counts()
-            summary_stats = rfm_results_df.groupby('segment')[['recency', 'frequency', 'monetary']].mean()
-
-            prompt_data = f"""
-            Customer Segmentation Summary:
-            Total Customers: {len(rfm_results_df)}
-            Segment Counts:
-            {segment_counts.to_string()}
-
-            Average RFM per Segment:
-            {summary_stats.to_string()}
-
-            Full RFM Data Sample (first 5 rows):
-            {rfm_results_df.head().to_string()}
-            """
-
-            # 3. Define the prompt for Gemini
+            # 2. Define the prompt for Gemini
             prompt = f"""
             Analyze the following customer RFM (Recency, Frequency, Monetary) segmentation data.
             Provide actionable business insights and 3 specific, prioritized action tips for a marketing team based on this data.
@@ -76,31 +46,20 @@ class GenerateInsightsView(views.APIView):
             {prompt_data}
             """
 
-            # 4. Call the Gemini API
+            # 3. Call the model; identical concurrent requests (same data, so same prompt) share one call
             try:
-                # Use a model suitable for text generation, like gemini-pro
-                model = genai.GenerativeModel('gemini-pro')
-                response = model.generate_content(prompt)
-
-                # Basic error handling for the response object
-                if not response.text:
-                     # Check parts if text is empty, sometimes content is in parts
-                     if response.parts:
-                         generated_text = "".join(part.text for part in response.parts)
-                     else:
-                         # Log the full response for debugging if possible
-                         print(f"Gemini API response issue: {response}")
-                         raise Exception("Received empty response from AI service")
-                else:
-                    generated_text = response.text
+                key = ('insights', user.pk, type(model).__name__, hashlib.sha256(prompt.encode()).hexdigest())
+                generated_text = coalesce(key, lambda: model.generate(prompt))
 
             except Exception as api_error:
-                 print(f"Gemini API call failed: {api_error}")
+                 print(f"AI model call failed: {api_error}")
+                 publish(user, 'insights', state='failed', error=str(api_error))
                  # Provide a more specific error message if possible
                  return Response({"error": f"Failed to generate insights from AI service: {api_error}"}, status=status.HTTP_502_BAD_GATEWAY)
 
 
-            # 5. Return the generated insights
+            # 4. Return the generated insights (and push them to the user's other open dashboards)
+            publish(user, 'insights', state='done', insights=generated_text)
             return Response({"insights": generated_text}, status=status.HTTP_200_OK)
 
         except Exception as e:
@@ -108,9 +67,33 @@ class GenerateInsightsView(views.APIView):
             print(f"Error generating AI insights for user {user.id}: {e}") # Basic logging
             return Response({'error': f'An unexpected error occurred: {e}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-# Placeholder for Chatbot view (Bonus)
-# class ChatbotView(views.APIView):
-#     permission_classes = [permissions.IsAuthenticated]
-#     def post(self, request, *args, **kwargs):
-#         # Logic to handle chatbot query using RFM data and Gemini
-#         pass
+class ChatbotView(views.APIView):
+    """
+    API view answering natural-language questions about the user's data.
+    Common questions (top customers, segment sizes, revenue for a period, a customer's history)
+    are answered locally from the cached per-user aggregates; anything else goes to the model
+    with a compact summary of the dataset.
+    Expects: {"message": "..."}
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_cost = 2  # usually answered locally, sometimes a model call
+
+    @read_from_replica
+    def post(self, request, *args, **kwargs):
+        message = str(request.data.get('message', '')).strip()
+        if not message:
+            return Response({'error': 'No message provided.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        aggregates = get_user_aggregates(request.user)
+        if aggregates.empty:
+            return Response({"message": "No transaction data found. Please upload a file first."}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            return Response(answer_question(message, aggregates), status=status.HTTP_200_OK)
+        except InvalidPeriod as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ModelUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            print(f"Chatbot error for user {request.user.id}: {e}")
+            return Response({'error': f'An unexpected error occurred: {e}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,71 @@
+"""
+DATABASES entries for the two runtime profiles selected by DB_PROFILE (see settings.py).
+
+development: Django's defaults, a new connection per request and SQLite's rollback journal.
+production:
+  * SQLite: WAL journal (readers no longer wait for an upload's write transaction), a busy timeout
+    instead of immediate "database is locked" errors, memory-mapped reads and a larger page cache,
+    write transactions started IMMEDIATE, and persistent connections.
+  * PostgreSQL: persistent connections with health checks, or psycopg's connection pool (DB_POOL).
+"""
+import os
+
+PROFILES = ('development', 'production')
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def sqlite_pragmas(read_only=False):
+    """PRAGMAs run on every new production SQLite connection (journal settings only on writable files)."""
+    pragmas = [] if read_only else ['journal_mode=WAL', 'synchronous=NORMAL']
+    pragmas += [
+        f"busy_timeout={_env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)}",
+        f"mmap_size={_env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)}",
+        # Negative cache_size is in KiB
+        f"cache_size=-{_env_int('SQLITE_CACHE_SIZE_KB', 64 * 1024)}",
+        'temp_store=MEMORY',
+    ]
+    return pragmas
+
+
+def sqlite_database(path, profile='development', read_only=False):
+    """A SQLite DATABASES entry for `path`. read_only is for replicas kept in sync by another tool."""
+    database = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+    if profile == 'production':
+        database['OPTIONS'] = {
+            'init_command': ';'.join(f'PRAGMA {pragma}' for pragma in sqlite_pragmas(read_only)),
+            'timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000,
+        }
+        if not read_only:
+            # Take the write lock when the transaction starts: waiting writers then queue on the
+            # busy timeout instead of failing when they upgrade from a read lock mid-transaction
+            database['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+        database['CONN_MAX_AGE'] = _env_int('DB_CONN_MAX_AGE', 600)
+        database['CONN_HEALTH_CHECKS'] = True
+    return database
+
+
+def postgres_database(profile='development', host=None):
+    """A PostgreSQL DATABASES entry from the POSTGRES_* environment variables."""
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('POSTGRES_DB', 'insightnest'),
+        'USER': os.getenv('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'HOST': host or os.getenv('POSTGRES_HOST', 'localhost'),
+        'PORT': os.getenv('POSTGRES_PORT', '5432'),
+    }
+    if profile == 'production':
+        if os.getenv('DB_POOL', 'False').lower() in ('true', '1'):
+            # psycopg 3's pool (pip install "psycopg[pool]"); Django requires CONN_MAX_AGE=0 with it
+            database['OPTIONS'] = {'pool': {
+                'min_size': _env_int('DB_POOL_MIN_SIZE', 2),
+                'max_size': _env_int('DB_POOL_MAX_SIZE', 10),
+                'timeout': _env_int('DB_POOL_TIMEOUT', 10),
+            }}
+        else:
+            database['CONN_MAX_AGE'] = _env_int('DB_CONN_MAX_AGE', 600)
+            database['CONN_HEALTH_CHECKS'] = True
+    return database
@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os                 # Import os
 from dotenv import load_dotenv # Import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
+
+from .databases import PROFILES, postgres_database, sqlite_database
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -59,6 +62,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rfm.memprofile.MemoryProfileMiddleware', # samples MEMORY_PROFILE_SAMPLE_RATE of requests (off by default)
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -67,6 +71,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'rfm.throttling.ThrottleReleaseMiddleware', # frees the in-flight budget rfm.throttling.CostThrottle took
 ]
 
 ROOT_URLCONF = 'backend_project.urls'
@@ -98,9 +103,127 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly', # Or IsAuthenticated for stricter access
-    ]
+    ],
+    # Per-user cost budgets (rfm.throttling); see the THROTTLE_* settings below
+    'DEFAULT_THROTTLE_CLASSES': [
+        'rfm.throttling.CostThrottle',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rfm.renderers.FastJSONRenderer', # NumPy/Decimal/date aware, column-wise DataFrames, compression
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Options for rfm.renderers.FastJSONRenderer (see DEFAULT_RENDERER_OPTIONS there)
+    'FAST_JSON_RENDERER': {
+        'COMPRESS_MIN_SIZE': int(os.getenv('API_COMPRESS_MIN_SIZE', '1024')),
+    },
+}
+
+# Text model used by ai_insights (insights and chatbot fallback).
+# Set AI_MODEL_BACKEND=ai_insights.llm.StubModel to run without a Gemini API key.
+AI_MODEL_BACKEND = os.getenv('AI_MODEL_BACKEND', 'ai_insights.llm.GeminiModel')
+
+# Number of users whose in-memory analytics aggregates (rfm.aggregates) are kept per process
+USER_AGGREGATES_CACHE_SIZE = int(os.getenv('USER_AGGREGATES_CACHE_SIZE', '32'))
+
+# Entries kept per precomputed leaderboard (rfm.leaderboards); the largest `k` ranking endpoints serve
+LEADERBOARD_DEPTH = int(os.getenv('LEADERBOARD_DEPTH', '100'))
+
+# Upload validation (rfm.ingest): rows per parsed chunk, default row-error cap, bytes read when sniffing
+UPLOAD_CHUNK_ROWS = int(os.getenv('UPLOAD_CHUNK_ROWS', '50000'))
+UPLOAD_MAX_ERRORS = int(os.getenv('UPLOAD_MAX_ERRORS', '100'))
+UPLOAD_SNIFF_BYTES = int(os.getenv('UPLOAD_SNIFF_BYTES', str(64 * 1024)))
+# Spreadsheet reader (rfm.spreadsheets): 'auto' streams with calamine when python-calamine is installed,
+# else openpyxl (.xlsx) or xlrd (.xls); 'calamine', 'openpyxl' or 'xlrd' pin one where it supports the file
+UPLOAD_EXCEL_ENGINE = os.getenv('UPLOAD_EXCEL_ENGINE', 'auto').lower()
+if UPLOAD_EXCEL_ENGINE not in ('auto', 'calamine', 'openpyxl', 'xlrd'):
+    raise ImproperlyConfigured(f"UPLOAD_EXCEL_ENGINE must be auto, calamine, openpyxl or xlrd, not {UPLOAD_EXCEL_ENGINE!r}.")
+# Multi-file/ZIP uploads: worker processes parsing members in parallel (1 = sequential), files per
+# upload, and uncompressed bytes an archive may expand to
+UPLOAD_PARSE_WORKERS = int(os.getenv('UPLOAD_PARSE_WORKERS', str(min(4, os.cpu_count() or 1))))
+UPLOAD_MAX_FILES = int(os.getenv('UPLOAD_MAX_FILES', '100'))
+UPLOAD_MAX_ARCHIVE_BYTES = int(os.getenv('UPLOAD_MAX_ARCHIVE_BYTES', str(512 * 1024 * 1024)))
+
+# Tenants with at least PARTITIONED_AGGREGATION_MIN_ROWS transactions get their per-customer
+# aggregates (calculate_rfm, customers panel) computed per customer-id range in
+# PARTITIONED_AGGREGATION_WORKERS processes (rfm.partitioned); 1 keeps everything in-process
+PARTITIONED_AGGREGATION_MIN_ROWS = int(os.getenv('PARTITIONED_AGGREGATION_MIN_ROWS', '2000000'))
+PARTITIONED_AGGREGATION_WORKERS = int(os.getenv('PARTITIONED_AGGREGATION_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Threads the async analytics views (rfm.async_views) compute panels in, per process
+ASYNC_PANEL_WORKERS = int(os.getenv('ASYNC_PANEL_WORKERS', '4'))
+
+# pandas and the Gemini SDK are imported lazily; set this to import them when the WSGI/ASGI app loads
+# (with a preforking server's --preload, workers then inherit them instead of paying on first request)
+WARM_UP_ON_LOAD = os.getenv('WARM_UP_ON_LOAD', 'False').lower() in ('true', '1')
+
+# Django's cache framework. The default file-based cache is shared by the worker processes of one host;
+# set CACHE_BACKEND=django.core.cache.backends.redis.RedisCache and CACHE_LOCATION=redis://... to share
+# it between hosts.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '5000'))},
+    },
 }
 
+# Post-upload warm-up (rfm.prewarm): background threads precomputing the dashboard into the panel cache
+# (rfm.panels.cached). Each process keeps PANEL_CACHE_SIZE users' payloads in memory, in front of the
+# PANEL_SHARED_CACHE alias of CACHES ('' for none), where they stay PANEL_SHARED_CACHE_SECONDS so every
+# worker serves a warmed dashboard, not only the one that handled the upload.
+PREWARM_AFTER_UPLOAD = os.getenv('PREWARM_AFTER_UPLOAD', 'True').lower() in ('true', '1')
+PREWARM_WORKERS = int(os.getenv('PREWARM_WORKERS', '2'))
+PANEL_CACHE_SIZE = int(os.getenv('PANEL_CACHE_SIZE', '16'))
+PANEL_SHARED_CACHE = os.getenv('PANEL_SHARED_CACHE', 'default')
+PANEL_SHARED_CACHE_SECONDS = int(os.getenv('PANEL_SHARED_CACHE_SECONDS', '86400'))
+
+# Rows per chunk read from the database and encoded by the streaming exports (rfm.exports)
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '5000'))
+
+# Cost-aware throttling (rfm.throttling): each request costs its view's throttle_cost (upload 20,
+# insights 10, export 5, chat 2, other reads 1). Per user: THROTTLE_RATE cost units per minute with
+# bursts up to THROTTLE_BURST, and at most THROTTLE_MAX_INFLIGHT units executing at once (a request
+# over it waits THROTTLE_QUEUE_SECONDS before getting 429).
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'True').lower() in ('true', '1')
+THROTTLE_RATE = int(os.getenv('THROTTLE_RATE', '240'))
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', '80'))
+THROTTLE_MAX_INFLIGHT = int(os.getenv('THROTTLE_MAX_INFLIGHT', '30'))
+THROTTLE_QUEUE_SECONDS = float(os.getenv('THROTTLE_QUEUE_SECONDS', '0'))
+THROTTLE_BACKEND = os.getenv('THROTTLE_BACKEND', 'rfm.throttling.LocalThrottleState')
+
+# Single-flight (rfm.singleflight): identical RFM tables, panels and insight model calls requested at the
+# same time are computed once and shared. FileLockFlights also coalesces across worker processes through
+# file locks in SINGLE_FLIGHT_LOCK_DIR (POSIX; elsewhere within each process only), a private directory of
+# the app: it must be owned by the server's user with mode 0700, since shared results are tenant data.
+# Waiters compute on their own after SINGLE_FLIGHT_TIMEOUT seconds.
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'True').lower() in ('true', '1')
+SINGLE_FLIGHT_BACKEND = os.getenv('SINGLE_FLIGHT_BACKEND', 'rfm.singleflight.FileLockFlights')
+SINGLE_FLIGHT_LOCK_DIR = Path(os.getenv('SINGLE_FLIGHT_LOCK_DIR', BASE_DIR / 'singleflight'))
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', '120'))
+
+# Server-sent events (rfm.events) at /api/rfm/events/: upload progress, dataset versions, warm-up state and
+# finished insights, pushed from an in-process broker. A reconnecting client gets back up to EVENTS_HISTORY
+# missed events; idle streams send a keep-alive (and re-check the dataset version) every
+# EVENTS_HEARTBEAT_SECONDS and end after EVENTS_STREAM_SECONDS (the browser reconnects after EVENTS_RETRY_SECONDS).
+EVENTS_ENABLED = os.getenv('EVENTS_ENABLED', 'True').lower() in ('true', '1')
+EVENTS_HISTORY = int(os.getenv('EVENTS_HISTORY', '50'))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', '15'))
+EVENTS_STREAM_SECONDS = float(os.getenv('EVENTS_STREAM_SECONDS', '3600'))
+EVENTS_RETRY_SECONDS = float(os.getenv('EVENTS_RETRY_SECONDS', '3'))
+EVENTS_MAX_STREAMS_PER_USER = int(os.getenv('EVENTS_MAX_STREAMS_PER_USER', '10'))
+
+# Memory profiling (rfm.memprofile): share of requests and warm-ups profiled stage by stage (peak RSS,
+# tracemalloc top allocators), 0 = off. Profiles are logged, and the last MEMORY_PROFILE_KEEP are
+# served to staff at /api/rfm/debug/memory/ with MEMORY_PROFILE_TOP allocators per stage.
+MEMORY_PROFILE_SAMPLE_RATE = float(os.getenv('MEMORY_PROFILE_SAMPLE_RATE', '0'))
+MEMORY_PROFILE_KEEP = int(os.getenv('MEMORY_PROFILE_KEEP', '50'))
+MEMORY_PROFILE_TOP = int(os.getenv('MEMORY_PROFILE_TOP', '5'))
+
+# Admin (rfm.admin): changelists count at most ADMIN_EXACT_COUNT_LIMIT rows (past that they show the
+# planner's estimate), and the tenant purge deletes ADMIN_BATCH_SIZE rows per transaction
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv('ADMIN_EXACT_COUNT_LIMIT', '10000'))
+ADMIN_BATCH_SIZE = int(os.getenv('ADMIN_BATCH_SIZE', '5000'))
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -122,13 +245,46 @@ WSGI_APPLICATION = 'backend_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DB_PROFILE=production tunes the connections (backend_project.databases): SQLite in WAL mode with
+# a busy timeout, mmap and a larger page cache, and persistent connections; PostgreSQL
+# (DB_ENGINE=postgresql, POSTGRES_* variables) with persistent connections and health checks, or
+# psycopg's pool with DB_POOL=True. development keeps Django's defaults.
+# Tuning: SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB, DB_CONN_MAX_AGE,
+# DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE. Compare the profiles with `manage.py bench_db_concurrency`.
+DB_PROFILE = os.getenv('DB_PROFILE', 'development').lower()
+if DB_PROFILE not in PROFILES:
+    raise ImproperlyConfigured(f"DB_PROFILE must be one of {', '.join(PROFILES)}, not {DB_PROFILE!r}")
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite').lower()
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': postgres_database(DB_PROFILE) if DB_ENGINE == 'postgresql' else sqlite_database(BASE_DIR / 'db.sqlite3', DB_PROFILE),
 }
 
+# Per-tenant shards for Transaction/UploadedFile (rfm.sharding): one SQLite file per shard, so one
+# tenant's upload doesn't lock the database for everyone. 0 keeps all data in 'default'.
+# On PostgreSQL, point each tenant_N alias at the same database with its own schema instead, e.g.
+# OPTIONS={'options': '-c search_path=tenant_N'}.
+# Migrate every alias with `manage.py migrate_shards`; move tenants with `manage.py rebalance_tenants`.
+TENANT_SHARD_COUNT = int(os.getenv('TENANT_SHARD_COUNT', '0'))
+TENANT_SHARD_DIR = Path(os.getenv('TENANT_SHARD_DIR', BASE_DIR / 'shards'))
+TENANT_SHARDS = [f'tenant_{index}' for index in range(TENANT_SHARD_COUNT)]
+if TENANT_SHARD_COUNT:
+    TENANT_SHARD_DIR.mkdir(parents=True, exist_ok=True)
+for _index in range(TENANT_SHARD_COUNT):
+    DATABASES[f'tenant_{_index}'] = sqlite_database(TENANT_SHARD_DIR / f'tenant_{_index}.sqlite3', DB_PROFILE)
+
+# Read replicas of 'default' for the analytics endpoints (rfm.replicas). DATABASE_REPLICAS is a
+# comma-separated list of SQLite files kept in sync with db.sqlite3 (e.g. by Litestream or a copy
+# job) for local testing; for PostgreSQL, add replica_N aliases with the standby's HOST instead.
+# A user's reads stay on the primary for REPLICA_PIN_SECONDS after their own upload.
+READ_REPLICAS = []
+for _index, _path in enumerate(filter(None, os.getenv('DATABASE_REPLICAS', '').split(','))):
+    DATABASES[f'replica_{_index}'] = sqlite_database(_path.strip(), DB_PROFILE, read_only=True)
+    READ_REPLICAS.append(f'replica_{_index}')
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '10'))
+
+# Replica routing first: it only claims reads inside replica_reads(), tenant routing handles the rest
+DATABASE_ROUTERS = ['rfm.replicas.ReplicaRouter', 'rfm.sharding.TenantRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -0,0 +1,25 @@
+"""
+Settings for the test suite: the production settings plus the switches and database aliases the
+tests rely on. `manage.py test` uses them by default; with another runner, set
+DJANGO_SETTINGS_MODULE=backend_project.test_settings.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES, DB_PROFILE, READ_REPLICAS, TENANT_SHARD_COUNT, TENANT_SHARD_DIR, sqlite_database
+
+# Background work the tests enable with override_settings where they cover it
+PREWARM_AFTER_UPLOAD = False
+THROTTLE_ENABLED = False
+
+# In memory, so no cached payloads outlive a test run
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Coalesce within the test process only, without files shared with other runs
+SINGLE_FLIGHT_BACKEND = 'rfm.singleflight.SingleFlight'
+
+# Two shard aliases, so tests can switch sharding on with override_settings(TENANT_SHARD_COUNT=2, ...)
+for _index in range(TENANT_SHARD_COUNT, 2):
+    DATABASES[f'tenant_{_index}'] = sqlite_database(TENANT_SHARD_DIR / f'tenant_{_index}.sqlite3', DB_PROFILE)
+
+# A second database standing in for a replica; tests enable it with override_settings(READ_REPLICAS=...)
+if not READ_REPLICAS:
+    DATABASES['replica_0'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'replica_0.sqlite3'}
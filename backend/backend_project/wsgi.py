@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_project.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402 (needs the app loaded above)
+
+if settings.WARM_UP_ON_LOAD:
+    from rfm.lazy import warm_up
+    warm_up()
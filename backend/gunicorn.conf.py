@@ -0,0 +1,11 @@
+# gunicorn -c gunicorn.conf.py backend_project.wsgi
+import os
+
+# Load the app (and, with WARM_UP_ON_LOAD, pandas and the Gemini SDK) once in the master;
+# forked workers share those pages instead of importing them on their first request.
+preload_app = True
+os.environ.setdefault('WARM_UP_ON_LOAD', 'True')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', '3'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_project.settings')
+    # The test suite runs with the production settings plus what the tests need (backend_project/test_settings.py)
+    default = 'backend_project.test_settings' if sys.argv[1:2] == ['test'] else 'backend_project.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', default)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -1,3 +1,191 @@
-from django.contrib import admin
+"""
+Admin for the tenant tables, built for multi-million-row Transaction tables:
+  * EstimatedCountPaginator never runs an unbounded COUNT(*) (the changelist's full count is off too);
+  * filters and search only touch indexed columns: user, purchase_date and exact customer ids;
+  * rows are listed from the tenant's shard (rfm.sharding): the one holding the filtered user, or
+    the one picked in the Database filter;
+  * user is a raw id field and rows show user_id, so no page joins or lists every user;
+  * rows are read-only here. Changes go through tenant-level actions (purge a tenant's data,
+    rebuild their aggregates; rfm.maintenance) that run in batches and keep the dataset version,
+    and with it every cache, consistent.
+"""
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.http import QueryDict
+from django.utils.functional import cached_property
 
-# Register your models here.
+from .maintenance import purge_tenant_data, rebuild_tenant_aggregates
+from .models import DatasetVersion, Transaction, UploadedFile
+from .sharding import DEFAULT_DB, shard_for_user_id, tenant_databases
+
+DATABASE_PARAM = 'db'
+USER_PARAM = 'user__id__exact'
+
+
+def table_row_estimate(model, alias):
+    """
+    The planner's row count for the model's table (pg_class.reltuples on PostgreSQL, sqlite_stat1
+    after ANALYZE on SQLite), or None when the database has no statistics for it.
+    """
+    connection = connections[alias]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        query = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+    elif connection.vendor == 'sqlite':
+        query = "SELECT CAST(substr(stat, 1, instr(stat || ' ', ' ') - 1) AS INTEGER) FROM sqlite_stat1 WHERE tbl = %s LIMIT 1"
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(query, [table])
+            row = cursor.fetchone()
+    except DatabaseError:  # e.g. sqlite_stat1 doesn't exist until the first ANALYZE
+        return None
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts at most ADMIN_EXACT_COUNT_LIMIT rows. Past that, an unfiltered list reports the
+    planner's estimate of the table size, and a filtered one reports the limit (narrow the
+    filters to page further).
+    """
+
+    @cached_property
+    def count(self):
+        limit = int(getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 10000))
+        queryset = self.object_list
+        count = queryset.order_by()[:limit + 1].count()  # SELECT COUNT(*) FROM (... LIMIT n)
+        if count <= limit:
+            return count
+        if not queryset.query.where:
+            estimate = table_row_estimate(queryset.model, queryset.db)
+            if estimate is not None:
+                return max(estimate, limit)
+        return limit
+
+
+def requested_params(request):
+    """The changelist's query parameters, also on change pages (which carry them in _changelist_filters)."""
+    if '_changelist_filters' in request.GET:
+        return QueryDict(request.GET['_changelist_filters'])
+    return request.GET
+
+
+def requested_alias(request):
+    """The database the tenant rows are listed from: the Database filter, else the filtered user's shard."""
+    params = requested_params(request)
+    alias = params.get(DATABASE_PARAM)
+    if alias in tenant_databases():
+        return alias
+    user_id = params.get(USER_PARAM, '')
+    return shard_for_user_id(int(user_id)) if user_id.isdigit() else DEFAULT_DB
+
+
+class DatabaseFilter(admin.SimpleListFilter):
+    """Which tenant database to list; only shown when tenant shards exist."""
+    title = 'database'
+    parameter_name = DATABASE_PARAM
+
+    def lookups(self, request, model_admin):
+        aliases = tenant_databases()
+        return [(alias, alias) for alias in aliases] if len(aliases) > 1 else []
+
+    def queryset(self, request, queryset):
+        return queryset  # applied by TenantDataAdmin.get_queryset
+
+
+class TenantActionsAdmin(admin.ModelAdmin):
+    """Read-only rows with the batched tenant-level actions. Subclasses say whose rows were selected."""
+    actions = ['purge_tenants', 'rebuild_tenant_aggregates']
+
+    def tenant_users(self, queryset):
+        raise NotImplementedError
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)  # one transaction, no version bump: use purge_tenants
+        return actions
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_purge_permission(self, request):
+        return request.user.has_perm('rfm.delete_transaction')
+
+    def has_rebuild_permission(self, request):
+        return request.user.has_perm('rfm.view_transaction')
+
+    @admin.action(description='Purge all data of the selected tenants', permissions=['purge'])
+    def purge_tenants(self, request, queryset):
+        for user in self.tenant_users(queryset):
+            deleted = purge_tenant_data(user)
+            self.message_user(
+                request,
+                f"Purged {user.username}: {deleted['transaction']} transactions, {deleted['uploadedfile']} uploaded files.",
+                messages.SUCCESS,
+            )
+
+    @admin.action(description='Rebuild aggregates of the selected tenants', permissions=['rebuild'])
+    def rebuild_tenant_aggregates(self, request, queryset):
+        users = self.tenant_users(queryset)
+        for user in users:
+            rebuild_tenant_aggregates(user)
+        self.message_user(request, f"Rebuilt leaderboards and rollups for {len(users)} tenant(s).", messages.SUCCESS)
+
+
+class TenantDataAdmin(TenantActionsAdmin):
+    """A tenant table, listed from the tenant's database; actions apply to the selected rows' owners."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ('user',)
+    list_per_page = 50
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(requested_alias(request))
+
+    def tenant_users(self, queryset):
+        user_ids = set(queryset.order_by().values_list('user_id', flat=True).distinct())
+        return list(User.objects.filter(pk__in=user_ids))
+
+
+@admin.register(Transaction)
+class TransactionAdmin(TenantDataAdmin):
+    list_display = ('id', 'user_id', 'customer_id', 'purchase_date', 'amount', 'city', 'product_type', 'loyalty_points')
+    list_filter = (DatabaseFilter, 'user', 'purchase_date')
+    search_fields = ('customer_id',)
+    search_help_text = 'Exact customer ids, separated by spaces.'
+
+    def get_search_results(self, request, queryset, search_term):
+        # Exact matches only: icontains or iexact can't use the customer_id index
+        terms = search_term.split()
+        if terms:
+            queryset = queryset.filter(customer_id__in=terms)
+        return queryset, False
+
+
+@admin.register(UploadedFile)
+class UploadedFileAdmin(TenantDataAdmin):
+    list_display = ('id', 'user_id', 'original_filename', 'uploaded_at')
+    list_filter = (DatabaseFilter, 'user')
+
+
+@admin.register(DatasetVersion)
+class DatasetVersionAdmin(TenantActionsAdmin):
+    """One row per tenant that has uploaded: the entry point for the tenant-level actions."""
+    list_display = ('user', 'version', 'updated_at')
+    search_fields = ('=user__username',)
+    raw_id_fields = ('user',)
+    list_select_related = ('user',)
+
+    def tenant_users(self, queryset):
+        return [version.user for version in queryset.select_related('user')]
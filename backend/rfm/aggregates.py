@@ -0,0 +1,171 @@
+import threading
+from collections import OrderedDict
+from functools import cached_property
+
+from django.conf import settings
+from django.utils import timezone
+
+from .lazy import LazyModule
+from .models import Transaction
+from .rfm_analysis import rfm_from_transactions
+from .segment_rules import segmenter_for
+from .versioning import get_dataset_version
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+class UserAggregates:
+    """
+    Indexed, in-memory aggregates of one user's dataset, built from a single transaction scan.
+
+    Every lookup the chatbot and the lightweight endpoints need is answered from here without
+    going back to the database:
+      * customers: per-customer totals indexed by customer_id
+      * city_rankings: per-city customer positions, already sorted by total paid
+      * daily revenue with a cumulative sum, so any date range is two binary searches
+      * per-customer transaction slices (history) via offsets into one sorted frame
+    The RFM table is derived lazily from the same scan the first time it is needed, and
+    consumers can memoize their own derived artifacts for this dataset version in `derived`.
+    """
+
+    def __init__(self, transactions_df, version=0, segmenter=None):
+        self.version = version
+        self.segmenter = segmenter  # the user's compiled segment rules, None for the built-in ones
+        # Recency is relative to today, so aggregates are only valid for the day they were built.
+        self.built_on = timezone.now().date()
+        self.derived = {}
+        df = transactions_df.copy()
+        if df.empty:
+            df = pd.DataFrame(columns=['customer_id', 'purchase_date', 'amount', 'city', 'product_type', 'loyalty_points'])
+        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0.0).astype(float)
+        df['loyalty_points'] = pd.to_numeric(df['loyalty_points'], errors='coerce').fillna(0).astype(int)
+        df['purchase_date'] = pd.to_datetime(df['purchase_date'], errors='coerce')
+        df['city'] = df['city'].fillna('').astype(str)
+        df = df.dropna(subset=['purchase_date'])
+
+        # Transactions sorted by customer then date; history lookups slice this frame.
+        self.transactions = df.sort_values(['customer_id', 'purchase_date'], kind='stable').reset_index(drop=True)
+        keys = self.transactions['customer_id'].to_numpy()
+        if len(keys):
+            boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+            starts = np.concatenate(([0], boundaries))
+            ends = np.concatenate((boundaries, [len(keys)]))
+            self._history_offsets = {keys[start]: (start, end) for start, end in zip(starts, ends)}
+        else:
+            self._history_offsets = {}
+
+        grouped = self.transactions.groupby('customer_id', sort=False)
+        self.customers = grouped.agg(
+            total_paid=('amount', 'sum'),
+            loyalty_points=('loyalty_points', 'sum'),
+            order_count=('amount', 'size'),
+            purchase_days=('purchase_date', 'nunique'),
+            first_purchase=('purchase_date', 'min'),
+            last_purchase=('purchase_date', 'max'),
+            city=('city', 'last'),
+        ).sort_values('total_paid', ascending=False, kind='stable')
+
+        city_totals = self.transactions.groupby(['city', 'customer_id'], sort=False)['amount'].sum().reset_index()
+        city_totals = city_totals.sort_values('amount', ascending=False, kind='stable')
+        self.city_rankings = {
+            city.lower(): group.rename(columns={'amount': 'total_paid'}).reset_index(drop=True)
+            for city, group in city_totals.groupby('city', sort=False)
+            if city
+        }
+        self.city_names = {city.lower(): city for city in city_totals['city'].unique() if city}
+
+        daily = self.transactions.groupby('purchase_date')['amount'].sum().sort_index()
+        self.daily_dates = daily.index.to_numpy()
+        self.daily_cumulative = np.concatenate(([0.0], daily.to_numpy().cumsum()))
+
+    @classmethod
+    def from_database(cls, user, version=None):
+        transactions = Transaction.objects.for_user(user).values(
+            'customer_id', 'purchase_date', 'amount', 'city', 'product_type', 'loyalty_points'
+        )
+        return cls(pd.DataFrame.from_records(transactions), version=version, segmenter=segmenter_for(user))
+
+    @property
+    def empty(self):
+        return self.transactions.empty
+
+    @cached_property
+    def rfm(self):
+        """RFM table for this dataset (None when there are no transactions)."""
+        if self.empty:
+            return None
+        columns = ['customer_id', 'purchase_date', 'amount', 'loyalty_points']
+        return rfm_from_transactions(self.transactions[columns].copy(), segmenter=self.segmenter)
+
+    @cached_property
+    def segment_counts(self):
+        if self.rfm is None:
+            return {}
+        return {segment: int(count) for segment, count in self.rfm['segment'].value_counts().items()}
+
+    def top_customers(self, k=10, city=None):
+        """Top-k customers by total paid, optionally within one city (case-insensitive)."""
+        if city is None:
+            top = self.customers.head(k).reset_index()
+            return top[['customer_id', 'city', 'total_paid', 'loyalty_points', 'order_count']]
+        ranking = self.city_rankings.get(city.lower())
+        if ranking is None:
+            return pd.DataFrame(columns=['customer_id', 'city', 'total_paid'])
+        return ranking.head(k)[['customer_id', 'city', 'total_paid']]
+
+    def revenue_between(self, start=None, end=None):
+        """Revenue for purchase dates in [start, end] (inclusive); None means unbounded."""
+        lo = 0 if start is None else np.searchsorted(self.daily_dates, np.datetime64(pd.Timestamp(start)), side='left')
+        hi = len(self.daily_dates) if end is None else np.searchsorted(self.daily_dates, np.datetime64(pd.Timestamp(end)), side='right')
+        return float(self.daily_cumulative[hi] - self.daily_cumulative[lo]) if hi > lo else 0.0
+
+    def customer_history(self, customer_id):
+        """The customer's transactions (oldest first), or None for an unknown customer."""
+        offsets = self._history_offsets.get(customer_id)
+        if offsets is None:
+            return None
+        start, end = offsets
+        return self.transactions.iloc[start:end]
+
+    def find_customer_id(self, text):
+        """Resolves a customer id case-insensitively (ids are stored as uploaded)."""
+        if text in self._history_offsets:
+            return text
+        return self._ids_by_lower.get(text.lower())
+
+    @cached_property
+    def _ids_by_lower(self):
+        return {str(customer_id).lower(): customer_id for customer_id in self._history_offsets}
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_user_aggregates(user):
+    """
+    Returns the UserAggregates for the user's current dataset version.
+    Instances are kept in a small per-process LRU keyed by user and invalidated by version, so
+    repeated questions cost one version lookup instead of a transaction scan.
+    """
+    version = get_dataset_version(user)
+    with _cache_lock:
+        cached = _cache.get(user.pk)
+        if cached is not None and cached.version == version and cached.built_on == timezone.now().date():
+            _cache.move_to_end(user.pk)
+            return cached
+
+    aggregates = UserAggregates.from_database(user, version=version)
+
+    with _cache_lock:
+        _cache[user.pk] = aggregates
+        _cache.move_to_end(user.pk)
+        while len(_cache) > getattr(settings, 'USER_AGGREGATES_CACHE_SIZE', 32):
+            _cache.popitem(last=False)
+    return aggregates
+
+
+def clear_user_aggregates():
+    with _cache_lock:
+        _cache.clear()
@@ -1,119 +1,114 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from .models import Transaction
-from django.db.models import Sum, Count, Q, F
-from datetime import datetime, timedelta
-import pandas as pd
+
+from .conditional import conditional_on_dataset
+from .replicas import read_from_replica
+from .leaderboards import parse_k
+from .panels import cached_panel
+from .search import MAX_LIMIT, customer_detail, search_customers
+from .timeseries import parse_max_points
 
 class RevenueAnalyticsView(APIView):
+    """
+    Revenue per product type and per day for ?period=. ?max_points=<n> downsamples the daily
+    graph to at most n points (LTTB, see rfm.timeseries).
+    """
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_on_dataset
+    @read_from_replica
     def get(self, request, *args, **kwargs):
-        user = request.user
         period = request.query_params.get('period', 'all')  # today, week, month, 3m, 6m, year, all
-        now = datetime.now().date()
-        period_map = {
-            'today': now,
-            'week': now - timedelta(days=7),
-            'month': now - timedelta(days=30),
-            '3m': now - timedelta(days=90),
-            '6m': now - timedelta(days=180),
-            'year': now - timedelta(days=365),
-        }
-        qs = Transaction.objects.filter(user=user)
-        if period in period_map:
-            qs = qs.filter(purchase_date__gte=period_map[period])
-        # Revenue by product type (money and weight)
-        df = pd.DataFrame.from_records(qs.values('product_type', 'amount', 'amount_100kg'))
-        if df.empty:
-            return Response({'revenue_by_type': [], 'revenue_by_weight': [], 'total_revenue': 0, 'graph': []}, status=status.HTTP_200_OK)
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
-        df['amount_100kg'] = pd.to_numeric(df['amount_100kg'], errors='coerce').fillna(0)
-        revenue_by_type = df.groupby('product_type')['amount'].sum().reset_index().sort_values(by='amount', ascending=False)
-        revenue_by_weight = df.groupby('product_type')['amount_100kg'].sum().reset_index().sort_values(by='amount_100kg', ascending=False)
-        # Graph data: revenue by date
-        graph_df = pd.DataFrame.from_records(qs.values('purchase_date', 'amount'))
-        graph_df['purchase_date'] = pd.to_datetime(graph_df['purchase_date'])
-        graph_df = graph_df.groupby(graph_df['purchase_date'].dt.date)['amount'].sum().reset_index()
-        graph = graph_df.to_dict('records')
-        total_revenue = df['amount'].sum()
-        return Response({
-            'revenue_by_type': revenue_by_type.to_dict('records'),
-            'revenue_by_weight': revenue_by_weight.to_dict('records'),
-            'total_revenue': total_revenue,
-            'graph': graph
-        }, status=status.HTTP_200_OK)
+        try:
+            max_points = parse_max_points(request.query_params.get('max_points'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(cached_panel('revenue', request.user, period=period, max_points=max_points), status=status.HTTP_200_OK)
 
 class CustomerAnalyticsView(APIView):
+    """Customer totals, payment logs and revenue per day; accepts ?max_points=<n> like the revenue graph."""
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_on_dataset
+    @read_from_replica
     def get(self, request, *args, **kwargs):
-        user = request.user
-        qs = Transaction.objects.filter(user=user)
-        df = pd.DataFrame.from_records(qs.values('customer_id', 'amount', 'loyalty_points', 'purchase_date'))
-        if df.empty:
-            return Response({'customers': [], 'top_40': [], 'logs': {}, 'graph': []}, status=status.HTTP_200_OK)
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
-        df['loyalty_points'] = pd.to_numeric(df['loyalty_points'], errors='coerce').fillna(0)
-        # All customers with stats
-        customers = df.groupby('customer_id').agg(
-            total_paid=('amount', 'sum'),
-            total_points=('loyalty_points', 'sum'),
-            order_count=('purchase_date', 'count')
-        ).reset_index().sort_values(by='total_paid', ascending=False)
-        # Top 40 highlighted
-        top_40 = customers.head(40).to_dict('records')
-        # Payment log for each
-        logs = {cid: df[df['customer_id'] == cid][['purchase_date', 'amount']].sort_values('purchase_date').to_dict('records') for cid in customers['customer_id']}
-        # Graph for each stat (example: total_paid over time)
-        graph_df = df.groupby(df['purchase_date'])['amount'].sum().reset_index()
-        graph = graph_df.to_dict('records')
-        return Response({
-            'customers': customers.to_dict('records'),
-            'top_40': top_40,
-            'logs': logs,
-            'graph': graph
-        }, status=status.HTTP_200_OK)
+        try:
+            max_points = parse_max_points(request.query_params.get('max_points'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(cached_panel('customers', request.user, max_points=max_points), status=status.HTTP_200_OK)
 
 class VIPCustomersView(APIView):
+    """
+    Top customers by loyalty points (ties broken by total paid), with a status per rank.
+    Accepts ?k=<n> (default 50) and ?city=<city>; served from the precomputed leaderboards.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_on_dataset
+    @read_from_replica
     def get(self, request, *args, **kwargs):
-        user = request.user
-        qs = Transaction.objects.filter(user=user)
-        df = pd.DataFrame.from_records(qs.values('customer_id', 'amount', 'loyalty_points'))
-        if df.empty:
-            return Response({'vip_customers': []}, status=status.HTTP_200_OK)
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
-        df['loyalty_points'] = pd.to_numeric(df['loyalty_points'], errors='coerce').fillna(0)
-        vip_customers = df.groupby('customer_id').agg(
-            total_paid=('amount', 'sum'),
-            loyalty_points=('loyalty_points', 'sum')
-        ).reset_index().sort_values(by=['loyalty_points', 'total_paid'], ascending=False)
-        vip_customers = vip_customers.head(50).to_dict('records')
-        # Assign status based on ranking
-        for idx, cust in enumerate(vip_customers):
-            if idx == 0:
-                cust['status'] = 'VIP'
-            elif 1 <= idx <= 4:
-                cust['status'] = 'Loyal Customer'
-            else:
-                cust['status'] = 'Thrifter'
-        return Response({'vip_customers': vip_customers}, status=status.HTTP_200_OK)
+        try:
+            k = parse_k(request.query_params.get('k'), default=50)
+        except ValueError as e:
+            return Response({'error': f'Invalid value for k. {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(cached_panel('vip', request.user, k=k, city=request.query_params.get('city') or None), status=status.HTTP_200_OK)
 
 
 class AvgOrderValueView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_on_dataset
+    @read_from_replica
     def get(self, request, *args, **kwargs):
-        user = request.user
-        qs = Transaction.objects.filter(user=user)
-        df = pd.DataFrame.from_records(qs.values('amount'))
-        if df.empty:
-            return Response({'avg_order_value': 0}, status=status.HTTP_200_OK)
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
-        avg_order_value = df['amount'].mean()
-        return Response({'avg_order_value': avg_order_value}, status=status.HTTP_200_OK)
+        return Response(cached_panel('avg_order_value', request.user), status=status.HTTP_200_OK)
+
+class CohortRetentionView(APIView):
+    """
+    Monthly cohort retention: per first-purchase month, the customers active 0, 1, 2... months later,
+    their share of the cohort and revenue. Accepts ?city=<city> and ?product_type=<type>; served from
+    the cohort rollup built at ingest.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @conditional_on_dataset
+    @read_from_replica
+    def get(self, request, *args, **kwargs):
+        city = request.query_params.get('city') or None
+        product_type = request.query_params.get('product_type') or None
+        return Response(cached_panel('cohorts', request.user, city=city, product_type=product_type), status=status.HTTP_200_OK)
+
+class CustomerSearchView(APIView):
+    """
+    Customer autocomplete: ?q=<text> matches customer ids (exact, prefix, substring, similar) and
+    cities, ranked by match then total paid, with each customer's totals. ?limit=<n> (default 20, max 100).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @conditional_on_dataset
+    @read_from_replica
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Provide a search term with ?q=.'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = request.query_params.get('limit') or '20'
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_LIMIT:
+            return Response({'error': f'Invalid value for limit. It must be between 1 and {MAX_LIMIT}.'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = int(limit)
+        return Response({'query': query, 'results': search_customers(request.user, query, limit)}, status=status.HTTP_200_OK)
+
+
+class CustomerDetailView(APIView):
+    """One customer's totals, RFM scores and segment, and payment log, without building the full RFM table."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    @conditional_on_dataset
+    @read_from_replica
+    def get(self, request, customer_id, *args, **kwargs):
+        detail = customer_detail(request.user, customer_id)
+        if detail is None:
+            return Response({'error': f'Customer {customer_id!r} not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(detail, status=status.HTTP_200_OK)
 
 # Robust error handling is built into each endpoint above.
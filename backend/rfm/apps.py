@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class RfmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rfm'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from django.db.models.signals import pre_delete
+        from .sharding import delete_tenant_rows
+        pre_delete.connect(delete_tenant_rows, sender=User, dispatch_uid='rfm_delete_tenant_rows')
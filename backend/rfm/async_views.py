@@ -0,0 +1,261 @@
+"""
+Async variants of the analytics endpoints, for deployments served through backend_project/asgi.py.
+
+Each request runs its panels (rfm.panels) in a bounded thread pool instead of on the event loop,
+and a dashboard request gathers several independent panels concurrently. If the client disconnects,
+Django cancels the view coroutine: panels that have not started yet are dropped, and running ones
+stop at their next raise_if_cancelled() checkpoint. events_view streams the user's server-sent
+events (rfm.events) without holding a thread per client.
+"""
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .conditional import cache_control_value, dataset_etag, etag_matches
+from .events import TooManyStreams, broker, parse_event_id, stream, stream_sync
+from .panels import PANELS, PanelCancelled, cached_panel, set_cancel_event
+from .renderers import FastJSONRenderer
+from .replicas import replica_reads
+from .throttling import take_budget, throttle_state
+from .versioning import get_dataset_version
+
+PANEL_THROTTLE_COST = 1  # what each panel's DRF endpoint costs; a dashboard costs the sum of its panels
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def panel_pool():
+    """The shared pool panels run in; ASYNC_PANEL_WORKERS bounds DB connections and pandas threads."""
+    global _pool
+    workers = getattr(settings, 'ASYNC_PANEL_WORKERS', 4)
+    with _pool_lock:
+        if _pool is None or _pool._max_workers != workers:
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='panel')
+        return _pool
+
+
+def _run_panel(name, kwargs, user, cancel):
+    """Runs one panel in a pool thread and returns (payload, seconds)."""
+    started = time.perf_counter()
+    set_cancel_event(cancel)
+    try:
+        if cancel.is_set():
+            raise PanelCancelled()
+        with replica_reads(user):
+            return cached_panel(name, user, **kwargs), time.perf_counter() - started
+    finally:
+        set_cancel_event(None)
+        close_old_connections()
+
+
+def _authenticate(request):
+    """DRF authentication plus the dataset ETag, in one trip to a sync thread."""
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    user = drf_request.user
+    if not user or not user.is_authenticated:
+        return None, None
+    return user, dataset_etag(drf_request, get_dataset_version(user))
+
+
+def _json_response(data, status=200, etag=None):
+    body = FastJSONRenderer().encode(data) if data is not None else b''
+    response = HttpResponse(body, status=status, content_type='application/json')
+    if etag:
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control_value()
+        patch_vary_headers(response, ('Accept', 'Authorization'))
+    return response
+
+
+async def gather_panels(requested, user, cancel):
+    """
+    Runs {name: kwargs} panels concurrently in the panel pool. Returns {name: (payload, seconds)};
+    a failed panel's payload is {'error': ...}. Cancelling this coroutine cancels the panels.
+    """
+    loop = asyncio.get_running_loop()
+    pool = panel_pool()
+    futures = {
+        name: loop.run_in_executor(pool, _run_panel, name, kwargs, user, cancel)
+        for name, kwargs in requested.items()
+    }
+    try:
+        results = await asyncio.gather(*futures.values(), return_exceptions=True)
+    except asyncio.CancelledError:
+        # Client went away: queued panels never start, running ones stop at their next checkpoint
+        cancel.set()
+        for future in futures.values():
+            future.cancel()
+        raise
+
+    out = {}
+    for name, result in zip(futures, results):
+        if isinstance(result, BaseException):
+            print(f"Error computing panel {name} for user {user.id}: {result}")
+            result = ({'error': f'An error occurred computing this panel: {result}'}, 0.0)
+        out[name] = result
+    return out
+
+
+async def _throttle(user, cost, label):
+    """
+    Takes the request's cost from the user's budgets, like CostThrottle does for the DRF views.
+    Returns None when taken (release it with _release), else a 429 response.
+    """
+    if not settings.THROTTLE_ENABLED or not cost:
+        return None
+    wait = await sync_to_async(take_budget)(f'user:{user.pk}', cost, label)
+    if not wait:
+        return None
+    seconds = math.ceil(wait)
+    response = _json_response({'detail': f'Request was throttled. Expected available in {seconds} seconds.'}, status=429)
+    response['Retry-After'] = str(seconds)
+    return response
+
+
+def _release(user, cost):
+    if settings.THROTTLE_ENABLED and cost:
+        throttle_state().release(f'user:{user.pk}', cost)
+
+
+async def _parse_and_authenticate(request, names, label):
+    """
+    ((user, etag, {name: kwargs}, cost), None) for a request that may run, with its cost taken from
+    the user's throttle budgets (release it with _release), else (None, the response to return).
+    """
+    user, etag = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return None, _json_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+    cost = PANEL_THROTTLE_COST * len(names)
+    response = await _throttle(user, cost, label)
+    if response is not None:
+        return None, response
+
+    requested = {}
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response = _json_response(None, status=304, etag=etag)
+    else:
+        for name in names:
+            try:
+                requested[name] = PANELS[name][1](request.GET)
+            except ValueError as e:
+                response = _json_response({'error': f'Invalid parameters for {name}. {e}'}, status=400)
+                break
+    if response is not None:
+        _release(user, cost)
+        return None, response
+    return (user, etag, requested, cost), None
+
+
+def async_panel_view(name):
+    """Async view serving a single panel, with the same parameters and payload as its DRF endpoint."""
+    async def view(request):
+        if request.method != 'GET':
+            return _json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+        parsed, response = await _parse_and_authenticate(request, [name], f'async {name}')
+        if response is not None:
+            return response
+        user, etag, requested, cost = parsed
+        try:
+            payload, _ = (await gather_panels(requested, user, threading.Event()))[name]
+        finally:
+            _release(user, cost)
+        if payload is None:
+            return _json_response({"message": "No transaction data found for this user. Please upload a file."}, status=404)
+        if 'error' in payload:
+            return _json_response(payload, status=500)
+        return _json_response(payload, etag=etag)
+
+    view.__name__ = f'async_{name}_view'
+    return view
+
+
+async def dashboard_view(request):
+    """
+    All dashboard panels in one request, computed concurrently.
+    ?panels=analysis,revenue,... picks a subset (default: all); the other query parameters are
+    passed to the panels that use them (k, city, period, segment, min_monetary, product_type).
+    It costs the user's throttle budgets as much as requesting each panel separately.
+    The response has one key per panel plus per-panel and total timings in milliseconds.
+    """
+    if request.method != 'GET':
+        return _json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    names = [name.strip() for name in request.GET.get('panels', '').split(',') if name.strip()] or list(PANELS)
+    unknown = [name for name in names if name not in PANELS]
+    if unknown:
+        return _json_response({'error': f'Unknown panels: {", ".join(unknown)}. Available: {", ".join(PANELS)}.'}, status=400)
+
+    started = time.perf_counter()
+    parsed, response = await _parse_and_authenticate(request, names, 'async dashboard')
+    if response is not None:
+        return response
+    user, etag, requested, cost = parsed
+    try:
+        results = await gather_panels(requested, user, threading.Event())
+    finally:
+        _release(user, cost)
+
+    data = {name: payload for name, (payload, _) in results.items()}
+    data['timings_ms'] = {name: round(seconds * 1000, 1) for name, (_, seconds) in results.items()}
+    data['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    if any(isinstance(payload, dict) and 'error' in payload for payload in data.values()):
+        return _json_response(data)
+    return _json_response(data, etag=etag)
+
+
+def _authenticate_stream(request):
+    """
+    DRF authentication, or a `token` query parameter: browsers' EventSource can't send an
+    Authorization header. Returns (user, dataset version) or (None, None).
+    """
+    if 'HTTP_AUTHORIZATION' in request.META or 'token' not in request.GET:
+        user = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]).user
+    else:
+        token = Token.objects.select_related('user').filter(key=request.GET['token']).first()
+        user = token.user if token is not None and token.user.is_active else None
+    if not user or not user.is_authenticated:
+        return None, None
+    return user, get_dataset_version(user)
+
+
+async def events_view(request):
+    """
+    The user's server-sent events (text/event-stream): upload progress, dataset versions, warm-up
+    state and finished insights. Resumes after the Last-Event-ID header (or ?last_event_id=).
+    """
+    if request.method != 'GET':
+        return _json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    user, version = await sync_to_async(_authenticate_stream)(request)
+    if user is None:
+        return _json_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    last_event_id = parse_event_id(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+    # Under WSGI this coroutine's loop is gone once the view returns: stream from the worker thread instead
+    asgi = isinstance(request, ASGIRequest)
+    try:
+        subscription, missed = broker().subscribe(user.pk, last_event_id, loop=asyncio.get_running_loop() if asgi else None)
+    except TooManyStreams:
+        response = _json_response({'error': 'Too many open event streams for this user.'}, status=429)
+        response['Retry-After'] = str(int(getattr(settings, 'EVENTS_RETRY_SECONDS', 3)))
+        return response
+
+    if asgi:
+        content = stream(subscription, missed, version, sync_to_async(lambda: get_dataset_version(user)))
+    else:
+        content = stream_sync(subscription, missed, version, lambda: get_dataset_version(user))
+    response = StreamingHttpResponse(content, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: pass events through as they come
+    return response
@@ -0,0 +1,204 @@
+"""
+Cohort retention: customers grouped by the month of their first purchase, and how many of them
+buy again 0, 1, 2... months later.
+
+At ingest, encode_cohort_rollup() reduces the transactions to one entry per (customer, month, city,
+product type) and stores them as compressed NumPy arrays (CohortRollup). The retention matrix is
+then a few vectorized passes over those entries, customers x active months, instead of a scan of
+the transactions; the city and product_type filters are masks over their codes.
+"""
+import io
+import threading
+from collections import OrderedDict
+from datetime import date
+
+from django.db import transaction as db_transaction
+
+from .lazy import LazyModule
+from .models import CohortRollup, Transaction
+from .versioning import get_dataset_version, rebuild_stale
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+ARRAYS = {'customer': 'int32', 'month': 'int32', 'city': 'int32', 'product_type': 'int32', 'orders': 'int32', 'revenue': 'float64'}
+MAX_LOADED = 8  # decoded rollups kept per process
+
+
+def build_rollup(df):
+    """
+    (base_month, cities, product_types, arrays) from a transactions DataFrame with customer_id,
+    purchase_date, amount, city and product_type. Months are offsets from base_month.
+    """
+    df = df[['customer_id', 'purchase_date', 'amount', 'city', 'product_type']].copy()
+    df['purchase_date'] = pd.to_datetime(df['purchase_date'], errors='coerce')
+    df = df.dropna(subset=['purchase_date'])
+    if df.empty:
+        return None, [], [], {name: np.array([], dtype=dtype) for name, dtype in ARRAYS.items()}
+
+    months = (df['purchase_date'].dt.year * 12 + df['purchase_date'].dt.month - 1).to_numpy()
+    base = int(months.min())
+    customers, _ = pd.factorize(df['customer_id'], sort=True)
+    cities, city_names = pd.factorize(df['city'].fillna('').astype(str))
+    products, product_names = pd.factorize(df['product_type'].fillna('').astype(str))
+    entries = pd.DataFrame({
+        'customer': customers, 'month': months - base, 'city': cities, 'product_type': products,
+        'amount': pd.to_numeric(df['amount'], errors='coerce').fillna(0).astype(float).to_numpy(),
+    })
+    # Sorted by customer, then month: retention() relies on that order
+    rolled = entries.groupby(['customer', 'month', 'city', 'product_type'], sort=True)['amount'].agg(['size', 'sum']).reset_index()
+    rolled = rolled.rename(columns={'size': 'orders', 'sum': 'revenue'})
+    arrays = {name: rolled[name].to_numpy(dtype=dtype) for name, dtype in ARRAYS.items()}
+    return date(base // 12, base % 12 + 1, 1), list(city_names), list(product_names), arrays
+
+
+def encode_cohort_rollup(df):
+    """The CohortRollup fields for a transactions DataFrame, ready to save."""
+    base_month, cities, product_types, arrays = build_rollup(df)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return {'base_month': base_month, 'cities': cities, 'product_types': product_types, 'data': buffer.getvalue()}
+
+
+def store_cohort_rollup(user, df, version):
+    """Replaces the user's rollup with one built from `df`."""
+    save_cohort_rollup(user, encode_cohort_rollup(df), version)
+
+
+def save_cohort_rollup(user, fields, version):
+    """Replaces the user's rollup with `fields` (encode_cohort_rollup)."""
+    with db_transaction.atomic():
+        CohortRollup.objects.update_or_create(user=user, defaults={**fields, 'dataset_version': version})
+
+
+def rebuild_cohort_rollup(user):
+    """Rebuilds the rollup from the stored transactions (for data that predates it)."""
+    df = pd.DataFrame.from_records(
+        Transaction.objects.for_user(user).values('customer_id', 'purchase_date', 'amount', 'city', 'product_type'),
+        columns=['customer_id', 'purchase_date', 'amount', 'city', 'product_type'],
+    )
+    store_cohort_rollup(user, df, get_dataset_version(user))
+
+
+class Rollup:
+    """A decoded CohortRollup."""
+
+    def __init__(self, base_month, cities, product_types, arrays):
+        self.base_month = base_month
+        self.cities = cities
+        self.product_types = product_types
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_model(cls, rollup):
+        with np.load(io.BytesIO(bytes(rollup.data))) as data:
+            arrays = {name: data[name] for name in ARRAYS}
+        return cls(rollup.base_month, rollup.cities, rollup.product_types, arrays)
+
+    def month_label(self, offset):
+        month = self.base_month.year * 12 + self.base_month.month - 1 + int(offset)
+        return f'{month // 12:04d}-{month % 12 + 1:02d}'
+
+    def _mask(self, codes, names, value):
+        wanted = [code for code, name in enumerate(names) if name.lower() == value.strip().lower()]
+        return np.isin(codes, wanted)
+
+    def retention(self, city=None, product_type=None):
+        """
+        One row per first-purchase month: cohort size, then per month since the first purchase the
+        active customers, their share of the cohort and revenue. Only customers' purchases matching
+        the filters count (a cohort is the month of their first matching purchase). Rows stop at
+        the dataset's last month.
+        """
+        mask = np.ones(len(self.customer), dtype=bool)
+        if city:
+            mask &= self._mask(self.city, self.cities, city)
+        if product_type:
+            mask &= self._mask(self.product_type, self.product_types, product_type)
+        customer, month, revenue = self.customer[mask], self.month[mask], self.revenue[mask]
+        if not len(customer):
+            return []
+
+        # Entries are sorted by customer then month: each customer's first entry is their cohort
+        new_customer = np.concatenate(([True], customer[1:] != customer[:-1]))
+        starts = np.flatnonzero(new_customer)
+        cohort = np.repeat(month[starts], np.diff(np.append(starts, len(customer))))
+        since = month - cohort
+        # A customer has one entry per city and product type in a month; count them once
+        first_in_month = new_customer | np.concatenate(([True], month[1:] != month[:-1]))
+
+        last_month = int(self.month.max())
+        width = last_month + 1
+        # One row per cohort that has customers, not per month of the span: a single outlier date
+        # (e.g. 1900-01-01) widens the rows, but doesn't make the matrix width x width
+        offsets, row = np.unique(cohort, return_inverse=True)
+        cells = row * width + since
+        shape = (len(offsets), width)
+        active = np.bincount(cells[first_in_month], minlength=shape[0] * width).reshape(shape)
+        spent = np.bincount(cells, weights=revenue, minlength=shape[0] * width).reshape(shape)
+
+        rows = []
+        for index, offset in enumerate(offsets):
+            observed = last_month - offset + 1
+            counts = active[index, :observed]
+            rows.append({
+                'cohort': self.month_label(offset),
+                'customers': int(counts[0]),
+                'active': counts.tolist(),
+                'retention': np.round(counts / counts[0], 4).tolist(),
+                'revenue': np.round(spent[index, :observed], 2).tolist(),
+            })
+        return rows
+
+
+_loaded = OrderedDict()  # user pk -> (dataset version, Rollup)
+_loaded_lock = threading.Lock()
+
+
+def cohort_rollup(user):
+    """
+    The user's decoded rollup for the current dataset, or None when they have no transactions.
+    Rebuilt from the transactions only if it is missing or predates the dataset.
+    """
+    version = get_dataset_version(user)
+    with _loaded_lock:
+        cached = _loaded.get(user.pk)
+        if cached is not None and cached[0] == version:
+            _loaded.move_to_end(user.pk)
+            return cached[1]
+
+    built_for = CohortRollup.objects.filter(user=user).values_list('dataset_version', flat=True).first()
+    if built_for != version:
+        if built_for is None and not Transaction.objects.for_user(user).exists():
+            return None
+        rebuild_stale(user, 'cohort_rollup', rebuild_cohort_rollup)
+    stored = CohortRollup.objects.filter(user=user).first()
+    if stored is None or stored.base_month is None:
+        return None
+    rollup = Rollup.from_model(stored)
+    with _loaded_lock:
+        _loaded[user.pk] = (stored.dataset_version, rollup)
+        _loaded.move_to_end(user.pk)
+        while len(_loaded) > MAX_LOADED:
+            _loaded.popitem(last=False)
+    return rollup
+
+
+def cohort_panel(user, city=None, product_type=None):
+    """Monthly cohort retention matrix, optionally for one city and/or product type."""
+    rollup = cohort_rollup(user)
+    filters = {'city': city, 'product_type': product_type}
+    if rollup is None:
+        return {'cohorts': [], 'filters': filters, 'cities': [], 'product_types': [], 'message': 'No transactions found.'}
+    return {
+        'cohorts': rollup.retention(city=city, product_type=product_type),
+        'filters': filters,
+        'cities': sorted(name for name in rollup.cities if name),
+        'product_types': sorted(name for name in rollup.product_types if name),
+    }
+
+
+def clear_loaded_rollups():
+    with _loaded_lock:
+        _loaded.clear()
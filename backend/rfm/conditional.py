@@ -0,0 +1,78 @@
+import functools
+import hashlib
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+from .versioning import get_dataset_version
+
+
+def dataset_etag(request, version):
+    """
+    Builds a weak ETag for an analytics response: the same tag covers the identity, gzip and br
+    encodings of the body (FastJSONRenderer.compress), which a strong tag must not (RFC 9110 8.8.1).
+    The tag is derived from the user's dataset version, the endpoint, the query parameters and the
+    negotiated format. Today's date is included too, because recency and the `period` filters are
+    computed relative to today, so the same dataset yields a different payload tomorrow.
+    """
+    params = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+    renderer = getattr(request, 'accepted_renderer', None)
+    parts = [
+        str(request.user.pk),
+        str(version),
+        request.path,
+        repr(params),
+        getattr(renderer, 'format', '') or '',
+        timezone.now().date().isoformat(),
+    ]
+    digest = hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Weak comparison as required for If-None-Match (RFC 9110 13.1.2): a tag matches with or
+    without the W/ prefix.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return any(tag.removeprefix('W/') == etag.removeprefix('W/') for tag in candidates)
+
+
+def cache_control_value():
+    """Per-user data: never shareable, and clients must revalidate with the ETag."""
+    max_age = getattr(settings, 'ANALYTICS_CACHE_MAX_AGE', 0)
+    if max_age:
+        return f'private, max-age={max_age}, must-revalidate'
+    return 'private, no-cache'
+
+
+def conditional_on_dataset(view_method):
+    """
+    Decorator for APIView GET handlers that only depend on the user's dataset.
+    Answers a matching If-None-Match with 304 before the handler runs (no pandas work, no
+    transaction scan), and tags successful responses with ETag and Cache-Control headers.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        etag = dataset_etag(request, get_dataset_version(request.user))
+
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control_value()
+        patch_vary_headers(response, ('Accept', 'Authorization'))
+        return response
+
+    return wrapper
@@ -0,0 +1,236 @@
+"""
+Server-sent events: one stream per user (/api/rfm/events/) that tells clients when their data
+changed, so they fetch once instead of polling. Events (SSE `event:`; `data:` is JSON):
+  upload    progress of an upload: {'stage': 'validating' | 'loading' | 'loaded' | 'failed', ...}
+  dataset   the dataset version changed (upload, segment rules, purge): {'version': n}
+  warmup    the post-upload warm-up (rfm.prewarm) changed state: {'state': ..., 'version': n}
+  insights  an insights generation finished: {'state': 'done', 'insights': ...} or {'state': 'failed', 'error': ...}
+
+The broker is this process's memory, so no external service is needed. It keeps the last
+EVENTS_HISTORY events per user, which a reconnecting client gets back after its Last-Event-ID.
+Like the panel cache it is per process: with several workers a stream only sees what its own
+worker published, except `dataset`, which every stream also checks in the database every
+EVENTS_HEARTBEAT_SECONDS (alongside the keep-alive comment). Streams end after
+EVENTS_STREAM_SECONDS and EventSource reconnects, resuming from the last event it got.
+"""
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+MAX_USERS_WITH_HISTORY = 1024
+QUEUE_SIZE = 100  # undelivered events per stream; a stream that falls further behind is ended
+
+
+class TooManyStreams(Exception):
+    """The user already has EVENTS_MAX_STREAMS_PER_USER streams open in this process."""
+
+
+class Event:
+    def __init__(self, id, name, data):
+        self.id = id
+        self.name = name
+        self.data = data
+
+    def encode(self):
+        """The event in the text/event-stream format."""
+        id_line = f'id: {self.id}\n' if self.id is not None else ''
+        return f'{id_line}event: {self.name}\ndata: {json.dumps(self.data, default=str)}\n\n'.encode()
+
+
+class Subscription:
+    """One open stream: events are queued for the event loop serving it, or for its thread under WSGI."""
+
+    def __init__(self, user_id, loop=None):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE) if loop is not None else queue.Queue(QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, event):
+        if self.loop is None:
+            self._put(event)
+            return
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:  # the loop is closed: the stream is gone
+            self.overflowed = True
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except (asyncio.QueueFull, queue.Full):
+            self.overflowed = True
+
+
+class EventBroker:
+    """Per-user fan-out of events to the streams open in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # user id -> set of Subscription
+        self._history = OrderedDict()  # user id -> deque of recent Events
+        self._next_id = 1
+
+    def publish(self, user_id, name, data):
+        with self._lock:
+            event = Event(self._next_id, name, data)
+            self._next_id += 1
+            history = self._history.get(user_id)
+            if history is None:
+                history = self._history[user_id] = deque(maxlen=getattr(settings, 'EVENTS_HISTORY', 50))
+            history.append(event)
+            self._history.move_to_end(user_id)
+            while len(self._history) > MAX_USERS_WITH_HISTORY:
+                self._history.popitem(last=False)
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+        return event
+
+    def subscribe(self, user_id, last_event_id=None, loop=None):
+        """
+        Opens a stream for the user. Returns (Subscription, events published after last_event_id);
+        raises TooManyStreams when the user is at EVENTS_MAX_STREAMS_PER_USER.
+        """
+        subscription = Subscription(user_id, loop)
+        with self._lock:
+            streams = self._subscriptions.setdefault(user_id, set())
+            if len(streams) >= getattr(settings, 'EVENTS_MAX_STREAMS_PER_USER', 10):
+                raise TooManyStreams()
+            streams.add(subscription)
+            missed = []
+            if last_event_id is not None:
+                history = list(self._history.get(user_id, ()))
+                # An id from before this process started: everything we have is newer
+                restarted = last_event_id >= self._next_id
+                missed = [event for event in history if restarted or event.id > last_event_id]
+        return subscription, missed
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            streams = self._subscriptions.get(subscription.user_id)
+            if streams is not None:
+                streams.discard(subscription)
+                if not streams:
+                    del self._subscriptions[subscription.user_id]
+
+    def stream_count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscriptions.get(user_id, ()))
+            return sum(len(streams) for streams in self._subscriptions.values())
+
+
+_broker = EventBroker()
+
+
+def broker():
+    return _broker
+
+
+def publish(user, name, **data):
+    """Publishes an event to the user's open streams (no-op when EVENTS_ENABLED is off)."""
+    if not getattr(settings, 'EVENTS_ENABLED', True):
+        return None
+    return _broker.publish(user.pk, name, data)
+
+
+def parse_event_id(value):
+    """A Last-Event-ID header or last_event_id parameter: an event id, or None when absent or malformed."""
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _settings():
+    return (
+        float(getattr(settings, 'EVENTS_HEARTBEAT_SECONDS', 15)),
+        float(getattr(settings, 'EVENTS_STREAM_SECONDS', 3600)),
+    )
+
+
+def _opening(missed):
+    retry_ms = int(getattr(settings, 'EVENTS_RETRY_SECONDS', 3) * 1000)
+    return [f'retry: {retry_ms}\n\n'.encode()] + [event.encode() for event in missed]
+
+
+class _Heartbeat:
+    """When a stream next checks the dataset version, and when it ends."""
+
+    def __init__(self, version):
+        self.version = version
+        self.interval, lifetime = _settings()
+        self.deadline = time.monotonic() + lifetime
+        self.next_check = time.monotonic() + self.interval
+
+    def wait_seconds(self):
+        """Seconds to wait for an event before the next check, or None once the stream should end."""
+        now = time.monotonic()
+        if now >= self.deadline:
+            return None
+        return max(0.0, min(self.next_check, self.deadline) - now)
+
+    def due(self):
+        return time.monotonic() >= self.next_check
+
+    def checked(self, latest):
+        """The chunk to send after a version check: a `dataset` event if it changed, else a keep-alive comment."""
+        self.next_check = time.monotonic() + self.interval
+        if latest == self.version:
+            return b': keep-alive\n\n'
+        self.version = latest
+        # Not published (no id): it only tells this stream what another worker changed
+        return Event(None, 'dataset', {'version': latest}).encode()
+
+    def seen(self, event):
+        if event.name == 'dataset':
+            self.version = event.data.get('version', self.version)
+        return event.encode()
+
+
+async def stream(subscription, missed, version, current_version):
+    """
+    Async generator of the text/event-stream body for an ASGI response. `current_version` is an
+    async callable returning the user's dataset version.
+    """
+    heartbeat = _Heartbeat(version)
+    try:
+        for chunk in _opening(missed):
+            yield chunk
+        while not subscription.overflowed:
+            wait = heartbeat.wait_seconds()
+            if wait is None:
+                return
+            try:
+                yield heartbeat.seen(await asyncio.wait_for(subscription.queue.get(), wait))
+            except asyncio.TimeoutError:
+                pass
+            if heartbeat.due():
+                yield heartbeat.checked(await current_version())
+    finally:
+        _broker.unsubscribe(subscription)
+
+
+def stream_sync(subscription, missed, version, current_version):
+    """stream() for WSGI servers (e.g. runserver), which hold a worker thread for the stream's lifetime."""
+    heartbeat = _Heartbeat(version)
+    try:
+        yield from _opening(missed)
+        while not subscription.overflowed:
+            wait = heartbeat.wait_seconds()
+            if wait is None:
+                return
+            try:
+                yield heartbeat.seen(subscription.queue.get(timeout=wait))
+            except queue.Empty:
+                pass
+            if heartbeat.due():
+                yield heartbeat.checked(current_version())
+    finally:
+        _broker.unsubscribe(subscription)
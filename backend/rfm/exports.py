@@ -0,0 +1,252 @@
+"""
+Streaming exports of a user's RFM table, customer totals and raw transactions as CSV, XLSX or
+Parquet (ExportView).
+
+Rows are produced in EXPORT_CHUNK_ROWS chunks: transactions and customer totals straight from the
+database cursor, the RFM table by slicing the cached columnar result. Each chunk is encoded and
+handed to the StreamingHttpResponse before the next one is read, so memory stays flat whatever the
+dataset size. XLSX uses openpyxl's write-only mode, which spools rows to a temporary file; the
+finished workbook is then streamed from that file in blocks.
+"""
+import csv
+import importlib.util
+import io
+import tempfile
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Count, Max, Min, Sum
+
+from .lazy import LazyModule
+from .models import Transaction
+from .panels import rfm_table
+
+pa = LazyModule('pyarrow')
+pq = LazyModule('pyarrow.parquet')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# dataset -> [(column, kind)]; kinds map to Parquet types below
+COLUMNS = {
+    'rfm': [
+        ('customer_id', 'str'), ('recency', 'int'), ('frequency', 'int'), ('monetary', 'decimal'),
+        ('r_score', 'int'), ('f_score', 'int'), ('m_score', 'int'), ('rfm_score', 'str'), ('segment', 'str'),
+        ('loyalty_points', 'int'),
+    ],
+    'customers': [
+        ('customer_id', 'str'), ('total_paid', 'decimal'), ('total_points', 'int'), ('order_count', 'int'),
+        ('first_purchase', 'date'), ('last_purchase', 'date'),
+    ],
+    'transactions': [
+        ('customer_id', 'str'), ('purchase_date', 'date'), ('amount', 'decimal'), ('city', 'str'),
+        ('product_type', 'str'), ('amount_100kg', 'decimal'), ('price_per_kg', 'decimal'), ('loyalty_points', 'int'),
+    ],
+}
+
+CENTS = Decimal('0.01')
+
+
+class ExportError(Exception):
+    """Raised for export parameters that cannot be served (e.g. a bad min_monetary filter)."""
+
+
+def chunk_rows():
+    return getattr(settings, 'EXPORT_CHUNK_ROWS', 5000)
+
+
+def parquet_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+# --- Row sources: iterators of row-tuple lists (chunks), in COLUMNS order -------------------------
+
+def _customer_filter(user, segment, min_monetary):
+    """
+    Customer ids allowed by the segment / min_monetary filters (from the RFM table), or None when
+    no filter is set. Both filters mean the same on every dataset: customers whose RFM segment
+    matches and whose total spend is at least min_monetary.
+    """
+    if not segment and min_monetary is None:
+        return None
+    table = rfm_table(user)
+    if table is None:
+        return set()
+    mask = table['customer_id'].notna()
+    if segment:
+        mask &= table['segment'].str.lower() == segment.lower()
+    if min_monetary is not None:
+        mask &= table['monetary'].astype(float) >= float(min_monetary)
+    return set(table.loc[mask, 'customer_id'])
+
+
+def _cursor_chunks(queryset, size, allowed):
+    """Rows from a values_list() queryset, read through the DB cursor `size` rows at a time."""
+    chunk = []
+    for row in queryset.iterator(chunk_size=size):
+        if allowed is None or row[0] in allowed:
+            chunk.append(row)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _frame_chunks(table, size):
+    for start in range(0, len(table), size):
+        part = table.iloc[start:start + size].copy()
+        part['monetary'] = part['monetary'].map(lambda value: Decimal(repr(float(value))).quantize(CENTS))
+        yield list(part.itertuples(index=False, name=None))
+
+
+# Row sources run their query (or fetch the cached table) when called, not when first iterated,
+# so they read from the database that is current for the request.
+
+def rfm_rows(user, allowed, size):
+    table = rfm_table(user)
+    if table is None:
+        return iter(())
+    if allowed is not None:
+        table = table[table['customer_id'].isin(allowed)]
+    return _frame_chunks(table[[name for name, _ in COLUMNS['rfm']]], size)
+
+
+def customer_rows(user, allowed, size):
+    queryset = (
+        Transaction.objects.for_user(user)
+        .values('customer_id')
+        .annotate(
+            total_paid=Sum('amount'), total_points=Sum('loyalty_points'), order_count=Count('id'),
+            first_purchase=Min('purchase_date'), last_purchase=Max('purchase_date'),
+        )
+        .order_by('customer_id')
+        .values_list('customer_id', 'total_paid', 'total_points', 'order_count', 'first_purchase', 'last_purchase')
+    )
+    # SQLite hands back aggregated decimals unquantized (Decimal('200') for 200.00)
+    return (
+        [(customer_id, total.quantize(CENTS), *rest) for customer_id, total, *rest in rows]
+        for rows in _cursor_chunks(queryset, size, allowed)
+    )
+
+
+def transaction_rows(user, allowed, size):
+    queryset = (
+        Transaction.objects.for_user(user)
+        .order_by('customer_id', 'purchase_date', 'id')
+        .values_list(*[name for name, _ in COLUMNS['transactions']])
+    )
+    return _cursor_chunks(queryset, size, allowed)
+
+
+DATASETS = {'rfm': rfm_rows, 'customers': customer_rows, 'transactions': transaction_rows}
+
+
+# --- Encoders: chunks of rows -> chunks of bytes --------------------------------------------------
+
+def csv_stream(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def xlsx_stream(columns, chunks, block_size=64 * 1024):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('export')
+    sheet.append([name for name, _ in columns])
+    for rows in chunks:
+        for row in rows:
+            sheet.append(row)
+    with tempfile.TemporaryFile() as spool:
+        workbook.save(spool)
+        spool.seek(0)
+        while True:
+            block = spool.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+class _ByteSink(io.RawIOBase):
+    """Write-only file object collecting what ParquetWriter writes, drained after every row group."""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data, self._buffer = bytes(self._buffer), bytearray()
+        return data
+
+
+def parquet_schema(columns):
+    types = {'str': pa.string(), 'int': pa.int64(), 'decimal': pa.decimal128(12, 2), 'date': pa.date32()}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def parquet_stream(columns, chunks):
+    """One row group per chunk, written through a sink that is emptied after each group."""
+    schema = parquet_schema(columns)
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in chunks:
+            values = list(zip(*rows))
+            arrays = [pa.array(list(column), type=field.type) for column, field in zip(values, schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {'csv': csv_stream, 'xlsx': xlsx_stream, 'parquet': parquet_stream}
+
+
+def parse_filters(params):
+    """(segment, min_monetary) from query parameters; raises ExportError for a bad min_monetary."""
+    segment = params.get('segment') or None
+    min_monetary = params.get('min_monetary') or None
+    if min_monetary is not None:
+        try:
+            min_monetary = Decimal(min_monetary)
+        except InvalidOperation:
+            raise ExportError('Invalid value for min_monetary filter.')
+    return segment, min_monetary
+
+
+def export_stream(user, dataset, file_format, segment=None, min_monetary=None):
+    """
+    Bytes of the export, as a generator for StreamingHttpResponse. The row queries are bound to
+    the database current at this call (e.g. the request's replica), though they run while streaming.
+    """
+    size = chunk_rows()
+    allowed = _customer_filter(user, segment, min_monetary)
+    chunks = DATASETS[dataset](user, allowed, size)
+    return ENCODERS[file_format](COLUMNS[dataset], chunks)
@@ -0,0 +1,553 @@
+import csv
+import io
+import threading
+import time
+import warnings
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from multiprocessing import get_context
+
+from django.conf import settings
+
+from .lazy import LazyModule
+from .spreadsheets import SpreadsheetError, iter_sheet_frames, read_header
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+class UploadFormatError(Exception):
+    """Raised when an upload cannot be read as a transactions file at all."""
+
+
+# Accept both old and new column names
+# Map new spreadsheet columns to model fields
+COLUMN_ALIASES = {
+    'customer_id': ['customer_id', 'relationship id'],
+    'purchase_date': ['purchase_date', 'date clean'],
+    'amount_100kg': ['amount (100kg)', 'amount_100kg'],
+    'price_per_kg': ['price_per_kg', 'price per kg', 'price per_kg'],
+    'city': ['city'],
+}
+OLD_FORMAT_COLUMNS = {'customer_id', 'purchase_date', 'amount'}
+
+MISSING_COLUMNS_ERROR = (
+    "File is missing required columns. Acceptable formats: (1) 'Relationship ID', 'Date Clean', "
+    "'amount (100kg)', 'price_per_kg', 'city' OR (2) 'customer_id', 'purchase_date', 'amount'."
+)
+
+FILE_TYPES = {'.csv': 'csv', '.xlsx': 'xlsx', '.xls': 'xls'}
+
+# Leading bytes of each spreadsheet container
+MAGIC_BYTES = {
+    'xlsx': b'PK\x03\x04',  # Office Open XML is a zip archive
+    'xls': b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',  # Legacy BIFF lives in an OLE2 compound file
+}
+
+TRANSACTION_COLUMNS = [
+    'customer_id', 'purchase_date', 'amount', 'city', 'product_type', 'amount_100kg', 'price_per_kg', 'loyalty_points',
+]
+
+
+def sniff_bytes():
+    return getattr(settings, 'UPLOAD_SNIFF_BYTES', 64 * 1024)
+
+
+def chunk_rows():
+    return getattr(settings, 'UPLOAD_CHUNK_ROWS', 50_000)
+
+
+def default_max_errors():
+    return getattr(settings, 'UPLOAD_MAX_ERRORS', 100)
+
+
+def parse_workers():
+    return getattr(settings, 'UPLOAD_PARSE_WORKERS', 4)
+
+
+def file_type_for(name):
+    """'csv', 'xlsx' or 'xls' from the file name, or None when unsupported."""
+    lowered = name.lower()
+    for extension, file_type in FILE_TYPES.items():
+        if lowered.endswith(extension):
+            return file_type
+    return None
+
+
+def normalize_columns(columns):
+    return [str(col).lower().strip() for col in columns]
+
+
+def detect_format(columns):
+    """'new' (Relationship ID / Date Clean / amount (100kg) / price_per_kg / city), 'old' or None."""
+    present = set(columns)
+    if all(any(alias in present for alias in aliases) for aliases in COLUMN_ALIASES.values()):
+        return 'new'
+    if OLD_FORMAT_COLUMNS.issubset(present):
+        return 'old'
+    return None
+
+
+def _read_head(file, size):
+    file.seek(0)
+    head = file.read(size)
+    file.seek(0)
+    return head
+
+
+def _csv_header(head):
+    if b'\x00' in head:
+        raise UploadFormatError('The file does not look like a CSV text file.')
+    text = head.decode('utf-8-sig', errors='replace')
+    if not text.strip():
+        raise UploadFormatError('The uploaded file is empty.')
+    first_line = text.splitlines()[0]
+    return next(csv.reader([first_line]))
+
+
+def sniff_upload(file, file_name, sniff_size=None, sheet=None):
+    """
+    Cheap pre-flight check that runs before any full parse.
+    Looks at the first UPLOAD_SNIFF_BYTES to confirm the content matches the extension and reads
+    only the header row (of `sheet` for spreadsheets, see rfm.spreadsheets) to detect the column format.
+
+    Returns {'file_type', 'format', 'columns', 'sheet', 'sheets'}; the last two are None for CSV.
+    Raises UploadFormatError for anything that cannot possibly be processed.
+    """
+    file_type = file_type_for(file_name)
+    if file_type is None:
+        raise UploadFormatError('Unsupported file type. Please upload a CSV or Excel file (.xlsx, .xls).')
+
+    head = _read_head(file, sniff_size or sniff_bytes())
+    if not head:
+        raise UploadFormatError('The uploaded file is empty.')
+
+    sheet_name = sheet_names = None
+    if file_type == 'csv':
+        if any(head.startswith(magic) for magic in MAGIC_BYTES.values()):
+            raise UploadFormatError('The file is a spreadsheet, not a CSV file. Please use the matching extension.')
+        columns = normalize_columns(_csv_header(head))
+    else:
+        if not head.startswith(MAGIC_BYTES[file_type]):
+            raise UploadFormatError(f'The file content does not match the .{file_type} extension.')
+        try:
+            sheet_name, columns, sheet_names = read_header(file, file_type, sheet)
+        except SpreadsheetError as e:
+            raise UploadFormatError(str(e))
+        columns = normalize_columns(columns)
+
+    file_format = detect_format(columns)
+    if file_format is None:
+        raise UploadFormatError(MISSING_COLUMNS_ERROR)
+    return {'file_type': file_type, 'format': file_format, 'columns': columns, 'sheet': sheet_name, 'sheets': sheet_names}
+
+
+def iter_frames(file, file_type, chunk_size=None, sheet=None):
+    """Yields the upload as DataFrames of UPLOAD_CHUNK_ROWS rows, streamed for CSV and spreadsheets alike."""
+    file.seek(0)
+    if file_type == 'csv':
+        yield from pd.read_csv(file, chunksize=chunk_size or chunk_rows())
+        return
+    try:
+        yield from iter_sheet_frames(file, file_type, sheet, chunk_size or chunk_rows())
+    except SpreadsheetError as e:
+        raise UploadFormatError(str(e))
+
+
+def _first_present(df, aliases):
+    """Column-wise equivalent of 'first alias column that is not NA' for each row."""
+    result = None
+    for alias in aliases:
+        if alias in df.columns:
+            result = df[alias] if result is None else result.combine_first(df[alias])
+    if result is None:
+        return pd.Series([np.nan] * len(df), index=df.index, dtype=object)
+    return result
+
+
+def _clean_text(values):
+    """Strings stripped of whitespace; NA stays NA (instead of becoming 'nan')."""
+    text = values.astype(object).where(values.notna())
+    return text.map(lambda value: str(value).strip(), na_action='ignore')
+
+
+def _parse_dates(values):
+    """
+    Vectorized purchase_date parsing. Values that the fast, single-format pass cannot parse are
+    retried one by one, so files mixing date formats still validate like before.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.tz_localize(None) if values.dt.tz is not None else values
+    text = _clean_text(values)
+    try:
+        with warnings.catch_warnings():
+            # "Could not infer format" is expected for mixed files; the retry below handles them
+            warnings.simplefilter('ignore', UserWarning)
+            parsed = pd.to_datetime(text, errors='coerce')
+    except (ValueError, TypeError):
+        parsed = pd.Series(pd.NaT, index=values.index)
+    retry = parsed.isna() & text.notna()
+    if retry.any():
+        def parse_one(value):
+            try:
+                return pd.Timestamp(pd.to_datetime(value)).tz_localize(None)
+            except (ValueError, TypeError, OverflowError):
+                return pd.NaT
+        parsed = parsed.astype('datetime64[ns]')
+        parsed[retry] = text[retry].map(parse_one).astype('datetime64[ns]')
+    return parsed
+
+
+def _to_decimal(value):
+    return Decimal(str(value))
+
+
+def validate_frame(df, file_format, first_row):
+    """
+    Validates one parsed chunk with column operations instead of a per-row loop.
+
+    Args:
+        df: The chunk, with normalized (lower-cased, stripped) column names.
+        file_format: 'new' or 'old' (see detect_format).
+        first_row: Spreadsheet row number of the chunk's first data row (the header is row 1).
+
+    Returns:
+        (valid, errors): a DataFrame with TRANSACTION_COLUMNS for the rows that passed, and a list of
+        (row_number, message) for the rows that did not, at most one message per row.
+    """
+    n = len(df)
+    row_numbers = np.arange(first_row, first_row + n)
+    bad = np.zeros(n, dtype=bool)
+    errors = []
+
+    def reject(mask, message):
+        mask = np.asarray(mask, dtype=bool) & ~bad
+        for position in np.flatnonzero(mask):
+            errors.append((int(row_numbers[position]), message(position) if callable(message) else message))
+        bad[mask] = True
+
+    if file_format == 'new':
+        customer_id = _clean_text(_first_present(df, COLUMN_ALIASES['customer_id']))
+        raw_dates = _first_present(df, COLUMN_ALIASES['purchase_date'])
+        amount_100kg = pd.to_numeric(_first_present(df, COLUMN_ALIASES['amount_100kg']), errors='coerce')
+        price_per_kg = pd.to_numeric(_first_present(df, COLUMN_ALIASES['price_per_kg']), errors='coerce')
+        city = _clean_text(_first_present(df, COLUMN_ALIASES['city'])).fillna('')
+    else:
+        customer_id = _clean_text(df['customer_id'])
+        raw_dates = df['purchase_date']
+        amount = pd.to_numeric(_clean_text(df['amount']), errors='coerce')
+        city = pd.Series('', index=df.index)
+
+    reject(customer_id.isna() | (customer_id == ''), 'Missing customer_id.')
+
+    reject(raw_dates.isna(), 'Missing purchase_date.')
+    purchase_date = _parse_dates(raw_dates)
+    raw_date_values = raw_dates.to_numpy()
+    reject(purchase_date.isna(), lambda i: f"Invalid purchase_date format '{raw_date_values[i]}'. Could not parse.")
+
+    if file_format == 'new':
+        reject(amount_100kg.isna() | price_per_kg.isna(), 'Invalid amount_100kg or price_per_kg.')
+    else:
+        raw_amounts = df['amount'].to_numpy()
+        reject(amount.isna(), lambda i: f"Invalid amount '{raw_amounts[i]}'.")
+
+    if 'loyalty_points' in df.columns:
+        loyalty_points = pd.to_numeric(df['loyalty_points'], errors='coerce')
+        raw_points = df['loyalty_points'].to_numpy()
+        reject(loyalty_points.isna() & df['loyalty_points'].notna(), lambda i: f"Invalid loyalty_points '{raw_points[i]}'.")
+        reject(loyalty_points < 0, lambda i: f"Invalid loyalty_points '{raw_points[i]}'.")
+        loyalty_points = loyalty_points.fillna(0)
+    else:
+        loyalty_points = pd.Series(0, index=df.index)
+
+    if 'product_type' in df.columns:
+        product_type = _clean_text(df['product_type']).fillna('')
+    else:
+        product_type = pd.Series('', index=df.index)
+
+    keep = ~bad
+    valid = pd.DataFrame({
+        'customer_id': customer_id[keep],
+        'purchase_date': purchase_date[keep],
+        'city': city[keep],
+        'product_type': product_type[keep],
+        'loyalty_points': loyalty_points[keep].astype(int),
+    })
+    # Exact decimal arithmetic, as the model stores DecimalFields
+    if file_format == 'new':
+        valid['amount_100kg'] = amount_100kg[keep].map(_to_decimal)
+        valid['price_per_kg'] = price_per_kg[keep].map(_to_decimal)
+        valid['amount'] = valid['amount_100kg'] * valid['price_per_kg']
+    else:
+        valid['amount'] = _clean_text(df['amount'])[keep].map(Decimal)
+        valid['amount_100kg'] = None
+        valid['price_per_kg'] = None
+
+    errors.sort()
+    return valid[TRANSACTION_COLUMNS].reset_index(drop=True), errors
+
+
+class ValidationReport:
+    """
+    Outcome of validating an upload: counts, error sample, date range and (optionally) the rows.
+    """
+
+    def __init__(self, file_type, file_format, max_errors, sheet=None):
+        self.file_type = file_type
+        self.file_format = file_format
+        self.sheet = sheet
+        self.max_errors = max_errors
+        self.rows_checked = 0
+        self.valid_rows = 0
+        self.error_count = 0
+        self.errors = []
+        self.stopped_early = False
+        self.min_date = None
+        self.max_date = None
+        self.customers = set()
+        self.timings = {'read_file': 0.0, 'validate': 0.0}  # ms, summed over the chunks
+        self._frames = []
+
+    @property
+    def errors_truncated(self):
+        return self.stopped_early or self.error_count > len(self.errors)
+
+    @property
+    def frame(self):
+        """All valid rows (only when validated with keep_rows=True)."""
+        if not self._frames:
+            return pd.DataFrame(columns=TRANSACTION_COLUMNS)
+        if len(self._frames) > 1:
+            self._frames = [pd.concat(self._frames, ignore_index=True)]
+        return self._frames[0]
+
+    def add(self, valid, errors, keep_rows):
+        self.rows_checked += len(valid) + len(errors)
+        self.valid_rows += len(valid)
+        self.error_count += len(errors)
+        room = self.max_errors - len(self.errors)
+        if room > 0:
+            self.errors.extend(f'Row {row}: {message}' for row, message in errors[:room])
+        if not valid.empty:
+            low, high = valid['purchase_date'].min(), valid['purchase_date'].max()
+            self.min_date = low if self.min_date is None else min(self.min_date, low)
+            self.max_date = high if self.max_date is None else max(self.max_date, high)
+            self.customers.update(valid['customer_id'].unique())
+            if keep_rows:
+                self._frames.append(valid)
+
+    def summary(self):
+        return {
+            'file_type': self.file_type,
+            'format': self.file_format,
+            'sheet': self.sheet,
+            'rows_checked': self.rows_checked,
+            'valid_rows': self.valid_rows,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.errors_truncated,
+            'stopped_early': self.stopped_early,
+            'unique_customers': len(self.customers),
+            'date_range': {
+                'min': self.min_date.date() if self.min_date is not None else None,
+                'max': self.max_date.date() if self.max_date is not None else None,
+            },
+        }
+
+
+def validate_upload(file, sniffed, max_errors, keep_rows=True, stop_early=True, chunk_size=None):
+    """
+    Parses and validates an upload chunk by chunk.
+
+    With stop_early, parsing stops at the chunk in which the error count reaches max_errors, so a
+    wrong file costs one chunk rather than the whole file. Without keep_rows only the counters are
+    kept (dry runs), so memory stays flat regardless of file size. Time spent reading chunks and
+    validating them is summed in report.timings.
+    Raises UploadFormatError when the columns do not match a known format.
+    """
+    report = ValidationReport(sniffed['file_type'], sniffed['format'], max_errors, sniffed.get('sheet'))
+    next_row = 2  # Row 1 is the header
+    chunks = iter_frames(file, sniffed['file_type'], chunk_size, sniffed.get('sheet'))
+    while True:
+        started = time.perf_counter()
+        chunk = next(chunks, None)
+        read = time.perf_counter()
+        report.timings['read_file'] += (read - started) * 1000
+        if chunk is None:
+            break
+        chunk.columns = normalize_columns(chunk.columns)
+        if report.file_format is None:
+            report.file_format = detect_format(chunk.columns)
+            if report.file_format is None:
+                raise UploadFormatError(MISSING_COLUMNS_ERROR)
+        valid, errors = validate_frame(chunk, report.file_format, next_row)
+        next_row += len(chunk)
+        report.add(valid, errors, keep_rows)
+        report.timings['validate'] += (time.perf_counter() - read) * 1000
+        if stop_early and report.error_count >= max_errors:
+            report.stopped_early = True
+            break
+    return report
+
+
+# --- Several files per upload ------------------------------------------------------------------
+
+ZIP_MAGIC = (b'PK\x03\x04', b'PK\x05\x06')  # local file header, or the end record of an empty archive
+
+
+def is_archive(name):
+    return name.lower().endswith('.zip')
+
+
+def _ignored_member(filename):
+    """Directories and the metadata archivers add (__MACOSX/, .DS_Store, ._resource forks)."""
+    parts = filename.split('/')
+    return filename.endswith('/') or parts[0] == '__MACOSX' or any(part.startswith('.') for part in parts)
+
+
+def collect_members(uploads):
+    """
+    Flattens the uploaded files into (name, bytes) members: plain files as they are, ZIP archives
+    expanded to the CSV/Excel files inside (as 'archive.zip/inner.csv'). Other files inside an
+    archive are skipped and returned by name. Enforces UPLOAD_MAX_FILES and, for archives,
+    UPLOAD_MAX_ARCHIVE_BYTES of uncompressed content.
+    Returns (members, skipped); raises UploadFormatError for unreadable archives or exceeded limits.
+    """
+    max_files = getattr(settings, 'UPLOAD_MAX_FILES', 100)
+    max_bytes = getattr(settings, 'UPLOAD_MAX_ARCHIVE_BYTES', 512 * 1024 * 1024)
+    members, skipped = [], []
+    for upload in uploads:
+        upload.seek(0)
+        if not is_archive(upload.name):
+            members.append((upload.name, upload.read()))
+            continue
+        if not upload.read(4).startswith(ZIP_MAGIC):
+            raise UploadFormatError(f'{upload.name} is not a valid ZIP archive.')
+        upload.seek(0)
+        try:
+            with zipfile.ZipFile(upload) as archive:
+                infos = [info for info in archive.infolist() if not _ignored_member(info.filename)]
+                # Declared sizes are enforced while reading, so this also stops zip bombs
+                if sum(info.file_size for info in infos) > max_bytes:
+                    raise UploadFormatError(f'{upload.name} expands to more than {max_bytes // (1024 * 1024)} MB.')
+                for info in infos:
+                    if file_type_for(info.filename) is None:
+                        skipped.append(f'{upload.name}/{info.filename}')
+                    else:
+                        members.append((f'{upload.name}/{info.filename}', archive.read(info)))
+        except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+            # RuntimeError: encrypted member; NotImplementedError: unsupported compression
+            raise UploadFormatError(f'Could not read {upload.name}: {e}')
+        finally:
+            upload.seek(0)
+        if len(members) > max_files:
+            break
+    if len(members) > max_files:
+        raise UploadFormatError(f'Too many files in one upload (at most {max_files}).')
+    if not members:
+        raise UploadFormatError('The upload contains no CSV or Excel files.')
+    return members, skipped
+
+
+DECIMAL_COLUMNS = ('amount', 'amount_100kg', 'price_per_kg')
+
+
+def parse_member(name, content, max_errors, keep_rows=True, stop_early=True, chunk_size=None, sniff_size=None,
+                 sheet=None, decimals_as_text=False):
+    """
+    Sniffs and validates one file. Runs in the parse pool's worker processes, so it takes its
+    settings as arguments and returns only picklable values:
+    {'file', 'error' (format error or None), 'summary' (ValidationReport.summary() or None),
+    'frame' (the valid rows, when keep_rows and the file had no errors), 'timings' (report.timings)}.
+
+    decimals_as_text returns DECIMAL_COLUMNS as strings: pickling Decimal objects one by one costs
+    more than the parse itself, strings are several times cheaper to send back (see parse_members).
+    """
+    result = {'file': name, 'error': None, 'summary': None, 'frame': None, 'timings': {}}
+    file = io.BytesIO(content)
+    try:
+        sniffed = sniff_upload(file, name, sniff_size, sheet)
+        report = validate_upload(file, sniffed, max_errors, keep_rows, stop_early, chunk_size)
+    except UploadFormatError as e:
+        result['error'] = str(e)
+        return result
+    except pd.errors.EmptyDataError:
+        result['error'] = 'The uploaded file is empty.'
+        return result
+    result['summary'] = report.summary()
+    result['timings'] = report.timings
+    if keep_rows and not report.error_count:
+        frame = report.frame
+        if decimals_as_text:
+            for column in DECIMAL_COLUMNS:
+                frame[column] = frame[column].map(str, na_action='ignore')
+        result['frame'] = frame
+    return result
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    # Workers import pandas as they start, not during the first upload they parse
+    import pandas  # noqa: F401
+
+
+def parse_pool(workers):
+    """
+    Process pool for parse_member, started on first use and kept for the life of the process.
+    Workers are spawned rather than forked: the server process has threads (panel and warm-up
+    pools) that a fork would copy mid-state.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._max_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'), initializer=_init_worker)
+        return _pool
+
+
+def _discard_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def parse_members(members, max_errors, keep_rows=True, stop_early=True, workers=None, sheet=None):
+    """
+    parse_member for every (name, bytes) member, in the parse pool when there is more than one
+    (UPLOAD_PARSE_WORKERS processes; 1 parses sequentially in this process). Results keep the
+    members' order. `sheet` applies to every spreadsheet member.
+    """
+    workers = parse_workers() if workers is None else workers
+    calls = [(name, content, max_errors, keep_rows, stop_early, chunk_rows(), sniff_bytes(), sheet) for name, content in members]
+    if workers > 1 and len(calls) > 1:
+        try:
+            results = list(parse_pool(workers).map(parse_member, *zip(*calls), [True] * len(calls)))
+            for result in results:
+                if result['frame'] is not None:
+                    for column in DECIMAL_COLUMNS:
+                        result['frame'][column] = result['frame'][column].map(Decimal, na_action='ignore')
+            return results
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed for memory); parse here rather than failing the upload
+            print(f"Upload parse pool failed, parsing sequentially: {e}")
+            _discard_pool()
+    return [parse_member(*call) for call in calls]
+
+
+def parse_max_errors(value):
+    """Validates the max_errors upload option (a positive integer)."""
+    if value in (None, ''):
+        return default_max_errors()
+    try:
+        max_errors = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('max_errors must be a positive integer.')
+    if max_errors < 1:
+        raise ValueError('max_errors must be a positive integer.')
+    return max_errors
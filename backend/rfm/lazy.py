@@ -0,0 +1,74 @@
+import importlib
+import time
+import types
+
+from django.conf import settings
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a heavy module that is only imported on first attribute access.
+
+        pd = LazyModule('pandas')   # no import yet
+        pd.DataFrame(...)           # pandas is imported here, once
+
+    After the import the real module's namespace is copied onto the proxy, so later
+    lookups are plain attribute reads rather than __getattr__ calls.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_lazy_loaded'] = False
+
+    def _load(self):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        self.__dict__['_lazy_module'] = module
+        self.__dict__['_lazy_loaded'] = True
+        return module
+
+    def __getattr__(self, name):
+        # Only called for names not yet copied onto the proxy
+        module = self.__dict__.get('_lazy_module') or self._load()
+        return getattr(module, name)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_loaded'] else 'not loaded'
+        return f'<lazy module {self.__name__!r} ({state})>'
+
+
+def is_loaded(module):
+    """True once a LazyModule (or any regular module) has actually been imported."""
+    return module.__dict__.get('_lazy_loaded', True)
+
+
+# Imported by warm_up(); google.generativeai only when the Gemini backend is configured.
+WARM_UP_MODULES = ['numpy', 'pandas', 'openpyxl']
+
+
+def warm_up():
+    """
+    Pays the deferred import and first-use costs up front. Call it in a preforking server's
+    master after the app is loaded (see gunicorn.conf.py) so every worker inherits loaded
+    modules instead of importing them on its first request. Returns seconds spent per step.
+    """
+    timings = {}
+    modules = list(WARM_UP_MODULES)
+    if getattr(settings, 'AI_MODEL_BACKEND', 'ai_insights.llm.GeminiModel').endswith('GeminiModel'):
+        modules.append('google.generativeai')
+    for name in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"Warm-up could not import {name}: {e}")
+        timings[name] = time.perf_counter() - started
+
+    # First groupby/to_json calls initialise pandas internals (dtype caches, ujson); do them now.
+    started = time.perf_counter()
+    import pandas as pd
+    frame = pd.DataFrame({'customer_id': ['a', 'b', 'a'], 'amount': [1.0, 2.0, 3.0],
+                          'purchase_date': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-03'])})
+    frame.groupby('customer_id').agg(total=('amount', 'sum'), last=('purchase_date', 'max')).to_json(orient='records')
+    timings['pandas first use'] = time.perf_counter() - started
+    return timings
@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.db import transaction as db_transaction
+
+from .lazy import LazyModule
+from .models import Leaderboard, Transaction
+from .versioning import get_dataset_version, rebuild_stale
+
+pd = LazyModule('pandas')
+
+TOTAL_PAID = Leaderboard.METRIC_TOTAL_PAID
+LOYALTY_POINTS = Leaderboard.METRIC_LOYALTY_POINTS
+
+# Sort keys per metric (ties on loyalty points are broken by total paid, like the VIP view)
+METRIC_ORDER = {
+    TOTAL_PAID: ['total_paid'],
+    LOYALTY_POINTS: ['loyalty_points', 'total_paid'],
+}
+
+
+def leaderboard_depth():
+    """How many entries each board keeps; the largest `k` the endpoints can serve."""
+    return getattr(settings, 'LEADERBOARD_DEPTH', 100)
+
+
+def parse_k(value, default):
+    """Validates a `k` query parameter: an integer between 1 and the board depth."""
+    if value in (None, ''):
+        return default
+    try:
+        k = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('k must be an integer.')
+    if not 1 <= k <= leaderboard_depth():
+        raise ValueError(f'k must be between 1 and {leaderboard_depth()}.')
+    return k
+
+
+def _top_records(df, metric, depth, by=None):
+    ordered = df.sort_values(METRIC_ORDER[metric], ascending=False, kind='stable')
+    if by is not None:
+        ordered = ordered.groupby(by, sort=False).head(depth)
+    else:
+        ordered = ordered.head(depth)
+    return ordered
+
+
+def _entries(df, columns):
+    out = df[columns].copy()
+    out['total_paid'] = out['total_paid'].round(2)
+    return out.to_dict('records')
+
+
+def build_leaderboards(df, depth=None):
+    """
+    Builds every board from a transactions DataFrame (customer_id, city, amount, loyalty_points).
+
+    Returns {(city_key, metric): (city, entries)} where city_key '' is the global board.
+    Global total-paid entries are per (customer, city), like CustomerRankingView; the global
+    loyalty board is per customer, like VIPCustomersView. City boards are per customer in that city.
+    """
+    depth = depth or leaderboard_depth()
+    if df.empty:
+        return {}
+    df = df.copy()
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0).astype(float)
+    df['loyalty_points'] = pd.to_numeric(df['loyalty_points'], errors='coerce').fillna(0).astype(int)
+    df['city'] = df['city'].fillna('').astype(str)
+
+    pairs = df.groupby(['customer_id', 'city'], sort=False).agg(
+        total_paid=('amount', 'sum'),
+        loyalty_points=('loyalty_points', 'sum'),
+    ).reset_index()
+    customers = df.groupby('customer_id', sort=False).agg(
+        total_paid=('amount', 'sum'),
+        loyalty_points=('loyalty_points', 'sum'),
+    ).reset_index()
+
+    pair_columns = ['customer_id', 'city', 'total_paid', 'loyalty_points']
+    boards = {
+        ('', TOTAL_PAID): ('', _entries(_top_records(pairs, TOTAL_PAID, depth), pair_columns)),
+        ('', LOYALTY_POINTS): ('', _entries(_top_records(customers, LOYALTY_POINTS, depth), ['customer_id', 'total_paid', 'loyalty_points'])),
+    }
+
+    pairs = pairs[pairs['city'] != ''].assign(city_key=lambda d: d['city'].str.lower())
+    for metric in (TOTAL_PAID, LOYALTY_POINTS):
+        top = _top_records(pairs, metric, depth, by='city_key')
+        for city_key, group in top.groupby('city_key', sort=False):
+            boards[(city_key, metric)] = (group['city'].iloc[0], _entries(group, pair_columns))
+    return boards
+
+
+def store_leaderboards(user, df, version):
+    """Replaces the user's boards with ones built from `df`."""
+    save_leaderboards(user, build_leaderboards(df), version)
+
+
+def save_leaderboards(user, boards, version):
+    """Replaces the user's boards with `boards` (build_leaderboards)."""
+    with db_transaction.atomic():
+        Leaderboard.objects.filter(user=user).delete()
+        # A rebuild in another process may have inserted the same boards since our delete
+        Leaderboard.objects.bulk_create([
+            Leaderboard(user=user, city_key=city_key, city=city, metric=metric, entries=entries, dataset_version=version)
+            for (city_key, metric), (city, entries) in boards.items()
+        ], ignore_conflicts=True)
+
+
+def rebuild_leaderboards(user):
+    """Rebuilds the boards from the stored transactions (for data that predates the boards)."""
+    df = pd.DataFrame.from_records(
+        Transaction.objects.for_user(user).values('customer_id', 'city', 'amount', 'loyalty_points')
+    )
+    store_leaderboards(user, df, get_dataset_version(user))
+
+
+def _ensure_current(user):
+    built_for = Leaderboard.objects.filter(user=user, city_key='', metric=TOTAL_PAID).values_list('dataset_version', flat=True).first()
+    if built_for is None:
+        # Never built: either no data, or data uploaded before boards existed.
+        if Transaction.objects.for_user(user).exists():
+            rebuild_stale(user, 'leaderboards', rebuild_leaderboards)
+    elif built_for != get_dataset_version(user):
+        rebuild_stale(user, 'leaderboards', rebuild_leaderboards)
+
+
+def get_leaderboard(user, metric, city=None, k=10):
+    """
+    Returns the first k entries of a board, or None when the city (or user data) is unknown.
+    This is one indexed row read; the boards are only rebuilt if they predate the dataset.
+    """
+    _ensure_current(user)
+    board = Leaderboard.objects.filter(user=user, city_key=(city or '').strip().lower(), metric=metric).values_list('entries', flat=True).first()
+    if board is None:
+        return None
+    return board[:k]
+
+
+def available_cities(user):
+    """Cities that have a board, as they appear in the data, sorted by name."""
+    return list(
+        Leaderboard.objects.filter(user=user, metric=TOTAL_PAID).exclude(city_key='').order_by('city_key').values_list('city', flat=True)
+    )
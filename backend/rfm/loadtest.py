@@ -0,0 +1,203 @@
+import io
+import json
+import threading
+import time
+import uuid
+from urllib import error as urllib_error
+from urllib import request as urllib_request
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+
+# One dashboard visit, in the order the frontend issues its requests. Each step is
+# (route label, method, path under /api/, query params).
+DASHBOARD_SESSION = [
+    ('me', 'GET', 'users/me/', {}),
+    ('analysis', 'GET', 'rfm/analysis/', {}),
+    ('analysis?segment', 'GET', 'rfm/analysis/', {'segment': 'Champions'}),
+    ('ranking', 'GET', 'rfm/ranking/', {}),
+    ('ranking?city', 'GET', 'rfm/ranking/', {'city': 'Lagos', 'k': 20}),
+    ('revenue?period=all', 'GET', 'rfm/analytics/revenue/', {'period': 'all'}),
+    ('revenue?period=month', 'GET', 'rfm/analytics/revenue/', {'period': 'month'}),
+    ('revenue?period=year', 'GET', 'rfm/analytics/revenue/', {'period': 'year'}),
+    ('customers', 'GET', 'rfm/analytics/customers/', {}),
+    ('vip', 'GET', 'rfm/analytics/vip/', {}),
+    ('avg-order-value', 'GET', 'rfm/analytics/avg-order-value/', {}),
+    ('ai-insights', 'GET', 'ai/generate/', {}),
+]
+
+CITIES = ['Lagos', 'Abuja', 'Kano', 'Ibadan', 'Port Harcourt', 'Enugu']
+PRODUCT_TYPES = ['Russet', 'Yukon Gold', 'Red', 'Fingerling']
+
+PERCENTILES = (50, 95, 99)
+
+
+def synthetic_upload(rows, customers=None, seed=0):
+    """A new-format transactions CSV (bytes) with `rows` rows spread over the last three years."""
+    rng = np.random.default_rng(seed)
+    customers = customers or max(1, rows // 10)
+    today = pd.Timestamp.today().normalize()
+    df = pd.DataFrame({
+        'Relationship ID': np.char.add('C', rng.integers(0, customers, rows).astype(str)),
+        'Date Clean': (today - pd.to_timedelta(rng.integers(0, 3 * 365, rows), unit='D')).strftime('%Y-%m-%d'),
+        'amount (100kg)': rng.gamma(2.0, 1.5, rows).round(2),
+        'price_per_kg': rng.uniform(0.2, 1.5, rows).round(2),
+        'city': rng.choice(CITIES, rows),
+        'product_type': rng.choice(PRODUCT_TYPES, rows),
+        'loyalty_points': rng.integers(0, 20, rows),
+    })
+    return df.to_csv(index=False).encode()
+
+
+def _multipart(fields, files):
+    """Encodes form fields and {name: (filename, bytes)} files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        body.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'.encode()
+        )
+        body.write(content)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class Recorder:
+    """Thread-safe collector of (route, status, seconds, bytes) samples."""
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def add(self, route, status, seconds, size):
+        with self._lock:
+            self.samples.append((route, status, seconds, size))
+
+
+class LoadClient:
+    """
+    Minimal HTTP client for one simulated user (stdlib only, so it runs anywhere the repo does).
+    Keeps the ETags it has seen and revalidates with If-None-Match, like a browser would.
+    """
+
+    def __init__(self, base_url, recorder, timeout=120, revalidate=True):
+        self.base_url = base_url.rstrip('/') + '/api/'
+        self.recorder = recorder
+        self.timeout = timeout
+        self.revalidate = revalidate
+        self.token = None
+        self.etags = {}
+
+    def call(self, route, method, path, params=None, data=None, content_type=None):
+        url = self.base_url + path
+        if params:
+            url += '?' + urlencode(params)
+        headers = {'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
+        if content_type:
+            headers['Content-Type'] = content_type
+        if self.token:
+            headers['Authorization'] = f'Token {self.token}'
+        if self.revalidate and method == 'GET' and url in self.etags:
+            headers['If-None-Match'] = self.etags[url]
+
+        req = urllib_request.Request(url, data=data, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with urllib_request.urlopen(req, timeout=self.timeout) as response:
+                body = response.read()
+                status, etag = response.status, response.headers.get('ETag')
+        except urllib_error.HTTPError as exc:
+            # 304s and 4xx/5xx land here; they are still measured
+            body = exc.read()
+            status, etag = exc.code, exc.headers.get('ETag')
+        except (urllib_error.URLError, OSError) as exc:
+            self.recorder.add(route, 0, time.perf_counter() - started, 0)
+            print(f'Load test request to {url} failed: {exc}')
+            return 0, None
+        self.recorder.add(route, status, time.perf_counter() - started, len(body))
+        if etag:
+            self.etags[url] = etag
+        return status, body
+
+    def register(self, username):
+        password = f'Load-{uuid.uuid4().hex[:12]}!'
+        payload = json.dumps({
+            'username': username, 'email': f'{username}@loadtest.invalid', 'password': password, 'password2': password,
+        }).encode()
+        status, body = self.call('register', 'POST', 'users/register/', data=payload, content_type='application/json')
+        if status != 201:
+            raise RuntimeError(f'Could not register {username} (HTTP {status}): {body[:200]!r}')
+        self.token = json.loads(body)['token']
+
+    def upload(self, content, filename='transactions.csv'):
+        data, content_type = _multipart({}, {'file': (filename, content)})
+        return self.call('upload', 'POST', 'rfm/upload/', data=data, content_type=content_type)[0]
+
+    def dashboard_session(self, steps=DASHBOARD_SESSION, think_time=0.0):
+        for route, method, path, params in steps:
+            self.call(route, method, path, params)
+            if think_time:
+                time.sleep(think_time)
+
+
+def _is_error(status):
+    # 304 Not Modified is a successful revalidation, not an error
+    return status == 0 or status >= 400
+
+
+def summarize(samples, elapsed):
+    """Per-route and overall request counts, error rates and latency percentiles (ms)."""
+    def stats(rows):
+        latencies = np.array([seconds for _, _, seconds, _ in rows]) * 1000
+        errors = sum(_is_error(status) for _, status, _, _ in rows)
+        out = {
+            'requests': len(rows),
+            'errors': errors,
+            'error_rate': round(errors / len(rows), 4),
+            'mean_ms': round(float(latencies.mean()), 2),
+        }
+        for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+            out[f'p{p}_ms'] = round(float(value), 2)
+        out['max_ms'] = round(float(latencies.max()), 2)
+        out['kib'] = round(sum(size for _, _, _, size in rows) / 1024, 1)
+        return out
+
+    routes = {}
+    for sample in samples:
+        routes.setdefault(sample[0], []).append(sample)
+    report = {
+        'elapsed_s': round(elapsed, 3),
+        'routes': {route: stats(rows) for route, rows in routes.items()},
+        'total': stats(samples) if samples else {'requests': 0, 'errors': 0, 'error_rate': 0.0},
+    }
+    report['total']['throughput_rps'] = round(len(samples) / elapsed, 2) if elapsed else 0.0
+    return report
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Compares a report against a saved baseline. Returns one row per route present in both:
+    (route, metric, baseline, current, relative change, regressed). A route regresses when its
+    p95 grows or its throughput/error rate worsens by more than `tolerance`.
+    """
+    rows = []
+    for route, current in report['routes'].items():
+        before = baseline.get('routes', {}).get(route)
+        if not before:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'error_rate'):
+            old, new = before.get(metric, 0), current.get(metric, 0)
+            change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+            regressed = metric in ('p95_ms', 'error_rate') and change > tolerance and new - old > (1.0 if metric == 'p95_ms' else 0.01)
+            rows.append((route, metric, old, new, change, regressed))
+    old_rps = baseline.get('total', {}).get('throughput_rps', 0)
+    new_rps = report['total'].get('throughput_rps', 0)
+    if old_rps:
+        change = (new_rps - old_rps) / old_rps
+        rows.append(('total', 'throughput_rps', old_rps, new_rps, change, change < -tolerance))
+    return rows
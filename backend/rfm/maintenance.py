@@ -0,0 +1,69 @@
+"""
+Tenant-level maintenance used by the admin actions: purging a user's data and rebuilding what is
+derived from it. Deletes run in batches of ADMIN_BATCH_SIZE rows, each in its own short
+transaction, so purging a multi-million-row tenant never holds the shard's write lock for the
+whole purge (uploads and reads of other tenants interleave between batches).
+"""
+from django.conf import settings
+from django.db import transaction as db_transaction
+
+from .cohorts import rebuild_cohort_rollup
+from .leaderboards import rebuild_leaderboards
+from .models import CohortRollup, DailyRollup, Leaderboard, Transaction, UploadedFile
+from .sharding import shard_for_user
+from .timeseries import rebuild_daily_rollup
+from .versioning import bump_dataset_version
+
+
+def batch_size():
+    return int(getattr(settings, 'ADMIN_BATCH_SIZE', 5000))
+
+
+def _delete_in_batches(model, alias, user, size, on_batch=None):
+    rows = model.objects.using(alias).filter(user=user).order_by('pk')
+    deleted = 0
+    while True:
+        batch = list(rows.values_list('pk', flat=True)[:size])
+        if not batch:
+            return deleted
+        with db_transaction.atomic(using=alias):
+            if on_batch is not None:
+                on_batch(batch)
+            # No signals or cascades hang off these tables: skip the collector
+            deleted += model.objects.using(alias).filter(pk__in=batch)._raw_delete(alias)
+
+
+def purge_tenant_data(user, size=None):
+    """
+    Deletes the user's transactions and uploaded files (rows and stored files), then bumps their
+    dataset version and drops the leaderboards and rollups. Returns rows deleted per model.
+    """
+    size = size or batch_size()
+    alias = shard_for_user(user)
+    stored_files = []
+
+    def collect_files(batch):
+        stored_files.extend(UploadedFile.objects.using(alias).filter(pk__in=batch).values_list('file', flat=True))
+
+    deleted = {
+        'transaction': _delete_in_batches(Transaction, alias, user, size),
+        'uploadedfile': _delete_in_batches(UploadedFile, alias, user, size, on_batch=collect_files),
+    }
+    storage = UploadedFile._meta.get_field('file').storage
+    for name in filter(None, stored_files):
+        storage.delete(name)
+    with db_transaction.atomic():
+        bump_dataset_version(user)
+        Leaderboard.objects.filter(user=user).delete()
+        CohortRollup.objects.filter(user=user).delete()
+        DailyRollup.objects.filter(user=user).delete()
+    print(f"Purged tenant {user.pk} on {alias}: {deleted['transaction']} transactions, {deleted['uploadedfile']} files")
+    return deleted
+
+
+def rebuild_tenant_aggregates(user):
+    """Rebuilds the user's leaderboards, cohort rollup and daily rollup from their stored transactions."""
+    rebuild_leaderboards(user)
+    rebuild_cohort_rollup(user)
+    rebuild_daily_rollup(user)
+    print(f"Rebuilt aggregates for tenant {user.pk}")
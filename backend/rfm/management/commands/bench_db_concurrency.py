@@ -0,0 +1,136 @@
+import json
+import random
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from backend_project.databases import PROFILES, sqlite_database
+
+READ_QUERY = 'SELECT customer_id, COUNT(*), SUM(amount), MAX(purchase_date) FROM bench_transaction WHERE tenant = %s GROUP BY customer_id'
+
+
+def _rows(tenant, count, seed):
+    rng = random.Random(seed)
+    return [
+        (tenant, f'C{rng.randrange(count // 10 or 1):06d}', round(rng.uniform(5, 500), 2), f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}')
+        for _ in range(count)
+    ]
+
+
+def _insert(cursor, rows):
+    cursor.executemany('INSERT INTO bench_transaction (tenant, customer_id, amount, purchase_date) VALUES (%s, %s, %s, %s)', rows)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures read latency on a SQLite database while another tenant\'s upload (a large delete and '
+        'insert in one transaction) is in progress, for each DB_PROFILE.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000, help='Rows written by the upload.')
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--profiles', default=','.join(PROFILES))
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        report = {'rows': options['rows'], 'readers': options['readers'], 'profiles': {}}
+        with tempfile.TemporaryDirectory() as directory:
+            for profile in filter(None, options['profiles'].split(',')):
+                report['profiles'][profile] = self.run_profile(Path(directory), profile.strip(), options)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        lines = [f'{report["rows"]}-row upload, {report["readers"]} concurrent readers']
+        for profile, result in report['profiles'].items():
+            lines.append(
+                f'  {profile:<12} upload {result["upload_ms"]:>8.0f} ms | reads {result["reads"]:>5} '
+                f'p50 {result["p50_ms"]:>7.1f} ms  p95 {result["p95_ms"]:>7.1f} ms  max {result["max_ms"]:>7.1f} ms  '
+                f'errors {result["errors"]}'
+            )
+        self.stdout.write('\n'.join(lines))
+
+    def run_profile(self, directory, profile, options):
+        alias = f'bench_{profile}'
+        config = sqlite_database(directory / f'{profile}.sqlite3', profile)
+        connections.settings[alias] = connections.configure_settings({'default': config})['default']
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute(
+                    'CREATE TABLE bench_transaction (id INTEGER PRIMARY KEY, tenant INTEGER, customer_id TEXT, '
+                    'amount REAL, purchase_date TEXT)'
+                )
+                cursor.execute('CREATE INDEX bench_transaction_tenant ON bench_transaction (tenant, customer_id)')
+                _insert(cursor, _rows(1, options['rows'], seed=1))
+                _insert(cursor, _rows(2, max(options['rows'] // 10, 1000), seed=2))
+            connections[alias].close()
+            return self.measure(alias, options)
+        finally:
+            connections[alias].close()
+            del connections.settings[alias]
+
+    def measure(self, alias, options):
+        replacement = _rows(1, options['rows'], seed=3)
+        writing = threading.Event()
+        done = threading.Event()
+        latencies, errors, upload = [], [], {}
+        lock = threading.Lock()
+
+        def writer():
+            try:
+                started = time.perf_counter()
+                with transaction.atomic(using=alias):
+                    with connections[alias].cursor() as cursor:
+                        writing.set()
+                        cursor.execute('DELETE FROM bench_transaction WHERE tenant = 1')
+                        _insert(cursor, replacement)
+                upload['ms'] = (time.perf_counter() - started) * 1000
+            except Exception as error:
+                with lock:
+                    errors.append(f'upload: {error}')
+            finally:
+                writing.set()
+                done.set()
+                connections[alias].close()
+
+        def reader():
+            writing.wait()
+            try:
+                while not done.is_set():
+                    started = time.perf_counter()
+                    try:
+                        with connections[alias].cursor() as cursor:
+                            cursor.execute(READ_QUERY, [2])
+                            cursor.fetchall()
+                    except Exception as error:
+                        with lock:
+                            errors.append(str(error))
+                        continue
+                    with lock:
+                        latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                connections[alias].close()
+
+        threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        ordered = sorted(latencies) or [0.0]
+        return {
+            'upload_ms': round(upload.get('ms', 0.0), 1),
+            'reads': len(latencies),
+            'p50_ms': round(statistics.median(ordered), 1),
+            'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+            'max_ms': round(ordered[-1], 1),
+            'errors': len(errors),
+            'error_samples': sorted(set(errors))[:3],
+        }
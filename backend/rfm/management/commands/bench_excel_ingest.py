@@ -0,0 +1,139 @@
+import json
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand
+
+from rfm.spreadsheets import engine_available
+
+READERS = [
+    ('read_excel', 'xlsx', None),  # the previous path: pd.read_excel, whole workbook model in memory
+    ('openpyxl', 'xlsx', 'openpyxl'),
+    ('calamine', 'xlsx', 'calamine'),
+    ('xlrd', 'xls', 'xlrd'),
+    ('calamine', 'xls', 'calamine'),
+]
+XLS_MAX_ROWS = 65535
+
+
+def write_xlsx(path, rows):
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Transactions')
+    sheet.append(['customer_id', 'purchase_date', 'amount', 'city', 'loyalty_points'])
+    today = date.today()
+    for index in range(rows):
+        sheet.append([f'C{index % 20000:06d}', today - timedelta(days=index % 730), round(20 + (index * 7919) % 50000 / 100, 2), 'Lagos', index % 20])
+    workbook.save(path)
+
+
+def write_xls(path, rows):
+    import xlwt
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet('Transactions')
+    dates = xlwt.easyxf(num_format_str='YYYY-MM-DD')
+    for column, name in enumerate(['customer_id', 'purchase_date', 'amount', 'city', 'loyalty_points']):
+        sheet.write(0, column, name)
+    today = date.today()
+    for index in range(rows):
+        sheet.write(index + 1, 0, f'C{index % 20000:06d}')
+        sheet.write(index + 1, 1, today - timedelta(days=index % 730), dates)
+        sheet.write(index + 1, 2, round(20 + (index * 7919) % 50000 / 100, 2))
+        sheet.write(index + 1, 3, 'Lagos')
+        sheet.write(index + 1, 4, index % 20)
+    workbook.save(path)
+
+
+def _rss_peak_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def ingest(path, file_type, engine):
+    """Sniffs and validates the file as an upload in this (fresh) process: (seconds, peak RSS growth in MB, valid rows)."""
+    from django.test.utils import override_settings
+    import pandas as pd
+    from rfm.ingest import normalize_columns, sniff_upload, validate_frame, validate_upload
+
+    before = _rss_peak_mb()
+    started = time.perf_counter()
+    with open(path, 'rb') as file:
+        if engine is None:
+            df = pd.read_excel(file, engine='openpyxl')
+            df.columns = normalize_columns(df.columns)
+            valid, _ = validate_frame(df, 'old', 2)
+            rows = len(valid)
+        else:
+            with override_settings(UPLOAD_EXCEL_ENGINE=engine):
+                sniffed = sniff_upload(file, f'upload.{file_type}')
+                rows = validate_upload(file, sniffed, max_errors=100).valid_rows
+    return time.perf_counter() - started, _rss_peak_mb() - before, rows
+
+
+def _init_worker():
+    import django
+    django.setup()
+    import pandas  # noqa: F401
+    import openpyxl  # noqa: F401
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks spreadsheet uploads (rfm.spreadsheets): parse and validation time and peak memory for '
+        'a generated workbook, with pd.read_excel (the previous path) and each installed streaming engine.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        report = {'rows': options['rows'], 'results': []}
+        with tempfile.TemporaryDirectory() as directory:
+            paths = {'xlsx': os.path.join(directory, 'upload.xlsx')}
+            started = time.perf_counter()
+            write_xlsx(paths['xlsx'], options['rows'])
+            try:
+                paths['xls'] = os.path.join(directory, 'upload.xls')
+                write_xls(paths['xls'], min(options['rows'], XLS_MAX_ROWS))
+            except ImportError:
+                del paths['xls']  # writing .xls needs xlwt
+            self.stderr.write(f'Wrote the workbooks in {time.perf_counter() - started:.1f} s')
+
+            for name, file_type, engine in READERS:
+                if file_type not in paths or (engine is not None and not engine_available(engine)):
+                    continue
+                samples = []
+                for _ in range(max(1, options['repeat'])):
+                    # A fresh process per run, so the peak memory is this run's alone
+                    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn'), initializer=_init_worker) as pool:
+                        samples.append(pool.submit(ingest, paths[file_type], file_type, engine).result())
+                report['results'].append({
+                    'file_type': file_type,
+                    'reader': name,
+                    'file_mb': round(os.path.getsize(paths[file_type]) / 1024 / 1024, 1),
+                    'valid_rows': samples[0][2],
+                    'ms': round(statistics.median(sample[0] for sample in samples) * 1000, 1),
+                    'peak_mb': round(statistics.median(sample[1] for sample in samples), 1),
+                })
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        lines = [f'Median of {options["repeat"]} runs, each in a fresh process']
+        for result in report['results']:
+            lines.append(
+                f'  .{result["file_type"]:<4} {result["reader"]:<10} {result["valid_rows"]:>8} rows  '
+                f'{result["ms"]:>8.0f} ms  peak +{result["peak_mb"]:>6.1f} MB'
+            )
+        self.stdout.write('\n'.join(lines))
@@ -0,0 +1,113 @@
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from backend_project.databases import sqlite_database
+from rfm.lazy import LazyModule
+from rfm.models import Transaction
+from rfm.partitioned import COLUMNS, PartitionedAggregation, aggregate_partition, partition_pool
+from rfm.rfm_analysis import rfm_from_transactions, score_customers
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+ALIAS = 'bench_partitioned'
+USER_ID = 1
+
+
+def seed(alias, rows, customers, seed=0):
+    """Creates the transactions table on `alias` and fills it with `rows` rows of user USER_ID."""
+    with connections[alias].schema_editor() as editor:
+        editor.create_model(Transaction)
+    table = Transaction._meta.db_table
+    with connections[alias].cursor() as cursor:
+        # Only the (user, customer_id) index serves the reads; the others would just slow seeding down
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name != 'rfm_txn_user_customer' AND sql IS NOT NULL", [table])
+        for (name,) in cursor.fetchall():
+            cursor.execute(f'DROP INDEX "{name}"')
+    rng = np.random.default_rng(seed)
+    today = np.datetime64('today', 'D')
+    chunk = 200_000
+    with connections[alias].cursor() as cursor:
+        for start in range(0, rows, chunk):
+            size = min(chunk, rows - start)
+            ids = rng.integers(0, customers, size)
+            dates = (today - rng.integers(0, 730, size)).astype(str)
+            amounts = rng.gamma(2.0, 60.0, size).round(2)
+            points = rng.integers(0, 20, size)
+            cursor.executemany(
+                f'INSERT INTO {table} (user_id, customer_id, purchase_date, amount, city, '
+                'loyalty_points, uploaded_at) VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)',
+                [(USER_ID, f'C{cid:07d}', day, str(amount), 'Lagos', int(point))
+                 for cid, day, amount, point in zip(ids.tolist(), dates.tolist(), amounts.tolist(), points)],
+            )
+        cursor.execute('ANALYZE')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks RFM aggregation of one large tenant: the single-process path (one DataFrame, one '
+        'groupby) against partitioned aggregation in 1, 2, 4... worker processes (rfm.partitioned).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--customers', type=int, default=50_000)
+        parser.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts.')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            database = sqlite_database(os.path.join(directory, 'bench.sqlite3'), 'production')
+            connections.settings[ALIAS] = connections.configure_settings({'default': database})['default']
+            try:
+                started = time.perf_counter()
+                seed(ALIAS, options['rows'], options['customers'])
+                self.stderr.write(f'Seeded {options["rows"]} rows in {time.perf_counter() - started:.1f} s')
+                report = self.measure(options)
+            finally:
+                connections[ALIAS].close()
+                del connections.settings[ALIAS]
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        lines = [f'{report["rows"]} transactions, {report["customers"]} customers, {os.cpu_count()} CPUs, median of {options["repeat"]} runs']
+        lines.append(f'  single process   {report["single_ms"]:>9.0f} ms')
+        for workers, result in report['partitioned'].items():
+            lines.append(f'  {workers} worker(s)      {result["ms"]:>9.0f} ms  speedup x{result["speedup"]:.2f}')
+        self.stdout.write('\n'.join(lines))
+
+    def time(self, run, repeat):
+        samples, result = [], None
+        for _ in range(max(1, repeat)):
+            started = time.perf_counter()
+            result = run()
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples) * 1000, result
+
+    def measure(self, options):
+        qs = Transaction.objects.using(ALIAS).filter(user_id=USER_ID)
+        rows = qs.count()
+
+        def single():
+            df = pd.DataFrame.from_records(qs.values(*COLUMNS))
+            return rfm_from_transactions(df)
+
+        single()  # imports and first-query costs out of the measurement
+        single_ms, expected = self.time(single, options['repeat'])
+        report = {'rows': rows, 'customers': len(expected), 'single_ms': round(single_ms, 1), 'partitioned': {}}
+        for workers in [int(count) for count in options['workers'].split(',') if count.strip()]:
+            # Start the workers (Django setup, pandas import) before timing
+            pool = partition_pool(workers)
+            list(pool.map(aggregate_partition, *zip(*[(ALIAS, connections[ALIAS].settings_dict, USER_ID, '~', None)] * workers)))
+            ms, result = self.time(lambda: score_customers(PartitionedAggregation(qs, USER_ID, rows, workers).result()), options['repeat'])
+            pd.testing.assert_frame_equal(result.reset_index(drop=True), expected.reset_index(drop=True), check_exact=False)
+            report['partitioned'][workers] = {'ms': round(ms, 1), 'speedup': round(single_ms / ms, 2)}
+        return report
@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from rfm.renderers import FastJSONRenderer, FrameRecords, GroupedFrameRecords, brotli, orjson
+
+
+def synthetic_transactions(rows, customers, seed=0):
+    """Transaction-shaped frame as CustomerAnalyticsView sees it after values()."""
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 5 * 365, rows), unit='D')
+    return pd.DataFrame({
+        'customer_id': np.char.add('C', rng.integers(0, customers, rows).astype(str)),
+        'amount': rng.gamma(2.0, 150.0, rows).round(2),
+        'loyalty_points': rng.integers(0, 50, rows),
+        'purchase_date': dates.date,
+    })
+
+
+def customer_payload(df, columnar):
+    """Builds the CustomerAnalyticsView payload either the legacy way or column-wise."""
+    customers = df.groupby('customer_id').agg(
+        total_paid=('amount', 'sum'),
+        total_points=('loyalty_points', 'sum'),
+        order_count=('purchase_date', 'count'),
+    ).reset_index().sort_values(by='total_paid', ascending=False)
+    graph_df = df.groupby('purchase_date')['amount'].sum().reset_index()
+    if columnar:
+        return {
+            'customers': FrameRecords(customers),
+            'top_40': FrameRecords(customers.head(40)),
+            'logs': GroupedFrameRecords(df, 'customer_id', ['purchase_date', 'amount'], sort_by='purchase_date'),
+            'graph': FrameRecords(graph_df),
+        }
+    logs = {
+        cid: group[['purchase_date', 'amount']].sort_values('purchase_date').to_dict('records')
+        for cid, group in df.groupby('customer_id')
+    }
+    return {
+        'customers': customers.to_dict('records'),
+        'top_40': customers.head(40).to_dict('records'),
+        'logs': logs,
+        'graph': graph_df.to_dict('records'),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks payload build + render time and bytes sent for the JSON renderers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000)
+        parser.add_argument('--customers', type=int, default=20_000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        df = synthetic_transactions(options['rows'], options['customers'])
+        fast = FastJSONRenderer()
+        variants = [
+            ('DRF JSONRenderer + to_dict', False, lambda data: JSONRenderer().render(data)),
+            ('FastJSON stdlib + frames', True, lambda data: fast.encode(data, use_orjson=False)),
+        ]
+        if orjson is not None:
+            variants.append(('FastJSON orjson + frames', True, lambda data: fast.encode(data, use_orjson=True)))
+
+        self.stdout.write(f"rows={options['rows']:,} customers={options['customers']:,} (best of {options['repeat']})")
+        for label, columnar, render in variants:
+            best_build = best_render = float('inf')
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                payload = customer_payload(df, columnar)
+                built = time.perf_counter()
+                body = render(payload)
+                best_build = min(best_build, built - start)
+                best_render = min(best_render, time.perf_counter() - built)
+            self.stdout.write(
+                f'{label:<30} build {best_build * 1000:8.1f} ms  render {best_render * 1000:8.1f} ms  '
+                f'{len(body) / 1024:10.1f} KiB'
+            )
+
+        import gzip
+        self.stdout.write(f'{"gzip -6":<30} {len(gzip.compress(body, 6)) / 1024:10.1f} KiB')
+        if brotli is not None:
+            self.stdout.write(f'{"brotli q5":<30} {len(brotli.compress(body, quality=5)) / 1024:10.1f} KiB')
@@ -0,0 +1,97 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from rfm.lazy import LazyModule
+from rfm.rfm_analysis import SEGMENT_MAP, builtin_segments
+from rfm.segment_rules import CompiledRules, validate_rule_set
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+SCORE_RULES = {
+    'rules': [
+        {'segment': 'Champions', 'r_score': {'min': 4}, 'f_score': {'min': 4}, 'm_score': {'min': 4}},
+        {'segment': 'Loyal', 'f_score': {'min': 4}},
+        {'segment': 'At Risk', 'r_score': {'max': 2}, 'm_score': {'min': 3}},
+        {'segment': 'New', 'r_score': {'min': 5}, 'f_score': {'max': 1}},
+        {'segment': 'Hibernating', 'r_score': {'max': 2}},
+    ],
+}
+MIXED_RULES = {
+    'rules': [
+        {'segment': 'Whales', 'monetary': {'min': 5000}},
+        {'segment': 'Champions', 'r_score': {'min': 4}, 'f_score': {'min': 4}, 'loyalty_points': {'min': 100}},
+        {'segment': 'Lapsed', 'recency': {'min': 180}},
+        {'segment': 'Regulars', 'frequency': {'min': 6, 'max': 20}, 'monetary': {'min': 200}},
+        {'segment': 'At Risk', 'r_score': {'max': 2}, 'm_score': {'min': 3}},
+    ],
+}
+
+
+def synthetic_rfm(customers, seed=0):
+    """An RFM table shaped like calculate_rfm's output, with random scores and values."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'r_score': rng.integers(1, 6, customers), 'f_score': rng.integers(1, 6, customers),
+        'm_score': rng.integers(1, 6, customers), 'recency': rng.integers(0, 730, customers),
+        'frequency': rng.integers(1, 40, customers), 'monetary': rng.gamma(2.0, 600.0, customers).round(2),
+        'loyalty_points': rng.integers(0, 500, customers),
+    })
+
+
+def regex_segments(frame):
+    """The segmentation loop calculate_rfm used before the lookup table (for comparison)."""
+    segments = pd.Series('Other', index=frame.index, dtype=object)
+    rf_score = frame['r_score'].astype(str) + frame['f_score'].astype(str)
+    for pattern, segment in SEGMENT_MAP.items():
+        segments[rf_score.str.match(pattern)] = segment
+    return segments
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks RFM segmentation over a synthetic table: the built-in SEGMENT_MAP (regex loop and '
+        'lookup table) against compiled custom rules (score-only lookup table and mixed NumPy masks).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1_000_000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        frame = synthetic_rfm(options['customers'])
+        compile_ms = {}
+        compiled = {}
+        for label, rule_set in (('custom_scores', SCORE_RULES), ('custom_mixed', MIXED_RULES)):
+            started = time.perf_counter()
+            normalized = validate_rule_set(rule_set)
+            compiled[label] = CompiledRules(normalized['rules'], normalized['default_segment'])
+            compile_ms[label] = round((time.perf_counter() - started) * 1000, 2)
+
+        runs = {
+            'builtin_regex': lambda: regex_segments(frame),
+            'builtin_lookup': lambda: builtin_segments(frame['r_score'], frame['f_score']),
+            'custom_scores': lambda: compiled['custom_scores'](frame),
+            'custom_mixed': lambda: compiled['custom_mixed'](frame),
+        }
+        timings = {}
+        for label, run in runs.items():
+            samples = []
+            for _ in range(max(1, options['repeat'])):
+                started = time.perf_counter()
+                run()
+                samples.append(time.perf_counter() - started)
+            timings[label] = round(statistics.median(samples) * 1000, 1)
+
+        report = {'customers': options['customers'], 'segment_ms': timings, 'compile_ms': compile_ms}
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        lines = [f'{report["customers"]} customers, median of {options["repeat"]} runs']
+        lines += [f'  {label:<16} {ms:>9.1f} ms' for label, ms in timings.items()]
+        lines += [f'  compile {label:<13} {ms:>6.2f} ms (once per saved rule set)' for label, ms in compile_ms.items()]
+        self.stdout.write('\n'.join(lines))
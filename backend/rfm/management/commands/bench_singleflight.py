@@ -0,0 +1,121 @@
+import json
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand
+
+from rfm.lazy import LazyModule
+from rfm.singleflight import FileLockFlights, SingleFlight
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+def transactions(rows, customers, seed=0):
+    rng = np.random.default_rng(seed)
+    today = np.datetime64('today', 'D')
+    return pd.DataFrame({
+        'customer_id': [f'C{cid:07d}' for cid in rng.integers(0, customers, rows).tolist()],
+        'purchase_date': (today - rng.integers(0, 730, rows)).astype(str),
+        'amount': rng.gamma(2.0, 60.0, rows).round(2),
+        'loyalty_points': rng.integers(0, 20, rows),
+    })
+
+
+def burst(flights, threads, df, key):
+    """`threads` identical RFM computations of `df` started together; returns (seconds, computations)."""
+    from rfm.rfm_analysis import rfm_from_transactions
+    computations = []
+    start = threading.Barrier(threads)
+
+    def compute():
+        computations.append(1)
+        return rfm_from_transactions(df.copy())
+
+    def request():
+        start.wait()
+        if flights is None:
+            compute()
+        else:
+            flights.do(key, compute)
+
+    workers = [threading.Thread(target=request) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started, len(computations)
+
+
+def process_burst(directory, threads, rows, customers, key, start_at):
+    """burst() in a worker process, starting at the shared wall-clock `start_at`."""
+    flights = FileLockFlights(directory) if directory else None
+    df = transactions(rows, customers)
+    time.sleep(max(0.0, start_at - time.time()))
+    return burst(flights, threads, df, key)
+
+
+def _init_worker():
+    import django
+    django.setup()
+    import pandas  # noqa: F401
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks single-flight (rfm.singleflight): bursts of identical concurrent RFM computations, '
+        'with and without coalescing, in threads of one process and in several worker processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000)
+        parser.add_argument('--customers', type=int, default=20_000)
+        parser.add_argument('--threads', type=int, default=8, help='Identical requests per process.')
+        parser.add_argument('--processes', type=int, default=2, help='Worker processes (0 to skip).')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        rows, customers, threads = options['rows'], options['customers'], options['threads']
+        df = transactions(rows, customers)
+        burst(None, 1, df, 'warm-up')  # imports out of the measurement
+        report = {'rows': rows, 'threads': threads, 'processes': options['processes'], 'runs': {}}
+        for name, flights in (('threads_off', None), ('threads_single_flight', SingleFlight())):
+            report['runs'][name] = self.measure(lambda run: burst(flights, threads, df, ('bench', run)), options['repeat'])
+        if options['processes'] > 0:
+            with tempfile.TemporaryDirectory() as directory, ProcessPoolExecutor(
+                max_workers=options['processes'], mp_context=get_context('spawn'), initializer=_init_worker,
+            ) as pool:
+                # Start the workers (Django setup, pandas import) before timing
+                list(pool.map(process_burst, *zip(*[(None, 1, 1000, 100, 'warm-up', 0)] * options['processes'])))
+                for name, lock_dir in (('processes_off', None), ('processes_single_flight', directory)):
+                    report['runs'][name] = self.measure(lambda run: self.across(pool, lock_dir, options, ('bench', run)), options['repeat'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        lines = [f'{rows} transactions, bursts of {threads} identical requests per process, median of {options["repeat"]} runs']
+        for name, result in report['runs'].items():
+            lines.append(f'  {name:<24} {result["ms"]:>8.0f} ms  {result["computations"]:>3} computation(s)')
+        self.stdout.write('\n'.join(lines))
+
+    def across(self, pool, lock_dir, options, key):
+        processes = options['processes']
+        start_at = time.time() + 2  # after every worker has built its DataFrame
+        results = list(pool.map(
+            process_burst, *zip(*[(lock_dir, options['threads'], options['rows'], options['customers'], key, start_at)] * processes),
+        ))
+        return max(seconds for seconds, _ in results), sum(count for _, count in results)
+
+    def measure(self, run, repeat):
+        samples, computations = [], []
+        for index in range(max(1, repeat)):
+            seconds, count = run(index)
+            samples.append(seconds)
+            computations.append(count)
+        return {'ms': round(statistics.median(samples) * 1000, 1), 'computations': max(computations)}
@@ -0,0 +1,111 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+HEAVY_MODULES = ('numpy', 'pandas', 'openpyxl', 'google.generativeai')
+
+# Run in a fresh interpreter: load the WSGI app, then time the first and second request.
+FIRST_REQUEST_SCRIPT = '''
+import json, os, sys, time
+started = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_project.settings')
+from backend_project.wsgi import application
+loaded = time.perf_counter()
+from django.test import Client
+client = Client(HTTP_HOST='localhost')
+headers = {'HTTP_AUTHORIZATION': 'Token ' + sys.argv[2]} if sys.argv[2] else {}
+timings = []
+for _ in range(2):
+    t = time.perf_counter()
+    status = client.get(sys.argv[1], **headers).status_code
+    timings.append(time.perf_counter() - t)
+print(json.dumps({'load': loaded - started, 'first': timings[0], 'second': timings[1], 'status': status,
+                  'heavy': [name for name in sys.argv[3].split(',') if name in sys.modules]}))
+'''
+
+
+def parse_importtime(stderr):
+    """-X importtime output -> {module: cumulative microseconds}."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cum, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(cum)
+    return cumulative
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures process startup: `manage.py check` wall time and -X importtime breakdown, plus app load '
+        'and first-request latency in a fresh interpreter (with and without WARM_UP_ON_LOAD).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--top', type=int, default=10, help='Slowest imports to list.')
+        parser.add_argument('--path', default='/api/rfm/analysis/', help='Path requested for first-request latency.')
+        parser.add_argument('--token', default='', help='API token, so --path hits a real (data-backed) view.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def run(self, args, env=None):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, *args], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**os.environ, **(env or {})},
+        )
+        if result.returncode != 0:
+            raise CommandError(f'{" ".join(args)} failed:\n{result.stderr[-2000:]}')
+        return time.perf_counter() - started, result
+
+    def handle(self, *args, **options):
+        repeat = max(1, options['repeat'])
+        check_times, imports = [], {}
+        for _ in range(repeat):
+            elapsed, result = self.run(['-X', 'importtime', 'manage.py', 'check'])
+            check_times.append(elapsed)
+            for name, micros in parse_importtime(result.stderr).items():
+                imports.setdefault(name, []).append(micros)
+        imports = {name: statistics.median(values) for name, values in imports.items()}
+
+        requests = {}
+        for label, env in (('lazy', {'WARM_UP_ON_LOAD': 'False'}), ('warm-up', {'WARM_UP_ON_LOAD': 'True'})):
+            runs = []
+            for _ in range(repeat):
+                _, result = self.run(['-c', FIRST_REQUEST_SCRIPT, options['path'], options['token'], ','.join(HEAVY_MODULES)], env)
+                runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+            requests[label] = {
+                key: round(statistics.median(run[key] for run in runs) * 1000, 1) for key in ('load', 'first', 'second')
+            }
+            requests[label].update(status=runs[-1]['status'], heavy_modules_loaded=runs[-1]['heavy'])
+
+        report = {
+            'check_ms': round(statistics.median(check_times) * 1000, 1),
+            'heavy_modules_imported_by_check': [name for name in HEAVY_MODULES if name in imports],
+            'slowest_imports_ms': {
+                name: round(micros / 1000, 1)
+                for name, micros in sorted(imports.items(), key=lambda item: -item[1])[:options['top']]
+            },
+            'first_request': requests,
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f'manage.py check: {report["check_ms"]} ms (median of {repeat})')
+        self.stdout.write(f'Heavy modules imported by check: {", ".join(report["heavy_modules_imported_by_check"]) or "none"}')
+        self.stdout.write('Slowest imports (cumulative):')
+        for name, ms in report['slowest_imports_ms'].items():
+            self.stdout.write(f'  {ms:>8.1f} ms  {name}')
+        self.stdout.write(f'\nGET {options["path"]}  (HTTP {requests["lazy"]["status"]})')
+        for label, stats in requests.items():
+            self.stdout.write(
+                f'  {label:<8} app load {stats["load"]:>7.1f} ms  first request {stats["first"]:>7.1f} ms  '
+                f'second {stats["second"]:>6.1f} ms  loaded: {", ".join(stats["heavy_modules_loaded"]) or "none"}'
+            )
@@ -0,0 +1,85 @@
+import io
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rfm.ingest import parse_members, parse_pool
+from rfm.lazy import LazyModule
+from rfm.loadtest import synthetic_upload
+
+pd = LazyModule('pandas')
+
+
+def synthetic_members(files, rows, file_format):
+    """`files` synthetic exports of `rows` rows each, as (name, bytes) upload members."""
+    members = []
+    for index in range(files):
+        content = synthetic_upload(rows, seed=index)
+        if file_format == 'xlsx':
+            buffer = io.BytesIO()
+            pd.read_csv(io.BytesIO(content)).to_excel(buffer, index=False, engine='openpyxl')
+            content = buffer.getvalue()
+        members.append((f'branch_{index}.{file_format}', content))
+    return members
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks multi-file upload parsing: the same synthetic files validated sequentially in this '
+        'process and in the upload parse pool (rfm.ingest.parse_members).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=8)
+        parser.add_argument('--rows', type=int, default=50000, help='Rows per file.')
+        parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 2:
+            raise CommandError('--workers must be at least 2 to compare against sequential parsing.')
+        self.stderr.write(f'Generating {options["files"]} {options["format"]} files of {options["rows"]} rows...')
+        members = synthetic_members(options['files'], options['rows'], options['format'])
+
+        # Spawning the workers (and their pandas import) is a one-off per server process
+        started = time.perf_counter()
+        list(parse_pool(options['workers']).map(int, range(options['workers'])))
+        pool_start = time.perf_counter() - started
+
+        timings = {'sequential': [], 'parallel': []}
+        valid_rows = {}
+        for _ in range(max(1, options['repeat'])):
+            for label, workers in (('sequential', 1), ('parallel', options['workers'])):
+                started = time.perf_counter()
+                results = parse_members(members, max_errors=100, workers=workers)
+                timings[label].append(time.perf_counter() - started)
+                valid_rows[label] = sum(result['summary']['valid_rows'] for result in results)
+        if valid_rows['sequential'] != valid_rows['parallel']:
+            raise CommandError(f'Parsers disagree: {valid_rows}')
+
+        sequential = statistics.median(timings['sequential'])
+        parallel = statistics.median(timings['parallel'])
+        report = {
+            'files': options['files'],
+            'rows_per_file': options['rows'],
+            'format': options['format'],
+            'workers': options['workers'],
+            'valid_rows': valid_rows['parallel'],
+            'pool_start_ms': round(pool_start * 1000, 1),
+            'sequential_ms': round(sequential * 1000, 1),
+            'parallel_ms': round(parallel * 1000, 1),
+            'speedup': round(sequential / parallel, 2) if parallel else None,
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(
+            f'{report["files"]} x {report["rows_per_file"]} rows ({report["format"]}), {report["valid_rows"]} valid rows\n'
+            f'  sequential          {report["sequential_ms"]:>9.1f} ms\n'
+            f'  {report["workers"]} worker processes {report["parallel_ms"]:>9.1f} ms  ({report["speedup"]}x)\n'
+            f'  pool start (once)   {report["pool_start_ms"]:>9.1f} ms'
+        )
@@ -0,0 +1,113 @@
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rfm.loadtest import DASHBOARD_SESSION, LoadClient, Recorder, compare, summarize, synthetic_upload
+
+
+class Command(BaseCommand):
+    help = (
+        'Replays mixed-tenant dashboard traffic against a running server and reports throughput, '
+        'p50/p95/p99 latency and error rates per route. Start the server with '
+        'AI_MODEL_BACKEND=ai_insights.llm.StubModel so the AI insights route does not call Gemini.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=10, help='Users registered for this run.')
+        parser.add_argument('--sessions', type=int, default=5, help='Dashboard sessions replayed per user.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Simultaneous sessions in flight.')
+        parser.add_argument('--rows', default='1000,10000,50000',
+                            help='Comma-separated upload sizes; users cycle through them (mixed tenants).')
+        parser.add_argument('--think-time', type=float, default=0.0, help='Seconds to pause between requests.')
+        parser.add_argument('--no-revalidate', action='store_true', help="Don't send If-None-Match on repeat requests.")
+        parser.add_argument('--skip-ai', action='store_true', help='Leave the AI insights route out of sessions.')
+        parser.add_argument('--timeout', type=float, default=120)
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+        parser.add_argument('--save-baseline', help='Write the JSON report here for later comparison.')
+        parser.add_argument('--baseline', help='Compare against a report saved with --save-baseline.')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Relative change that counts as a regression.')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['rows'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--rows must be a comma-separated list of integers.')
+        if not sizes or options['users'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--rows, --users and --concurrency must be positive.')
+        steps = [step for step in DASHBOARD_SESSION if not (options['skip_ai'] and step[0] == 'ai-insights')]
+
+        recorder = Recorder()
+        run_id = uuid.uuid4().hex[:8]
+        clients = [
+            LoadClient(options['base_url'], recorder, timeout=options['timeout'], revalidate=not options['no_revalidate'])
+            for _ in range(options['users'])
+        ]
+        # Generated up front so file creation isn't part of the measured upload time
+        uploads = {size: synthetic_upload(size, seed=size) for size in set(sizes)}
+
+        def setup(index):
+            clients[index].register(f'loadtest-{run_id}-{index}')
+            clients[index].upload(uploads[sizes[index % len(sizes)]])
+
+        self.stdout.write(f"Registering {len(clients)} users and uploading {', '.join(map(str, sizes))}-row files...")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            try:
+                list(pool.map(setup, range(len(clients))))
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+
+        self.stdout.write(f"Replaying {options['sessions']} dashboard sessions per user at concurrency {options['concurrency']}...")
+        # Interleave users so concurrent sessions belong to different tenants
+        sessions = [client for _ in range(options['sessions']) for client in clients]
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(lambda client: client.dashboard_session(steps, options['think_time']), sessions))
+        report = summarize(recorder.samples, time.perf_counter() - started)
+        report['config'] = {
+            key: options[key] for key in ('base_url', 'users', 'sessions', 'concurrency', 'rows', 'think_time', 'no_revalidate', 'skip_ai')
+        }
+
+        self.write_report(report)
+        for path in (options['output'], options['save_baseline']):
+            if path:
+                with open(path, 'w') as fh:
+                    json.dump(report, fh, indent=2)
+                self.stdout.write(f'Report written to {path}')
+
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as fh:
+                    baseline = json.load(fh)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Could not read baseline {options["baseline"]}: {exc}')
+            regressions = self.write_comparison(compare(report, baseline, options['tolerance']))
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f'{regressions} metric(s) regressed by more than {options["tolerance"]:.0%}.')
+
+    def write_report(self, report):
+        header = f'{"route":<22}{"reqs":>7}{"err%":>7}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}{"KiB":>10}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for route, stats in list(report['routes'].items()) + [('TOTAL', report['total'])]:
+            if not stats['requests']:
+                continue
+            self.stdout.write(
+                f'{route:<22}{stats["requests"]:>7}{stats["error_rate"] * 100:>7.1f}{stats["p50_ms"]:>10.1f}'
+                f'{stats["p95_ms"]:>10.1f}{stats["p99_ms"]:>10.1f}{stats["max_ms"]:>10.1f}{stats["kib"]:>10.1f}'
+            )
+        self.stdout.write(f'{report["total"]["requests"]} requests in {report["elapsed_s"]:.2f}s = '
+                          f'{report["total"]["throughput_rps"]:.1f} req/s')
+
+    def write_comparison(self, rows):
+        self.stdout.write(f'\n{"route":<22}{"metric":<16}{"baseline":>10}{"current":>10}{"change":>9}')
+        regressions = 0
+        for route, metric, old, new, change, regressed in rows:
+            regressions += regressed
+            line = f'{route:<22}{metric:<16}{old:>10.2f}{new:>10.2f}{change:>+9.0%}'
+            self.stdout.write(self.style.ERROR(line + '  REGRESSION') if regressed else line)
+        return regressions
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from rfm.sharding import tenant_databases
+
+
+class Command(BaseCommand):
+    help = "Runs `migrate` on 'default' and every tenant shard alias (only the tenant tables exist on shards)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Exit non-zero if any alias has unapplied migrations.')
+
+    def handle(self, *args, **options):
+        for alias in tenant_databases():
+            name = settings.DATABASES[alias]['NAME']
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{alias} ({name})'))
+            migrate_options = {'database': alias, 'verbosity': options['verbosity'], 'interactive': False}
+            if options['check']:
+                migrate_options['check_unapplied'] = True
+            call_command('migrate', stdout=self.stdout, **migrate_options)
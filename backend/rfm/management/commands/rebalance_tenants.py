@@ -0,0 +1,58 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from rfm.models import TenantShard, Transaction, UploadedFile
+from rfm.sharding import DEFAULT_DB, hashed_shard, move_tenant, shard_for_user, tenant_shards
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves tenants between shards. With --user and --to, moves one user; with --auto, moves every '
+        'tenant whose shard differs from its hashed shard for the current TENANT_SHARDS (run it after '
+        'adding shards, or after enabling sharding to move data off the default database).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username or id of the tenant to move.')
+        parser.add_argument('--to', help='Target alias for --user.')
+        parser.add_argument('--auto', action='store_true')
+        parser.add_argument('--dry-run', action='store_true', help='Only print the planned moves.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        shards = tenant_shards()
+        if options['auto']:
+            if not shards:
+                raise CommandError('TENANT_SHARDS is empty; set TENANT_SHARD_COUNT to enable sharding.')
+            plan = [(user, hashed_shard(user.pk, shards)) for user in self.tenants()]
+        elif options['user'] and options['to']:
+            if options['to'] not in shards + [DEFAULT_DB]:
+                raise CommandError(f"Unknown shard {options['to']!r}. Configured: {', '.join(shards + [DEFAULT_DB])}.")
+            lookup = {'pk': options['user']} if options['user'].isdigit() else {'username': options['user']}
+            try:
+                plan = [(User.objects.get(**lookup), options['to'])]
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']!r} not found.")
+        else:
+            raise CommandError('Pass --auto, or --user and --to.')
+
+        moves = [(user, target) for user, target in plan if shard_for_user(user) != target]
+        if not moves:
+            self.stdout.write('Nothing to move.')
+            return
+        for user, target in moves:
+            source = shard_for_user(user)
+            if options['dry_run']:
+                self.stdout.write(f'{user.username}: {source} -> {target}')
+                continue
+            moved = move_tenant(user, target, batch_size=options['batch_size'])
+            counts = ', '.join(f'{count} {name}' for name, count in moved.items())
+            self.stdout.write(self.style.SUCCESS(f'{user.username}: {source} -> {target} ({counts})'))
+
+    def tenants(self):
+        """Users with an assigned shard, plus users that still have rows on 'default'."""
+        assigned = set(TenantShard.objects.values_list('user_id', flat=True))
+        legacy = set()
+        for model in (Transaction, UploadedFile):
+            legacy |= set(model.objects.using(DEFAULT_DB).order_by().values_list('user_id', flat=True).distinct())
+        return User.objects.filter(pk__in=assigned | legacy).order_by('pk')
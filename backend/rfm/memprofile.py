@@ -0,0 +1,291 @@
+"""
+Opt-in memory profiling of requests and background jobs, stage by stage.
+
+MemoryProfileMiddleware profiles a MEMORY_PROFILE_SAMPLE_RATE share of requests (0 = off, the
+default; 1 = every request); rfm.prewarm profiles warm-ups at the same rate. Code marks its
+pipeline stages with `with stage('validate'):`. Outside a sampled profile that is one thread-local
+lookup, so the markers can stay in place in production. Work interleaved chunk by chunk (reading
+and validating an upload) is timed by the caller and added with add_timings().
+
+For each stage of a sampled request the profile records:
+  * wall time and resident set size (RSS) before and after;
+  * peak RSS during the stage (Linux resets the kernel's high-water mark per stage; elsewhere
+    this is the process's lifetime peak, flagged with rss_peak_scope='process');
+  * peak traced Python memory and the MEMORY_PROFILE_TOP source lines that grew most (tracemalloc).
+Finished profiles are logged in one line and the last MEMORY_PROFILE_KEEP are served by
+MemoryProfileView (staff only).
+
+tracemalloc traces every thread while any profile runs, so concurrent requests are slower then
+and show up in each other's allocator lists; keep the sample rate low in production.
+"""
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+
+_local = threading.local()
+_recent = None
+_recent_lock = threading.Lock()
+_tracing_lock = threading.Lock()
+_tracing_users = 0  # profiles currently running (tracemalloc stops when the last one ends)
+
+
+def sample_rate():
+    return float(getattr(settings, 'MEMORY_PROFILE_SAMPLE_RATE', 0))
+
+
+def _status_kb(field):
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_mb():
+    kb = _status_kb('VmRSS')
+    return round(kb / 1024, 1) if kb is not None else None
+
+
+def _reset_rss_peak():
+    """Resets the kernel's RSS high-water mark (Linux). Returns False where that isn't possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _rss_peak_mb():
+    kb = _status_kb('VmHWM')
+    if kb is None and resource is not None:
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # kB on Linux, bytes on macOS
+    return round(kb / 1024, 1) if kb is not None else None
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+
+class _Frame:
+    """An open stage: what it saw when it started, and the peaks of the stages nested in it."""
+
+    def __init__(self, name, snapshot=True):
+        self.name = name
+        self.started = time.perf_counter()
+        self.rss_start = current_rss_mb()
+        self.rss_peak = 0.0
+        self.py_peak = 0
+        self.py_start = tracemalloc.get_traced_memory()[0]
+        self.snapshot = _snapshot() if snapshot else None
+
+    def fold(self, rss_peak, py_peak):
+        self.rss_peak = max(self.rss_peak, rss_peak or 0.0)
+        self.py_peak = max(self.py_peak, py_peak)
+
+
+class MemoryProfile:
+    """Stage records of one sampled request or job."""
+
+    def __init__(self, name, user_id=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.user_id = user_id
+        self.started_at = timezone.now()
+        self.started = time.perf_counter()
+        self.rss_scope = 'stage' if _reset_rss_peak() else 'process'
+        self.rss_start = current_rss_mb()
+        self.stages = []
+        self._open = [_Frame('total', snapshot=False)]
+
+    def enter(self, name):
+        parent = self._open[-1]
+        # The stage resets the peaks; keep what its parent reached so far
+        parent.fold(_rss_peak_mb(), tracemalloc.get_traced_memory()[1])
+        if self.rss_scope == 'stage':
+            _reset_rss_peak()
+        tracemalloc.reset_peak()
+        self._open.append(_Frame(name))
+
+    def exit(self):
+        frame = self._open.pop()
+        py_now, py_peak = tracemalloc.get_traced_memory()  # before the snapshot below allocates
+        frame.fold(_rss_peak_mb(), py_peak)
+        growth = _snapshot().compare_to(frame.snapshot, 'lineno')
+        top = [
+            {'where': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+             'size_mb': round(stat.size_diff / MB, 2), 'count': stat.count_diff}
+            for stat in sorted(growth, key=lambda stat: stat.size_diff, reverse=True)[:getattr(settings, 'MEMORY_PROFILE_TOP', 5)]
+            if stat.size_diff > 0
+        ]
+        self.stages.append({
+            'name': frame.name,
+            'depth': len(self._open) - 1,
+            'ms': round((time.perf_counter() - frame.started) * 1000, 1),
+            'rss_start_mb': frame.rss_start,
+            'rss_end_mb': current_rss_mb(),
+            'rss_peak_mb': frame.rss_peak,
+            'py_peak_mb': round((frame.py_peak - frame.py_start) / MB, 2),
+            'py_net_mb': round((py_now - frame.py_start) / MB, 2),
+            'top_allocators': top,
+        })
+        self._open[-1].fold(frame.rss_peak, frame.py_peak)
+
+    def add_timings(self, timings):
+        """Records {name: ms} as time-only stages nested in the open one (see add_timings())."""
+        depth = len(self._open) - 1
+        for name, ms in timings.items():
+            self.stages.append({
+                'name': name, 'depth': depth, 'ms': round(ms, 1), 'summed': True,
+                'rss_start_mb': None, 'rss_end_mb': None, 'rss_peak_mb': None,
+                'py_peak_mb': None, 'py_net_mb': None, 'top_allocators': [],
+            })
+
+    def finish(self):
+        while len(self._open) > 1:
+            self.exit()
+        total = self._open[0]
+        total.fold(_rss_peak_mb(), tracemalloc.get_traced_memory()[1])
+        return {
+            'id': self.id,
+            'name': self.name,
+            'user_id': self.user_id,
+            'started_at': self.started_at,
+            'elapsed_ms': round((time.perf_counter() - self.started) * 1000, 1),
+            'rss_start_mb': self.rss_start,
+            'rss_end_mb': current_rss_mb(),
+            'rss_peak_mb': total.rss_peak,
+            'rss_peak_scope': self.rss_scope,
+            'py_peak_mb': round((total.py_peak - total.py_start) / MB, 2),
+            'stages': self.stages,
+        }
+
+
+def _record(result):
+    global _recent
+    with _recent_lock:
+        keep = getattr(settings, 'MEMORY_PROFILE_KEEP', 50)
+        if _recent is None or _recent.maxlen != keep:
+            _recent = deque(_recent or (), maxlen=keep)
+        _recent.append(result)
+    stages = ', '.join(
+        f"{stage['name']} {stage['ms']} ms peak {stage['rss_peak_mb']} MB (py +{stage['py_peak_mb']} MB)"
+        for stage in result['stages'] if stage['depth'] == 0
+    )
+    print(f"Memory profile {result['name']} (user {result['user_id']}): {result['elapsed_ms']} ms, "
+          f"RSS {result['rss_start_mb']} -> {result['rss_end_mb']} MB, peak {result['rss_peak_mb']} MB; {stages}")
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def profile(name, user_id=None, force=False):
+    """
+    Profiles the block if it is sampled (or `force`d) and no profile is running in this thread.
+    Yields the MemoryProfile, or None when not sampled.
+    """
+    rate = sample_rate()
+    if current_profile() is not None or not (force or (rate > 0 and random.random() < rate)):
+        yield None
+        return
+    _start_tracing()
+    try:
+        active = _local.profile = MemoryProfile(name, user_id)
+        try:
+            yield active
+        finally:
+            _local.profile = None
+            _record(active.finish())
+    finally:
+        _stop_tracing()
+
+
+@contextmanager
+def stage(name):
+    """Marks a pipeline stage of the current profile; does nothing when none is running."""
+    active = current_profile()
+    if active is None:
+        yield
+        return
+    active.enter(name)
+    try:
+        yield
+    finally:
+        active.exit()
+
+
+def add_timings(**timings):
+    """
+    Adds milliseconds summed over interleaved work, e.g. add_timings(read_file=..., validate=...),
+    as stages nested in the current one. They carry the time only (flagged 'summed'); memory is
+    measured for the enclosing stage. Does nothing when no profile is running.
+    """
+    active = current_profile()
+    if active is not None:
+        active.add_timings(timings)
+
+
+def recent_profiles(limit=None):
+    """Finished profiles, newest first."""
+    with _recent_lock:
+        profiles = list(_recent or ())[::-1]
+    return profiles[:limit] if limit else profiles
+
+
+def clear_profiles():
+    with _recent_lock:
+        if _recent is not None:
+            _recent.clear()
+
+
+class MemoryProfileMiddleware:
+    """Profiles a MEMORY_PROFILE_SAMPLE_RATE share of requests, rendering included."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if sample_rate() <= 0:
+            return self.get_response(request)
+        with profile(f'{request.method} {request.path}') as active:
+            response = self.get_response(request)
+            if active is not None:
+                user = getattr(request, 'user', None)  # set by DRF authentication
+                active.user_id = user.pk if user is not None and user.is_authenticated else None
+                response['X-Memory-Profile'] = active.id
+        return response
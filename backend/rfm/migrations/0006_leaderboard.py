@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfm', '0005_datasetversion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Leaderboard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city_key', models.CharField(blank=True, help_text='Lower-cased city, empty for the global board', max_length=100)),
+                ('city', models.CharField(blank=True, help_text='City as it appears in the data', max_length=100)),
+                ('metric', models.CharField(choices=[('total_paid', 'Total paid'), ('loyalty_points', 'Loyalty points')], max_length=20)),
+                ('entries', models.JSONField(default=list)),
+                ('dataset_version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboards', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'city_key', 'metric')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfm', '0008_segment_rule_sets'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohortRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_month', models.DateField(blank=True, null=True)),
+                ('cities', models.JSONField(default=list)),
+                ('product_types', models.JSONField(default=list)),
+                ('data', models.BinaryField()),
+                ('dataset_version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cohort_rollup', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
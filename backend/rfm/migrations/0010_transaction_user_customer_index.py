@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfm', '0009_cohort_rollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'customer_id'], name='rfm_txn_user_customer'),
+        ),
+    ]
@@ -2,11 +2,30 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .replicas import current_read_alias
+from .sharding import shard_for_user
+
+
+class TenantQuerySet(models.QuerySet):
+    """QuerySet for models stored in per-tenant shards (see rfm.sharding)."""
+
+    def for_user(self, user):
+        """
+        The user's rows, from the shard that holds them. Inside replica_reads() (rfm.replicas),
+        users on 'default' are read from the request's replica instead.
+        """
+        alias = shard_for_user(user)
+        if alias == 'default':
+            alias = current_read_alias() or alias
+        return self.using(alias).filter(user=user)
+
+
 class Transaction(models.Model):
     """
     Represents a single customer transaction uploaded by a user.
     """
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
+    # No FK constraint: the row may live in a tenant shard that has no auth_user table
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions', db_constraint=False)
     customer_id = models.CharField(max_length=255, db_index=True) # Assuming customer ID can be alphanumeric
     purchase_date = models.DateField(db_index=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
@@ -17,8 +36,12 @@ class Transaction(models.Model):
     loyalty_points = models.PositiveIntegerField(default=0, help_text="Loyalty points for this transaction")
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TenantQuerySet.as_manager()
+
     class Meta:
         ordering = ['-purchase_date'] # Default ordering
+        # A tenant's customers in key order: partition bounds and partition reads (rfm.partitioned)
+        indexes = [models.Index(fields=['user', 'customer_id'], name='rfm_txn_user_customer')]
         # Ensure a user cannot upload the exact same transaction details multiple times?
         # unique_together = ('user', 'customer_id', 'purchase_date', 'amount') # Optional: depends on requirements
 
@@ -29,14 +52,113 @@ class UploadedFile(models.Model):
     """
     Stores uploaded transaction files for each user, allowing download/view later.
     """
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_files')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_files', db_constraint=False)
     file = models.FileField(upload_to='uploads/')
     original_filename = models.CharField(max_length=255)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TenantQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.original_filename} ({self.user.username}) - {self.uploaded_at}"
 
+class DatasetVersion(models.Model):
+    """
+    Monotonic version of a user's transaction dataset.
+    Bumped every time the user's transactions (or segmentation rules) are replaced, so anything
+    derived from them (ETags, cached analytics) can be keyed by (user, version) without scanning transactions.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='dataset_version')
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - v{self.version}"
+
+class Leaderboard(models.Model):
+    """
+    Precomputed top customers for one user, per city (or globally) and per metric.
+    Rebuilt at ingest so ranking endpoints serve the first k entries without scanning transactions.
+    """
+    METRIC_TOTAL_PAID = 'total_paid'
+    METRIC_LOYALTY_POINTS = 'loyalty_points'
+    METRIC_CHOICES = [
+        (METRIC_TOTAL_PAID, 'Total paid'),
+        (METRIC_LOYALTY_POINTS, 'Loyalty points'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='leaderboards')
+    city_key = models.CharField(max_length=100, blank=True, help_text="Lower-cased city, empty for the global board")
+    city = models.CharField(max_length=100, blank=True, help_text="City as it appears in the data")
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES)
+    entries = models.JSONField(default=list)
+    dataset_version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'city_key', 'metric')
+
+    def __str__(self):
+        return f"{self.user.username} - {self.city or 'global'} - {self.metric}"
+
+class CohortRollup(models.Model):
+    """
+    Compact monthly activity of a user's customers for cohort retention (rfm.cohorts), built at ingest.
+    `data` holds NumPy arrays with one entry per (customer, month, city, product type): customer
+    number, month offset from `base_month`, city and product type codes (into `cities` and
+    `product_types`), order count and revenue, sorted by customer then month.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cohort_rollup')
+    base_month = models.DateField(null=True, blank=True)
+    cities = models.JSONField(default=list)
+    product_types = models.JSONField(default=list)
+    data = models.BinaryField()
+    dataset_version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - cohorts for v{self.dataset_version}"
+
+class DailyRollup(models.Model):
+    """
+    A user's revenue per purchase day (rfm.timeseries), built at ingest for the revenue graphs.
+    `data` holds NumPy arrays sorted by day: day offset from `first_day`, revenue and order count.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='daily_rollup')
+    first_day = models.DateField(null=True, blank=True)
+    data = models.BinaryField()
+    dataset_version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - daily revenue for v{self.dataset_version}"
+
+class TenantShard(models.Model):
+    """
+    Which database alias holds a user's Transaction and UploadedFile rows (see rfm.sharding).
+    Users without a row are on 'default'.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='tenant_shard')
+    alias = models.CharField(max_length=100)
+    assigned_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} -> {self.alias}"
+
+class SegmentRuleSet(models.Model):
+    """
+    A user's own RFM segmentation (rfm.segment_rules), replacing the built-in SEGMENT_MAP.
+    `rules` is a list in priority order (the first matching rule names the segment); customers no
+    rule matches get `default_segment`.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='segment_rules')
+    rules = models.JSONField(default=list)
+    default_segment = models.CharField(max_length=50, default='Other')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {len(self.rules)} segment rules"
+
 # We might add an RFMSegment model later if we want to persist calculated segments
 # class RFMSegment(models.Model):
 #     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rfm_segments')
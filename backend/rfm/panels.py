@@ -0,0 +1,421 @@
+"""
+Dashboard panels: the payload behind each analytics endpoint, as a plain function of the user
+and already-parsed parameters. The DRF views render one panel each; rfm.async_views runs several
+of them concurrently in a thread pool.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .cohorts import cohort_panel
+from .lazy import LazyModule
+from .memprofile import stage
+from .leaderboards import LOYALTY_POINTS, TOTAL_PAID, available_cities, get_leaderboard, parse_k
+from .models import Transaction
+from .partitioned import start_partitioned_aggregation
+from .renderers import FrameRecords, GroupedFrameRecords, rendered
+from .rfm_analysis import calculate_rfm
+from .replicas import current_read_alias
+from .serializers import RFMScoreSerializer
+from .singleflight import coalesce
+from .timeseries import parse_max_points, revenue_graph
+from .versioning import dataset_stamp
+
+pd = LazyModule('pandas')
+
+
+class PanelCancelled(Exception):
+    """Raised inside a panel when the request it is computing for has gone away."""
+
+
+_state = threading.local()
+
+
+def set_cancel_event(event):
+    """Binds a threading.Event to the current thread; panels stop at their next checkpoint once it is set."""
+    _state.cancel_event = event
+
+
+def raise_if_cancelled():
+    """Checkpoint between a panel's stages (after each query, before heavy pandas work)."""
+    event = getattr(_state, 'cancel_event', None)
+    if event is not None and event.is_set():
+        raise PanelCancelled()
+
+
+def rfm_output_frame(rfm_df):
+    """
+    Shapes an RFM DataFrame like RFMScoreSerializer output without per-row serialization:
+    only the serializer's fields, with monetary rendered as a 2-decimal string.
+    """
+    out = rfm_df[list(RFMScoreSerializer().fields)].copy()
+    out['monetary'] = pd.to_numeric(out['monetary'], errors='coerce').map('{:.2f}'.format)
+    return out
+
+
+def rfm_panel(user, segment=None, min_monetary=None, filters_applied=None):
+    """
+    RFM scores, optionally filtered by segment and minimum monetary value, with a summary of the
+    unfiltered data. Returns None when there is nothing to analyse; raises ValueError on a bad filter.
+    """
+    rfm_results_df = rfm_table(user)
+    if rfm_results_df is None or rfm_results_df.empty:
+        return None
+    raise_if_cancelled()
+
+    # Apply filters if provided
+    filtered_df = rfm_results_df.copy()
+    if segment:
+        filtered_df = filtered_df[filtered_df['segment'].str.lower() == segment.lower()]
+    if min_monetary:
+        try:
+            min_monetary_val = Decimal(min_monetary)
+            filtered_df['monetary'] = pd.to_numeric(filtered_df['monetary'], errors='coerce')
+            filtered_df.dropna(subset=['monetary'], inplace=True) # Drop rows where conversion failed
+            filtered_df = filtered_df[filtered_df['monetary'] >= min_monetary_val]
+        except (InvalidOperation, ValueError):
+            raise ValueError('Invalid value for min_monetary filter.')
+
+    # Prepare summary statistics based on the *original* unfiltered data
+    summary = {
+        'total_customers': len(rfm_results_df),
+        'segment_counts': rfm_results_df['segment'].value_counts().to_dict(),
+        'filters_applied': filters_applied or {},
+        'filtered_results_count': len(filtered_df),
+    }
+    if filtered_df.empty and (segment or min_monetary):
+        # Only return this message if filters were actually applied and resulted in no matches
+        return {"message": "No customers match the specified filters.", "rfm_data": [], "summary": summary}
+
+    # Rendered column-wise in the RFMScoreSerializer shape (monetary as a 2dp string)
+    return {'rfm_data': FrameRecords(rfm_output_frame(filtered_df)), 'summary': summary}
+
+
+def ranking_panel(user, k=10, city=None):
+    """Customers by total paid (per city), from the precomputed leaderboards."""
+    ranking = get_leaderboard(user, TOTAL_PAID, city=city, k=k)
+    cities = available_cities(user)
+    if not ranking:
+        return {'ranking': [], 'cities': cities, 'message': 'No transactions found.'}
+    return {'ranking': ranking, 'cities': cities}
+
+
+# `period` filter -> days back from today
+PERIOD_DAYS = {'today': 0, 'week': 7, 'month': 30, '3m': 90, '6m': 180, 'year': 365}
+
+
+def period_start(period, today=None):
+    """First day included by a `period` filter (today, week, month, 3m, 6m, year); None for all."""
+    if period not in PERIOD_DAYS:
+        return None
+    now = today or datetime.now().date()
+    return now - timedelta(days=PERIOD_DAYS[period])
+
+
+def revenue_panel(user, period='all', max_points=None):
+    """
+    Revenue and weight per product type, total revenue and revenue per day for a period. The daily
+    graph comes from the daily rollup, downsampled to max_points (rfm.timeseries) when given.
+    """
+    qs = Transaction.objects.for_user(user)
+    start = period_start(period)
+    if start is not None:
+        qs = qs.filter(purchase_date__gte=start)
+    # Revenue by product type (money and weight)
+    df = pd.DataFrame.from_records(qs.values('product_type', 'amount', 'amount_100kg'))
+    if df.empty:
+        return {'revenue_by_type': [], 'revenue_by_weight': [], 'total_revenue': 0, 'graph': []}
+    raise_if_cancelled()
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
+    df['amount_100kg'] = pd.to_numeric(df['amount_100kg'], errors='coerce').fillna(0)
+    revenue_by_type = df.groupby('product_type')['amount'].sum().reset_index().sort_values(by='amount', ascending=False)
+    revenue_by_weight = df.groupby('product_type')['amount_100kg'].sum().reset_index().sort_values(by='amount_100kg', ascending=False)
+    # Graph data: revenue by date
+    raise_if_cancelled()
+    graph_df, graph_days = revenue_graph(user, start=start, max_points=max_points)
+    total_revenue = df['amount'].sum()
+    return with_graph_size({
+        'revenue_by_type': FrameRecords(revenue_by_type),
+        'revenue_by_weight': FrameRecords(revenue_by_weight),
+        'total_revenue': total_revenue,
+        'graph': FrameRecords(graph_df)
+    }, graph_days, max_points)
+
+
+def with_graph_size(payload, days, max_points):
+    """Adds the graph's day count before downsampling when the request asked for max_points."""
+    if max_points is not None:
+        payload['graph_total_points'] = days
+    return payload
+
+
+def customers_panel(user, max_points=None):
+    """
+    Every customer's totals, the top 40, per-customer payment logs and revenue per day (from the
+    daily rollup, downsampled to max_points when given).
+    """
+    qs = Transaction.objects.for_user(user)
+    # Large tenants: per-customer totals come from the partition workers while the logs load here
+    partitioned = start_partitioned_aggregation(user)
+    with stage('dataframe'):
+        df = pd.DataFrame.from_records(qs.values('customer_id', 'amount', 'loyalty_points', 'purchase_date'))
+    if df.empty:
+        return {'customers': [], 'top_40': [], 'logs': {}, 'graph': []}
+    raise_if_cancelled()
+    with stage('groupby'):
+        df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
+        df['loyalty_points'] = pd.to_numeric(df['loyalty_points'], errors='coerce').fillna(0)
+        # All customers with stats
+        if partitioned is not None:
+            customers = partitioned.result().rename(columns={'monetary': 'total_paid', 'loyalty_points': 'total_points'})
+            customers = customers[['customer_id', 'total_paid', 'total_points', 'order_count']]
+        else:
+            customers = df.groupby('customer_id').agg(
+                total_paid=('amount', 'sum'),
+                total_points=('loyalty_points', 'sum'),
+                order_count=('purchase_date', 'count')
+            ).reset_index()
+        customers = customers.sort_values(by='total_paid', ascending=False)
+        # Top 40 highlighted
+        top_40 = customers.head(40)
+        # Payment log for each (one sort, rendered per customer straight from the columns)
+        logs = GroupedFrameRecords(df, 'customer_id', ['purchase_date', 'amount'], sort_by='purchase_date')
+    # Graph for each stat (example: total_paid over time)
+    graph_df, graph_days = revenue_graph(user, max_points=max_points)
+    return with_graph_size({
+        'customers': FrameRecords(customers),
+        'top_40': FrameRecords(top_40),
+        'logs': logs,
+        'graph': FrameRecords(graph_df)
+    }, graph_days, max_points)
+
+
+def vip_panel(user, k=50, city=None):
+    """Top customers by loyalty points with a status per rank, from the precomputed leaderboards."""
+    vip_customers = get_leaderboard(user, LOYALTY_POINTS, city=city, k=k) or []
+    # Assign status based on ranking
+    for idx, cust in enumerate(vip_customers):
+        if idx == 0:
+            cust['status'] = 'VIP'
+        elif 1 <= idx <= 4:
+            cust['status'] = 'Loyal Customer'
+        else:
+            cust['status'] = 'Thrifter'
+    return {'vip_customers': vip_customers, 'cities': available_cities(user)}
+
+
+def avg_order_value_panel(user):
+    df = pd.DataFrame.from_records(Transaction.objects.for_user(user).values('amount'))
+    if df.empty:
+        return {'avg_order_value': 0}
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)
+    return {'avg_order_value': df['amount'].mean()}
+
+
+def _rfm_params(params):
+    min_monetary = params.get('min_monetary') or None
+    if min_monetary is not None:
+        try:
+            Decimal(min_monetary)
+        except InvalidOperation:
+            raise ValueError('Invalid value for min_monetary filter.')
+    return {'segment': params.get('segment') or None, 'min_monetary': min_monetary, 'filters_applied': params.dict()}
+
+
+def _k_param(default):
+    def parse(params):
+        return {'k': parse_k(params.get('k'), default=default), 'city': params.get('city') or None}
+    return parse
+
+
+# name -> (panel function, parser turning query parameters into its keyword arguments).
+# Parsers raise ValueError for invalid parameters.
+PANELS = {
+    'analysis': (rfm_panel, _rfm_params),
+    'ranking': (ranking_panel, _k_param(10)),
+    'revenue': (revenue_panel, lambda params: {'period': params.get('period', 'all'), 'max_points': parse_max_points(params.get('max_points'))}),
+    'customers': (customers_panel, lambda params: {'max_points': parse_max_points(params.get('max_points'))}),
+    'vip': (vip_panel, _k_param(50)),
+    'avg_order_value': (avg_order_value_panel, lambda params: {}),
+    'cohorts': (cohort_panel, lambda params: {'city': params.get('city') or None, 'product_type': params.get('product_type') or None}),
+}
+
+
+# --- Cache of panel payloads -------------------------------------------------------------------
+# Two levels: this process's LRU, user pk -> {'stamp': dataset stamp, 'day': date, 'payloads':
+# OrderedDict(key -> payload)}, in front of Django's cache framework (settings.PANEL_SHARED_CACHE),
+# which the worker processes share, so a payload computed by one worker serves them all.
+# Payloads are only valid for the dataset they were computed from and the day (recency and the
+# period filters are relative to today), so both levels are keyed by them. rfm.prewarm fills the
+# default ones right after an upload. Panel payloads are cached with their frames already encoded
+# (renderers.rendered), not as the DataFrames they were computed from; the RFM table, which panels
+# filter further, is only kept in this process. Each user's shared entries are listed under one
+# index key, and the first entry stored for a new dataset or day deletes the previous ones.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+MAX_PAYLOADS_PER_USER = 64  # bounds filter combinations (segment, min_monetary, k, city...)
+_MISSING = object()
+
+
+def _shared_cache():
+    alias = getattr(settings, 'PANEL_SHARED_CACHE', 'default')
+    return caches[alias] if alias else None
+
+
+def _shared_key(user, stamp, today, key):
+    version, updated_at = stamp
+    digest = hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+    return f'rfm:panel:{user.pk}:{version}:{updated_at.timestamp()}:{today.isoformat()}:{digest}'
+
+
+def _shared_get(user, stamp, today, key):
+    """(True, payload) when another process (or an earlier request) stored it in the shared cache."""
+    shared = _shared_cache()
+    if shared is None:
+        return False, None
+    try:
+        found = shared.get(_shared_key(user, stamp, today, key), _MISSING)
+    except Exception as e:  # a cache outage only costs the computation
+        print(f"Shared panel cache read failed: {e}")
+        return False, None
+    return (False, None) if found is _MISSING else (True, found)
+
+
+def _shared_set(user, stamp, today, key, value):
+    shared = _shared_cache()
+    if shared is None:
+        return
+    seconds = getattr(settings, 'PANEL_SHARED_CACHE_SECONDS', 86400)
+    shared_key, index_key = _shared_key(user, stamp, today, key), f'rfm:panel-index:{user.pk}'
+    try:
+        shared.set(shared_key, value, seconds)
+        # Not atomic: an entry missed by a concurrent write still expires after `seconds`
+        index = shared.get(index_key)
+        if index is None or index['stamp'] != (stamp, today):
+            if index is not None:
+                shared.delete_many(index['keys'])
+            index = {'stamp': (stamp, today), 'keys': []}
+        if shared_key not in index['keys']:
+            index['keys'].append(shared_key)
+        shared.set(index_key, index, seconds)
+    except Exception as e:
+        print(f"Shared panel cache write failed: {e}")
+
+
+def cached(user, key, compute, shared=True):
+    """
+    Returns compute() for the user's current dataset, computing it at most once per dataset and day
+    across the worker processes sharing PANEL_SHARED_CACHE (only in this process when `shared` is
+    False). Datasets that were never uploaded aren't cached, and neither are results read from a
+    replica, which may not have caught up with the primary yet. Concurrent misses for the same
+    payload are computed once (rfm.singleflight).
+    """
+    stamp = dataset_stamp(user)
+    if stamp is None:
+        return compute()
+    today = timezone.now().date()
+    with _cache_lock:
+        entry = _cache.get(user.pk)
+        if entry is not None and entry['stamp'] == stamp and entry['day'] == today and key in entry['payloads']:
+            _cache.move_to_end(user.pk)
+            return entry['payloads'][key]
+
+    found, value = _shared_get(user, stamp, today, key) if shared else (False, None)
+    if found:
+        _remember(user, stamp, today, key, value)
+        return value
+
+    read_alias = current_read_alias()
+
+    def compute_and_share():
+        value = compute()
+        if shared:
+            value = rendered(value)
+            if read_alias is None:
+                _shared_set(user, stamp, today, key, value)
+        return value
+
+    # A waiter whose computing request was cancelled (rfm.async_views) computes it itself
+    value = coalesce(('panel', user.pk, stamp, today, read_alias, key), compute_and_share, retry=(PanelCancelled,))
+    if read_alias is None:
+        _remember(user, stamp, today, key, value)
+    return value
+
+
+def _remember(user, stamp, today, key, value):
+    """Keeps the payload in this process's LRU."""
+    with _cache_lock:
+        entry = _cache.get(user.pk)
+        if entry is None or entry['stamp'] != stamp or entry['day'] != today:
+            if entry is not None and entry['stamp'][0] > stamp[0]:
+                return  # a newer upload landed while computing
+            entry = _cache[user.pk] = {'stamp': stamp, 'day': today, 'payloads': OrderedDict()}
+        entry['payloads'][key] = value
+        while len(entry['payloads']) > MAX_PAYLOADS_PER_USER:
+            entry['payloads'].popitem(last=False)
+        _cache.move_to_end(user.pk)
+        while len(_cache) > getattr(settings, 'PANEL_CACHE_SIZE', 16):
+            _cache.popitem(last=False)
+
+
+def cached_panel(name, user, /, **kwargs):
+    """PANELS[name] payload for these keyword arguments, through the cache."""
+    function, _ = PANELS[name]
+    return cached(user, (name, repr(sorted(kwargs.items()))), lambda: function(user, **kwargs))
+
+
+def rfm_table(user):
+    """calculate_rfm through the cache; shared by the RFM panel and the insights endpoint (read-only)."""
+    return cached(user, ('rfm_table',), lambda: calculate_rfm(user), shared=False)
+
+
+def insights_summary(user):
+    """The RFM summary the insights endpoint gives the model, through the cache; None without data."""
+    return cached(user, ('insights_summary',), lambda: _insights_summary(user))
+
+
+def _insights_summary(user):
+    """The RFM segmentation summary given to the model, or None when the user has no transactions."""
+    rfm_results_df = rfm_table(user)
+    if rfm_results_df is None:
+        return None
+
+    # Convert relevant parts of the DataFrame to a string format for the prompt
+    # Example: Segment counts and maybe average R/F/M per segment
+    segment_counts = rfm_results_df['segment'].value_counts()
+    summary_stats = rfm_results_df.groupby('segment')[['recency', 'frequency', 'monetary']].mean()
+
+    return f"""
+            Customer Segmentation Summary:
+            Total Customers: {len(rfm_results_df)}
+            Segment Counts:
+            {segment_counts.to_string()}
+
+            Average RFM per Segment:
+            {summary_stats.to_string()}
+
+            Full RFM Data Sample (first 5 rows):
+            {rfm_results_df.head().to_string()}
+            """
+
+
+def cached_keys(user):
+    """Keys cached for the user's current dataset (for the warm-up status and tests)."""
+    stamp = dataset_stamp(user)
+    with _cache_lock:
+        entry = _cache.get(user.pk)
+        if entry is None or entry['stamp'] != stamp or entry['day'] != timezone.now().date():
+            return []
+        return list(entry['payloads'])
+
+
+def clear_panel_cache():
+    with _cache_lock:
+        _cache.clear()
+
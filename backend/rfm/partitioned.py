@@ -0,0 +1,175 @@
+"""
+Per-customer aggregation of a tenant's transactions, in partitions for very large tenants.
+
+Every analytics path that needs per-customer totals (calculate_rfm, the customers panel) reduces
+the transactions with customer_aggregates(). For a tenant with at least
+PARTITIONED_AGGREGATION_MIN_ROWS transactions, and PARTITIONED_AGGREGATION_WORKERS > 1, the
+reduction is split into customer-id ranges of about equal row counts instead. Each range is read
+through its own database connection (the (user, customer_id) index makes it a range scan) and
+reduced in a worker process. A customer's rows all fall in one range, so merging the partitions is
+a concatenation. Scoring (global quantiles) then runs once over the merged table, as before.
+
+Customer-id ranges rather than a hash of the id: SQLite has no hash function, and a range is what
+the index can serve. Workers are spawned (see rfm.ingest.parse_pool for why) and set Django up on
+start. An in-memory database (the test suite's) can't be opened from another process, so there
+the partitions are reduced one after another in this process.
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.db import connections
+
+from .lazy import LazyModule
+
+pd = LazyModule('pandas')
+
+COLUMNS = ['customer_id', 'purchase_date', 'amount', 'loyalty_points']
+AGGREGATE_COLUMNS = ['customer_id', 'last_purchase_date', 'frequency', 'monetary', 'loyalty_points', 'order_count']
+
+
+def min_rows():
+    return int(getattr(settings, 'PARTITIONED_AGGREGATION_MIN_ROWS', 2_000_000))
+
+
+def partition_workers():
+    return int(getattr(settings, 'PARTITIONED_AGGREGATION_WORKERS', 1))
+
+
+def customer_aggregates(df):
+    """
+    One row per customer of a transactions DataFrame (customer_id, purchase_date, amount and
+    optionally loyalty_points), sorted by customer_id: last purchase, distinct purchase days
+    (frequency), amount total (monetary), loyalty points and orders. Rows without a parseable
+    purchase date are dropped.
+    """
+    df['amount'] = pd.to_numeric(df['amount'])
+    df['purchase_date'] = pd.to_datetime(df['purchase_date'], errors='coerce')
+    df = df.dropna(subset=['purchase_date'])
+    if 'loyalty_points' not in df.columns:
+        df = df.assign(loyalty_points=0)
+    customers = df.groupby('customer_id').agg(
+        last_purchase_date=pd.NamedAgg(column='purchase_date', aggfunc='max'),
+        frequency=pd.NamedAgg(column='purchase_date', aggfunc='nunique'),  # Count unique purchase days
+        monetary=pd.NamedAgg(column='amount', aggfunc='sum'),
+        loyalty_points=pd.NamedAgg(column='loyalty_points', aggfunc='sum'),
+        order_count=pd.NamedAgg(column='purchase_date', aggfunc='size'),
+    ).reset_index()
+    # Amounts are cents: rounding drops the float error of summing them, which depends on row order
+    # (and so on the partitioning) and would otherwise reorder near-equal customers in the M ranking
+    customers['monetary'] = customers['monetary'].round(2)
+    return customers
+
+
+def _ensure_alias(alias, database):
+    """Registers the parent's database alias in a worker that doesn't have it (e.g. a benchmark's)."""
+    if connections.settings.get(alias, {}).get('NAME') != database['NAME']:
+        connections.settings[alias] = connections.configure_settings({'default': database})['default']
+
+
+def aggregate_partition(alias, database, user_id, low, high):
+    """customer_aggregates of the user's transactions with low <= customer_id < high (None = open)."""
+    from .models import Transaction
+    _ensure_alias(alias, database)
+    qs = Transaction.objects.using(alias).filter(user_id=user_id).order_by()
+    if low is not None:
+        qs = qs.filter(customer_id__gte=low)
+    if high is not None:
+        qs = qs.filter(customer_id__lt=high)
+    df = pd.DataFrame.from_records(qs.values_list(*COLUMNS), columns=COLUMNS)
+    return customer_aggregates(df)
+
+
+def partition_bounds(qs, rows, partitions):
+    """
+    Customer ids splitting the queryset into `partitions` ranges of about rows / partitions rows
+    each, as [(low, high), ...]. Each bound is one index-only OFFSET query.
+    """
+    ordered = qs.order_by('customer_id').values_list('customer_id', flat=True)
+    bounds = []
+    for index in range(1, partitions):
+        bound = ordered[rows * index // partitions:rows * index // partitions + 1].first()
+        if bound is not None and (not bounds or bound > bounds[-1]):
+            bounds.append(bound)
+    edges = [None] + bounds + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _init_worker():
+    # This module is imported before Django is set up in the worker: it only imports models lazily
+    import django
+    django.setup()
+    import pandas  # noqa: F401
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def partition_pool(workers):
+    """Process pool for aggregate_partition, started on first use and kept for the life of the process."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._max_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'), initializer=_init_worker)
+        return _pool
+
+
+def _discard_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+class PartitionedAggregation:
+    """Partitions of one queryset being reduced; result() merges them."""
+
+    def __init__(self, qs, user_id, rows, workers):
+        self.rows = rows
+        self.bounds = partition_bounds(qs, rows, workers)
+        database = connections[qs.db]
+        self.calls = [(qs.db, database.settings_dict, user_id, low, high) for low, high in self.bounds]
+        self.futures = None
+        if not database.is_in_memory_db():
+            try:
+                pool = partition_pool(workers)
+                self.futures = [pool.submit(aggregate_partition, *call) for call in self.calls]
+            except BrokenProcessPool:
+                _discard_pool()
+
+    def result(self):
+        parts = None
+        if self.futures is not None:
+            try:
+                parts = [future.result() for future in self.futures]
+            except BrokenProcessPool as e:
+                # A worker died (e.g. killed for memory); reduce here rather than failing the request
+                print(f"Partitioned aggregation pool failed, aggregating in-process: {e}")
+                _discard_pool()
+        if parts is None:
+            parts = [aggregate_partition(*call) for call in self.calls]
+        # Ranges follow the database's collation; sort as the in-process groupby does, since
+        # rank(method='first') in the scoring depends on row order
+        merged = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=AGGREGATE_COLUMNS)
+        return merged.sort_values('customer_id', kind='stable', ignore_index=True)
+
+
+def start_partitioned_aggregation(user, workers=None):
+    """
+    Starts reducing the user's transactions in partitions when they are large enough (and more
+    than one worker is configured); returns the PartitionedAggregation, or None to aggregate in-process.
+    """
+    from .models import Transaction
+    workers = partition_workers() if workers is None else workers
+    if workers <= 1:
+        return None
+    qs = Transaction.objects.for_user(user)
+    rows = qs.order_by().count()
+    if rows < min_rows():
+        return None
+    print(f"Aggregating {rows} transactions of user {user.pk} on {qs.db} in {workers} partitions")
+    return PartitionedAggregation(qs, user.pk, rows, workers)
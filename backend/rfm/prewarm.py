@@ -0,0 +1,157 @@
+"""
+Post-upload warm-up: right after an upload commits, a background thread computes the payloads the
+dashboard asks for first (RFM table and panel, ranking, revenue for every period, customers, VIP,
+average order value, cohorts) plus the chatbot aggregates and customer search index, and stores them in the panel cache
+(rfm.panels.cached), so the first dashboard visit and the insights request don't pay the cold cost.
+Panel payloads also go to the shared cache (PANEL_SHARED_CACHE), so every worker process serves
+them warm, not only the one that handled the upload.
+
+Progress and per-stage timings are kept per user, for the last MAX_TRACKED_USERS users, in the
+process that ran the warm-up; WarmupStatusView serves them and state changes are pushed to the
+user's event stream (rfm.events).
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import QueryDict
+from django.utils import timezone
+
+from .aggregates import get_user_aggregates
+from .events import publish
+from .memprofile import profile, stage
+from .panels import PANELS, PERIOD_DAYS, cached_panel, insights_summary, rfm_table
+from .search import customer_index
+from .versioning import get_dataset_version
+
+_pool = None
+_pool_lock = threading.Lock()
+_status = OrderedDict()  # user pk -> status dict (see warm_up_dataset), least recently scheduled first
+_futures = {}  # user pk -> Future of the latest warm-up, until it finishes
+_status_lock = threading.Lock()
+MAX_TRACKED_USERS = 1024
+
+
+def warmup_stages():
+    """(stage name, callable(user)) in the order the dashboard needs them."""
+    def panel(name, query=''):
+        kwargs = PANELS[name][1](QueryDict(query))  # the same kwargs a parameterless request produces
+        return lambda user: cached_panel(name, user, **kwargs)
+
+    stages = [('rfm_table', rfm_table), ('analysis', panel('analysis')), ('insights', insights_summary), ('ranking', panel('ranking'))]
+    stages += [(f'revenue:{period}', panel('revenue', f'period={period}')) for period in ['all', *PERIOD_DAYS]]
+    stages += [
+        ('customers', panel('customers')),
+        ('vip', panel('vip')),
+        ('avg_order_value', panel('avg_order_value')),
+        ('cohorts', panel('cohorts')),
+        ('aggregates', get_user_aggregates),
+        ('search_index', lambda user: customer_index(get_user_aggregates(user))),
+    ]
+    return stages
+
+
+def _pool_executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=getattr(settings, 'PREWARM_WORKERS', 2), thread_name_prefix='prewarm')
+        return _pool
+
+
+def _update(user, version, stage=None, **fields):
+    """Updates the status of the user's warm-up of `version` (ignored once a newer upload was queued)."""
+    with _status_lock:
+        status = _status.get(user.pk)
+        if status is None or status['version'] != version:
+            return
+        if stage is not None:
+            status['stages'][stage] = fields
+        else:
+            status.update(fields)
+    if 'state' in fields and stage is None:
+        publish(user, 'warmup', version=version, **{key: fields[key] for key in ('state', 'elapsed_ms') if key in fields})
+
+
+def warm_up_dataset(user, version):
+    """
+    Runs every warm-up stage for the given dataset version. Stops early ('superseded') if a newer
+    upload replaced the dataset meanwhile; a failing stage is recorded and the others still run.
+    Sampled like requests by the memory profiler (rfm.memprofile), one profile stage per warm-up stage.
+    """
+    started = time.perf_counter()
+    results = {}
+    _update(user, version, state='running', started_at=timezone.now())
+    try:
+        with profile(f'warmup v{version}', user_id=user.id):
+            for name, run in warmup_stages():
+                if get_dataset_version(user) != version:
+                    _update(user, version, state='superseded')
+                    return
+                stage_started = time.perf_counter()
+                try:
+                    with stage(name):
+                        run(user)
+                    result = {'status': 'done'}
+                except Exception as e:
+                    print(f"Warm-up stage {name} failed for user {user.id}: {e}")
+                    result = {'status': 'failed', 'error': str(e)}
+                result['ms'] = round((time.perf_counter() - stage_started) * 1000, 1)
+                results[name] = result
+                _update(user, version, stage=name, **result)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        failed = [name for name, result in results.items() if result['status'] == 'failed']
+        _update(user, version, state='failed' if failed else 'done', elapsed_ms=elapsed_ms, finished_at=timezone.now())
+        print(f"Warm-up for user {user.id} (dataset v{version}) finished in {elapsed_ms} ms"
+              + (f", failed stages: {', '.join(failed)}" if failed else ''))
+    finally:
+        close_old_connections()
+
+
+def schedule_warmup(user, version):
+    """
+    Queues the warm-up of a freshly uploaded dataset and returns its status. Call after the upload
+    committed (the worker thread reads through its own connection).
+    """
+    queued_at = timezone.now()
+    with _status_lock:
+        _status[user.pk] = {
+            'state': 'queued', 'version': version, 'queued_at': queued_at,
+            'stages': {name: {'status': 'pending'} for name, _ in warmup_stages()},
+        }
+        _status.move_to_end(user.pk)
+        while len(_status) > MAX_TRACKED_USERS:
+            _status.popitem(last=False)
+        status = dict(_status[user.pk])
+    publish(user, 'warmup', state='queued', version=version)
+    future = _pool_executor().submit(warm_up_dataset, user, version)
+    with _status_lock:
+        _futures[user.pk] = future
+    future.add_done_callback(lambda done: _forget(user.pk, done))
+    return status
+
+
+def _forget(user_pk, future):
+    with _status_lock:
+        if _futures.get(user_pk) is future:
+            del _futures[user_pk]
+
+
+def warmup_status(user):
+    """The latest warm-up status for the user, or None if none ran in this process (or it was dropped)."""
+    with _status_lock:
+        status = _status.get(user.pk)
+        if status is None:
+            return None
+        return {**status, 'stages': {name: dict(result) for name, result in status['stages'].items()}}
+
+
+def wait_for_warmup(user, timeout=None):
+    """Blocks until the user's latest warm-up finished (used by tests)."""
+    with _status_lock:
+        future = _futures.get(user.pk)
+    if future is not None:
+        future.result(timeout=timeout)
@@ -0,0 +1,316 @@
+import datetime
+import decimal
+import gzip
+import json
+import uuid
+
+from django.conf import settings
+from django.db.models.query import QuerySet
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from .lazy import LazyModule, is_loaded
+from .memprofile import stage
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+try:
+    import orjson
+except ImportError:  # Optional: falls back to the stdlib encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Optional: falls back to gzip only
+    brotli = None
+
+
+DEFAULT_RENDERER_OPTIONS = {
+    'COMPRESS_MIN_SIZE': 1024,  # Bytes; smaller bodies are sent as-is
+    'GZIP_LEVEL': 6,
+    'BROTLI_QUALITY': 5,
+    'USE_ORJSON': True,
+}
+
+
+def renderer_options():
+    """Reads the FAST_JSON_RENDERER block from REST_FRAMEWORK settings, filling defaults."""
+    configured = getattr(settings, 'REST_FRAMEWORK', {}).get('FAST_JSON_RENDERER', {})
+    return {**DEFAULT_RENDERER_OPTIONS, **configured}
+
+
+def _iso_dates(col):
+    """
+    ISO-formats a date-like column the way DRF's encoder would (date.isoformat(), or the datetime
+    isoformat with a 'Z' suffix for UTC). Dates repeat heavily in transaction data, so only the
+    distinct values are formatted and the result is gathered by code.
+    """
+    codes, uniques = pd.factorize(col)
+    lookup = np.array([_default(value) for value in uniques] + [None], dtype=object)
+    return pd.Series(lookup[codes], index=col.index)
+
+
+def _prepare_frame(df):
+    """
+    Makes a DataFrame safe for pandas' C JSON writer, without touching numeric columns.
+    Decimal columns become floats and date/datetime columns become ISO strings (the same
+    representation DRF's encoder uses), everything else is passed through.
+    """
+    prepared = {}
+    for name in df.columns:
+        col = df[name]
+        if pd.api.types.is_datetime64_any_dtype(col):
+            col = _iso_dates(col)
+        elif col.dtype == object:
+            sample = col.dropna().head(1)
+            if not sample.empty:
+                first = sample.iloc[0]
+                if isinstance(first, decimal.Decimal):
+                    col = pd.to_numeric(col, errors='coerce')
+                elif isinstance(first, (datetime.date, datetime.time)):
+                    col = _iso_dates(col)
+        prepared[name] = col
+    return pd.DataFrame(prepared, index=df.index)
+
+
+class FramePayload:
+    """
+    Base class for response values that are still held as DataFrames.
+    FastJSONRenderer writes them straight from the columns via pandas' C encoder instead of
+    building one dict per row. `tolist()` keeps them serializable by DRF's stock JSONEncoder.
+    """
+
+    def to_json(self):
+        raise NotImplementedError
+
+    def to_python(self):
+        raise NotImplementedError
+
+    def tolist(self):
+        return self.to_python()
+
+
+class FrameRecords(FramePayload):
+    """A DataFrame that should be rendered as a list of row objects (orient='records')."""
+
+    def __init__(self, df, columns=None):
+        self.df = df if columns is None else df[list(columns)]
+
+    def __len__(self):
+        return len(self.df)
+
+    def to_json(self):
+        if self.df.empty:
+            return '[]'
+        return _prepare_frame(self.df).to_json(orient='records', force_ascii=False)
+
+    def to_python(self):
+        return self.df.to_dict('records')
+
+
+class GroupedFrameRecords(FramePayload):
+    """
+    A DataFrame rendered as {group key: [row objects]}, e.g. per-customer payment logs.
+    Rows are encoded once as JSON lines and sliced per group, so the cost is one sort plus one
+    encoder pass, not one filter per group.
+    """
+
+    def __init__(self, df, by, columns, sort_by=None):
+        self.df = df
+        self.by = by
+        self.columns = list(columns)
+        self.sort_by = sort_by
+
+    def _sorted(self):
+        order = [self.by] + ([self.sort_by] if self.sort_by else [])
+        return self.df.sort_values(order, kind='stable')
+
+    def to_json(self):
+        if self.df.empty:
+            return '{}'
+        ordered = self._sorted()
+        lines = _prepare_frame(ordered[self.columns]).to_json(
+            orient='records', lines=True, force_ascii=False
+        ).splitlines()
+        keys = ordered[self.by].to_numpy()
+        boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(keys)]))
+        parts = [
+            f'{json.dumps(str(keys[start]), ensure_ascii=False)}:[{",".join(lines[start:end])}]'
+            for start, end in zip(starts, ends)
+        ]
+        return '{' + ','.join(parts) + '}'
+
+    def to_python(self):
+        ordered = self._sorted()
+        return {
+            key: group[self.columns].to_dict('records')
+            for key, group in ordered.groupby(self.by, sort=False)
+        }
+
+
+def _default(obj):
+    """Fallback conversions matching rest_framework.utils.encoders.JSONEncoder, plus NumPy."""
+    # NumPy/pandas objects can't exist before those modules are imported; don't import them to check
+    if is_loaded(np) and isinstance(obj, np.generic):
+        return obj.item()
+    if is_loaded(np) and isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, datetime.datetime):
+        representation = obj.isoformat()
+        if representation.endswith('+00:00'):
+            representation = representation[:-6] + 'Z'
+        return representation
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, QuerySet):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if is_loaded(pd) and isinstance(obj, (pd.Series, pd.Index)):
+        return obj.tolist()
+    if is_loaded(pd) and isinstance(obj, pd.DataFrame):
+        return obj.to_dict('records')
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if hasattr(obj, '__iter__'):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class RenderedJSON(FramePayload):
+    """A FramePayload already encoded to JSON; cached payloads keep this instead of the DataFrame."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def to_json(self):
+        return self.text
+
+    def to_python(self):
+        return json.loads(self.text)
+
+
+def rendered(payload):
+    """The payload with each FramePayload in it (in dicts and lists) replaced by its RenderedJSON."""
+    if isinstance(payload, RenderedJSON):
+        return payload
+    if isinstance(payload, FramePayload):
+        return RenderedJSON(payload.to_json())
+    if isinstance(payload, dict):
+        return {key: rendered(value) for key, value in payload.items()}
+    if isinstance(payload, list):
+        return [rendered(value) for value in payload]
+    return payload
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Drop-in replacement for DRF's JSONRenderer tuned for large analytics payloads.
+
+    * NumPy scalars/arrays, Decimal and date values are encoded natively (orjson when installed).
+    * FramePayload values are emitted directly from DataFrame columns.
+    * Bodies above COMPRESS_MIN_SIZE are brotli/gzip compressed when the client accepts it.
+
+    Enable it through REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] and tune it with
+    REST_FRAMEWORK['FAST_JSON_RENDERER'] (see DEFAULT_RENDERER_OPTIONS).
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            # Pretty-printing is only used by the browsable API; keep DRF's exact formatting.
+            return super().render(data, accepted_media_type, renderer_context)
+
+        options = renderer_options()
+        with stage('serialize'):
+            body = self.encode(data, use_orjson=options['USE_ORJSON'])
+        with stage('compress'):
+            return self.compress(body, renderer_context, options)
+
+    def encode(self, data, use_orjson=True):
+        frames = {}
+
+        def default(obj):
+            if isinstance(obj, FramePayload):
+                marker = f'\x00frame-{len(frames)}\x00'
+                frames[marker] = obj
+                return marker
+            return _default(obj)
+
+        if use_orjson and orjson is not None:
+            body = orjson.dumps(
+                data,
+                default=default,
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z,
+            ).decode('utf-8')
+        else:
+            body = json.dumps(
+                data,
+                default=default,
+                ensure_ascii=self.ensure_ascii,
+                allow_nan=not self.strict,
+                separators=(',', ':'),
+            )
+
+        # Splice the column-encoded frames in place of their markers.
+        for marker, frame in frames.items():
+            body = body.replace(json.dumps(marker), frame.to_json(), 1)
+
+        # Same escaping DRF applies for embedding JSON in HTML <script> tags.
+        body = body.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        return body.encode('utf-8')
+
+    def compress(self, body, renderer_context, options):
+        request = renderer_context.get('request')
+        response = renderer_context.get('response')
+        if request is None or response is None or len(body) < options['COMPRESS_MIN_SIZE']:
+            return body
+        if getattr(response, 'accepted_renderer', None) is not self or response.has_header('Content-Encoding'):
+            # Rendered on behalf of another renderer (e.g. the browsable API page).
+            return body
+
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in accepted:
+            encoding, compressed = 'br', brotli.compress(body, quality=options['BROTLI_QUALITY'])
+        elif 'gzip' in accepted:
+            encoding, compressed = 'gzip', gzip.compress(body, compresslevel=options['GZIP_LEVEL'], mtime=0)
+        else:
+            return body
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(compressed) >= len(body):
+            return body
+        response['Content-Encoding'] = encoding
+        return compressed
+
+
+def accepted_encodings(header):
+    """Parses an Accept-Encoding header into the set of codings with a non-zero q-value."""
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(coding)
+    return accepted
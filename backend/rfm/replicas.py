@@ -0,0 +1,115 @@
+"""
+Read/write splitting for the heavy read-only endpoints.
+
+Views decorated with @read_from_replica (analysis, ranking, analytics, insights, chat) send their
+ORM reads to one of READ_REPLICAS, chosen round-robin per request. Writes, authentication, and the
+dataset version behind ETags always use the primary. After a user's own upload, their reads stay on
+the primary for REPLICA_PIN_SECONDS, so they never see a replica that hasn't caught up yet
+(read-your-writes).
+
+Replicas mirror 'default' only; users whose data lives in a tenant shard (rfm.sharding) read from
+their shard.
+"""
+import contextvars
+import functools
+import itertools
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .sharding import is_tenant_model
+
+DEFAULT_DB = 'default'
+
+# Alias serving the current request's reads; None means the primary.
+_read_alias = contextvars.ContextVar('rfm_replica_read_alias', default=None)
+_counter = itertools.count()
+_counter_lock = threading.Lock()
+
+# Must never be read stale: they decide ETags and which shard holds a user's data.
+PRIMARY_ONLY_MODELS = {('rfm', 'datasetversion'), ('rfm', 'tenantshard')}
+
+
+def read_replicas():
+    return list(getattr(settings, 'READ_REPLICAS', []))
+
+
+def next_replica():
+    """Round-robin over the configured replicas."""
+    replicas = read_replicas()
+    if not replicas:
+        return None
+    with _counter_lock:
+        index = next(_counter)
+    return replicas[index % len(replicas)]
+
+
+def recently_written(user):
+    """True if the user's dataset changed within REPLICA_PIN_SECONDS (read on the primary)."""
+    from .models import DatasetVersion
+    pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+    if pin_seconds <= 0:
+        return False
+    since = timezone.now() - timedelta(seconds=pin_seconds)
+    return DatasetVersion.objects.using(DEFAULT_DB).filter(user=user, updated_at__gte=since).exists()
+
+
+def current_read_alias():
+    return _read_alias.get()
+
+
+@contextmanager
+def replica_reads(user):
+    """Routes reads inside the block to a replica, unless the user is pinned to the primary."""
+    alias = None
+    if read_replicas() and user is not None and user.is_authenticated and not recently_written(user):
+        alias = next_replica()
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+def read_from_replica(view_method):
+    """Decorator for APIView handlers that only read: their queries go to a replica (see replica_reads)."""
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        with replica_reads(request.user):
+            return view_method(self, request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Sends reads to the request's replica while replica_reads() is active; everything else is left alone."""
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None:
+            return None
+        if (model._meta.app_label, model._meta.model_name) in PRIMARY_ONLY_MODELS:
+            return DEFAULT_DB
+        if is_tenant_model(model):
+            # Transaction.objects.for_user() picks the replica itself, only for users on 'default'
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db not in (None, DEFAULT_DB, alias):
+            # Related objects of a row read from a tenant shard
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Rows read from a replica relate to the same rows on the primary
+        dbs = {obj1._state.db, obj2._state.db}
+        if dbs <= {DEFAULT_DB, *read_replicas()}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
@@ -1,8 +1,53 @@
-import pandas as pd
+import re
 from django.utils import timezone
+from .lazy import LazyModule
+from .memprofile import stage
 from .models import Transaction
-from django.db.models import Max, Count, Sum
-from datetime import date
+from .partitioned import customer_aggregates, start_partitioned_aggregation
+from .segment_rules import segmenter_for
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+# Segment per combined R and F score (regex); later patterns override earlier ones.
+# This is a common segmentation approach, can be customized
+SEGMENT_MAP = {
+    r'[1-2][1-2]': 'Hibernating',
+    r'[1-2][3-4]': 'Least Thrift Shopper',
+    r'[1-2]5': 'Cannot Lose Them',
+    r'3[1-2]': 'About To Sleep',
+    r'33': 'Need Attention',
+    r'[3-4][4-5]': 'Super Loyal Customers',
+    r'41': 'Promising',
+    r'51': 'New Customers',
+    r'[4-5][2-3]': 'Potential Loyalists',
+    r'5[4-5]': 'Super Loyal Customers' # Combined 54 and 55
+}
+
+
+def segment_for(r_score, f_score):
+    """The segment calculate_rfm assigns to one customer's R and F scores."""
+    rf_score = f'{r_score}{f_score}'
+    segment = 'Other'
+    for pattern, name in SEGMENT_MAP.items():
+        if re.match(pattern, rf_score):
+            segment = name
+    return segment
+
+
+_segment_table = None
+
+
+def builtin_segments(r_scores, f_scores):
+    """SEGMENT_MAP segments for arrays of R and F scores, through a lookup table of segment_for."""
+    global _segment_table
+    if _segment_table is None:
+        table = np.full((6, 6), 'Other', dtype=object)
+        for r in range(1, 6):
+            for f in range(1, 6):
+                table[r, f] = segment_for(r, f)
+        _segment_table = table
+    return _segment_table[np.asarray(r_scores, dtype=np.intp), np.asarray(f_scores, dtype=np.intp)]
 
 def calculate_rfm(user):
     """
@@ -16,33 +61,51 @@ def calculate_rfm(user):
         customer_id, recency, frequency, monetary,
         r_score, f_score, m_score, rfm_score, segment
         Returns None if the user has no transactions.
+        Segments follow the user's own rules (rfm.segment_rules) when they saved some.
     """
-    transactions = Transaction.objects.filter(user=user)
+    transactions = Transaction.objects.for_user(user)
     if not transactions.exists():
         return None
 
+    # Tenants over PARTITIONED_AGGREGATION_MIN_ROWS are reduced per customer range in worker processes
+    partitioned = start_partitioned_aggregation(user)
+    if partitioned is not None:
+        with stage('partitions'):
+            customers = partitioned.result()
+        with stage('rfm_scores'):
+            return score_customers(customers, segmenter=segmenter_for(user))
+
     # Convert transactions QuerySet to DataFrame, include city for ranking
-    df = pd.DataFrame.from_records(
-        transactions.values('customer_id', 'purchase_date', 'amount', 'city')
-    )
-    # Convert amount to numeric if it's not already (it should be Decimal)
-    df['amount'] = pd.to_numeric(df['amount'])
-    # Ensure purchase_date is parsed as datetime before using .dt accessor
-    df['purchase_date'] = pd.to_datetime(df['purchase_date'], errors='coerce')
-    df = df.dropna(subset=['purchase_date'])
-    # Do NOT convert to .dt.date here, keep as datetime for .dt operations later
-    # df['purchase_date'] = df['purchase_date'].dt.date
+    with stage('dataframe'):
+        df = pd.DataFrame.from_records(
+            transactions.values('customer_id', 'purchase_date', 'amount', 'city', 'loyalty_points')
+        )
+    with stage('rfm_scores'):
+        return rfm_from_transactions(df, segmenter=segmenter_for(user))
+
+def rfm_from_transactions(df, segmenter=None):
+    """
+    Computes the RFM table from an already loaded transactions DataFrame.
+
+    Args:
+        df: DataFrame with at least customer_id, purchase_date and amount columns
+            (loyalty_points is summed per customer when present).
+        segmenter: compiled custom rules (rfm.segment_rules.CompiledRules); None for SEGMENT_MAP.
 
+    Returns:
+        The same DataFrame shape as calculate_rfm.
+    """
+    return score_customers(customer_aggregates(df), segmenter=segmenter)
+
+def score_customers(customers, segmenter=None):
+    """
+    RFM scores and segments from per-customer aggregates (rfm.partitioned.customer_aggregates,
+    sorted by customer_id). Returns the same DataFrame shape as calculate_rfm.
+    """
     # --- Calculate Recency, Frequency, Monetary ---
     # Use a consistent snapshot date for calculations (today)
     snapshot_date = pd.Timestamp(timezone.now().date())
-
-    # Aggregate data per customer
-    rfm_df = df.groupby('customer_id').agg(
-        last_purchase_date=pd.NamedAgg(column='purchase_date', aggfunc='max'),
-        frequency=pd.NamedAgg(column='purchase_date', aggfunc='nunique'), # Count unique purchase days
-        monetary=pd.NamedAgg(column='amount', aggfunc='sum')
-    ).reset_index()
+    rfm_df = customers.drop(columns=['order_count'])
 
     # Calculate Recency (days since last purchase)
     # Ensure last_purchase_date is datetime
@@ -77,38 +140,12 @@ def calculate_rfm(user):
     rfm_df['rfm_score'] = rfm_df['r_score'].astype(str) + rfm_df['f_score'].astype(str) + rfm_df['m_score'].astype(str)
 
     # --- Define Segmentation Logic ---
-    # This is a common segmentation approach, can be customized
-    segment_map = {
-        r'[1-2][1-2]': 'Hibernating',
-        r'[1-2][3-4]': 'Least Thrift Shopper',
-        r'[1-2]5': 'Cannot Lose Them',
-        r'3[1-2]': 'About To Sleep',
-        r'33': 'Need Attention',
-        r'[3-4][4-5]': 'Super Loyal Customers',
-        r'41': 'Promising',
-        r'51': 'New Customers',
-        r'[4-5][2-3]': 'Potential Loyalists',
-        r'5[4-5]': 'Super Loyal Customers' # Combined 54 and 55
-    }
-
-    # Apply segmentation using regex matching on the combined R and F scores
-    # More robust than exact RFM score matching
-    rfm_df['segment'] = 'Other' # Default segment
-    rfm_df['rf_score'] = rfm_df['r_score'].astype(str) + rfm_df['f_score'].astype(str)
-
-    for pattern, segment in segment_map.items():
-         # Use regex=True for pattern matching
-        rfm_df.loc[rfm_df['rf_score'].str.match(pattern), 'segment'] = segment
-
-    # Drop the intermediate rf_score column
-    rfm_df = rfm_df.drop(columns=['rf_score'])
-
-    # If loyalty points are present in the transactions, sum them per customer and merge into rfm_df
-    if 'loyalty_points' in df.columns:
-        loyalty_points_df = df.groupby('customer_id')['loyalty_points'].sum().reset_index()
-        rfm_df = pd.merge(rfm_df, loyalty_points_df, on='customer_id', how='left')
-    else:
-        rfm_df['loyalty_points'] = 0
+    # SEGMENT_MAP applied to the combined R and F scores, as one lookup per customer
+    rfm_df['segment'] = builtin_segments(rfm_df['r_score'], rfm_df['f_score'])
+
+    if segmenter is not None:
+        # Custom rules replace SEGMENT_MAP; they may also bound raw values and loyalty points
+        rfm_df['segment'] = segmenter(rfm_df)
 
     # Reorder columns for clarity
     rfm_df = rfm_df[['customer_id', 'recency', 'frequency', 'monetary', 'r_score', 'f_score', 'm_score', 'rfm_score', 'segment', 'loyalty_points']]
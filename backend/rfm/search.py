@@ -0,0 +1,241 @@
+"""
+Customer search and per-customer detail, answered from the cached UserAggregates (rfm.aggregates).
+
+CustomerIndex is built once per dataset version: customer ids sorted for prefix lookups, trigram
+posting lists for substring and fuzzy matches, and customer positions per city. A query is a few
+binary searches and array intersections, so it stays in the milliseconds at tens of thousands of
+customers. RFMScorer gives one customer's RFM row without computing the whole table: the quantile
+edges and ranks that calculate_rfm derives are precomputed per version as well.
+"""
+from collections import defaultdict
+
+from .aggregates import get_user_aggregates
+from .lazy import LazyModule
+from .renderers import FrameRecords
+from .rfm_analysis import builtin_segments
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+MAX_LIMIT = 100
+QUANTILES = [0, 0.2, 0.4, 0.6, 0.8, 1]
+SIMILARITY_THRESHOLD = 0.3
+
+
+def trigrams(text):
+    """Distinct 3-character substrings of the text padded with one space each side ('ab' -> ' ab', 'ab ')."""
+    padded = f' {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CustomerIndex:
+    """Search structures over one dataset's customers (aggregates.customers)."""
+
+    def __init__(self, customers):
+        # Positions follow aggregates.customers, which is ordered by total paid: within a match
+        # tier, ascending positions are the customers' ranking
+        self.frame = customers.reset_index()
+        self.positions = {customer_id: i for i, customer_id in enumerate(self.frame['customer_id'])}
+        ids = self.frame['customer_id'].astype(str).str.lower().to_numpy()
+        self.ids = ids
+        self._by_id = np.argsort(ids, kind='stable')
+        self._sorted_ids = ids[self._by_id]
+
+        postings = defaultdict(list)
+        for position, customer_id in enumerate(ids):
+            for gram in trigrams(customer_id):
+                postings[gram].append(position)
+        self._postings = {gram: np.array(positions) for gram, positions in postings.items()}
+        self._gram_counts = np.array([len(trigrams(customer_id)) for customer_id in ids])
+
+        self._cities = {
+            city: group.to_numpy()
+            for city, group in self.frame.groupby(self.frame['city'].str.lower(), sort=False).groups.items()
+            if city
+        }
+
+    def _prefixed(self, query):
+        lo = np.searchsorted(self._sorted_ids, query, side='left')
+        hi = np.searchsorted(self._sorted_ids, query + '\U0010ffff', side='left')
+        return np.sort(self._by_id[lo:hi])
+
+    def _containing(self, query):
+        """Positions whose id contains the query (3+ characters): trigram intersection, then a check."""
+        grams = [gram for gram in trigrams(query) if ' ' not in gram] or [query[:3]]
+        postings = [self._postings.get(gram) for gram in grams]
+        if any(posting is None for posting in postings):
+            return np.array([], dtype=int)
+        candidates = postings[0]
+        for posting in postings[1:]:
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        return np.array([position for position in candidates if query in self.ids[position]], dtype=int)
+
+    def _similar(self, query):
+        """(positions, scores) of ids sharing at least SIMILARITY_THRESHOLD of their trigrams with the query."""
+        grams = trigrams(query)
+        hits = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not hits:
+            return np.array([], dtype=int), np.array([])
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.ids))
+        scores = shared / (len(grams) + self._gram_counts - shared)
+        positions = np.flatnonzero(scores >= SIMILARITY_THRESHOLD)
+        order = np.lexsort((positions, -scores[positions]))
+        return positions[order], scores[positions][order]
+
+    def search(self, query, limit=20):
+        """
+        Ranked matches for the query (case-insensitive): exact id, id prefix, id substring, city,
+        each tier ordered by total paid; similar ids (typos) when none of those match.
+        Returns a list of dicts.
+        """
+        query = query.strip().lower()
+        tiers = []
+        prefixed = self._prefixed(query)
+        exact = prefixed[self.ids[prefixed] == query]
+        tiers += [('exact', exact), ('prefix', prefixed)]
+        if len(query) >= 3:
+            tiers.append(('contains', self._containing(query)))
+        city_positions = [positions for city, positions in self._cities.items() if city.startswith(query)]
+        if city_positions:
+            tiers.append(('city', np.sort(np.concatenate(city_positions))))
+
+        seen, picked = set(), []
+        for match, positions in tiers:
+            for position in positions:
+                if len(picked) >= limit:
+                    break
+                if position not in seen:
+                    seen.add(position)
+                    picked.append((int(position), match, None))
+        if not picked and len(query) >= 3:
+            # Nothing matched as typed: suggest ids that look alike (typos)
+            positions, scores = self._similar(query)
+            for position, score in zip(positions, scores):
+                if len(picked) >= limit:
+                    break
+                if position not in seen:
+                    seen.add(position)
+                    picked.append((int(position), 'similar', round(float(score), 2)))
+        return [self.record(position, match=match, score=score) for position, match, score in picked]
+
+    def record(self, position, **extra):
+        row = self.frame.iloc[position]
+        return {
+            'customer_id': row['customer_id'],
+            'city': row['city'],
+            'total_paid': round(float(row['total_paid']), 2),
+            'loyalty_points': int(row['loyalty_points']),
+            'order_count': int(row['order_count']),
+            'first_purchase': row['first_purchase'].date(),
+            'last_purchase': row['last_purchase'].date(),
+            **{key: value for key, value in extra.items() if value is not None},
+        }
+
+
+def _qcut_bin(edges, value):
+    """
+    The bin pd.qcut(values, 5, labels=..., duplicates='drop') puts `value` in, given the quantile
+    edges of `values`; None where calculate_rfm's qcut fails (repeated edges) and falls back to 1.
+    """
+    if len(np.unique(edges)) != len(edges):
+        return None
+    return max(int(np.searchsorted(edges, value, side='left')) - 1, 0)
+
+
+class RFMScorer:
+    """
+    Scores single customers exactly as calculate_rfm scores the whole table: recency quantiles,
+    and quantiles of frequency and monetary ranks (ties broken in customer_id order), then the
+    user's segment rules (or the built-in segments).
+    """
+
+    def __init__(self, customers, today, segmenter=None):
+        self.segmenter = segmenter
+        # calculate_rfm groups by customer_id, which orders customers by id
+        by_id = customers.sort_index(kind='stable')
+        self._positions = {customer_id: i for i, customer_id in enumerate(by_id.index)}
+        self.recency = (pd.Timestamp(today) - by_id['last_purchase']).dt.days.to_numpy()
+        self.frequency = by_id['purchase_days'].to_numpy()
+        self.monetary = by_id['total_paid'].to_numpy()
+        self.loyalty_points = by_id['loyalty_points'].to_numpy()
+        n = len(by_id)
+        self._recency_edges = np.quantile(self.recency, QUANTILES)
+        self._rank_edges = np.quantile(np.arange(1, n + 1), QUANTILES)
+        self._frequency_rank = self._first_ranks(self.frequency)
+        self._monetary_rank = self._first_ranks(self.monetary)
+
+    @staticmethod
+    def _first_ranks(values):
+        """Series.rank(method='first'): 1-based, ties in order of appearance."""
+        ranks = np.empty(len(values))
+        ranks[np.argsort(values, kind='stable')] = np.arange(1, len(values) + 1)
+        return ranks
+
+    def score(self, customer_id):
+        """The customer's row in RFMScoreSerializer shape, or None for an unknown customer."""
+        i = self._positions.get(customer_id)
+        if i is None:
+            return None
+        r_bin = _qcut_bin(self._recency_edges, self.recency[i])
+        f_bin = _qcut_bin(self._rank_edges, self._frequency_rank[i])
+        m_bin = _qcut_bin(self._rank_edges, self._monetary_rank[i])
+        r_score = 1 if r_bin is None else 5 - r_bin
+        f_score = 1 if f_bin is None else f_bin + 1
+        m_score = 1 if m_bin is None else m_bin + 1
+        if self.segmenter is None:
+            segment = builtin_segments([r_score], [f_score])[0]
+        else:
+            segment = self.segmenter({
+                'r_score': [r_score], 'f_score': [f_score], 'm_score': [m_score], 'recency': [self.recency[i]],
+                'frequency': [self.frequency[i]], 'monetary': [self.monetary[i]], 'loyalty_points': [self.loyalty_points[i]],
+            })[0]
+        return {
+            'customer_id': customer_id,
+            'recency': int(self.recency[i]),
+            'frequency': int(self.frequency[i]),
+            'monetary': f'{self.monetary[i]:.2f}',
+            'r_score': r_score,
+            'f_score': f_score,
+            'm_score': m_score,
+            'rfm_score': f'{r_score}{f_score}{m_score}',
+            'segment': segment,
+        }
+
+
+def customer_index(aggregates):
+    index = aggregates.derived.get('customer_index')
+    if index is None:
+        index = aggregates.derived['customer_index'] = CustomerIndex(aggregates.customers)
+    return index
+
+
+def rfm_scorer(aggregates):
+    scorer = aggregates.derived.get('rfm_scorer')
+    if scorer is None:
+        scorer = aggregates.derived['rfm_scorer'] = RFMScorer(aggregates.customers, aggregates.built_on, aggregates.segmenter)
+    return scorer
+
+
+def search_customers(user, query, limit=20):
+    return customer_index(get_user_aggregates(user)).search(query, limit)
+
+
+def customer_detail(user, customer_id):
+    """
+    One customer's stats, RFM row and payment log (oldest first), or None when unknown.
+    The id is matched case-insensitively.
+    """
+    aggregates = get_user_aggregates(user)
+    customer_id = aggregates.find_customer_id(customer_id)
+    if customer_id is None:
+        return None
+    index = customer_index(aggregates)
+    history = aggregates.customer_history(customer_id)
+    payments = history[['purchase_date', 'amount', 'city', 'product_type', 'loyalty_points']].copy()
+    payments['purchase_date'] = payments['purchase_date'].dt.date
+    payments['amount'] = payments['amount'].round(2)
+    return {
+        'customer': index.record(index.positions[customer_id]),
+        'rfm': rfm_scorer(aggregates).score(customer_id),
+        'payments': FrameRecords(payments),
+    }
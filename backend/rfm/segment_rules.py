@@ -0,0 +1,214 @@
+"""
+User-defined RFM segmentation: a user's SegmentRuleSet replaces the built-in SEGMENT_MAP.
+
+A rule names a segment and bounds any of the R/F/M scores (1-5) and the raw recency, frequency,
+monetary and loyalty_points values:
+
+    {"segment": "Champions", "r_score": {"min": 4}, "monetary": {"min": 500}}
+
+Bounds are inclusive and either end may be left out. Rules are tried in list order and the first
+match wins; customers no rule matches get the rule set's default segment.
+
+Rule sets are validated when saved and compiled once into a vectorized evaluator: a 5x5x5 lookup
+table when every rule only bounds scores (one gather per customer, like the built-in map), NumPy
+masks otherwise. Compiled rule sets are cached per process and reused until the user saves new
+rules, so a custom segmentation costs about what the built-in one does.
+"""
+import threading
+from collections import OrderedDict
+from numbers import Real
+
+from django.db import transaction as db_transaction
+
+from .lazy import LazyModule
+from .models import CohortRollup, DailyRollup, Leaderboard, SegmentRuleSet
+from .versioning import bump_dataset_version, get_dataset_version
+
+np = LazyModule('numpy')
+
+SCORE_FIELDS = ('r_score', 'f_score', 'm_score')
+VALUE_FIELDS = ('recency', 'frequency', 'monetary', 'loyalty_points')
+FIELDS = SCORE_FIELDS + VALUE_FIELDS
+MAX_RULES = 100
+MAX_SEGMENT_LENGTH = 50  # SegmentRuleSet.default_segment's max_length
+MAX_COMPILED = 256  # compiled rule sets kept per process
+
+
+class SegmentRuleError(ValueError):
+    """Raised for a rule set that cannot be saved; the message says which rule and why."""
+
+
+def _segment_name(value, where):
+    if not isinstance(value, str) or not value.strip():
+        raise SegmentRuleError(f'{where}: a segment name is required.')
+    value = value.strip()
+    if len(value) > MAX_SEGMENT_LENGTH:
+        raise SegmentRuleError(f'{where}: segment names are at most {MAX_SEGMENT_LENGTH} characters.')
+    return value
+
+
+def _bound(value, field, where):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, Real):
+        raise SegmentRuleError(f'{where}: {field} bounds must be numbers.')
+    if field in SCORE_FIELDS and (value != int(value) or not 1 <= value <= 5):
+        raise SegmentRuleError(f'{where}: {field} bounds must be whole scores from 1 to 5.')
+    return value
+
+
+def validate_rule_set(data):
+    """
+    Checks a rule set as sent by a client ({'rules': [...], 'default_segment': ...}) and returns
+    it normalized: names stripped, every condition as {'min': ..., 'max': ...}. Raises SegmentRuleError.
+    """
+    if not isinstance(data, dict):
+        raise SegmentRuleError('Expected an object with a "rules" list.')
+    rules = data.get('rules')
+    if not isinstance(rules, list):
+        raise SegmentRuleError('"rules" must be a list.')
+    if len(rules) > MAX_RULES:
+        raise SegmentRuleError(f'At most {MAX_RULES} rules are allowed.')
+    default_segment = _segment_name(data.get('default_segment', 'Other'), 'default_segment')
+
+    normalized = []
+    for number, rule in enumerate(rules, start=1):
+        where = f'Rule {number}'
+        if not isinstance(rule, dict):
+            raise SegmentRuleError(f'{where}: expected an object.')
+        unknown = sorted(set(rule) - set(FIELDS) - {'segment'})
+        if unknown:
+            raise SegmentRuleError(f'{where}: unknown fields {", ".join(unknown)}. Conditions can use {", ".join(FIELDS)}.')
+        out = {'segment': _segment_name(rule.get('segment'), where)}
+        for field in FIELDS:
+            if field not in rule:
+                continue
+            condition = rule[field]
+            if not isinstance(condition, dict) or set(condition) - {'min', 'max'}:
+                raise SegmentRuleError(f'{where}: {field} must be an object with "min" and/or "max".')
+            low, high = _bound(condition.get('min'), field, where), _bound(condition.get('max'), field, where)
+            if low is not None and high is not None and low > high:
+                raise SegmentRuleError(f'{where}: {field} min is greater than max.')
+            if low is not None or high is not None:
+                out[field] = {'min': low, 'max': high}
+        normalized.append(out)
+    return {'rules': normalized, 'default_segment': default_segment}
+
+
+class CompiledRules:
+    """
+    A validated rule set ready to segment a whole RFM table. Call it with anything indexable by
+    column name (a DataFrame, a dict of arrays) to get an object array of segment names.
+    """
+
+    def __init__(self, rules, default_segment='Other'):
+        self.names = list(dict.fromkeys([rule['segment'] for rule in rules] + [default_segment]))
+        self._labels = np.array(self.names, dtype=object)
+        codes = {name: code for code, name in enumerate(self.names)}
+        self._default = codes[default_segment]
+        # (segment code, [(field, min, max)]) in priority order
+        self._rules = [
+            (codes[rule['segment']], [(field, rule[field].get('min'), rule[field].get('max')) for field in FIELDS if field in rule])
+            for rule in rules
+        ]
+        self.score_only = all(field in SCORE_FIELDS for _, conditions in self._rules for field, _, _ in conditions)
+        self.table = self._score_table() if self.score_only else None
+
+    def _score_table(self):
+        """Segment code per (r, f, m) score, 1-based (index 0 unused), from the rules in priority order."""
+        grid = np.indices((6, 6, 6)).reshape(3, -1)
+        codes = self._evaluate(dict(zip(SCORE_FIELDS, grid)), len(grid[0]))
+        return codes.reshape(6, 6, 6)
+
+    def _evaluate(self, columns, n):
+        codes = np.full(n, self._default, dtype=np.int32)
+        unassigned = np.ones(n, dtype=bool)
+        for code, conditions in self._rules:
+            mask = unassigned.copy()
+            for field, low, high in conditions:
+                values = columns[field]
+                if low is not None:
+                    mask &= values >= low
+                if high is not None:
+                    mask &= values <= high
+            codes[mask] = code
+            unassigned &= ~mask
+            if not unassigned.any():
+                break
+        return codes
+
+    def codes(self, frame):
+        if self.table is not None:
+            return self.table[tuple(np.asarray(frame[field], dtype=np.intp) for field in SCORE_FIELDS)]
+        columns = {field: np.asarray(frame[field], dtype=float) for field in FIELDS}
+        return self._evaluate(columns, len(columns['r_score']))
+
+    def __call__(self, frame):
+        return self._labels[self.codes(frame)]
+
+
+_compiled = OrderedDict()  # user pk -> (rule set updated_at, CompiledRules)
+_compiled_lock = threading.Lock()
+
+
+def segmenter_for(user):
+    """
+    The user's compiled rules, or None when they use the built-in segments. Costs one indexed
+    lookup while the rule set is unchanged; it is only read and compiled again after a save.
+    """
+    stamp = SegmentRuleSet.objects.filter(user=user).values_list('updated_at', flat=True).first()
+    if stamp is None:
+        return None
+    with _compiled_lock:
+        cached = _compiled.get(user.pk)
+        if cached is not None and cached[0] == stamp:
+            _compiled.move_to_end(user.pk)
+            return cached[1]
+
+    rule_set = SegmentRuleSet.objects.filter(user=user).values('rules', 'default_segment', 'updated_at').first()
+    if rule_set is None:
+        return None
+    compiled = CompiledRules(rule_set['rules'], rule_set['default_segment'])
+    with _compiled_lock:
+        _compiled[user.pk] = (rule_set['updated_at'], compiled)
+        _compiled.move_to_end(user.pk)
+        while len(_compiled) > MAX_COMPILED:
+            _compiled.popitem(last=False)
+    return compiled
+
+
+def _dataset_changed(user):
+    """
+    Bumps the dataset version so ETags and cached RFM results pick up the new segments. The
+    leaderboards and rollups don't depend on segments, so they are re-stamped instead of rebuilt.
+    """
+    previous = get_dataset_version(user)
+    version = bump_dataset_version(user)
+    Leaderboard.objects.filter(user=user, dataset_version=previous).update(dataset_version=version)
+    CohortRollup.objects.filter(user=user, dataset_version=previous).update(dataset_version=version)
+    DailyRollup.objects.filter(user=user, dataset_version=previous).update(dataset_version=version)
+    return version
+
+
+def save_rule_set(user, data):
+    """Validates and stores the user's rules (replacing any previous set). Returns the normalized set."""
+    rule_set = validate_rule_set(data)
+    CompiledRules(rule_set['rules'], rule_set['default_segment'])  # fail before saving if it can't compile
+    with db_transaction.atomic():
+        SegmentRuleSet.objects.update_or_create(user=user, defaults=rule_set)
+        _dataset_changed(user)
+    return rule_set
+
+
+def delete_rule_set(user):
+    """Reverts the user to the built-in segments. Returns False if they had no rules."""
+    with db_transaction.atomic():
+        deleted, _ = SegmentRuleSet.objects.filter(user=user).delete()
+        if deleted:
+            _dataset_changed(user)
+    return bool(deleted)
+
+
+def clear_compiled_rules():
+    with _compiled_lock:
+        _compiled.clear()
@@ -0,0 +1,179 @@
+"""
+Per-tenant shards for the bulky per-user tables (Transaction, UploadedFile).
+
+With TENANT_SHARDS set (database aliases, see settings.py), each user's rows live in one shard, so a
+large upload only write-locks that tenant's SQLite file (or PostgreSQL schema) instead of the whole
+database. Users, tokens, dataset versions and leaderboards stay on 'default'.
+
+A user is assigned to a shard on their first upload, deterministically (hash of the user id over the
+configured shards), and the assignment is recorded in TenantShard so changing the shard list later
+doesn't strand data; `manage.py rebalance_tenants` moves tenants between shards. Users without an
+assignment are read from 'default', which is where data uploaded before sharding was enabled lives.
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+
+TENANT_ALIAS_PREFIX = 'tenant_'
+TENANT_MODELS = {('rfm', 'transaction'), ('rfm', 'uploadedfile')}
+DEFAULT_DB = 'default'
+
+
+def tenant_shards():
+    """Aliases new tenants are spread over; empty means sharding is off."""
+    return list(getattr(settings, 'TENANT_SHARDS', []))
+
+
+def is_tenant_alias(alias):
+    return alias.startswith(TENANT_ALIAS_PREFIX)
+
+
+def is_tenant_model(model):
+    return (model._meta.app_label, model._meta.model_name) in TENANT_MODELS
+
+
+def hashed_shard(user_id, shards=None):
+    """
+    Deterministic shard for a user id. blake2b rather than hash() (salted per process) or crc32
+    (whose low bits cluster for sequential ids).
+    """
+    shards = tenant_shards() if shards is None else shards
+    if not shards:
+        return DEFAULT_DB
+    digest = hashlib.blake2b(str(user_id).encode(), digest_size=8).digest()
+    return shards[int.from_bytes(digest, 'big') % len(shards)]
+
+
+def shard_for_user_id(user_id):
+    """The alias holding a user's tenant rows: their recorded shard, else 'default'."""
+    if not tenant_shards():
+        return DEFAULT_DB
+    from .models import TenantShard
+    alias = TenantShard.objects.using(DEFAULT_DB).filter(user_id=user_id).values_list('alias', flat=True).first()
+    return alias or DEFAULT_DB
+
+
+def shard_for_user(user):
+    """shard_for_user_id, memoized on the user instance (one lookup per request)."""
+    shards = tuple(tenant_shards())
+    cached = getattr(user, '_tenant_shard', None)
+    if cached is not None and cached[0] == shards:
+        return cached[1]
+    alias = shard_for_user_id(user.pk)
+    user._tenant_shard = (shards, alias)
+    return alias
+
+
+def assign_shard(user):
+    """
+    Called before a user's first write: records the hashed shard for users that have no data
+    anywhere yet. Users with data keep their current location (move them with move_tenant).
+    """
+    if not tenant_shards():
+        return DEFAULT_DB
+    from .models import TenantShard, Transaction, UploadedFile
+    current = shard_for_user(user)
+    if current != DEFAULT_DB or TenantShard.objects.filter(user=user).exists():
+        return current
+    has_data = (
+        Transaction.objects.using(DEFAULT_DB).filter(user=user).exists()
+        or UploadedFile.objects.using(DEFAULT_DB).filter(user=user).exists()
+    )
+    if has_data:
+        return DEFAULT_DB
+    alias = hashed_shard(user.pk)
+    TenantShard.objects.update_or_create(user=user, defaults={'alias': alias})
+    user._tenant_shard = (tuple(tenant_shards()), alias)
+    return alias
+
+
+def move_tenant(user, target, batch_size=5000):
+    """
+    Copies a user's tenant rows to `target`, deletes them from their current shard and records the
+    new assignment. The copy commits before the source is cleared, so a failure leaves the data
+    readable where it was. Returns the number of rows moved per model.
+    """
+    from .models import TenantShard, Transaction, UploadedFile
+    source = shard_for_user(user)
+    moved = {}
+    if source == target:
+        return moved
+    with db_transaction.atomic(using=target):
+        for model in (Transaction, UploadedFile):
+            rows = model.objects.using(source).filter(user=user).order_by('pk')
+            model.objects.using(target).filter(user=user).delete()  # leftovers of an interrupted move
+            batch, count = [], 0
+            for row in rows.iterator(chunk_size=batch_size):
+                # Each shard has its own id sequence; the target assigns new ids
+                row.pk = None
+                row._state.adding, row._state.db = True, target
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    model.objects.using(target).bulk_create(batch)
+                    count, batch = count + len(batch), []
+            if batch:
+                model.objects.using(target).bulk_create(batch)
+                count += len(batch)
+            moved[model._meta.model_name] = count
+    TenantShard.objects.update_or_create(user=user, defaults={'alias': target})
+    user._tenant_shard = (tuple(tenant_shards()), target)
+    with db_transaction.atomic(using=source):
+        for model in (Transaction, UploadedFile):
+            model.objects.using(source).filter(user=user).delete()
+    return moved
+
+
+def delete_tenant_rows(sender, instance, using, **kwargs):
+    """pre_delete(User): the ORM cascade only reaches rows on the user's own database."""
+    alias = shard_for_user(instance)
+    if alias != using:
+        from .models import Transaction, UploadedFile
+        for model in (Transaction, UploadedFile):
+            model.objects.using(alias).filter(user=instance).delete()
+
+
+class TenantRouter:
+    """
+    Routes Transaction and UploadedFile to the owning user's shard when Django can tell who the
+    owner is (saving an instance, or following user.transactions). Queries built from
+    Transaction.objects.for_user(user) carry the alias explicitly. Shard aliases only get the
+    tenant tables; everything else is migrated on 'default' alone.
+    """
+
+    def _tenant_db(self, model, hints):
+        instance = hints.get('instance')
+        if not tenant_shards() or instance is None:
+            return None
+        if not is_tenant_model(model):
+            # e.g. transaction.user: the user is on 'default', not on the row's shard
+            return DEFAULT_DB if is_tenant_model(type(instance)) else None
+        if is_tenant_model(type(instance)):
+            user = instance._state.fields_cache.get('user')
+            return shard_for_user(user) if user is not None else shard_for_user_id(instance.user_id)
+        if instance._meta.label_lower == settings.AUTH_USER_MODEL.lower():
+            return shard_for_user(instance)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._tenant_db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._tenant_db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A tenant row's user lives on 'default' while the row itself may be in a shard
+        if is_tenant_model(type(obj1)) or is_tenant_model(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if is_tenant_alias(db):
+            return model_name is not None and (app_label, model_name) in TENANT_MODELS
+        return None
+
+
+def tenant_databases():
+    """Every alias that can hold tenant rows ('default' for unassigned users, plus all shards)."""
+    return [DEFAULT_DB] + [alias for alias in settings.DATABASES if is_tenant_alias(alias)]
+
@@ -0,0 +1,291 @@
+"""
+Single-flight: identical expensive computations requested at the same time run once.
+
+When a tenant's team opens the dashboard together, or the frontend fires its requests twice on
+mount, every request would compute the same RFM table or panel concurrently. Callers name a
+computation with a key (user, dataset stamp, parameters): the first caller computes it, and the
+others wait for that flight and share its result, or its exception.
+
+SINGLE_FLIGHT_BACKEND is SingleFlight (threads of this process) or FileLockFlights, which also
+coalesces across worker processes: the thread that computes a key in each process takes an
+exclusive file lock for it in SINGLE_FLIGHT_LOCK_DIR (fcntl, one lock file per key, so a flight
+nested in another and unrelated keys never wait for each other's locks). The process that gets the lock first computes, and if other processes were waiting it leaves the
+pickled result for them next to the lock. A process that doesn't find a result written since it
+started waiting (the computation failed, or nobody asked for it in time) computes it itself, still
+holding the lock. Nothing is kept once a flight has landed: caching stays with the callers
+(rfm.panels.cached). Waiters give up after SINGLE_FLIGHT_TIMEOUT seconds and compute on their own.
+
+Results are tenant data and are unpickled, so the directory must be private: it is only used when
+it is owned by this process's user with mode 0700 (otherwise flights are coalesced within each
+process only), and a result file is only unpickled when its HMAC (keyed with SECRET_KEY) matches.
+"""
+import contextlib
+import hashlib
+import hmac
+import os
+import pickle
+import stat
+import threading
+import time
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+from django.utils.module_loading import import_string
+
+try:
+    import fcntl
+except ImportError:  # Windows: flights are coalesced within each process only
+    fcntl = None
+
+RESULT_SECONDS = 60  # results, and the lock files of keys nobody holds, are swept after this
+POLL_SECONDS = 0.02
+SIGNATURE_BYTES = 32  # HMAC-SHA256 in front of each pickled result
+
+
+def wait_timeout():
+    return float(getattr(settings, 'SINGLE_FLIGHT_TIMEOUT', 120))
+
+
+def _signature(payload):
+    return salted_hmac('rfm.singleflight', payload, algorithm='sha256').digest()
+
+
+def _same_file(opened, path):
+    """Whether `path` still names the file open as `opened` (a swept lock file has been unlinked)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    opened_st = os.fstat(opened.fileno())
+    return (st.st_dev, st.st_ino) == (opened_st.st_dev, opened_st.st_ino)
+
+
+def _private(st):
+    """Whether an lstat result is owned by this process's user and closed to everyone else."""
+    return st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+class Flight:
+    """One computation in progress in this process."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces identical computations across the threads of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> Flight
+        self.stats = {'computed': 0, 'shared': 0}
+
+    def do(self, key, compute, retry=()):
+        """
+        compute(), or the result of the identical computation already in flight for `key`.
+        If the computing caller fails with one of the `retry` exceptions (its own request went
+        away), a waiting caller computes instead of failing with it.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leading = flight is None
+                if leading:
+                    flight = self._flights[key] = Flight()
+            if leading:
+                return self._lead(key, flight, compute)
+            if not flight.done.wait(wait_timeout()):
+                print(f"Single-flight wait for {key[:2]} timed out; computing it again")
+                return compute()
+            if isinstance(flight.error, retry):
+                continue
+            self._count('shared')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+    def _lead(self, key, flight, compute):
+        try:
+            flight.result = self.compute(key, compute)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def compute(self, key, compute):
+        self._count('computed')
+        return compute()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
+
+
+class FileLockFlights(SingleFlight):
+    """SingleFlight that also coalesces with the other processes sharing SINGLE_FLIGHT_LOCK_DIR."""
+
+    def __init__(self, directory=None):
+        super().__init__()
+        self.directory = str(directory or getattr(settings, 'SINGLE_FLIGHT_LOCK_DIR', ''))
+        self._warned = False
+        self._swept_at = 0.0
+
+    def compute(self, key, compute):
+        if fcntl is None or not self.directory or not self._directory_is_private():
+            return super().compute(key, compute)
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        result_path = os.path.join(self.directory, f'{digest}.result')
+        wanted_path = os.path.join(self.directory, f'{digest}.wanted')
+        lock_path = os.path.join(self.directory, f'{digest}.lock')
+        started = time.time()
+        try:
+            with self._acquire(lock_path, wanted_path) as lock_file:
+                if lock_file is None:
+                    print(f"Single-flight lock for {key[:2]} timed out; computing without it")
+                    return super().compute(key, compute)
+                try:
+                    found, value = self._read(result_path, started)
+                    if found:
+                        self._count('shared')
+                        return value
+                    value = super().compute(key, compute)
+                    if self._wanted_since(wanted_path, started):
+                        self._write(result_path, value)
+                    return value
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            self._sweep()
+
+    def _directory_is_private(self):
+        """Creates the directory if needed; False (with a warning, once) unless it is ours with mode 0700."""
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            st = os.lstat(self.directory)
+            private = stat.S_ISDIR(st.st_mode) and _private(st) and stat.S_IMODE(st.st_mode) == 0o700
+        except OSError:
+            private = False
+        if not private and not self._warned:
+            self._warned = True
+            print(f"SINGLE_FLIGHT_LOCK_DIR {self.directory} is not a directory owned by this user with mode 0700; "
+                  "coalescing within this process only")
+        return private
+
+    @contextlib.contextmanager
+    def _acquire(self, lock_path, wanted_path):
+        """
+        Yields the key's lock file, locked, marking the key as wanted when another process holds it;
+        None on timeout. A lock file the sweeper removed while we waited on it is opened again.
+        """
+        deadline = time.monotonic() + wait_timeout()
+        marked = False
+        while True:
+            with open(lock_path, 'a+b') as lock_file:
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if not marked:
+                            with open(wanted_path, 'ab'):
+                                os.utime(wanted_path)
+                            marked = True
+                        if time.monotonic() >= deadline:
+                            yield None
+                            return
+                        time.sleep(POLL_SECONDS)
+                if _same_file(lock_file, lock_path):
+                    yield lock_file
+                    return
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _wanted_since(self, wanted_path, started):
+        try:
+            return os.path.getmtime(wanted_path) >= started
+        except OSError:
+            return False
+
+    def _read(self, result_path, started):
+        """(True, result) when another process wrote the key's result, signed, after we started waiting."""
+        try:
+            st = os.lstat(result_path)
+            if not stat.S_ISREG(st.st_mode) or not _private(st) or st.st_mtime < started:
+                return False, None
+            with open(result_path, 'rb') as result_file:
+                content = result_file.read()
+            signature, payload = content[:SIGNATURE_BYTES], content[SIGNATURE_BYTES:]
+            if not hmac.compare_digest(signature, _signature(payload)):
+                print(f"Ignoring single-flight result {os.path.basename(result_path)}: bad signature")
+                return False, None
+            return True, pickle.loads(payload)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+
+    def _write(self, result_path, value):
+        temporary = f'{result_path}.{os.getpid()}.tmp'
+        try:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            with os.fdopen(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as result_file:
+                result_file.write(_signature(payload) + payload)
+            os.replace(temporary, result_path)
+        except Exception as e:  # e.g. an unpicklable result: the waiting processes compute it themselves
+            print(f"Could not share a single-flight result: {e}")
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def _sweep(self):
+        """Removes expired results and idle lock files, at most once every RESULT_SECONDS per process."""
+        now = time.time()
+        if now - self._swept_at < RESULT_SECONDS:
+            return
+        self._swept_at = now
+        expired = now - RESULT_SECONDS
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith(('.result', '.wanted', '.tmp')):
+                    if entry.stat().st_mtime < expired:
+                        os.remove(entry.path)
+                elif entry.name.endswith('.lock') and entry.stat().st_mtime < expired:
+                    self._remove_lock(entry.path)
+            except OSError:
+                pass  # another process swept it
+
+    def _remove_lock(self, lock_path):
+        """Removes a key's lock file unless a process holds it (see _acquire for the ones waiting on it)."""
+        with open(lock_path, 'a+b') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            if _same_file(lock_file, lock_path):
+                os.remove(lock_path)
+
+
+_flights = None
+_flights_lock = threading.Lock()
+
+
+def flights():
+    """The configured backend (settings.SINGLE_FLIGHT_BACKEND, a dotted path), one per process."""
+    global _flights
+    with _flights_lock:
+        if _flights is None:
+            _flights = import_string(getattr(settings, 'SINGLE_FLIGHT_BACKEND', 'rfm.singleflight.SingleFlight'))()
+        return _flights
+
+
+def coalesce(key, compute, retry=()):
+    """compute() through the single-flight backend, or directly when SINGLE_FLIGHT_ENABLED is off."""
+    if not getattr(settings, 'SINGLE_FLIGHT_ENABLED', True):
+        return compute()
+    return flights().do(key, compute, retry=retry)
@@ -0,0 +1,240 @@
+"""
+Spreadsheet readers for uploads: one sheet of an .xlsx or .xls file as DataFrame chunks for the
+validation pipeline (rfm.ingest.validate_upload), like CSV files.
+
+Rows are streamed without building the workbook's object model:
+  * calamine (python-calamine, Rust), when installed: .xlsx and .xls, several times faster;
+  * openpyxl in read-only mode for .xlsx: cells are parsed from the sheet XML as they are iterated;
+  * xlrd for .xls without calamine (legacy files are at most 65536 rows).
+openpyxl and xlrd are requirements; python-calamine is optional.
+UPLOAD_EXCEL_ENGINE picks one ('auto' by default: the first available in that order).
+
+Cells are converted as pandas.read_excel converts them (integral numbers to int, dates to
+datetimes, empty cells to NA), and blank rows are kept between data rows but not after the last
+one, so validation sees the same rows and values whichever engine read the file. The header is
+the first non-blank row.
+"""
+import importlib.util
+from datetime import date, datetime
+
+from django.conf import settings
+
+from .lazy import LazyModule
+
+pd = LazyModule('pandas')
+
+ENGINE_MODULES = {'calamine': 'python_calamine', 'openpyxl': 'openpyxl', 'xlrd': 'xlrd'}
+ENGINES_FOR = {'xlsx': ('calamine', 'openpyxl'), 'xls': ('calamine', 'xlrd')}
+
+
+class SpreadsheetError(Exception):
+    """The workbook or the requested sheet can't be read; the message is shown to the user."""
+
+
+def engine_available(engine):
+    return importlib.util.find_spec(ENGINE_MODULES[engine]) is not None
+
+
+def excel_engine(file_type):
+    """The engine reading this file type: UPLOAD_EXCEL_ENGINE if it can, else the first one installed."""
+    configured = getattr(settings, 'UPLOAD_EXCEL_ENGINE', 'auto')
+    candidates = ENGINES_FOR[file_type]
+    if configured in candidates:
+        candidates = (configured,) + tuple(engine for engine in candidates if engine != configured)
+    for engine in candidates:
+        if engine_available(engine):
+            return engine
+    if file_type == 'xls':
+        raise SpreadsheetError('Legacy .xls files cannot be read on this server. Please save the file as .xlsx or CSV.')
+    raise SpreadsheetError('Excel files cannot be read on this server. Please upload a CSV file.')
+
+
+def _number(value):
+    return int(value) if value.is_integer() else value
+
+
+class CalamineReader:
+    def __init__(self, file):
+        from python_calamine import CalamineWorkbook
+        self.workbook = CalamineWorkbook.from_filelike(file)
+
+    def sheet_names(self):
+        return list(self.workbook.sheet_names)
+
+    def rows(self, name):
+        for row in self.workbook.get_sheet_by_name(name).iter_rows():
+            yield [
+                None if value == '' else _number(value) if type(value) is float
+                else datetime(value.year, value.month, value.day) if type(value) is date else value
+                for value in row
+            ]
+
+    def close(self):
+        self.workbook.close()
+
+
+class OpenpyxlReader:
+    def __init__(self, file):
+        from openpyxl import load_workbook
+        self.workbook = load_workbook(file, read_only=True, data_only=True)
+
+    def sheet_names(self):
+        return self.workbook.sheetnames
+
+    def rows(self, name):
+        for row in self.workbook[name].iter_rows(values_only=True):
+            yield [_number(value) if type(value) is float else value for value in row]
+
+    def close(self):
+        self.workbook.close()
+
+
+class XlrdReader:
+    def __init__(self, file):
+        import xlrd
+        self.xlrd = xlrd
+        self.workbook = xlrd.open_workbook(file_contents=file.read(), on_demand=True)
+
+    def sheet_names(self):
+        return self.workbook.sheet_names()
+
+    def rows(self, name):
+        xlrd = self.xlrd
+        sheet = self.workbook.sheet_by_name(name)
+        empty = (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR)
+        for index in range(sheet.nrows):
+            row = []
+            for kind, value in zip(sheet.row_types(index), sheet.row_values(index)):
+                if kind in empty:
+                    value = None
+                elif kind == xlrd.XL_CELL_DATE:
+                    value = xlrd.xldate_as_datetime(value, self.workbook.datemode)
+                elif kind == xlrd.XL_CELL_NUMBER:
+                    value = _number(value)
+                elif kind == xlrd.XL_CELL_BOOLEAN:
+                    value = bool(value)
+                row.append(value)
+            yield row
+
+    def close(self):
+        self.workbook.release_resources()
+
+
+READERS = {'calamine': CalamineReader, 'openpyxl': OpenpyxlReader, 'xlrd': XlrdReader}
+
+
+def open_workbook(file, file_type, engine=None):
+    file.seek(0)
+    engine = engine or excel_engine(file_type)
+    try:
+        return READERS[engine](file)
+    except Exception as e:
+        raise SpreadsheetError(f'Could not read the spreadsheet: {e}')
+
+
+def resolve_sheet(names, requested=None):
+    """
+    The sheet to read: the first one by default, else `requested` by name (case-insensitive)
+    or by position (1 is the first sheet).
+    """
+    if not names:
+        raise SpreadsheetError('The workbook has no sheets.')
+    if requested in (None, ''):
+        return names[0]
+    requested = str(requested).strip()
+    for name in names:
+        if name == requested or name.lower() == requested.lower():
+            return name
+    if requested.isdigit() and 1 <= int(requested) <= len(names):
+        return names[int(requested) - 1]
+    raise SpreadsheetError(f"Sheet '{requested}' not found. Available sheets: {', '.join(names)}.")
+
+
+def _is_blank(row):
+    return all(value is None or (type(value) is str and not value.strip()) for value in row)
+
+
+def _data_rows(rows):
+    """The rows, without the blank ones at the end."""
+    blank = []
+    for row in rows:
+        if _is_blank(row):
+            blank.append(row)
+            continue
+        if blank:
+            yield from blank
+            blank = []
+        yield row
+
+
+def header_columns(row):
+    """Column names for the header row, named and de-duplicated like pandas does (Unnamed: 3, amount.1)."""
+    columns, seen = [], {}
+    for index, value in enumerate(row):
+        name = f'Unnamed: {index}' if value is None else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        columns.append(name)
+    while columns and row[len(columns) - 1] is None:  # trailing empty header cells
+        columns.pop()
+    return columns
+
+
+class Sheet:
+    """An open sheet: its header and the rows below it."""
+
+    def __init__(self, file, file_type, sheet=None, engine=None):
+        self.reader = open_workbook(file, file_type, engine)
+        self.sheet_names = self.reader.sheet_names()
+        try:
+            self.name = resolve_sheet(self.sheet_names, sheet)
+            rows = iter(self.reader.rows(self.name))
+            first = next((row for row in rows if not _is_blank(row)), None)
+            self._rows = _data_rows(rows)
+        except SpreadsheetError:
+            self.close()
+            raise
+        except Exception as e:
+            self.close()
+            raise SpreadsheetError(f'Could not read the spreadsheet: {e}')
+        if first is None:
+            self.close()
+            raise SpreadsheetError(f"The sheet '{self.name}' is empty.")
+        self.columns = header_columns(first)
+
+    def frames(self, chunk_size):
+        """The data rows as DataFrames of up to chunk_size rows (one empty frame when there are none)."""
+        width = len(self.columns)
+        chunk, emitted = [], False
+        for row in self._rows:
+            chunk.append(row[:width] if len(row) >= width else list(row) + [None] * (width - len(row)))
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame.from_records(chunk, columns=self.columns)
+                chunk, emitted = [], True
+        if chunk or not emitted:
+            yield pd.DataFrame.from_records(chunk, columns=self.columns)
+
+    def close(self):
+        self.reader.close()
+
+
+def read_header(file, file_type, sheet=None):
+    """(sheet name, header columns, all sheet names), reading only up to the header row."""
+    opened = Sheet(file, file_type, sheet)
+    try:
+        return opened.name, opened.columns, opened.sheet_names
+    finally:
+        opened.close()
+        file.seek(0)
+
+
+def iter_sheet_frames(file, file_type, sheet=None, chunk_size=50_000):
+    """Yields the sheet's rows as DataFrames of up to chunk_size rows, with the header row as columns."""
+    opened = Sheet(file, file_type, sheet)
+    try:
+        yield from opened.frames(chunk_size)
+    finally:
+        opened.close()
@@ -1,3 +1,1945 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+import zipfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+
+from django.conf import settings
+from django.core.cache import caches
+from django.contrib.auth.models import Permission, User
+from django.db import connection, connections, transaction as db_transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import LiveServerTestCase, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase
+
+from backend_project.databases import postgres_database, sqlite_database
+
+from . import ingest, leaderboards, panels, prewarm, singleflight, throttling
+from .async_views import gather_panels
+from .lazy import LazyModule, is_loaded
+from .loadtest import compare, summarize
+from .exports import parquet_available
+from .events import broker, stream
+from .admin import EstimatedCountPaginator, table_row_estimate
+from .aggregates import clear_user_aggregates
+from .cohorts import Rollup, build_rollup, clear_loaded_rollups
+from .ingest import parse_members
+from .partitioned import partition_bounds, start_partitioned_aggregation
+from . import memprofile
+from .prewarm import wait_for_warmup
+from .models import CohortRollup, DailyRollup, DatasetVersion, Leaderboard, TenantShard, Transaction, UploadedFile
+from .replicas import next_replica
+from .rfm_analysis import builtin_segments, calculate_rfm, segment_for
+from .segment_rules import CompiledRules, clear_compiled_rules, segmenter_for
+from .singleflight import FileLockFlights, SingleFlight
+from .sharding import hashed_shard, shard_for_user
+from .spreadsheets import engine_available, iter_sheet_frames
+from .throttling import LocalThrottleState, throttle_state
+from .timeseries import clear_loaded_series, lttb
+from .renderers import FastJSONRenderer, FrameRecords, GroupedFrameRecords, RenderedJSON, orjson
+from .versioning import bump_dataset_version
+
+
+def csv_upload(rows, name='transactions.csv'):
+    """Helper: a CSV upload (customer_id, purchase_date, amount_100kg, price_per_kg, city format)."""
+    today = date.today()
+    lines = ['customer_id,purchase_date,amount_100kg,price_per_kg,city,loyalty_points']
+    lines += [f'{cid},{today - timedelta(days=days_ago)},{amount},1,{city},{points}' for cid, days_ago, amount, city, points in rows]
+    return SimpleUploadedFile(name, '\n'.join(lines).encode(), content_type='text/csv')
+
+
+class UploadTestCase(APITestCase):
+    """APITestCase whose uploaded files go to a throwaway MEDIA_ROOT."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._media_root = tempfile.mkdtemp()
+        cls._media_override = override_settings(MEDIA_ROOT=cls._media_root)
+        cls._media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._media_override.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+
+
+def create_transactions(user, rows):
+    """Helper: rows are (customer_id, days_ago, amount, city, loyalty_points) tuples."""
+    today = date.today()
+    Transaction.objects.bulk_create([
+        Transaction(
+            user=user,
+            customer_id=customer_id,
+            purchase_date=today - timedelta(days=days_ago),
+            amount=Decimal(str(amount)),
+            city=city,
+            product_type='Russet',
+            loyalty_points=points,
+        )
+        for customer_id, days_ago, amount, city, points in rows
+    ])
+    bump_dataset_version(user)
+
+
+SAMPLE_ROWS = [
+    ('C1', 1, 120, 'Lagos', 10),
+    ('C1', 20, 80, 'Lagos', 5),
+    ('C2', 3, 300, 'Abuja', 30),
+    ('C3', 40, 50, 'Lagos', 0),
+    ('C4', 90, 75, 'Kano', 2),
+    ('C5', 200, 10, 'Abuja', 1),
+]
+
+
+class ConditionalGetTests(APITestCase):
+    """ETag / If-None-Match handling on the analytics endpoints."""
+
+    url_names = [
+        'rfm:rfm_analysis',
+        'rfm:customer_ranking',
+        'rfm:revenue_analytics',
+        'rfm:customer_analytics',
+        'rfm:vip_customers',
+        'rfm:avg_order_value',
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        create_transactions(self.user, SAMPLE_ROWS)
+        self.client.force_authenticate(self.user)
+
+    def test_responses_carry_etag_and_cache_control(self):
+        for name in self.url_names:
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200, name)
+            self.assertTrue(response['ETag'].startswith('W/"'), name)
+            self.assertIn('private', response['Cache-Control'])
+
+    def test_matching_if_none_match_returns_304_without_transaction_queries(self):
+        for name in self.url_names:
+            etag = self.client.get(reverse(name))['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, name)
+            self.assertEqual(response['ETag'], etag)
+            self.assertFalse(response.content)
+            touched = [q['sql'] for q in queries.captured_queries if 'rfm_transaction' in q['sql']]
+            self.assertEqual(touched, [], name)
+
+    def test_etag_depends_on_params_and_dataset_version(self):
+        url = reverse('rfm:revenue_analytics')
+        etag_all = self.client.get(url)['ETag']
+        etag_week = self.client.get(url, {'period': 'week'})['ETag']
+        self.assertNotEqual(etag_all, etag_week)
+
+        bump_dataset_version(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag_all)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag_all)
+
+    def test_tag_matches_with_or_without_the_weak_prefix(self):
+        url = reverse('rfm:vip_customers')
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"other", {etag.removeprefix("W/")}')
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_is_per_user(self):
+        other = User.objects.create_user('bob', password='pw')
+        create_transactions(other, SAMPLE_ROWS)
+        url = reverse('rfm:avg_order_value')
+        etag = self.client.get(url)['ETag']
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    """Output parity with DRF's JSONRenderer and column-wise DataFrame emission."""
+
+    def setUp(self):
+        self.frame = pd.DataFrame({
+            'customer_id': ['B', 'A', 'B', 'A'],
+            'purchase_date': [date(2024, 1, 3), date(2024, 1, 1), date(2024, 1, 1), date(2024, 2, 1)],
+            'amount': [Decimal('10.50'), Decimal('3.25'), Decimal('1.00'), Decimal('7.75')],
+            'points': np.array([1, 2, 3, 4], dtype=np.int64),
+        })
+
+    def encoders(self):
+        renderer = FastJSONRenderer()
+        yield lambda data: renderer.encode(data, use_orjson=False)
+        if orjson is not None:
+            yield lambda data: renderer.encode(data, use_orjson=True)
+
+    def test_native_numpy_decimal_and_date_values(self):
+        data = {'n': np.int64(3), 'f': np.float64(1.5), 'd': Decimal('2.50'), 'day': date(2024, 5, 1), 'arr': np.arange(3)}
+        for encode in self.encoders():
+            self.assertEqual(json.loads(encode(data)), {'n': 3, 'f': 1.5, 'd': 2.5, 'day': '2024-05-01', 'arr': [0, 1, 2]})
+
+    def test_frame_payloads_match_stock_renderer(self):
+        data = {
+            'rows': FrameRecords(self.frame),
+            'logs': GroupedFrameRecords(self.frame, 'customer_id', ['purchase_date', 'amount'], sort_by='purchase_date'),
+            'empty': FrameRecords(self.frame.iloc[0:0]),
+        }
+        expected = json.loads(JSONRenderer().render(data))
+        self.assertEqual(list(expected['logs']['A'][0]), ['purchase_date', 'amount'])
+        self.assertEqual(expected['logs']['A'][0]['purchase_date'], '2024-01-01')
+        for encode in self.encoders():
+            self.assertEqual(json.loads(encode(data)), expected)
+
+
+
+class ResponseCompressionTests(APITestCase):
+    """FastJSONRenderer compression negotiated through Accept-Encoding."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('carol', password='pw')
+        create_transactions(self.user, [(f'C{i}', i % 300, 10 + i, 'Lagos', i % 7) for i in range(400)])
+        self.client.force_authenticate(self.user)
+        self.url = reverse('rfm:customer_analytics')
+
+    def test_large_bodies_are_compressed_when_accepted(self):
+        plain = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+
+        compressed = self.client.get(self.url, HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(compressed.content)), json.loads(plain.content))
+        self.assertLess(len(compressed.content), len(plain.content))
+        # One weak tag for both encodings: a strong one would claim the bodies are byte-identical
+        self.assertEqual(compressed['ETag'], plain['ETag'])
+        self.assertTrue(compressed['ETag'].startswith('W/'))
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'FAST_JSON_RENDERER': {'COMPRESS_MIN_SIZE': 10 ** 9}})
+    def test_compression_threshold_is_configurable(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class LeaderboardTests(UploadTestCase):
+    """Ranking and VIP endpoints served from leaderboards built at upload time."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('erin', password='pw')
+        self.client.force_authenticate(self.user)
+
+    def upload(self, rows):
+        response = self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload(rows)}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_rankings_are_served_without_scanning_transactions(self):
+        self.upload(SAMPLE_ROWS)
+        with CaptureQueriesContext(connection) as queries:
+            ranking = self.client.get(reverse('rfm:customer_ranking'), {'k': 2}).json()
+        self.assertFalse([q for q in queries.captured_queries if 'rfm_transaction' in q['sql']])
+        self.assertEqual([(row['customer_id'], row['total_paid']) for row in ranking['ranking']], [('C2', 300.0), ('C1', 200.0)])
+        self.assertEqual(ranking['cities'], ['Abuja', 'Kano', 'Lagos'])
+
+    def test_city_boards_and_vip_order(self):
+        self.upload(SAMPLE_ROWS)
+        lagos = self.client.get(reverse('rfm:customer_ranking'), {'city': 'LAGOS'}).json()['ranking']
+        self.assertEqual([row['customer_id'] for row in lagos], ['C1', 'C3'])
+
+        vip = self.client.get(reverse('rfm:vip_customers'), {'k': 3}).json()['vip_customers']
+        self.assertEqual([row['customer_id'] for row in vip], ['C2', 'C1', 'C4'])
+        self.assertEqual([row['status'] for row in vip], ['VIP', 'Loyal Customer', 'Loyal Customer'])
+
+        abuja_vip = self.client.get(reverse('rfm:vip_customers'), {'city': 'abuja'}).json()['vip_customers']
+        self.assertEqual([row['customer_id'] for row in abuja_vip], ['C2', 'C5'])
+
+    def test_boards_follow_new_uploads_and_legacy_data(self):
+        self.upload(SAMPLE_ROWS)
+        self.upload([('Z9', 1, 999, 'Ibadan', 1)])
+        ranking = self.client.get(reverse('rfm:customer_ranking')).json()
+        self.assertEqual([row['customer_id'] for row in ranking['ranking']], ['Z9'])
+        self.assertEqual(ranking['cities'], ['Ibadan'])
+
+        # Data written without going through the upload is picked up on first read.
+        create_transactions(self.user, [('Y1', 1, 5000, 'Kano', 0)])
+        self.assertEqual(self.client.get(reverse('rfm:customer_ranking')).json()['ranking'][0]['customer_id'], 'Y1')
+
+    def test_unknown_city_and_invalid_k(self):
+        self.upload(SAMPLE_ROWS)
+        response = self.client.get(reverse('rfm:customer_ranking'), {'city': 'Atlantis'}).json()
+        self.assertEqual(response['ranking'], [])
+        self.assertEqual(self.client.get(reverse('rfm:customer_ranking'), {'k': 'ten'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('rfm:vip_customers'), {'k': 0}).status_code, 400)
+
+
+class UploadValidationTests(UploadTestCase):
+    """Format sniffing, capped fail-fast validation and dry runs on the upload endpoint."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('frank', password='pw')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('rfm:transaction_upload')
+
+    def post(self, content, name='transactions.csv', **options):
+        upload = SimpleUploadedFile(name, content.encode() if isinstance(content, str) else content)
+        return self.client.post(self.url, {'file': upload, **options}, format='multipart')
+
+    def test_wrong_columns_are_rejected_before_parsing_or_saving(self):
+        response = self.post('name,when,total\nA,2024-01-01,3\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('missing required columns', response.json()['error'])
+        self.assertFalse(UploadedFile.objects.exists())
+
+        mismatch = self.post('customer_id,purchase_date,amount\n', name='transactions.xlsx')
+        self.assertEqual(mismatch.status_code, 400)
+        self.assertIn('does not match', mismatch.json()['error'])
+
+    @override_settings(UPLOAD_CHUNK_ROWS=10)
+    def test_error_cap_stops_parsing_early(self):
+        rows = ['customer_id,purchase_date,amount'] + [f'C{i},not-a-date,10' for i in range(100)]
+        response = self.post('\n'.join(rows), max_errors=5)
+        self.assertEqual(response.status_code, 400)
+        body = response.json()
+        self.assertEqual(body['errors'], [f"Row {i}: Invalid purchase_date format 'not-a-date'. Could not parse." for i in range(2, 7)])
+        self.assertTrue(body['errors_truncated'])
+        self.assertEqual(body['rows_checked'], 10)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_row_errors_match_row_numbers(self):
+        content = (
+            'Relationship ID,Date Clean,amount (100kg),price_per_kg,city,loyalty_points\n'
+            'C1,2024-01-05,2.5,1.10,Lagos,3\n'
+            ',2024-01-05,1,1,Lagos,0\n'
+            'C3,,1,1,Lagos,0\n'
+            'C4,2024-01-06,abc,1,Lagos,0\n'
+            'C5,05/02/2024,1,1,Lagos,-1\n'
+        )
+        body = self.post(content).json()
+        self.assertEqual(body['errors'], [
+            'Row 3: Missing customer_id.',
+            'Row 4: Missing purchase_date.',
+            'Row 5: Invalid amount_100kg or price_per_kg.',
+            "Row 6: Invalid loyalty_points '-1'.",
+        ])
+
+    def test_valid_file_is_loaded_with_exact_amounts(self):
+        content = (
+            'Relationship ID,Date Clean,amount (100kg),price_per_kg,city,product_type\n'
+            'C1,2024-01-05,2.5,1.10,Lagos,Russet\n'
+            'C2,01/07/2024,3,0.35,Kano,\n'
+        )
+        self.assertEqual(self.post(content).status_code, 201)
+        first, second = Transaction.objects.order_by('customer_id')
+        self.assertEqual((first.amount, first.purchase_date, first.product_type), (Decimal('2.75'), date(2024, 1, 5), 'Russet'))
+        self.assertEqual((second.amount, second.purchase_date, second.product_type), (Decimal('1.05'), date(2024, 1, 7), ''))
+
+    def test_dry_run_reports_without_touching_the_database(self):
+        rows = ['customer_id,purchase_date,amount'] + [f'C{i % 4},2024-02-{10 + i % 9},10' for i in range(30)]
+        rows += ['C9,bad,1', 'C9,2024-03-01,x']
+        response = self.post('\n'.join(rows), dry_run='true', max_errors=1)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertTrue(body['dry_run'])
+        self.assertEqual((body['file_type'], body['format']), ('csv', 'old'))
+        self.assertEqual((body['rows_checked'], body['valid_rows'], body['error_count']), (32, 30, 2))
+        self.assertEqual(len(body['errors']), 1)
+        self.assertTrue(body['errors_truncated'])
+        self.assertEqual(body['unique_customers'], 4)
+        self.assertEqual(body['date_range'], {'min': '2024-02-10', 'max': '2024-02-18'})
+        self.assertFalse(UploadedFile.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+
+
+def zip_upload(members, name='exports.zip'):
+    """Helper: a ZIP archive of {filename: bytes} members."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for filename, content in members.items():
+            archive.writestr(filename, content)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='application/zip')
+
+
+@override_settings(UPLOAD_PARSE_WORKERS=1)
+class MultiFileUploadTests(UploadTestCase):
+    """Several files or a ZIP archive per upload, validated per file and loaded together."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('judy', password='pw')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('rfm:transaction_upload')
+
+    def post(self, files, **options):
+        return self.client.post(self.url, {'file': files, **options}, format='multipart')
+
+    def test_files_are_loaded_together(self):
+        response = self.post([csv_upload(SAMPLE_ROWS[:3], 'lagos.csv'), csv_upload(SAMPLE_ROWS[3:], 'kano.csv')])
+        self.assertEqual(response.status_code, 201, response.content)
+        body = response.json()
+        self.assertEqual([(f['file'], f['valid_rows']) for f in body['files']], [('lagos.csv', 3), ('kano.csv', 3)])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 6)
+        self.assertEqual(UploadedFile.objects.filter(user=self.user).count(), 2)
+
+    def test_zip_archive_members_are_expanded(self):
+        archive = zip_upload({
+            'lagos.csv': csv_upload(SAMPLE_ROWS[:3]).read(),
+            'month/kano.csv': csv_upload(SAMPLE_ROWS[3:]).read(),
+            'README.txt': b'exported by the branch tool',
+            '__MACOSX/._lagos.csv': b'\x00',
+        })
+        response = self.post([archive])
+        self.assertEqual(response.status_code, 201, response.content)
+        body = response.json()
+        self.assertEqual([f['file'] for f in body['files']], ['exports.zip/lagos.csv', 'exports.zip/month/kano.csv'])
+        self.assertEqual(body['skipped'], ['exports.zip/README.txt'])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 6)
+
+    def test_one_bad_file_loads_nothing_and_reports_per_file(self):
+        create_transactions(self.user, SAMPLE_ROWS[:1])
+        bad = SimpleUploadedFile('bad.csv', b'customer_id,purchase_date,amount\nC1,2024-01-01,x\n')
+        wrong = SimpleUploadedFile('wrong.csv', b'name,total\nA,1\n')
+        response = self.post([csv_upload(SAMPLE_ROWS, 'good.csv'), bad, wrong])
+        self.assertEqual(response.status_code, 400)
+        files = {f['file']: f for f in response.json()['files']}
+        self.assertEqual(files['good.csv']['error_count'], 0)
+        self.assertEqual(files['bad.csv']['errors'], ["Row 2: Invalid amount 'x'."])
+        self.assertIn('missing required columns', files['wrong.csv']['error'])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 1)
+
+        self.assertEqual(self.post([SimpleUploadedFile('broken.zip', b'not a zip')]).status_code, 400)
+        with override_settings(UPLOAD_MAX_FILES=1):
+            self.assertIn('Too many files', self.post([csv_upload(SAMPLE_ROWS), csv_upload(SAMPLE_ROWS)]).json()['error'])
+
+    def test_process_pool_matches_sequential_parsing(self):
+        members = [(f'part{i}.csv', csv_upload(SAMPLE_ROWS[i:i + 2]).read()) for i in range(0, 6, 2)]
+        members.append(('broken.csv', b'name\nA\n'))
+        sequential = parse_members(members, max_errors=10, workers=1)
+        parallel = parse_members(members, max_errors=10, workers=2)
+        self.assertEqual([r['summary'] for r in parallel], [r['summary'] for r in sequential])
+        self.assertEqual([r['error'] for r in parallel], [r['error'] for r in sequential])
+        for seq, par in zip(sequential[:3], parallel[:3]):
+            pd.testing.assert_frame_equal(seq['frame'], par['frame'])
+
+
+class ExportTests(APITestCase):
+    """Streaming CSV/XLSX/Parquet exports of the RFM table, customer totals and transactions."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('kate', password='pw')
+        create_transactions(self.user, SAMPLE_ROWS)
+        self.client.force_authenticate(self.user)
+
+    def export(self, name, **params):
+        return self.client.get(reverse('rfm:export', args=name.split('.')), params)
+
+    def csv_rows(self, response):
+        self.assertEqual(response.status_code, 200)
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    @override_settings(EXPORT_CHUNK_ROWS=2)
+    def test_transactions_csv_is_streamed_in_chunks(self):
+        response = self.export('transactions.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment; filename="transactions_', response['Content-Disposition'])
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 3)  # header + 2 rows, then 2 + 2 rows
+        rows = list(csv.reader(io.StringIO(b''.join(chunks).decode())))
+        self.assertEqual(rows[0][:3], ['customer_id', 'purchase_date', 'amount'])
+        self.assertEqual([row[0] for row in rows[1:]], ['C1', 'C1', 'C2', 'C3', 'C4', 'C5'])
+        self.assertEqual(rows[2][2], '120.00')
+
+    def test_filters_select_the_same_customers_in_every_dataset(self):
+        analysis = self.client.get(reverse('rfm:rfm_analysis'), {'min_monetary': '100'}).json()
+        expected = sorted(row['customer_id'] for row in analysis['rfm_data'])
+        self.assertEqual(expected, ['C1', 'C2'])
+        for name in ('rfm.csv', 'customers.csv', 'transactions.csv'):
+            rows = self.csv_rows(self.export(name, min_monetary='100'))
+            self.assertEqual(sorted(set(row[0] for row in rows[1:])), expected, name)
+
+        customers = self.csv_rows(self.export('customers.csv'))
+        self.assertEqual(customers[0], ['customer_id', 'total_paid', 'total_points', 'order_count', 'first_purchase', 'last_purchase'])
+        self.assertEqual(customers[1][:4], ['C1', '200.00', '15', '2'])
+
+        segment = analysis['rfm_data'][0]['segment']
+        rows = self.csv_rows(self.export('rfm.csv', segment=segment.upper()))
+        self.assertTrue(rows[1:] and all(row[8] == segment for row in rows[1:]))
+
+    def test_rfm_xlsx_export(self):
+        from openpyxl import load_workbook
+
+        response = self.export('rfm.xlsx')
+        self.assertEqual(response.status_code, 200)
+        sheet = load_workbook(io.BytesIO(b''.join(response.streaming_content)), read_only=True).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(rows[0][:4], ('customer_id', 'recency', 'frequency', 'monetary'))
+        self.assertEqual({row[0]: row[3] for row in rows[1:]}, {'C1': 200, 'C2': 300, 'C3': 50, 'C4': 75, 'C5': 10})
+
+    @unittest.skipUnless(parquet_available(), 'pyarrow is not installed')
+    def test_parquet_export(self):
+        import pyarrow.parquet as pq
+
+        with override_settings(EXPORT_CHUNK_ROWS=4):
+            response = self.export('transactions.parquet')
+        parquet = pq.ParquetFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(parquet.metadata.num_row_groups, 2)  # one per chunk
+        table = parquet.read()
+        self.assertEqual(table.num_rows, 6)
+        self.assertEqual(table.column('amount').to_pylist()[:2], [Decimal('80.00'), Decimal('120.00')])
+
+    def test_errors(self):
+        self.assertEqual(self.export('everything.csv').status_code, 404)
+        self.assertEqual(self.export('rfm.pdf').status_code, 400)
+        self.assertEqual(self.export('rfm.csv', min_monetary='abc').status_code, 400)
+        with mock.patch('rfm.views.parquet_available', return_value=False):
+            self.assertEqual(self.export('rfm.parquet').status_code, 501)
+        Transaction.objects.all().delete()
+        self.assertEqual(self.export('rfm.csv').status_code, 404)
+
+
+class CustomerSearchTests(APITestCase):
+    """Indexed customer search and the per-customer detail endpoint."""
+
+    def setUp(self):
+        clear_user_aggregates()
+        self.user = User.objects.create_user('leo', password='pw')
+        create_transactions(self.user, SAMPLE_ROWS + [
+            ('CX-100', 5, 500, 'Port Harcourt', 4),
+            ('CX-101', 6, 20, 'Lagos', 0),
+            ('AB-C100', 7, 30, 'Kano', 0),
+        ])
+        self.client.force_authenticate(self.user)
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('rfm:customer_search'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(row['customer_id'], row['match']) for row in response.json()['results']]
+
+    def test_matches_are_ranked_by_tier_then_total_paid(self):
+        self.assertEqual(self.search('cx-100'), [('CX-100', 'exact')])
+        self.assertEqual(self.search('cx'), [('CX-100', 'prefix'), ('CX-101', 'prefix')])
+        self.assertEqual(self.search('c100'), [('AB-C100', 'contains')])
+        self.assertEqual(self.search('cx-1000'), [('CX-100', 'similar'), ('CX-101', 'similar')])
+        self.assertEqual(self.search('port'), [('CX-100', 'city')])
+        self.assertEqual(self.search('c', limit=3), [('CX-100', 'prefix'), ('C2', 'prefix'), ('C1', 'prefix')])
+
+        row = self.client.get(reverse('rfm:customer_search'), {'q': 'C1'}).json()['results'][0]
+        self.assertEqual(row, {
+            'customer_id': 'C1', 'city': 'Lagos', 'total_paid': 200.0, 'loyalty_points': 15, 'order_count': 2,
+            'first_purchase': str(date.today() - timedelta(days=20)), 'last_purchase': str(date.today() - timedelta(days=1)),
+            'match': 'exact',
+        })
+
+    def test_detail_matches_the_full_rfm_table(self):
+        expected = {row['customer_id']: row for row in self.client.get(reverse('rfm:rfm_analysis')).json()['rfm_data']}
+        for customer_id, row in expected.items():
+            detail = self.client.get(reverse('rfm:customer_detail', args=[customer_id.lower()])).json()
+            self.assertEqual(detail['rfm'], row, customer_id)
+        detail = self.client.get(reverse('rfm:customer_detail', args=['C1'])).json()
+        self.assertEqual(detail['customer']['total_paid'], 200.0)
+        self.assertEqual([(p['purchase_date'], p['amount']) for p in detail['payments']], [
+            (str(date.today() - timedelta(days=20)), 80.0), (str(date.today() - timedelta(days=1)), 120.0),
+        ])
+
+    def test_scores_match_on_a_larger_dataset_with_ties(self):
+        rng = np.random.default_rng(3)
+        rows = [(f'K{rng.integers(0, 80)}', int(rng.integers(0, 40)), int(rng.integers(1, 6)) * 10, 'Lagos', 0) for _ in range(400)]
+        other = User.objects.create_user('mia', password='pw')
+        create_transactions(other, rows)
+        self.client.force_authenticate(other)
+        expected = self.client.get(reverse('rfm:rfm_analysis')).json()['rfm_data']
+        scored = [self.client.get(reverse('rfm:customer_detail', args=[row['customer_id']])).json()['rfm'] for row in expected]
+        self.assertEqual(scored, expected)
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(reverse('rfm:customer_search')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('rfm:customer_search'), {'q': 'c', 'limit': '0'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('rfm:customer_detail', args=['nobody'])).status_code, 404)
+
+
+class SegmentRulesTests(APITestCase):
+    """User-defined segmentation rules: validation, compilation and use by the RFM endpoints."""
+
+    RULES = {
+        'rules': [
+            {'segment': 'Whales', 'monetary': {'min': 250}},
+            {'segment': 'Recent', 'r_score': {'min': 4}},
+            {'segment': 'Points', 'loyalty_points': {'min': 2, 'max': 5}},
+        ],
+        'default_segment': 'Rest',
+    }
+
+    def setUp(self):
+        clear_user_aggregates()
+        clear_compiled_rules()
+        self.user = User.objects.create_user('nia', password='pw')
+        create_transactions(self.user, SAMPLE_ROWS)
+        self.client.force_authenticate(self.user)
+
+    def segments(self):
+        rows = self.client.get(reverse('rfm:rfm_analysis')).json()['rfm_data']
+        return {row['customer_id']: row['segment'] for row in rows}
+
+    def test_builtin_lookup_matches_segment_map(self):
+        r, f = np.indices((5, 5)).reshape(2, -1) + 1
+        self.assertEqual(list(builtin_segments(r, f)), [segment_for(a, b) for a, b in zip(r, f)])
+
+    def test_compiled_rules_match_a_row_by_row_evaluation(self):
+        rng = np.random.default_rng(5)
+        n = 2000
+        frame = pd.DataFrame({
+            'r_score': rng.integers(1, 6, n), 'f_score': rng.integers(1, 6, n), 'm_score': rng.integers(1, 6, n),
+            'recency': rng.integers(0, 365, n), 'frequency': rng.integers(1, 20, n),
+            'monetary': rng.uniform(0, 1000, n), 'loyalty_points': rng.integers(0, 50, n),
+        })
+
+        def by_row(rules, default):
+            out = []
+            for row in frame.to_dict('records'):
+                for rule in rules:
+                    bounds = [(row[field], rule[field].get('min'), rule[field].get('max')) for field in rule if field != 'segment']
+                    if all((low is None or value >= low) and (high is None or value <= high) for value, low, high in bounds):
+                        out.append(rule['segment'])
+                        break
+                else:
+                    out.append(default)
+            return out
+
+        score_rules = [
+            {'segment': 'Best', 'r_score': {'min': 4}, 'f_score': {'min': 4}, 'm_score': {'min': 4}},
+            {'segment': 'Lapsed', 'r_score': {'max': 2}},
+            {'segment': 'Best', 'm_score': {'min': 5}},
+        ]
+        compiled = CompiledRules(score_rules, 'Other')
+        self.assertTrue(compiled.score_only)
+        self.assertEqual(list(compiled(frame)), by_row(score_rules, 'Other'))
+
+        mixed = score_rules + [{'segment': 'Big', 'monetary': {'min': 500.5}, 'recency': {'max': 30}}]
+        compiled = CompiledRules(mixed, 'Other')
+        self.assertFalse(compiled.score_only)
+        self.assertEqual(list(compiled(frame)), by_row(mixed, 'Other'))
+
+    def test_custom_rules_drive_the_rfm_endpoints(self):
+        builtin = self.segments()
+        etag = self.client.get(reverse('rfm:rfm_analysis'))['ETag']
+        self.client.get(reverse('rfm:customer_ranking'))
+        board_version = Leaderboard.objects.filter(user=self.user).values_list('dataset_version', flat=True).first()
+
+        response = self.client.put(reverse('rfm:segment_rules'), self.RULES, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['dataset_version'], board_version + 1)
+        # C2 spent 300; C1 (r_score 5) is recent; C4 has 2 points; C3 and C5 match nothing
+        self.assertEqual(self.segments(), {'C1': 'Recent', 'C2': 'Whales', 'C3': 'Rest', 'C4': 'Points', 'C5': 'Rest'})
+        self.assertNotEqual(self.client.get(reverse('rfm:rfm_analysis'))['ETag'], etag)
+        summary = self.client.get(reverse('rfm:rfm_analysis'), {'segment': 'rest'}).json()['summary']
+        self.assertEqual(summary['segment_counts'], {'Rest': 2, 'Recent': 1, 'Whales': 1, 'Points': 1})
+        self.assertEqual(summary['filtered_results_count'], 2)
+        for customer_id, segment in self.segments().items():
+            detail = self.client.get(reverse('rfm:customer_detail', args=[customer_id])).json()
+            self.assertEqual(detail['rfm']['segment'], segment)
+        # The leaderboards don't depend on segments: re-stamped, not rebuilt
+        self.assertEqual(set(Leaderboard.objects.filter(user=self.user).values_list('dataset_version', flat=True)), {board_version + 1})
+
+        self.assertEqual(self.client.get(reverse('rfm:segment_rules')).json()['default_segment'], 'Rest')
+        self.assertEqual(self.client.delete(reverse('rfm:segment_rules')).status_code, 204)
+        self.assertEqual(self.segments(), builtin)
+        self.assertEqual(self.client.delete(reverse('rfm:segment_rules')).status_code, 404)
+        self.assertFalse(self.client.get(reverse('rfm:segment_rules')).json()['custom'])
+
+    def test_compiled_rules_are_reused_until_saved_again(self):
+        self.client.put(reverse('rfm:segment_rules'), self.RULES, format='json')
+        compiled = segmenter_for(self.user)
+        self.assertIs(segmenter_for(self.user), compiled)
+        self.client.put(reverse('rfm:segment_rules'), {'rules': self.RULES['rules'][:1]}, format='json')
+        self.assertIsNot(segmenter_for(self.user), compiled)
+        self.assertEqual(segmenter_for(self.user).names, ['Whales', 'Other'])
+
+    def test_invalid_rule_sets_are_rejected(self):
+        invalid = [
+            {'rules': 'nope'},
+            {'rules': [{'r_score': {'min': 4}}]},
+            {'rules': [{'segment': 'A', 'r_score': {'min': 6}}]},
+            {'rules': [{'segment': 'A', 'r_score': {'min': 2.5}}]},
+            {'rules': [{'segment': 'A', 'monetary': {'min': 10, 'max': 5}}]},
+            {'rules': [{'segment': 'A', 'monetary': {'min': '10'}}]},
+            {'rules': [{'segment': 'A', 'basket': {'min': 1}}]},
+            {'rules': [{'segment': 'A', 'recency': [1, 2]}]},
+            {'rules': [{'segment': 'x' * 51}]},
+        ]
+        for body in invalid:
+            response = self.client.put(reverse('rfm:segment_rules'), body, format='json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn('error', response.json())
+        self.assertIsNone(segmenter_for(self.user))
+        self.assertIn('Rule 1: r_score bounds must be whole scores from 1 to 5.', self.client.put(
+            reverse('rfm:segment_rules'), invalid[2], format='json').json()['error'])
+
+
+class CohortRetentionTests(UploadTestCase):
+    """Cohort retention from the rollup built at ingest."""
+
+    ROWS = [
+        # (customer_id, purchase_date, amount, city, product_type)
+        ('A', '2024-01-05', 10, 'Lagos', 'Russet'),
+        ('A', '2024-01-20', 5, 'Abuja', 'Yukon'),
+        ('A', '2024-02-03', 20, 'Lagos', 'Russet'),
+        ('B', '2024-01-15', 30, 'Abuja', 'Yukon'),
+        ('B', '2024-03-01', 40, 'Abuja', 'Russet'),
+        ('C', '2024-02-10', 50, 'Lagos', 'Yukon'),
+        ('C', '2024-03-12', 60, 'Lagos', 'Yukon'),
+    ]
+
+    def setUp(self):
+        clear_loaded_rollups()
+        self.user = User.objects.create_user('olu', password='pw')
+        self.client.force_authenticate(self.user)
+
+    def upload(self, rows):
+        lines = ['customer_id,purchase_date,amount_100kg,price_per_kg,city,product_type,loyalty_points']
+        lines += [f'{customer},{day},1,{amount},{city},{product},0' for customer, day, amount, city, product in rows]
+        upload = SimpleUploadedFile('cohorts.csv', '\n'.join(lines).encode(), content_type='text/csv')
+        response = self.client.post(reverse('rfm:transaction_upload'), {'file': upload})
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def cohorts(self, **params):
+        response = self.client.get(reverse('rfm:cohort_retention'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_retention_matrix_and_filters(self):
+        self.upload(self.ROWS)
+        with CaptureQueriesContext(connection) as queries:
+            data = self.cohorts()
+        self.assertFalse(any('rfm_transaction' in q['sql'] for q in queries.captured_queries))
+        self.assertEqual(data['cohorts'], [
+            {'cohort': '2024-01', 'customers': 2, 'active': [2, 1, 1], 'retention': [1.0, 0.5, 0.5], 'revenue': [45.0, 20.0, 40.0]},
+            {'cohort': '2024-02', 'customers': 1, 'active': [1, 1], 'retention': [1.0, 1.0], 'revenue': [50.0, 60.0]},
+        ])
+        self.assertEqual(data['cities'], ['Abuja', 'Lagos'])
+
+        # A customer's cohort is their first purchase matching the filters
+        lagos = self.cohorts(city='LAGOS')['cohorts']
+        self.assertEqual([(row['cohort'], row['active']) for row in lagos], [('2024-01', [1, 1, 0]), ('2024-02', [1, 1])])
+        russet = self.cohorts(city='abuja', product_type='russet')['cohorts']
+        self.assertEqual([(row['cohort'], row['active'], row['revenue']) for row in russet], [('2024-03', [1], [40.0])])
+        self.assertEqual(self.cohorts(city='Atlantis')['cohorts'], [])
+
+    def test_matches_a_transaction_scan(self):
+        rng = np.random.default_rng(11)
+        start = date(2023, 1, 1)
+        rows = [
+            (f'K{rng.integers(0, 60)}', str(start + timedelta(days=int(rng.integers(0, 400)))), int(rng.integers(1, 50)),
+             str(rng.choice(['Lagos', 'Kano', 'Abuja'])), str(rng.choice(['Russet', 'Yukon'])))
+            for _ in range(500)
+        ]
+        self.upload(rows)
+        df = pd.DataFrame(rows, columns=['customer_id', 'purchase_date', 'amount', 'city', 'product_type'])
+        dates = pd.to_datetime(df['purchase_date'])
+        df['month'] = dates.dt.year * 12 + dates.dt.month - 1
+        last = df['month'].max()
+        for params in [{}, {'city': 'kano'}, {'product_type': 'Yukon', 'city': 'Lagos'}]:
+            scoped = df
+            if 'city' in params:
+                scoped = scoped[scoped['city'].str.lower() == params['city'].lower()]
+            if 'product_type' in params:
+                scoped = scoped[scoped['product_type'] == params['product_type']]
+            first = scoped.groupby('customer_id')['month'].transform('min')
+            active = scoped.assign(cohort=first, since=scoped['month'] - first)
+            active = active.drop_duplicates(['customer_id', 'month'])
+            expected = [
+                {'cohort': f'{cohort // 12}-{cohort % 12 + 1:02d}', 'active': [int((group['since'] == i).sum()) for i in range(last - cohort + 1)]}
+                for cohort, group in active.groupby('cohort')
+            ]
+            got = [{'cohort': row['cohort'], 'active': row['active']} for row in self.cohorts(**params)['cohorts']]
+            self.assertEqual(got, expected, params)
+
+    def test_an_outlier_date_does_not_blow_up_the_matrix(self):
+        df = pd.DataFrame(self.ROWS + [('Z', '1900-01-01', 1, 'Lagos', 'Russet')], columns=['customer_id', 'purchase_date', 'amount', 'city', 'product_type'])
+        rollup = Rollup(*build_rollup(df))
+        tracemalloc.start()
+        try:
+            rows = rollup.retention()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual([row['cohort'] for row in rows], ['1900-01', '2024-01', '2024-02'])
+        self.assertEqual(rows[1]['active'], [2, 1, 1])
+        self.assertEqual(len(rows[0]['active']), (2024 - 1900) * 12 + 3)
+        self.assertLess(peak, 2 * 1024 * 1024)  # a dense months x months matrix would be ~18 MB
+
+    def test_rebuilt_for_data_that_predates_the_rollup(self):
+        self.assertEqual(self.cohorts()['cohorts'], [])
+        create_transactions(self.user, SAMPLE_ROWS)
+        self.assertFalse(CohortRollup.objects.filter(user=self.user).exists())
+        data = self.cohorts()
+        self.assertEqual(sum(row['customers'] for row in data['cohorts']), 5)
+        self.assertEqual(CohortRollup.objects.get(user=self.user).dataset_version, DatasetVersion.objects.get(user=self.user).version)
+
+
+@override_settings(THROTTLE_ENABLED=True, THROTTLE_RATE=60, THROTTLE_BURST=45, THROTTLE_MAX_INFLIGHT=30, THROTTLE_QUEUE_SECONDS=0)
+class ThrottlingTests(UploadTestCase):
+    """Per-user cost budgets: rate (token bucket) and cost in flight."""
+
+    def setUp(self):
+        throttle_state().reset()
+        self.addCleanup(throttle_state().reset)
+        self.user = User.objects.create_user('pat', password='pw')
+        self.client.force_authenticate(self.user)
+        self.key = f'user:{self.user.pk}'
+
+    def upload(self):
+        return self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload(SAMPLE_ROWS)})
+
+    def test_heavy_requests_spend_the_rate_budget_per_user(self):
+        self.assertEqual(self.upload().status_code, 201)
+        self.assertEqual(self.upload().status_code, 201)
+        refused = self.upload()
+        self.assertEqual(refused.status_code, 429)
+        self.assertGreaterEqual(int(refused['Retry-After']), 14)  # 15 more tokens at 1 per second
+        # Cheap reads still fit in what is left, and free ones are never throttled
+        self.assertEqual(self.client.get(reverse('rfm:rfm_analysis')).status_code, 200)
+        for _ in range(10):
+            self.assertEqual(self.client.get(reverse('rfm:warmup_status')).status_code, 200)
+
+        other = User.objects.create_user('quinn', password='pw')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.upload().status_code, 201)
+
+    def test_cost_in_flight_is_limited_and_released(self):
+        state = throttle_state()
+        state.acquire(self.key, 20, limit=30)  # e.g. an upload still running
+        refused = self.upload()
+        self.assertEqual(refused.status_code, 429)
+        self.assertEqual(refused['Retry-After'], '2')
+        self.assertEqual(self.client.get(reverse('rfm:rfm_analysis')).status_code, 404)  # cost 1 fits
+        self.assertEqual(state.usage(self.key)[1], 20)  # the read's cost was released with its response
+
+        state.release(self.key, 20)
+        self.assertEqual(self.upload().status_code, 201)
+        self.assertEqual(state.usage(self.key)[1], 0)
+
+    def test_queued_request_runs_when_a_slot_frees(self):
+        state = LocalThrottleState()
+        state.acquire('k', 20, limit=30)
+        self.assertFalse(state.acquire('k', 20, limit=30, timeout=0.05))
+        threading.Timer(0.1, state.release, args=('k', 20)).start()
+        self.assertTrue(state.acquire('k', 20, limit=30, timeout=5))
+        # A request dearer than the whole limit still runs on its own
+        self.assertTrue(state.acquire('big', 50, limit=30))
+        self.assertEqual(state.take('bucket', 50, rate=1, burst=10), 0)
+        self.assertAlmostEqual(state.take('bucket', 5, rate=1, burst=10), 5, delta=0.1)
+
+    def test_streamed_exports_hold_their_cost_until_sent(self):
+        create_transactions(self.user, SAMPLE_ROWS)
+        response = self.client.get(reverse('rfm:export', args=['transactions', 'csv']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(throttle_state().usage(self.key)[1], 5)
+        b''.join(response.streaming_content)
+        self.assertEqual(throttle_state().usage(self.key)[1], 0)
+
+    def test_idle_buckets_are_dropped(self):
+        state = LocalThrottleState()
+        for index in range(50):
+            state.take(f'ip:10.0.0.{index}', 1, rate=1000, burst=10)
+        state.take('busy', 10, rate=1000, burst=10)
+        state.acquire('busy', 1, limit=30)
+        time.sleep(0.02)  # all refilled
+        state._pruned_at -= throttling.PRUNE_SECONDS
+        state.take('new', 1, rate=1000, burst=10)
+        self.assertEqual(state.buckets(), 2)  # 'busy' still has a request in flight
+
+
+@override_settings(MEMORY_PROFILE_SAMPLE_RATE=1)
+class MemoryProfileTests(UploadTestCase):
+    """Sampled per-stage memory profiles of requests, served to staff."""
+
+    def setUp(self):
+        memprofile.clear_profiles()
+        self.addCleanup(memprofile.clear_profiles)
+        self.user = User.objects.create_user('rae', password='pw')
+        self.staff = User.objects.create_user('sam', password='pw', is_staff=True)
+        self.client.force_authenticate(self.user)
+
+    def stages(self, profile):
+        return [stage['name'] for stage in profile['stages']]
+
+    def test_upload_and_analytics_requests_are_profiled_by_stage(self):
+        response = self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload(SAMPLE_ROWS)})
+        self.assertEqual(response.status_code, 201)
+        upload = memprofile.recent_profiles()[0]
+        self.assertEqual(upload['id'], response['X-Memory-Profile'])
+        self.assertEqual(upload['user_id'], self.user.pk)
+        for name in ['sniff', 'read_and_validate', 'build_objects', 'leaderboards', 'bulk_insert', 'store_aggregates', 'serialize']:
+            self.assertIn(name, self.stages(upload))
+        validate = next(stage for stage in upload['stages'] if stage['name'] == 'read_and_validate')
+        self.assertGreater(validate['rss_peak_mb'], 0)
+        self.assertGreaterEqual(validate['py_peak_mb'], validate['py_net_mb'])
+        self.assertTrue(all(set(entry) == {'where', 'size_mb', 'count'} for entry in validate['top_allocators']))
+        # Reading and validating alternate chunk by chunk: summed, nested in read_and_validate
+        split = [stage for stage in upload['stages'] if stage['name'] in ('read_file', 'validate')]
+        self.assertEqual([(stage['name'], stage['depth'], stage['summed']) for stage in split], [('read_file', 1, True), ('validate', 1, True)])
+        self.assertLessEqual(sum(stage['ms'] for stage in split), validate['ms'])
+
+        self.client.get(reverse('rfm:customer_analytics'))
+        analytics = memprofile.recent_profiles()[0]
+        self.assertEqual(analytics['name'], 'GET /api/rfm/analytics/customers/')
+        self.assertEqual(self.stages(analytics), ['dataframe', 'groupby', 'serialize', 'compress'])
+
+        self.assertEqual(self.client.get(reverse('rfm:memory_profiles')).status_code, 403)
+        self.client.force_authenticate(self.staff)
+        served = self.client.get(reverse('rfm:memory_profiles'), {'limit': 3}).json()
+        self.assertEqual(served['sample_rate'], 1.0)
+        # Newest first; the refused request above was profiled too
+        self.assertEqual([profile['name'] for profile in served['profiles']][0], 'GET /api/rfm/debug/memory/')
+        self.assertEqual([profile['id'] for profile in served['profiles']][1:], [analytics['id'], upload['id']])
+
+        files = [csv_upload(SAMPLE_ROWS[:3], 'a.csv'), csv_upload(SAMPLE_ROWS[3:], 'b.csv')]
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.post(reverse('rfm:transaction_upload'), {'file': files}).status_code, 201)
+        self.assertIn('read_file', self.stages(memprofile.recent_profiles()[0]))
+
+    def test_nested_stages_fold_into_their_parent(self):
+        with memprofile.profile('job', force=True):
+            with memprofile.stage('outer'):
+                with memprofile.stage('inner'):
+                    block = bytearray(8 * 1024 * 1024)
+                    del block
+        job = memprofile.recent_profiles()[0]
+        inner, outer = job['stages']
+        self.assertEqual((inner['name'], inner['depth'], outer['name'], outer['depth']), ('inner', 1, 'outer', 0))
+        self.assertGreaterEqual(inner['py_peak_mb'], 8)
+        self.assertGreaterEqual(outer['py_peak_mb'], inner['py_peak_mb'])
+        self.assertLess(outer['py_net_mb'], 1)
+
+    @override_settings(MEMORY_PROFILE_SAMPLE_RATE=0)
+    def test_off_by_default(self):
+        response = self.client.get(reverse('rfm:customer_analytics'))
+        self.assertNotIn('X-Memory-Profile', response)
+        self.assertEqual(memprofile.recent_profiles(), [])
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+class GraphDownsamplingTests(UploadTestCase):
+    def setUp(self):
+        clear_loaded_series()
+        self.user = User.objects.create_user('graphs', password='pw')
+        self.client.force_authenticate(self.user)
+        # 400 purchase days with a weekly pattern and one spike
+        rows = [(f'C{day % 17}', day, 100 + 40 * (day % 7), 'Lagos', 1) for day in range(400)]
+        rows.append(('C1', 123, 25000, 'Lagos', 1))
+        response = self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload(rows)})
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def graph(self, name, **params):
+        response = self.client.get(reverse(f'rfm:{name}'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_full_graph_by_default(self):
+        data = self.graph('revenue_analytics')
+        self.assertEqual(len(data['graph']), 400)
+        self.assertNotIn('graph_total_points', data)
+        spike = date.today() - timedelta(days=123)
+        self.assertEqual(next(point['amount'] for point in data['graph'] if point['purchase_date'] == spike.isoformat()), 25000 + 100 + 40 * (123 % 7))
+
+    def test_max_points_keeps_the_ends_and_the_peaks(self):
+        full = self.graph('revenue_analytics')['graph']
+        for name in ('revenue_analytics', 'customer_analytics'):
+            data = self.graph(name, max_points=40)
+            self.assertEqual(len(data['graph']), 40)
+            self.assertEqual(data['graph_total_points'], 400)
+            self.assertEqual(data['graph'][0], full[0])
+            self.assertEqual(data['graph'][-1], full[-1])
+            self.assertEqual(max(point['amount'] for point in data['graph']), max(point['amount'] for point in full))
+            dates = [point['purchase_date'] for point in data['graph']]
+            self.assertEqual(dates, sorted(dates))
+
+    def test_period_and_max_points_combine(self):
+        data = self.graph('revenue_analytics', period='3m', max_points=10)
+        start = (date.today() - timedelta(days=90)).isoformat()
+        self.assertEqual(data['graph_total_points'], 91)
+        self.assertEqual(len(data['graph']), 10)
+        self.assertTrue(all(point['purchase_date'] >= start for point in data['graph']))
+
+    def test_invalid_max_points(self):
+        for value in ('x', '2', '100000'):
+            response = self.client.get(reverse('rfm:revenue_analytics'), {'max_points': value})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('max_points', response.json()['error'])
+
+    def test_missing_rollup_is_rebuilt(self):
+        DailyRollup.objects.filter(user=self.user).delete()
+        clear_loaded_series()
+        self.assertEqual(len(self.graph('customer_analytics', max_points=5)['graph']), 5)
+        self.assertTrue(DailyRollup.objects.filter(user=self.user).exists())
+
+    def test_lttb_picks_one_point_per_bucket(self):
+        x = np.arange(1000)
+        y = np.sin(x / 30.0)
+        kept = lttb(x, y, 100)
+        self.assertEqual(len(kept), 100)
+        self.assertTrue((np.diff(kept) > 0).all())
+        self.assertEqual((kept[0], kept[-1]), (0, 999))
+        self.assertEqual(list(lttb(x[:50], y[:50], 100)), list(range(50)))
+
+
+LEGACY_XLS = os.path.join(os.path.dirname(__file__), 'testdata', 'legacy_transactions.xls')
+
+
+def workbook_bytes(sheets):
+    """Helper: an .xlsx file with {sheet name: rows}."""
+    from openpyxl import Workbook
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for name, rows in sheets.items():
+        worksheet = workbook.create_sheet(name)
+        for row in rows:
+            worksheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+class SpreadsheetUploadTests(UploadTestCase):
+    ROWS = [
+        ['Customer_ID', 'Purchase_Date', 'Amount', 'City', None, 'Note'],
+        ['C1', date(2024, 1, 2), 10.5, 'Lagos'],
+        [None, None, None, None],
+        [7, date(2024, 1, 3), 3, ' Kano '],
+        ['C3', '2024-02-03', 'x', None],
+        ['C4', '03/04/2024', 12.0, 'Abuja'],
+        [None, None],
+    ]
+
+    def setUp(self):
+        self.user = User.objects.create_user('grace', password='pw')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('rfm:transaction_upload')
+
+    def post(self, content, name='transactions.xlsx', **options):
+        return self.client.post(self.url, {'file': SimpleUploadedFile(name, content), **options}, format='multipart')
+
+    def test_engines_read_like_read_excel(self):
+        content = workbook_bytes({'Notes': [['hello']], 'Data': self.ROWS})
+        expected = pd.read_excel(io.BytesIO(content), sheet_name='Data', engine='openpyxl')
+        expected.columns = ingest.normalize_columns(expected.columns)
+        expected_valid, expected_errors = ingest.validate_frame(expected, 'old', 2)
+        self.assertEqual(expected_errors, [(3, 'Missing customer_id.'), (5, "Invalid amount 'x'.")])
+        for engine in ('openpyxl', 'calamine'):
+            if not engine_available(engine):
+                continue
+            with self.subTest(engine=engine), override_settings(UPLOAD_EXCEL_ENGINE=engine):
+                frames = list(iter_sheet_frames(io.BytesIO(content), 'xlsx', 'data', chunk_size=2))
+                self.assertEqual([len(frame) for frame in frames], [2, 2, 1])
+                frame = pd.concat(frames, ignore_index=True)
+                frame.columns = ingest.normalize_columns(frame.columns)
+                valid, errors = ingest.validate_frame(frame, 'old', 2)
+                pd.testing.assert_frame_equal(valid, expected_valid)
+                self.assertEqual(errors, expected_errors)
+
+    def test_upload_reads_the_selected_sheet(self):
+        rows = [['customer_id', 'purchase_date', 'amount'], ['C1', date.today(), 10], ['C2', date.today(), 20.5]]
+        content = workbook_bytes({'Summary': [['total', 30.5]], 'Sales': rows})
+
+        first = self.post(content)
+        self.assertEqual(first.status_code, 400)
+        self.assertIn('missing required columns', first.json()['error'])
+        missing = self.post(content, sheet='Returns')
+        self.assertEqual(missing.status_code, 400)
+        self.assertEqual(missing.json()['error'], "Sheet 'Returns' not found. Available sheets: Summary, Sales.")
+
+        dry_run = self.post(content, sheet='2', dry_run='true').json()
+        self.assertEqual((dry_run['sheet'], dry_run['sheets'], dry_run['valid_rows']), ('Sales', ['Summary', 'Sales'], 2))
+        self.assertEqual(self.post(content, sheet='sales').status_code, 201)
+        self.assertEqual(Transaction.objects.for_user(self.user).count(), 2)
+
+    def test_legacy_xls(self):
+        with open(LEGACY_XLS, 'rb') as fixture:
+            content = fixture.read()
+        engines = [engine for engine in ('xlrd', 'calamine') if engine_available(engine)]
+        self.assertIn('xlrd', engines)  # a requirement, so .xls always works
+        for engine in engines:
+            with self.subTest(engine=engine), override_settings(UPLOAD_EXCEL_ENGINE=engine):
+                frame = next(iter_sheet_frames(io.BytesIO(content), 'xls'))
+                self.assertEqual(frame['customer_id'].tolist(), ['C1', 7, 'C3'])
+                self.assertEqual(frame['purchase_date'].tolist()[:2], [datetime(2024, 1, 2), datetime(2024, 1, 3)])
+                self.assertEqual(frame['amount'].tolist(), [10.5, 3, 'x'])
+
+                data = self.post(content, name='legacy.xls', dry_run='true').json()
+                self.assertEqual((data['format'], data['valid_rows'], data['sheet']), ('old', 2, 'Sales'))
+                self.assertEqual(data['sheets'], ['Sales', 'Returns'])
+                data = self.post(content, name='legacy.xls', dry_run='true', sheet='returns').json()
+                self.assertEqual((data['valid_rows'], data['sheet']), (1, 'Returns'))
+        response = self.post(content, name='legacy.xls')
+        self.assertEqual(response.status_code, 400)  # the 'x' amount
+        with mock.patch('rfm.spreadsheets.engine_available', return_value=False):
+            response = self.post(content, name='legacy.xls')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Legacy .xls files cannot be read', response.json()['error'])
+
+def parse_events(body):
+    """Helper: (event name, data) of each event in a text/event-stream body, and whether it had an id."""
+    events = []
+    for block in body.decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line and not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields['event'], json.loads(fields['data']), 'id' in fields))
+    return events
+
+
+@override_settings(EVENTS_HEARTBEAT_SECONDS=0.1, EVENTS_STREAM_SECONDS=0.5)
+class EventStreamTests(UploadTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ada', password='pw')
+        self.token = Token.objects.create(user=self.user).key
+        self.url = reverse('rfm:events')
+
+    def drain(self, subscription):
+        events = []
+        while not subscription.queue.empty():
+            event = subscription.queue.get_nowait()
+            events.append((event.name, event.data))
+        return events
+
+    def test_upload_pushes_progress_and_the_new_version(self):
+        subscription, _ = broker().subscribe(self.user.pk)
+        self.addCleanup(broker().unsubscribe, subscription)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload([('C1', 1, 2, 'Lagos', 0)])}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        events = self.drain(subscription)
+        self.assertEqual([data.get('stage') for name, data in events if name == 'upload'], ['validating', 'loading', 'loaded'])
+        self.assertIn(('dataset', {'version': 1}), events)
+
+        response = self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload([('C1', 1, 'x', 'Lagos', 0)])}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.drain(subscription)[-1][1]['stage'], 'failed')
+
+    def test_stream_resumes_after_last_event_id_and_delivers_new_events(self):
+        first = broker().publish(self.user.pk, 'upload', {'stage': 'validating'})
+        broker().publish(self.user.pk, 'upload', {'stage': 'loading'})
+        broker().publish(User.objects.create_user('other').pk, 'upload', {'stage': 'loading'})
+        versions = [0]
+
+        def later():
+            time.sleep(0.15)
+            broker().publish(self.user.pk, 'insights', {'state': 'done', 'insights': 'Keep the champions.'})
+            versions[0] = 7  # committed by another worker: no event here, the heartbeat finds it
+
+        threading.Thread(target=later).start()
+        with mock.patch('rfm.async_views.get_dataset_version', side_effect=lambda user: versions[0]):
+            response = self.client.get(f'{self.url}?token={self.token}', HTTP_LAST_EVENT_ID=str(first.id))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            events = parse_events(b''.join(response.streaming_content))
+        self.assertEqual(events, [
+            ('upload', {'stage': 'loading'}, True),
+            ('insights', {'state': 'done', 'insights': 'Keep the champions.'}, True),
+            ('dataset', {'version': 7}, False),
+        ])
+        self.assertEqual(broker().stream_count(self.user.pk), 0)
+
+    def test_stream_errors(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        self.assertEqual(self.client.get(f'{self.url}?token=nope').status_code, 401)
+        with override_settings(EVENTS_MAX_STREAMS_PER_USER=0):
+            response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(response.status_code, 429)
+
+    def test_async_stream_receives_events_published_from_threads(self):
+        async def read():
+            subscription, _ = broker().subscribe(self.user.pk, loop=asyncio.get_running_loop())
+
+            async def version():
+                return 3
+
+            chunks = stream(subscription, [], 3, version)
+            await chunks.__anext__()  # retry: ...
+            threading.Thread(target=broker().publish, args=(self.user.pk, 'warmup', {'state': 'done', 'version': 3})).start()
+            event = await chunks.__anext__()
+            keep_alive = await chunks.__anext__()
+            await chunks.aclose()
+            return event, keep_alive
+
+        event, keep_alive = asyncio.run(read())
+        self.assertEqual(parse_events(event), [('warmup', {'state': 'done', 'version': 3}, True)])
+        self.assertEqual(keep_alive, b': keep-alive\n\n')
+        self.assertEqual(broker().stream_count(self.user.pk), 0)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def run_concurrently(self, calls, release, settle=0.3):
+        """Runs the calls in threads, letting the computations finish `settle` seconds after they all started."""
+        results = [None] * len(calls)
+
+        def run(index, call):
+            try:
+                results[index] = call()
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(index, call)) for index, call in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        time.sleep(settle)
+        release.set()
+        for thread in threads:
+            thread.join(10)
+        return results
+
+    def test_concurrent_identical_calls_compute_once(self):
+        flights, release, calls = SingleFlight(), threading.Event(), []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return {'rows': 42}
+
+        results = self.run_concurrently([lambda: flights.do(('rfm', 1), compute)] * 6, release)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(flights.stats, {'computed': 1, 'shared': 5})
+        self.assertEqual(flights.in_flight(), 0)
+        flights.do(('rfm', 1), compute)  # landed flights aren't cached
+        self.assertEqual(len(calls), 2)
+
+    def test_errors_are_shared_and_retry_errors_are_not(self):
+        flights, release = SingleFlight(), threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise ValueError('boom')
+
+        results = self.run_concurrently([lambda: flights.do('k', fail)] * 3, release)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+        release.clear()
+
+        def cancelled():
+            release.wait(5)
+            raise panels.PanelCancelled()
+
+        results = self.run_concurrently(
+            [lambda: flights.do('k', cancelled, retry=(panels.PanelCancelled,))]
+            + [lambda: flights.do('k', lambda: 'recomputed', retry=(panels.PanelCancelled,))] * 2,
+            release,
+        )
+        self.assertIsInstance(results[0], panels.PanelCancelled)
+        self.assertEqual(results[1:], ['recomputed', 'recomputed'])
+
+    @unittest.skipIf(sys.platform == 'win32', 'file locks need fcntl')
+    def test_file_lock_shares_results_across_processes(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        # Two backends on one directory stand in for two worker processes
+        first, second, release = FileLockFlights(directory), FileLockFlights(directory), threading.Event()
+
+        def compute():
+            release.wait(5)
+            return pd.DataFrame({'customer_id': ['C1'], 'monetary': [10.5]})
+
+        results = self.run_concurrently(
+            [lambda: first.do(('panel', 1), compute), lambda: second.do(('panel', 1), compute)], release,
+        )
+        pd.testing.assert_frame_equal(results[0], results[1])
+        self.assertEqual(first.stats['computed'] + second.stats['computed'], 1)
+        self.assertEqual(first.stats['shared'] + second.stats['shared'], 1)
+        # A later flight doesn't pick up the earlier flight's result
+        self.assertEqual(second.do(('panel', 1), lambda: 'fresher'), 'fresher')
+
+    @unittest.skipIf(sys.platform == 'win32', 'file locks need fcntl')
+    def test_file_lock_results_are_private_and_signed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        flights = FileLockFlights(directory)
+        key = ('panel', 2)
+        result_path = os.path.join(directory, f'{hashlib.sha256(repr(key).encode()).hexdigest()}.result')
+
+        def plant(content):
+            with open(result_path, 'wb') as planted:
+                planted.write(content)
+            os.chmod(result_path, 0o600)
+            future = time.time() + 60  # as if written while this flight waited
+            os.utime(result_path, (future, future))
+
+        payload = pickle.dumps('planted')
+        plant(b'x' * 32 + payload)
+        self.assertEqual(flights.do(key, lambda: 'computed'), 'computed')  # never unpickled
+        plant(singleflight._signature(payload) + payload)
+        self.assertEqual(flights.do(key, lambda: 'computed'), 'planted')
+
+        os.chmod(directory, 0o755)  # e.g. created by someone else: not used at all
+        with mock.patch.object(FileLockFlights, '_read') as read:
+            self.assertEqual(flights.do(key, lambda: 'computed'), 'computed')
+        read.assert_not_called()
+
+    @unittest.skipIf(sys.platform == 'win32', 'file locks need fcntl')
+    def test_file_lock_flights_nest(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        flights = FileLockFlights(directory)
+
+        def stripe(key):  # the lock file the key shared with others when there were 256
+            return int(hashlib.sha256(repr(key).encode()).hexdigest()[:8], 16) % 256
+
+        outer = ('rfm_panel', 1)
+        inner = next(('rfm_table', index) for index in itertools.count() if stripe(('rfm_table', index)) == stripe(outer))
+        started = time.monotonic()
+        with self.settings(SINGLE_FLIGHT_TIMEOUT=3), mock.patch('builtins.print') as printed:
+            result = flights.do(outer, lambda: flights.do(inner, lambda: 'table') + ' panel')
+        self.assertEqual(result, 'table panel')
+        self.assertLess(time.monotonic() - started, 1)
+        printed.assert_not_called()
+
+        # Lock files of idle keys are swept; a flight waiting on a swept one takes the new file
+        for name in os.listdir(directory):
+            os.utime(os.path.join(directory, name), (0, 0))
+        flights._swept_at = 0.0
+        flights._sweep()
+        self.assertEqual([name for name in os.listdir(directory) if name.endswith('.lock')], [])
+        self.assertEqual(flights.do(outer, lambda: 'again'), 'again')
+
+    def test_cached_panels_coalesce_concurrent_misses(self):
+        user, release, calls = mock.Mock(pk=987654), threading.Event(), []
+
+        def calculate(user):
+            calls.append(user.pk)
+            release.wait(5)
+            return pd.DataFrame({'customer_id': ['C1']})
+
+        panels.clear_panel_cache()
+        self.addCleanup(panels.clear_panel_cache)
+        with mock.patch.object(panels, 'dataset_stamp', return_value=(3, timezone.now())), \
+                mock.patch.object(panels, 'calculate_rfm', calculate), \
+                mock.patch('rfm.singleflight._flights', SingleFlight()):
+            results = self.run_concurrently([lambda: panels.rfm_table(user)] * 4, release)
+        self.assertEqual(calls, [987654])
+        self.assertTrue(all(result is results[0] for result in results))
+
+
+class PartitionedAggregationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('big', password='pw')
+        rng = np.random.default_rng(7)
+        create_transactions(self.user, [
+            (f'C{customer:03d}', int(days), float(amount), 'Lagos', int(points))
+            for customer, days, amount, points in zip(
+                rng.integers(0, 80, 600), rng.integers(0, 400, 600), rng.gamma(2.0, 50.0, 600).round(2), rng.integers(0, 9, 600),
+            )
+        ])
+
+    def test_bounds_split_customers_into_disjoint_ranges(self):
+        qs = Transaction.objects.for_user(self.user)
+        bounds = partition_bounds(qs, qs.count(), 4)
+        self.assertEqual(len(bounds), 4)
+        self.assertIsNone(bounds[0][0])
+        self.assertIsNone(bounds[-1][1])
+        for (_, high), (low, _) in zip(bounds, bounds[1:]):
+            self.assertEqual(high, low)
+        sizes = [qs.filter(**{k: v for k, v in (('customer_id__gte', low), ('customer_id__lt', high)) if v}).count() for low, high in bounds]
+        self.assertEqual(sum(sizes), 600)
+        self.assertTrue(all(size > 0 for size in sizes))
+
+    def test_partitioned_results_match_the_single_pass(self):
+        with override_settings(PARTITIONED_AGGREGATION_WORKERS=1):
+            expected_rfm = calculate_rfm(self.user)
+            expected_customers = panels.customers_panel(self.user)['customers'].df
+        with override_settings(PARTITIONED_AGGREGATION_WORKERS=3, PARTITIONED_AGGREGATION_MIN_ROWS=100):
+            self.assertIsNotNone(start_partitioned_aggregation(self.user))
+            rfm = calculate_rfm(self.user)
+            customers = panels.customers_panel(self.user)['customers'].df
+        pd.testing.assert_frame_equal(rfm, expected_rfm)
+        pd.testing.assert_frame_equal(
+            customers.reset_index(drop=True), expected_customers.reset_index(drop=True), check_dtype=False,
+        )
+
+    @override_settings(PARTITIONED_AGGREGATION_WORKERS=3, PARTITIONED_AGGREGATION_MIN_ROWS=601)
+    def test_small_tenants_aggregate_in_process(self):
+        self.assertIsNone(start_partitioned_aggregation(self.user))
+
+
+class AdminTests(UploadTestCase):
+    databases = {'default', 'tenant_0', 'tenant_1'}
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('ops', 'ops@example.com', 'pw')
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        for user in (self.alice, self.bob):
+            self.client.force_authenticate(user)
+            response = self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload(SAMPLE_ROWS)})
+            self.assertEqual(response.status_code, 201, response.content)
+        self.client.force_authenticate(None)
+        self.client.force_login(self.admin)
+
+    def changelist(self, model='transaction', **params):
+        return self.client.get(reverse(f'admin:rfm_{model}_changelist'), params)
+
+    def test_changelist_never_counts_the_whole_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.changelist(**{'user__id__exact': self.alice.pk, 'q': 'C1 C2'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        counts = [query['sql'] for query in queries if 'COUNT(' in query['sql'] and 'rfm_transaction' in query['sql']]
+        self.assertTrue(counts)
+        self.assertTrue(all('LIMIT' in sql for sql in counts), counts)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=4)
+    def test_paginator_estimates_past_the_limit(self):
+        paginator = EstimatedCountPaginator(Transaction.objects.all(), 2)
+        self.assertEqual(paginator.count, 4)  # no statistics yet
+        paginator = EstimatedCountPaginator(Transaction.objects.filter(user=self.alice), 2)
+        self.assertEqual(paginator.count, 4)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE rfm_transaction')
+        self.assertEqual(table_row_estimate(Transaction, 'default'), 12)
+        self.assertEqual(EstimatedCountPaginator(Transaction.objects.all(), 2).count, 12)
+
+    @override_settings(ADMIN_BATCH_SIZE=2)
+    def test_purge_deletes_the_selected_tenants_data_in_batches(self):
+        stored = UploadedFile.objects.get(user=self.alice).file.name
+        version = DatasetVersion.objects.get(user=self.alice).version
+        row = Transaction.objects.filter(user=self.alice).first()
+        response = self.client.post(reverse('admin:rfm_transaction_changelist'), {'action': 'purge_tenants', '_selected_action': [row.pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Transaction.objects.filter(user=self.alice).exists())
+        self.assertFalse(UploadedFile.objects.filter(user=self.alice).exists())
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, stored)))
+        self.assertFalse(Leaderboard.objects.filter(user=self.alice).exists())
+        self.assertEqual(DatasetVersion.objects.get(user=self.alice).version, version + 1)
+        self.assertEqual(Transaction.objects.filter(user=self.bob).count(), len(SAMPLE_ROWS))
+
+    def test_rebuild_aggregates_from_the_tenant_list(self):
+        Leaderboard.objects.filter(user=self.bob).delete()
+        CohortRollup.objects.filter(user=self.bob).delete()
+        tenant = DatasetVersion.objects.get(user=self.bob)
+        self.client.post(reverse('admin:rfm_datasetversion_changelist'), {'action': 'rebuild_tenant_aggregates', '_selected_action': [tenant.pk]})
+        self.assertTrue(Leaderboard.objects.filter(user=self.bob).exists())
+        self.assertTrue(CohortRollup.objects.filter(user=self.bob).exists())
+
+    def test_rows_are_read_only_and_purge_needs_delete_permission(self):
+        staff = User.objects.create_user('viewer', password='pw', is_staff=True)
+        staff.user_permissions.add(Permission.objects.get(codename='view_transaction'))
+        self.client.force_login(staff)
+        response = self.changelist()
+        self.assertEqual(response.status_code, 200)
+        actions = [name for name, _ in response.context['action_form'].fields['action'].choices]
+        self.assertIn('rebuild_tenant_aggregates', actions)
+        self.assertNotIn('purge_tenants', actions)
+        self.assertNotIn('delete_selected', actions)
+        self.assertEqual(self.client.get(reverse('admin:rfm_transaction_add')).status_code, 403)
+
+    @override_settings(TENANT_SHARDS=['tenant_0', 'tenant_1'])
+    def test_lists_the_filtered_tenants_shard(self):
+        carol = User.objects.create_user('carol', password='pw')
+        self.client.force_authenticate(carol)
+        self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload(SAMPLE_ROWS[:2])})
+        alias = shard_for_user(carol)
+        self.assertNotEqual(alias, 'default')
+        self.assertEqual(self.changelist(**{'user__id__exact': carol.pk}).context['cl'].result_count, 2)
+        self.assertEqual(self.changelist(db=alias).context['cl'].result_count, 2)
+        self.assertEqual(self.changelist().context['cl'].result_count, 2 * len(SAMPLE_ROWS))
+
+
+class DatabaseProfileTests(SimpleTestCase):
+    """backend_project.databases: the DB_PROFILE connection settings."""
+
+    def test_development_keeps_django_defaults(self):
+        self.assertEqual(sqlite_database('db.sqlite3'), {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'db.sqlite3'})
+        self.assertNotIn('CONN_MAX_AGE', postgres_database())
+
+    def test_production_sqlite_runs_the_pragmas_on_connect(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = sqlite_database(os.path.join(directory, 'tuned.sqlite3'), 'production')
+            self.assertEqual(config['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+            self.assertTrue(config['CONN_HEALTH_CHECKS'])
+            wrapper = DatabaseWrapper(connections.configure_settings({'default': config})['default'], 'profile_test')
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 5000)
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            finally:
+                wrapper.close()
+
+    def test_production_replicas_leave_the_journal_alone(self):
+        config = sqlite_database('replica.sqlite3', 'production', read_only=True)
+        self.assertNotIn('journal_mode', config['OPTIONS']['init_command'])
+        self.assertNotIn('transaction_mode', config['OPTIONS'])
+
+    def test_production_postgres_persistent_or_pooled(self):
+        self.assertEqual(postgres_database('production')['CONN_MAX_AGE'], 600)
+        with mock.patch.dict(os.environ, {'DB_POOL': 'True', 'DB_POOL_MAX_SIZE': '20'}):
+            config = postgres_database('production')
+        self.assertEqual(config['OPTIONS']['pool']['max_size'], 20)
+        self.assertNotIn('CONN_MAX_AGE', config)  # Django requires 0 (the default) with a pool
+
+
+@override_settings(AI_MODEL_BACKEND='ai_insights.llm.StubModel')
+class LoadTestHarnessTests(LiveServerTestCase):
+    """The loadtest command end to end against a live test server, plus baseline comparison."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    def test_run_reports_every_route_and_compares_to_baseline(self):
+        baseline = os.path.join(self.media_root, 'baseline.json')
+        out = io.StringIO()
+        # One worker: the live server shares a single in-memory SQLite connection
+        call_command('loadtest', base_url=self.live_server_url, users=2, sessions=2, concurrency=1,
+                     rows='50,200', save_baseline=baseline, stdout=out)
+        with open(baseline) as fh:
+            report = json.load(fh)
+
+        self.assertEqual(User.objects.filter(username__startswith='loadtest-').count(), 2)
+        self.assertEqual(Transaction.objects.count(), 250)
+        self.assertEqual(report['routes']['register']['requests'], 2)
+        self.assertEqual(report['routes']['analysis']['requests'], 4)
+        for route in ('upload', 'analysis', 'analysis?segment', 'ranking', 'revenue?period=month', 'customers', 'vip', 'avg-order-value', 'ai-insights'):
+            self.assertEqual(report['routes'][route]['error_rate'], 0, route)
+        self.assertGreater(report['total']['throughput_rps'], 0)
+        self.assertIn('TOTAL', out.getvalue())
+
+        out = io.StringIO()
+        call_command('loadtest', base_url=self.live_server_url, users=1, sessions=1, concurrency=1,
+                     rows='50', baseline=baseline, skip_ai=True, stdout=out)
+        self.assertIn('throughput_rps', out.getvalue())
+        self.assertNotIn('ai-insights', out.getvalue())
+
+
+class LoadTestReportTests(SimpleTestCase):
+
+    def test_percentiles_errors_and_regressions(self):
+        samples = [('vip', 200, ms / 1000, 10) for ms in range(1, 101)] + [('vip', 500, 0.001, 0), ('vip', 304, 0.001, 0)]
+        report = summarize(samples, elapsed=2.0)
+        vip = report['routes']['vip']
+        self.assertEqual((vip['requests'], vip['errors']), (102, 1))
+        self.assertAlmostEqual(vip['p50_ms'], 49.5, delta=1)
+        self.assertAlmostEqual(vip['p99_ms'], 99, delta=1)
+        self.assertEqual(report['total']['throughput_rps'], 51.0)
+
+        slower = summarize([(route, status, seconds * 2, size) for route, status, seconds, size in samples], elapsed=4.0)
+        rows = {(route, metric): regressed for route, metric, _, _, _, regressed in compare(slower, report)}
+        self.assertTrue(rows[('vip', 'p95_ms')])
+        self.assertFalse(rows[('vip', 'error_rate')])
+        self.assertTrue(rows[('total', 'throughput_rps')])
+        self.assertFalse(any(regressed for *_, regressed in compare(report, report)))
+
+
+class LazyImportTests(SimpleTestCase):
+
+    def test_url_loading_does_not_import_heavy_modules(self):
+        script = (
+            'import django, os, sys; os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend_project.settings"); '
+            'django.setup(); import backend_project.urls; from django.urls import resolve; resolve("/api/rfm/analysis/"); '
+            'print(",".join(m for m in ("numpy", "pandas", "google.generativeai") if m in sys.modules))'
+        )
+        result = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '')
+
+    def test_lazy_module_imports_on_first_attribute_access(self):
+        module = LazyModule('json')
+        self.assertFalse(is_loaded(module))
+        self.assertEqual(module.dumps([1]), '[1]')
+        self.assertTrue(is_loaded(module))
+        self.assertIn('dumps', module.__dict__)
+
+
+def slow_panel(user, seconds=0.2, log=None, name=None):
+    """Test panel: sleeps in small steps, checking for cancellation like the real panels do."""
+    if log is not None:
+        log.append(('start', name))
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        time.sleep(0.01)
+        panels.raise_if_cancelled()
+    if log is not None:
+        log.append(('end', name))
+    return {'slept': seconds}
+
+
+class AsyncDashboardTests(TransactionTestCase):
+    """Async views run panels in pool threads (own DB connections), so data must be committed."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('grace', password='pw')
+        create_transactions(self.user, SAMPLE_ROWS)  # no aggregates yet: the panels build them
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {Token.objects.create(user=self.user).key}'}
+
+    def test_dashboard_panels_match_the_sync_endpoints(self):
+        response = self.client.get(reverse('rfm:async_dashboard') + '?period=month&k=3', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        dashboard = response.json()
+        for panel, name, query in [
+            ('analysis', 'rfm:rfm_analysis', ''), ('ranking', 'rfm:customer_ranking', '?k=3'),
+            ('revenue', 'rfm:revenue_analytics', '?period=month'), ('customers', 'rfm:customer_analytics', ''),
+            ('vip', 'rfm:vip_customers', '?k=3'), ('avg_order_value', 'rfm:avg_order_value', ''),
+        ]:
+            expected = self.client.get(reverse(name) + query, **self.auth).json()
+            if panel == 'analysis':
+                expected['summary']['filters_applied'] = {'period': 'month', 'k': '3'}
+            self.assertEqual(dashboard[panel], expected, panel)
+        self.assertEqual(set(dashboard['timings_ms']), set(panels.PANELS))
+
+        single = self.client.get(reverse('rfm:async_vip_customers') + '?k=3', **self.auth)
+        self.assertEqual(single.json(), dashboard['vip'])
+        revalidated = self.client.get(reverse('rfm:async_vip_customers') + '?k=3', HTTP_IF_NONE_MATCH=single['ETag'], **self.auth)
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_concurrent_panels_rebuild_stale_aggregates_once(self):
+        rebuild, rebuilt = leaderboards.rebuild_leaderboards, []
+
+        def slow_rebuild(user):
+            rebuilt.append(user.pk)
+            time.sleep(0.2)  # long enough for the vip panel to find the boards stale too
+            rebuild(user)
+
+        with mock.patch('rfm.leaderboards.rebuild_leaderboards', slow_rebuild):
+            response = self.client.get(reverse('rfm:async_dashboard') + '?k=3', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        dashboard = response.json()
+        self.assertEqual(rebuilt, [self.user.pk])  # the ranking and vip panels shared one rebuild
+        self.assertEqual(len(dashboard['ranking']['ranking']), 3)
+        self.assertEqual(len(dashboard['vip']['vip_customers']), 3)
+        self.assertEqual(Leaderboard.objects.filter(user=self.user, city_key='').count(), 2)
+
+    @override_settings(THROTTLE_ENABLED=True, THROTTLE_RATE=60, THROTTLE_BURST=10, THROTTLE_MAX_INFLIGHT=30)
+    def test_throttled_like_the_drf_endpoints(self):
+        state = throttle_state()
+        state.reset()
+        self.addCleanup(state.reset)
+        key = f'user:{self.user.pk}'
+        self.assertEqual(self.client.get(reverse('rfm:async_dashboard'), **self.auth).status_code, 200)
+        tokens, inflight = state.usage(key)
+        self.assertLess(tokens, 4)  # seven panels spent seven of the ten tokens
+        self.assertEqual(inflight, 0)
+
+        refused = self.client.get(reverse('rfm:async_dashboard'), **self.auth)
+        self.assertEqual(refused.status_code, 429)
+        self.assertGreaterEqual(int(refused['Retry-After']), 3)
+        self.assertEqual(self.client.get(reverse('rfm:async_vip_customers'), **self.auth).status_code, 200)
+
+        while not state.take(key, 1, rate=1, burst=10):  # drain the bucket
+            pass
+        self.assertEqual(self.client.get(reverse('rfm:async_vip_customers'), **self.auth).status_code, 429)
+        self.assertEqual(state.usage(key)[1], 0)
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(reverse('rfm:async_dashboard')).status_code, 401)
+        self.assertEqual(self.client.get(reverse('rfm:async_dashboard') + '?panels=nope', **self.auth).status_code, 400)
+        self.assertEqual(self.client.get(reverse('rfm:async_customer_ranking') + '?k=0', **self.auth).status_code, 400)
+        self.assertEqual(self.client.get(reverse('rfm:async_rfm_analysis') + '?min_monetary=abc', **self.auth).status_code, 400)
+
+    @override_settings(ASYNC_PANEL_WORKERS=4)
+    def test_independent_panels_run_concurrently(self):
+        slow = {f'slow{i}': (slow_panel, lambda params: {}) for i in range(4)}
+        with mock.patch.dict(panels.PANELS, slow):
+            started = time.perf_counter()
+            response = self.client.get(reverse('rfm:async_dashboard') + '?panels=' + ','.join(slow), **self.auth)
+            elapsed = time.perf_counter() - started
+        timings = response.json()['timings_ms']
+        # Four 200ms panels: ~800ms back to back, ~200ms when gathered
+        self.assertGreaterEqual(sum(timings.values()), 800)
+        self.assertLess(elapsed, 0.6)
+
+    @override_settings(ASYNC_PANEL_WORKERS=1)
+    def test_cancellation_stops_running_and_queued_panels(self):
+        log = []
+        requested = {f'slow{i}': {'seconds': 0.5, 'log': log, 'name': f'slow{i}'} for i in range(3)}
+
+        async def disconnect_soon():
+            task = asyncio.ensure_future(gather_panels(requested, self.user, threading.Event()))
+            await asyncio.sleep(0.1)
+            task.cancel()  # what Django does to the view when the client disconnects
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.dict(panels.PANELS, {name: (slow_panel, None) for name in requested}):
+            started = time.perf_counter()
+            asyncio.run(disconnect_soon())
+            time.sleep(0.1)  # let the running panel reach its next checkpoint
+        self.assertEqual(log, [('start', 'slow0')])
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+
+@override_settings(TENANT_SHARDS=['tenant_0', 'tenant_1'])
+class TenantShardingTests(TransactionTestCase):
+    databases = {'default', 'tenant_0', 'tenant_1'}
+    client_class = APIClient
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        # Two users that hash to different shards
+        users = [User.objects.create_user(f'tenant{i}', password='pw') for i in range(12)]
+        self.alice = users[0]
+        self.bob = next(user for user in users if hashed_shard(user.pk) != hashed_shard(self.alice.pk))
+
+    def upload(self, user, rows=SAMPLE_ROWS):
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload(rows)})
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def rows_on(self, alias, user):
+        return Transaction.objects.using(alias).filter(user=user).count()
+
+    def test_uploads_land_in_the_tenants_shard_and_reads_follow(self):
+        self.upload(self.alice)
+        self.upload(self.bob)
+        alice_shard, bob_shard = hashed_shard(self.alice.pk), hashed_shard(self.bob.pk)
+        self.assertEqual(TenantShard.objects.get(user=self.alice).alias, alice_shard)
+        self.assertEqual(self.rows_on(alice_shard, self.alice), len(SAMPLE_ROWS))
+        self.assertEqual(self.rows_on(bob_shard, self.alice), 0)
+        self.assertEqual(self.rows_on('default', self.alice), 0)
+        self.assertEqual(UploadedFile.objects.using(alice_shard).filter(user=self.alice).count(), 1)
+        self.assertEqual(self.alice.transactions.count(), len(SAMPLE_ROWS))  # router follows the relation
+
+        self.client.force_authenticate(self.alice)
+        analysis = self.client.get(reverse('rfm:rfm_analysis')).json()
+        self.assertEqual(analysis['summary']['total_customers'], 5)
+        files = self.client.get(reverse('rfm:uploaded_file_list')).json()['files']
+        self.assertEqual(self.client.get(files[0]['download_url']).status_code, 200)
+
+        bob_id = self.bob.pk
+        self.bob.delete()
+        self.assertFalse(Transaction.objects.using(bob_shard).filter(user_id=bob_id).exists())
+
+    def test_upload_is_not_blocked_by_another_tenants_open_write(self):
+        self.upload(self.alice)
+        holding, release = threading.Event(), threading.Event()
+
+        def long_write():
+            # Holds the write lock on alice's shard, like a slow bulk_create/delete would
+            with db_transaction.atomic(using=shard_for_user(self.alice)):
+                Transaction.objects.for_user(self.alice).update(city='Locked')
+                holding.set()
+                release.wait(5)
+            connections.close_all()
+
+        writer = threading.Thread(target=long_write)
+        writer.start()
+        try:
+            holding.wait(5)
+            started = time.perf_counter()
+            self.upload(self.bob)
+            self.assertLess(time.perf_counter() - started, 2)
+        finally:
+            release.set()
+            writer.join()
+        self.assertEqual(self.rows_on(hashed_shard(self.bob.pk), self.bob), len(SAMPLE_ROWS))
+
+    def test_upload_holds_no_default_transaction_during_the_shard_write(self):
+        shard, seen = hashed_shard(self.alice.pk), {}
+        queryset = type(Transaction.objects.all())
+        bulk_create, build = queryset.bulk_create, leaderboards.build_leaderboards
+
+        def record(name, call):
+            def recorded(*args, **kwargs):
+                seen.setdefault(name, (connections['default'].in_atomic_block, connections[shard].in_atomic_block))
+                return call(*args, **kwargs)
+            return recorded
+
+        with mock.patch.object(queryset, 'bulk_create', record('bulk_insert', bulk_create)), \
+                mock.patch('rfm.views.build_leaderboards', record('leaderboards', build)):
+            self.upload(self.alice)
+        self.assertEqual(seen, {'bulk_insert': (False, True), 'leaderboards': (False, False)})
+        self.assertEqual(Leaderboard.objects.filter(user=self.alice).values_list('dataset_version', flat=True).first(), 1)
+
+    def test_rebalance_moves_tenants_and_legacy_data(self):
+        self.upload(self.alice)
+        source, target = hashed_shard(self.alice.pk), hashed_shard(self.bob.pk)
+        call_command('rebalance_tenants', user=self.alice.username, to=target, stdout=io.StringIO())
+        self.assertEqual((self.rows_on(source, self.alice), self.rows_on(target, self.alice)), (0, len(SAMPLE_ROWS)))
+        self.client.force_authenticate(User.objects.get(pk=self.alice.pk))  # a fresh user, as each request gets
+        self.assertEqual(len(self.client.get(reverse('rfm:customer_analytics')).json()['customers']), 5)
+
+        # Data uploaded before sharding was enabled sits on 'default' until --auto moves it
+        with override_settings(TENANT_SHARDS=[]):
+            self.upload(self.bob)
+        self.assertEqual(self.rows_on('default', self.bob), len(SAMPLE_ROWS))
+        out = io.StringIO()
+        call_command('rebalance_tenants', auto=True, stdout=out)
+        self.assertEqual(self.rows_on(hashed_shard(self.bob.pk), self.bob), len(SAMPLE_ROWS))
+        self.assertEqual(self.rows_on('default', self.bob), 0)
+        self.assertEqual(TenantShard.objects.get(user=self.alice).alias, source)
+        self.assertIn(f'{self.bob.username}: default ->', out.getvalue())
+
+        call_command('migrate_shards', check=True, stdout=io.StringIO())
+
+
+@override_settings(READ_REPLICAS=['replica_0'], REPLICA_PIN_SECONDS=60)
+class ReadReplicaTests(TransactionTestCase):
+    """'replica_0' is a second SQLite database; tests copy rows into it to play replication."""
+    databases = {'default', 'replica_0'}
+    client_class = APIClient
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = User.objects.create_user('heidi', password='pw')
+        self.client.force_authenticate(self.user)
+
+    def upload(self, rows=SAMPLE_ROWS):
+        response = self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload(rows)})
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def unpin(self):
+        DatasetVersion.objects.filter(user=self.user).update(updated_at=timezone.now() - timedelta(minutes=5))
+
+    def replicate(self):
+        rows = list(Transaction.objects.using('default').filter(user=self.user))
+        for row in rows:
+            row._state.adding = True
+        Transaction.objects.using('replica_0').filter(user=self.user).delete()
+        Transaction.objects.using('replica_0').bulk_create(rows)
+
+    def test_reads_are_pinned_to_the_primary_right_after_an_upload(self):
+        self.upload()
+        with CaptureQueriesContext(connections['replica_0']) as replica_queries:
+            response = self.client.get(reverse('rfm:rfm_analysis'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica_queries.captured_queries, [])
+
+    def test_analytics_reads_go_to_the_replica_once_unpinned(self):
+        self.upload()
+        self.unpin()
+        # The replica hasn't caught up yet: reads really come from it
+        self.assertEqual(self.client.get(reverse('rfm:rfm_analysis')).status_code, 404)
+
+        self.replicate()
+        with CaptureQueriesContext(connections['replica_0']) as replica_queries, \
+                CaptureQueriesContext(connections['default']) as primary_queries:
+            revenue = self.client.get(reverse('rfm:revenue_analytics'))
+            analysis = self.client.get(reverse('rfm:rfm_analysis'))
+        self.assertEqual(revenue.json()['total_revenue'], 635.0)
+        self.assertEqual(analysis.json()['summary']['total_customers'], 5)
+        self.assertTrue(any('rfm_transaction' in q['sql'] for q in replica_queries.captured_queries))
+        self.assertFalse(any('rfm_transaction' in q['sql'] for q in primary_queries.captured_queries))
+        # ETags come from the primary's dataset version, never a stale replica copy
+        self.assertTrue(any('rfm_datasetversion' in q['sql'] for q in primary_queries.captured_queries))
+
+        # Writes always go to the primary
+        self.upload(SAMPLE_ROWS[:2])
+        self.assertEqual(Transaction.objects.using('default').filter(user=self.user).count(), 2)
+        self.assertEqual(self.client.get(reverse('rfm:revenue_analytics')).json()['total_revenue'], 200.0)
+
+    @override_settings(READ_REPLICAS=['replica_0', 'replica_1', 'replica_2'])
+    def test_replicas_are_used_round_robin(self):
+        picks = [next_replica() for _ in range(6)]
+        self.assertEqual(sorted(picks), sorted(['replica_0', 'replica_1', 'replica_2'] * 2))
+        self.assertEqual(picks[:3], picks[3:])
+
+
+@override_settings(PREWARM_AFTER_UPLOAD=True, AI_MODEL_BACKEND='ai_insights.llm.StubModel')
+class PrewarmTests(TransactionTestCase):
+    """The warm-up runs in a background thread with its own connection, so data must be committed."""
+    client_class = APIClient
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(panels.clear_panel_cache)
+        self.user = User.objects.create_user('ivan', password='pw')
+        self.client.force_authenticate(self.user)
+
+    def upload(self, rows):
+        response = self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload(rows)})
+        self.assertEqual(response.status_code, 201, response.content)
+        wait_for_warmup(self.user, timeout=30)
+        return response.json()
+
+    def test_dashboard_is_served_warm_after_upload(self):
+        uploaded = self.upload(SAMPLE_ROWS)
+        self.assertEqual(uploaded['warmup']['state'], 'queued')
+
+        warmup = self.client.get(reverse('rfm:warmup_status')).json()
+        self.assertEqual(warmup['state'], 'done')
+        self.assertTrue(warmup['current'])
+        self.assertIn('revenue:week', warmup['stages'])
+        self.assertTrue(all(stage['status'] == 'done' and stage['ms'] >= 0 for stage in warmup['stages'].values()))
+
+        requests = [
+            reverse('rfm:rfm_analysis'), reverse('rfm:customer_ranking'), reverse('rfm:customer_analytics'),
+            reverse('rfm:vip_customers'), reverse('rfm:avg_order_value'), reverse('rfm:cohort_retention'),
+            reverse('ai_insights:generate_insights'),
+        ] + [reverse('rfm:revenue_analytics') + f'?period={period}' for period in ['all', *panels.PERIOD_DAYS]]
+        with CaptureQueriesContext(connection) as queries:
+            warm = [self.client.get(url).json() for url in requests]
+        self.assertFalse(any('rfm_transaction' in q['sql'] for q in queries.captured_queries))
+
+        # Another worker process: nothing in its memory, but the shared cache is warm
+        panels.clear_panel_cache()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual([self.client.get(url).json() for url in requests], warm)
+        self.assertFalse(any('rfm_transaction' in q['sql'] for q in queries.captured_queries))
+
+        panels.clear_panel_cache()
+        with override_settings(PANEL_SHARED_CACHE=''):
+            cold = [self.client.get(url).json() for url in requests]
+        self.assertEqual(warm, cold)
+
+    def test_status_is_kept_for_recent_users_only(self):
+        self.upload(SAMPLE_ROWS)
+        self.assertNotIn(self.user.pk, prewarm._futures)  # dropped once finished
+        other = User.objects.create_user('judy', password='pw')
+        self.client.force_authenticate(other)
+        with mock.patch.object(prewarm, 'MAX_TRACKED_USERS', 1):
+            self.client.post(reverse('rfm:transaction_upload'), {'file': csv_upload(SAMPLE_ROWS[:2])})
+        wait_for_warmup(other, timeout=30)
+        self.assertIsNone(prewarm.warmup_status(self.user))
+        self.assertEqual(prewarm.warmup_status(other)['state'], 'done')
+
+    def test_new_upload_replaces_the_warm_payloads(self):
+        self.upload(SAMPLE_ROWS)
+        self.assertEqual(self.client.get(reverse('rfm:revenue_analytics')).json()['total_revenue'], 635.0)
+        shared = caches['default']
+        old_keys = shared.get(f'rfm:panel-index:{self.user.pk}')['keys']
+        stored = shared.get_many(old_keys)
+        self.assertEqual(len(stored), len(old_keys))
+        customers = next(value for value in stored.values() if isinstance(value, dict) and 'logs' in value)
+        # Shared with their frames encoded, not as the transactions they were computed from
+        self.assertIsInstance(customers['logs'], RenderedJSON)
+        self.assertFalse(any(isinstance(value, pd.DataFrame) for value in stored.values()))
+
+        self.upload(SAMPLE_ROWS[:2])
+        self.assertEqual(shared.get_many(old_keys), {})  # the previous dataset's entries are gone
+        self.assertEqual(self.client.get(reverse('rfm:revenue_analytics')).json()['total_revenue'], 200.0)
+        self.assertEqual(self.client.get(reverse('rfm:warmup_status')).json()['version'], 2)
@@ -0,0 +1,211 @@
+"""
+Cost-aware throttling for the DRF views (REST_FRAMEWORK['DEFAULT_THROTTLE_CLASSES']).
+
+Every request costs its view's `throttle_cost` (1 unless the view says otherwise; uploads and AI
+insights cost much more than cached reads) and each user, or client IP when anonymous, has two
+budgets:
+  * a token bucket refilled at THROTTLE_RATE cost units per minute, holding up to THROTTLE_BURST;
+  * THROTTLE_MAX_INFLIGHT cost units executing at the same time. A request over it waits up to
+    THROTTLE_QUEUE_SECONDS for running ones to finish.
+A request over either budget gets 429 with Retry-After. Budgets are per tenant, so one tenant
+re-uploading in a loop only slows itself down.
+
+State lives in THROTTLE_BACKEND, by default LocalThrottleState: this process's memory, so no
+external service is needed (each worker process enforces the limits on its own). In-flight cost
+is released by ThrottleReleaseMiddleware once the response is returned, or for a streaming
+response (the exports) once it has been sent. The async views (rfm.async_views), which DRF
+doesn't dispatch, take and release the same budgets themselves. The THROTTLE_* defaults are in
+settings.py.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+CONCURRENCY_RETRY_SECONDS = 2  # Retry-After when refused for too much work in flight
+PRUNE_SECONDS = 60  # how often idle buckets are dropped
+
+
+class LocalThrottleState:
+    """Token buckets and in-flight costs per key, in this process's memory."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._buckets = {}  # key -> (tokens, last refill monotonic time)
+        self._inflight = {}  # key -> cost units executing
+        self._pruned_at = time.monotonic()
+
+    def take(self, key, cost, rate, burst):
+        """
+        Takes `cost` tokens from the key's bucket (refilled at `rate` per second, up to `burst`).
+        Returns 0 if taken, else the seconds until enough tokens are available.
+        """
+        cost = min(cost, burst)  # a request dearer than the whole bucket is allowed from a full one
+        now = time.monotonic()
+        with self._condition:
+            if now - self._pruned_at >= PRUNE_SECONDS:
+                self._prune(now, rate, burst)
+            tokens, last = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+
+    def _prune(self, now, rate, burst):
+        """Drops the buckets that have refilled and have nothing in flight: a new bucket starts full anyway."""
+        self._pruned_at = now
+        idle = [
+            key for key, (tokens, last) in self._buckets.items()
+            if tokens + (now - last) * rate >= burst and key not in self._inflight
+        ]
+        for key in idle:
+            del self._buckets[key]
+
+    def buckets(self):
+        with self._condition:
+            return len(self._buckets)
+
+    def acquire(self, key, cost, limit, timeout=0):
+        """
+        Adds `cost` to the key's in-flight total if it stays within `limit` (or nothing else is in
+        flight), waiting up to `timeout` seconds for running requests to release. Returns True on success.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                inflight = self._inflight.get(key, 0)
+                if inflight == 0 or inflight + cost <= limit:
+                    self._inflight[key] = inflight + cost
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+
+    def release(self, key, cost):
+        with self._condition:
+            inflight = self._inflight.get(key, 0) - cost
+            if inflight > 0:
+                self._inflight[key] = inflight
+            else:
+                self._inflight.pop(key, None)
+            self._condition.notify_all()
+
+    def usage(self, key):
+        """(tokens left without refill, cost in flight) for the key."""
+        with self._condition:
+            return self._buckets.get(key, (None, None))[0], self._inflight.get(key, 0)
+
+    def reset(self):
+        with self._condition:
+            self._buckets.clear()
+            self._inflight.clear()
+            self._condition.notify_all()
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def throttle_state():
+    """The configured state backend (settings.THROTTLE_BACKEND, a dotted path), one per process."""
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = import_string(settings.THROTTLE_BACKEND)()
+        return _state
+
+
+def request_cost(request, view):
+    """The view's throttle_cost: a number, or {method: number} (methods not listed cost 1)."""
+    cost = getattr(view, 'throttle_cost', 1)
+    if isinstance(cost, dict):
+        cost = cost.get(request.method, 1)
+    return cost
+
+
+def take_budget(key, cost, label):
+    """
+    Takes `cost` from the key's in-flight and rate budgets. Returns 0 when taken (give the in-flight
+    cost back with throttle_state().release(key, cost) once the request is done), else the seconds
+    the client should wait before retrying.
+    """
+    state = throttle_state()
+    limit = settings.THROTTLE_MAX_INFLIGHT
+    if not state.acquire(key, cost, limit, timeout=settings.THROTTLE_QUEUE_SECONDS):
+        print(f"Throttled {key}: {label} (cost {cost}) over the in-flight limit of {limit}")
+        return CONCURRENCY_RETRY_SECONDS
+    wait = state.take(key, cost, settings.THROTTLE_RATE / 60, settings.THROTTLE_BURST)
+    if wait:
+        state.release(key, cost)
+        print(f"Throttled {key}: {label} (cost {cost}) over the rate budget")
+        return wait
+    return 0
+
+
+class CostThrottle(BaseThrottle):
+    """Refuses requests over the user's rate or in-flight cost budget (see the module docstring)."""
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        if not settings.THROTTLE_ENABLED:
+            return True
+        cost = request_cost(request, view)
+        if not cost:
+            return True
+        user = request.user
+        key = f'user:{user.pk}' if user and user.is_authenticated else f'ip:{self.get_ident(request)}'
+        wait = take_budget(key, cost, view.__class__.__name__)
+        if wait:
+            self.retry_after = wait
+            return False
+        # Released by ThrottleReleaseMiddleware after the view returned
+        slots = getattr(request._request, 'throttle_slots', [])
+        slots.append((throttle_state(), key, cost))
+        request._request.throttle_slots = slots
+        return True
+
+    def wait(self):
+        return math.ceil(self.retry_after) if self.retry_after else None
+
+
+class ThrottleReleaseMiddleware:
+    """
+    Releases the in-flight cost CostThrottle took for the request, whatever the outcome: once the
+    response is returned, or for a streaming response once the server closes it (it is sent).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            slots = getattr(request, 'throttle_slots', ())
+            if response is not None and response.streaming and slots:
+                self._release_on_close(response, slots)
+            else:
+                _release(slots)
+        return response
+
+    def _release_on_close(self, response, slots):
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                _release(slots)
+        response.close = close_and_release
+
+
+def _release(slots):
+    for state, key, cost in slots:
+        state.release(key, cost)
@@ -0,0 +1,191 @@
+"""
+Revenue per day for the revenue and customers graphs, and downsampling of those graphs.
+
+At ingest, encode_daily_rollup() reduces the transactions to one entry per purchase day (DailyRollup),
+so a graph is a slice of that series instead of a scan and groupby of every transaction. With
+`max_points`, the series is downsampled with Largest-Triangle-Three-Buckets (LTTB): the first and
+last days are kept, and from each of max_points - 2 buckets in between the day that forms the
+largest triangle with its neighbours. Peaks and troughs survive, unlike with averaging, and the
+payload has a fixed size however long the history is.
+"""
+import io
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.db import transaction as db_transaction
+
+from .lazy import LazyModule
+from .models import DailyRollup, Transaction
+from .versioning import dataset_stamp, get_dataset_version, rebuild_stale
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+ARRAYS = {'day': 'int32', 'revenue': 'float64', 'orders': 'int32'}
+MAX_LOADED = 32  # decoded series kept per process
+MIN_POINTS = 3  # LTTB keeps the first and last points plus at least one bucket
+MAX_POINTS = 5000
+
+
+def parse_max_points(value):
+    """Validates a `max_points` query parameter: None (all points), or an integer in [MIN_POINTS, MAX_POINTS]."""
+    if value in (None, ''):
+        return None
+    try:
+        points = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('max_points must be an integer.')
+    if not MIN_POINTS <= points <= MAX_POINTS:
+        raise ValueError(f'max_points must be between {MIN_POINTS} and {MAX_POINTS}.')
+    return points
+
+
+def build_daily(df):
+    """(first_day, arrays) from a transactions DataFrame with purchase_date and amount."""
+    dates = pd.to_datetime(df['purchase_date'], errors='coerce')
+    amounts = pd.to_numeric(df['amount'], errors='coerce').fillna(0).astype(float)
+    frame = pd.DataFrame({'purchase_date': dates.dt.normalize(), 'amount': amounts.to_numpy()}).dropna(subset=['purchase_date'])
+    if frame.empty:
+        return None, {name: np.array([], dtype=dtype) for name, dtype in ARRAYS.items()}
+    daily = frame.groupby('purchase_date', sort=True)['amount'].agg(['sum', 'size'])
+    first = daily.index[0]
+    arrays = {
+        'day': ((daily.index - first).days).to_numpy(dtype='int32'),
+        'revenue': daily['sum'].to_numpy(dtype='float64'),
+        'orders': daily['size'].to_numpy(dtype='int32'),
+    }
+    return first.date(), arrays
+
+
+def encode_daily_rollup(df):
+    """The DailyRollup fields for a transactions DataFrame, ready to save."""
+    first_day, arrays = build_daily(df)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return {'first_day': first_day, 'data': buffer.getvalue()}
+
+
+def store_daily_rollup(user, df, version):
+    """Replaces the user's daily series with one built from `df`."""
+    save_daily_rollup(user, encode_daily_rollup(df), version)
+
+
+def save_daily_rollup(user, fields, version):
+    """Replaces the user's daily series with `fields` (encode_daily_rollup)."""
+    with db_transaction.atomic():
+        DailyRollup.objects.update_or_create(user=user, defaults={**fields, 'dataset_version': version})
+
+
+def rebuild_daily_rollup(user):
+    """Rebuilds the series from the stored transactions (for data that predates it)."""
+    df = pd.DataFrame.from_records(
+        Transaction.objects.for_user(user).values('purchase_date', 'amount'), columns=['purchase_date', 'amount'],
+    )
+    store_daily_rollup(user, df, get_dataset_version(user))
+
+
+class DailySeries:
+    """A decoded DailyRollup."""
+
+    def __init__(self, first_day, arrays):
+        self.first_day = first_day
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_model(cls, rollup):
+        with np.load(io.BytesIO(bytes(rollup.data))) as data:
+            arrays = {name: data[name] for name in ARRAYS}
+        return cls(rollup.first_day, arrays)
+
+    def graph(self, start=None, max_points=None):
+        """
+        Revenue per purchase day from `start` on, as a purchase_date/amount DataFrame of at most
+        max_points rows, and the number of days before downsampling.
+        """
+        first = 0
+        if start is not None:
+            first = int(np.searchsorted(self.day, (start - self.first_day).days, side='left'))
+        days, revenue = self.day[first:], self.revenue[first:]
+        total = len(days)
+        if max_points is not None and total > max_points:
+            keep = lttb(days, revenue, max_points)
+            days, revenue = days[keep], revenue[keep]
+        dates = [self.first_day + timedelta(days=int(offset)) for offset in days]
+        return pd.DataFrame({'purchase_date': dates, 'amount': revenue}), total
+
+
+def lttb(x, y, points):
+    """Indices of the `points` samples Largest-Triangle-Three-Buckets keeps of the series (x ascending)."""
+    count = len(x)
+    if points >= count or points < MIN_POINTS:
+        return np.arange(count)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    # Bucket edges over the points between the first and the last
+    edges = np.floor(np.linspace(1, count - 1, points - 1)).astype(np.intp)
+    kept = np.empty(points, dtype=np.intp)
+    kept[0], kept[-1] = 0, count - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        if bucket + 2 < len(edges):
+            next_start, next_end = end, max(edges[bucket + 2], end + 1)
+            next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # Twice the triangle area between the previous kept point, each candidate and the next bucket's mean
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+_loaded = OrderedDict()  # user pk -> (dataset stamp, DailySeries)
+_loaded_lock = threading.Lock()
+
+
+def daily_series(user):
+    """
+    The user's decoded series for the current dataset, or None when they have no transactions.
+    Rebuilt from the transactions only if it is missing or predates the dataset.
+    """
+    stamp = dataset_stamp(user)
+    version = stamp[0] if stamp else 0
+    with _loaded_lock:
+        cached = _loaded.get(user.pk)
+        if cached is not None and cached[0] == stamp:
+            _loaded.move_to_end(user.pk)
+            return cached[1]
+
+    built_for = DailyRollup.objects.filter(user=user).values_list('dataset_version', flat=True).first()
+    if built_for != version:
+        if built_for is None and not Transaction.objects.for_user(user).exists():
+            return None
+        rebuild_stale(user, 'daily_rollup', rebuild_daily_rollup)
+    stored = DailyRollup.objects.filter(user=user).first()
+    if stored is None or stored.first_day is None:
+        return None
+    series = DailySeries.from_model(stored)
+    if stored.dataset_version != version:
+        return series  # the dataset changed meanwhile; don't keep this one
+    with _loaded_lock:
+        _loaded[user.pk] = (stamp, series)
+        _loaded.move_to_end(user.pk)
+        while len(_loaded) > MAX_LOADED:
+            _loaded.popitem(last=False)
+    return series
+
+
+def revenue_graph(user, start=None, max_points=None):
+    """(purchase_date/amount DataFrame, days before downsampling); an empty frame without data."""
+    series = daily_series(user)
+    if series is None:
+        return pd.DataFrame(columns=['purchase_date', 'amount']), 0
+    return series.graph(start=start, max_points=max_points)
+
+
+def clear_loaded_series():
+    with _loaded_lock:
+        _loaded.clear()
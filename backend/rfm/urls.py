@@ -1,18 +1,38 @@
 from django.urls import path
-from .views import TransactionUploadView, RFMAnalysisView, CustomerRankingView, UploadedFileListView, UploadedFileDownloadView
-from .analytics_endpoints import RevenueAnalyticsView, CustomerAnalyticsView, VIPCustomersView, AvgOrderValueView
+from .views import TransactionUploadView, RFMAnalysisView, CustomerRankingView, UploadedFileListView, UploadedFileDownloadView, WarmupStatusView, ExportView, SegmentRulesView, MemoryProfileView
+from .analytics_endpoints import (
+    RevenueAnalyticsView, CustomerAnalyticsView, VIPCustomersView, AvgOrderValueView, CohortRetentionView, CustomerSearchView, CustomerDetailView,
+)
+from .async_views import async_panel_view, dashboard_view, events_view
 
 app_name = 'rfm'
 
 urlpatterns = [
     path('upload/', TransactionUploadView.as_view(), name='transaction_upload'),
+    path('warmup/', WarmupStatusView.as_view(), name='warmup_status'),
+    path('debug/memory/', MemoryProfileView.as_view(), name='memory_profiles'),
     path('uploaded-files/', UploadedFileListView.as_view(), name='uploaded_file_list'),
     path('uploaded-files/<int:file_id>/download/', UploadedFileDownloadView.as_view(), name='uploaded_file_download'),
+    path('export/<str:dataset>.<str:file_format>', ExportView.as_view(), name='export'),
     path('analysis/', RFMAnalysisView.as_view(), name='rfm_analysis'),
+    path('segment-rules/', SegmentRulesView.as_view(), name='segment_rules'),
     path('ranking/', CustomerRankingView.as_view(), name='customer_ranking'),
     path('analytics/revenue/', RevenueAnalyticsView.as_view(), name='revenue_analytics'),
     path('analytics/customers/', CustomerAnalyticsView.as_view(), name='customer_analytics'),
+    path('customers/search/', CustomerSearchView.as_view(), name='customer_search'),
+    path('customers/<path:customer_id>/', CustomerDetailView.as_view(), name='customer_detail'),
     path('analytics/vip/', VIPCustomersView.as_view(), name='vip_customers'),
     path('analytics/avg-order-value/', AvgOrderValueView.as_view(), name='avg_order_value'),
+    path('analytics/cohorts/', CohortRetentionView.as_view(), name='cohort_retention'),
+    # Async variants (best served through asgi.py): panels run in a bounded pool, dashboard gathers them concurrently
+    path('async/dashboard/', dashboard_view, name='async_dashboard'),
+    path('events/', events_view, name='events'),  # server-sent events (rfm.events)
+    path('async/analysis/', async_panel_view('analysis'), name='async_rfm_analysis'),
+    path('async/ranking/', async_panel_view('ranking'), name='async_customer_ranking'),
+    path('async/analytics/revenue/', async_panel_view('revenue'), name='async_revenue_analytics'),
+    path('async/analytics/customers/', async_panel_view('customers'), name='async_customer_analytics'),
+    path('async/analytics/vip/', async_panel_view('vip'), name='async_vip_customers'),
+    path('async/analytics/avg-order-value/', async_panel_view('avg_order_value'), name='async_avg_order_value'),
+    path('async/analytics/cohorts/', async_panel_view('cohorts'), name='async_cohort_retention'),
 ]
 
@@ -0,0 +1,46 @@
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .events import publish
+from .models import DatasetVersion
+from .singleflight import coalesce
+
+
+def get_dataset_version(user):
+    """
+    Returns the current dataset version for a user (0 if the user never uploaded).
+    This is a single indexed lookup and never touches the Transaction table.
+    """
+    version = DatasetVersion.objects.filter(user=user).values_list('version', flat=True).first()
+    return version or 0
+
+
+def dataset_stamp(user):
+    """
+    (version, updated_at) for a user's dataset, or None if they never uploaded. Unlike the bare
+    version it also tells apart datasets of different users that happened to reuse a primary key.
+    """
+    return DatasetVersion.objects.filter(user=user).values_list('version', 'updated_at').first()
+
+
+def bump_dataset_version(user):
+    """
+    Increments the user's dataset version. Call this whenever the user's transactions change.
+    Returns the new version; its `dataset` event (rfm.events) is published once the change commits.
+    """
+    with db_transaction.atomic():
+        DatasetVersion.objects.get_or_create(user=user)
+        DatasetVersion.objects.filter(user=user).update(version=F('version') + 1, updated_at=timezone.now())
+        version = get_dataset_version(user)
+        db_transaction.on_commit(lambda: publish(user, 'dataset', version=version))
+    return version
+
+
+def rebuild_stale(user, name, rebuild):
+    """
+    Runs rebuild(user) for an aggregate found stale, once for every request that finds it stale at
+    the same time (rfm.singleflight): the dashboard's panels read the same aggregates concurrently,
+    and would otherwise each replace the same rows.
+    """
+    coalesce(('rebuild', name, user.pk, dataset_stamp(user)), lambda: rebuild(user))
@@ -1,217 +1,264 @@
-import pandas as pd
-from datetime import datetime
-from decimal import Decimal, InvalidOperation
-
+from django.conf import settings
 from django.db import transaction as db_transaction
 from rest_framework import views, status, permissions
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 
 from .models import Transaction, UploadedFile
-from .serializers import RFMScoreSerializer
-from .rfm_analysis import calculate_rfm
+from .conditional import conditional_on_dataset
+from .replicas import read_from_replica
+from .versioning import bump_dataset_version, get_dataset_version
+from .ingest import (
+    UploadFormatError, collect_members, is_archive, parse_max_errors, parse_members, sniff_upload, validate_upload,
+)
+from .leaderboards import build_leaderboards, parse_k, save_leaderboards
+from .cohorts import encode_cohort_rollup, save_cohort_rollup
+from .timeseries import encode_daily_rollup, save_daily_rollup
+from .sharding import assign_shard
+from .panels import cached_panel
+from .prewarm import schedule_warmup, warmup_status
+from .events import publish
+from .memprofile import add_timings, stage
+from .lazy import LazyModule
+
+pd = LazyModule('pandas') # Imported on first use, not at URL loading
 
 class CustomerRankingView(views.APIView):
     """
-    API view to return a ranking of customers by total paid, including city. Supports filtering by city via ?city=<city>.
+    API view to return a ranking of customers by total paid, including city. Supports filtering by city via ?city=<city>
+    and the ranking size via ?k=<n> (default 10). Served from the leaderboards precomputed at upload time.
     """
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_on_dataset
+    @read_from_replica
     def get(self, request, *args, **kwargs):
         user = request.user
         city = request.query_params.get('city', None)
-        transactions = Transaction.objects.filter(user=user)
-        if city:
-            transactions = transactions.filter(city__iexact=city)
-        if not transactions.exists():
-            return Response({'ranking': [], 'message': 'No transactions found.'}, status=status.HTTP_200_OK)
-        df = pd.DataFrame.from_records(
-            transactions.values('customer_id', 'city', 'amount')
-        )
-        if df.empty:
-            return Response({'ranking': [], 'message': 'No transactions found.'}, status=status.HTTP_200_OK)
-        df['amount'] = pd.to_numeric(df['amount'])
-        ranking_df = df.groupby(['customer_id', 'city'], as_index=False)['amount'].sum()
-        ranking_df = ranking_df.rename(columns={'amount': 'total_paid'})
-        ranking_df = ranking_df.sort_values(by='total_paid', ascending=False)
-        ranking_df = ranking_df.head(10)  # Only top 10
-        ranking = ranking_df.to_dict('records')
-        return Response({'ranking': ranking}, status=status.HTTP_200_OK)
+        try:
+            k = parse_k(request.query_params.get('k'), default=10)
+        except ValueError as e:
+            return Response({'error': f'Invalid value for k. {e}'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(cached_panel('ranking', user, k=k, city=city or None), status=status.HTTP_200_OK)
 
 class TransactionUploadView(views.APIView):
     """
     API view for uploading customer transaction data via CSV or Excel file.
     Requires authentication. Deletes previous transactions for the user upon new upload.
     Expects columns: customer_id, purchase_date, amount
+    (or Relationship ID, Date Clean, amount (100kg), price_per_kg, city).
+
+    Several files can be sent at once (repeated `file` fields) or as a ZIP archive of CSV/Excel
+    files, e.g. one export per city or month: they are parsed in parallel (UPLOAD_PARSE_WORKERS
+    processes), each gets its own error report, and their union replaces the user's transactions
+    in one go. Nothing is loaded if any file has errors.
+
+    Options (form fields or query parameters):
+        max_errors: stop validating once this many row errors were found (default UPLOAD_MAX_ERRORS),
+            per file.
+        dry_run=true: validate the whole file and report counts, detected format, date range and
+            sample errors, without saving anything.
+        sheet: the spreadsheet sheet to read, by name or position (1 is the first; the default).
+
+    Progress (validating, loading, loaded or failed) is pushed to the user's event stream (rfm.events).
     """
     permission_classes = [permissions.IsAuthenticated]
+    throttle_cost = {'POST': 20}  # parse, validate and rewrite the whole dataset
     parser_classes = (MultiPartParser, FormParser)
 
     def post(self, request, *args, **kwargs):
         if 'file' not in request.FILES:
             return Response({'error': 'No file provided.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        file = request.FILES['file']
+        uploads = request.FILES.getlist('file')
         user = request.user
-        file_name = file.name.lower()
-
-        # Save uploaded file for download/view later
-        uploaded_file_obj = UploadedFile.objects.create(
-            user=user,
-            file=file,
-            original_filename=file.name
-        )
-
+        dry_run = str(request.data.get('dry_run', request.query_params.get('dry_run', ''))).lower() in ('1', 'true', 'yes')
         try:
-            # Read file using pandas
-            if file_name.endswith('.csv'):
-                df = pd.read_csv(file)
-            elif file_name.endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(file, engine='openpyxl')
-            else:
-                return Response({'error': 'Unsupported file type. Please upload a CSV or Excel file (.xlsx, .xls).'}, status=status.HTTP_400_BAD_REQUEST)
-
-            if df.empty:
-                 return Response({'error': 'The uploaded file is empty or could not be read.'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # --- Validate Required Columns Exist ---
-            # Normalize column names from file for checking
-            df.columns = [col.lower().strip() for col in df.columns]
-
-            # Accept both old and new column names
-            # Map new spreadsheet columns to model fields
-            col_map = {
-                'customer_id': ['customer_id', 'relationship id'],
-                'purchase_date': ['purchase_date', 'date clean'],
-                'amount_100kg': ['amount (100kg)', 'amount_100kg'],
-                'price_per_kg': ['price_per_kg', 'price per kg', 'price per_kg'],
-                'city': ['city'],
-            }
+            max_errors = parse_max_errors(request.data.get('max_errors', request.query_params.get('max_errors')))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        sheet = request.data.get('sheet', request.query_params.get('sheet')) or None
+        response = self.upload(user, uploads, max_errors, dry_run, sheet)
+        if response.status_code >= 400 and not dry_run:
+            publish(user, 'upload', stage='failed', error=response.data.get('error', 'The file has errors.'),
+                    error_count=response.data.get('error_count'))
+        return response
+
+    def upload(self, user, uploads, max_errors, dry_run, sheet):
+        try:
+            if len(uploads) > 1 or is_archive(uploads[0].name):
+                return self.post_many(user, uploads, max_errors, dry_run, sheet)
+
+            file = uploads[0]
+            # Cheap format check on the first few KB before any full parse
+            with stage('sniff'):
+                sniffed = sniff_upload(file, file.name, sheet=sheet)
+
+            if dry_run:
+                report = validate_upload(file, sniffed, max_errors, keep_rows=False, stop_early=False)
+                return Response({'dry_run': True, **report.summary(), 'sheets': sniffed['sheets']}, status=status.HTTP_200_OK)
+
+            # First write for this user: pick their tenant shard (no-op when sharding is off)
+            shard = assign_shard(user)
+
+            # Save uploaded file for download/view later
+            UploadedFile.objects.using(shard).create(
+                user=user,
+                file=file,
+                original_filename=file.name
+            )
 
-            # Check for required columns (new format)
-            required_new = [col_map['customer_id'], col_map['purchase_date'], col_map['amount_100kg'], col_map['price_per_kg'], col_map['city']]
-            required_new_flat = [item for sublist in required_new for item in sublist]
-            has_new_format = all(any(col in df.columns for col in col_list) for col_list in required_new)
-
-            # Check for required columns (old format)
-            required_old = {'customer_id', 'purchase_date', 'amount'}
-            has_old_format = required_old.issubset(set(df.columns))
-
-            if not has_new_format and not has_old_format:
-                error_msg = "File is missing required columns. Acceptable formats: (1) 'Relationship ID', 'Date Clean', 'amount (100kg)', 'price_per_kg', 'city' OR (2) 'customer_id', 'purchase_date', 'amount'."
-                return Response({'error': error_msg}, status=status.HTTP_400_BAD_REQUEST)
-
-            transactions_to_create = []
-            errors = []
-
-            for i, row in df.iterrows():
-                try:
-                    if has_new_format:
-                        # Flexible column access for new format
-                        def get_col(row, options):
-                            for col in options:
-                                if col in row and not pd.isna(row[col]):
-                                    return row[col]
-                            return None
-                        customer_id = str(get_col(row, col_map['customer_id'])).strip()
-                        purchase_date_input = get_col(row, col_map['purchase_date'])
-                        amount_100kg = get_col(row, col_map['amount_100kg'])
-                        price_per_kg = get_col(row, col_map['price_per_kg'])
-                        city = str(get_col(row, col_map['city'])).strip() if get_col(row, col_map['city']) else ''
-                        # New fields
-                        product_type = str(row.get('product_type', '')).strip() if 'product_type' in row else ''
-                        loyalty_points = int(row.get('loyalty_points', 0)) if 'loyalty_points' in row and not pd.isna(row['loyalty_points']) else 0
-                        # Compute amount
-                        try:
-                            amount = Decimal(str(amount_100kg)) * Decimal(str(price_per_kg))
-                        except Exception:
-                            errors.append(f"Row {i+2}: Invalid amount_100kg or price_per_kg.")
-                            continue
-                    else:
-                        # Old format
-                        customer_id = str(row['customer_id']).strip()
-                        purchase_date_input = row['purchase_date']
-                        amount = Decimal(str(row['amount']).strip())
-                        city = ''
-                        product_type = str(row.get('product_type', '')).strip() if 'product_type' in row else ''
-                        loyalty_points = int(row.get('loyalty_points', 0)) if 'loyalty_points' in row and not pd.isna(row['loyalty_points']) else 0
-                        amount_100kg = None
-                        price_per_kg = None
-
-                    if pd.isna(customer_id) or not customer_id:
-                        errors.append(f"Row {i+2}: Missing customer_id.")
-                        continue
-
-                    # Attempt to parse date
-                    if pd.isna(purchase_date_input):
-                        errors.append(f"Row {i+2}: Missing purchase_date.")
-                        continue
-                    elif isinstance(purchase_date_input, datetime):
-                        purchase_date = purchase_date_input.date()
-                    else:
-                        try:
-                            parsed_dt = pd.to_datetime(str(purchase_date_input).strip())
-                            purchase_date = parsed_dt.date()
-                        except (ValueError, TypeError):
-                            errors.append(f"Row {i+2}: Invalid purchase_date format '{purchase_date_input}'. Could not parse.")
-                            continue
-
-                    if has_new_format:
-                        if pd.isna(amount_100kg) or pd.isna(price_per_kg):
-                            errors.append(f"Row {i+2}: Missing amount_100kg or price_per_kg.")
-                            continue
-                        try:
-                            amount_100kg_val = Decimal(str(amount_100kg))
-                            price_per_kg_val = Decimal(str(price_per_kg))
-                        except Exception:
-                            errors.append(f"Row {i+2}: Invalid amount_100kg or price_per_kg format.")
-                            continue
-                    else:
-                        amount_100kg_val = None
-                        price_per_kg_val = None
-
-                    transactions_to_create.append(
-                        Transaction(
-                            user=user,
-                            customer_id=customer_id,
-                            purchase_date=purchase_date,
-                            amount=amount,
-                            city=city,
-                            product_type=product_type,
-                            amount_100kg=amount_100kg_val,
-                            price_per_kg=price_per_kg_val,
-                            loyalty_points=loyalty_points
-                        )
-                    )
-                except KeyError as e:
-                     errors.append(f"Row {i+2}: Missing expected column '{e}'. Required: customer_id, purchase_date, amount.")
-                except Exception as e:
-                    errors.append(f"Row {i+2}: Error processing row - {type(e).__name__}: {e}")
-
-            if errors:
-                return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
-
-            if not transactions_to_create:
+            publish(user, 'upload', stage='validating', files=[file.name])
+            with stage('read_and_validate'):
+                report = validate_upload(file, sniffed, max_errors)
+                add_timings(**report.timings)  # reading and validating alternate chunk by chunk
+            if report.error_count:
+                return Response({
+                    'errors': report.errors,
+                    'error_count': report.error_count,
+                    'errors_truncated': report.errors_truncated,
+                    'rows_checked': report.rows_checked,
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            if not report.valid_rows:
                  return Response({'error': 'File contains no valid transaction data after processing.'}, status=status.HTTP_400_BAD_REQUEST)
 
-            # --- Database Operation ---
-            with db_transaction.atomic():
-                Transaction.objects.filter(user=user).delete()
-                Transaction.objects.bulk_create(transactions_to_create)
-
-            return Response(
-                {'message': f'Successfully uploaded and processed {len(transactions_to_create)} transactions.'},
-                status=status.HTTP_201_CREATED
-            )
+            publish(user, 'upload', stage='loading', rows=report.valid_rows)
+            count, version = replace_transactions(user, shard, report.frame)
+            publish(user, 'upload', stage='loaded', rows=count, version=version)
+            response_data = {'message': f'Successfully uploaded and processed {count} transactions.'}
+            return Response(self.with_warmup(response_data, user, version), status=status.HTTP_201_CREATED)
 
+        except UploadFormatError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except pd.errors.EmptyDataError:
              return Response({'error': 'The uploaded file is empty.'}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             print(f"Error processing upload for user {user.id}: {e}")
             return Response({'error': f'An unexpected error occurred during file processing: {e}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def post_many(self, user, uploads, max_errors, dry_run, sheet=None):
+        """Several files and/or ZIP archives: parse members in parallel, load their union atomically."""
+        members, skipped = collect_members(uploads)
+        if not dry_run:
+            publish(user, 'upload', stage='validating', files=[name for name, _ in members])
+        with stage('read_and_validate'):
+            results = parse_members(members, max_errors, keep_rows=not dry_run, stop_early=not dry_run, sheet=sheet)
+            # Summed over the files, which may have been parsed in parallel
+            add_timings(**{name: sum(result['timings'].get(name, 0.0) for result in results) for name in ('read_file', 'validate')})
+        reports = [{'file': result['file'], 'error': result['error'], **(result['summary'] or {})} for result in results]
+
+        if dry_run:
+            return Response({'dry_run': True, 'files': reports, 'skipped': skipped}, status=status.HTTP_200_OK)
+        failed = [report['file'] for report in reports if report['error'] or report['error_count']]
+        if failed:
+            return Response({
+                'error': f'{len(failed)} of {len(reports)} files have errors; nothing was loaded.',
+                'files': reports,
+                'skipped': skipped,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        frames = [result['frame'] for result in results if result['frame'] is not None and not result['frame'].empty]
+        if not frames:
+            return Response({'error': 'Files contain no valid transaction data after processing.', 'files': reports}, status=status.HTTP_400_BAD_REQUEST)
+
+        shard = assign_shard(user)
+        for upload in uploads:
+            upload.seek(0)
+            UploadedFile.objects.using(shard).create(user=user, file=upload, original_filename=upload.name)
+        rows = pd.concat(frames, ignore_index=True)
+        publish(user, 'upload', stage='loading', rows=len(rows))
+        count, version = replace_transactions(user, shard, rows)
+        publish(user, 'upload', stage='loaded', rows=count, version=version)
+        response_data = {
+            'message': f'Successfully uploaded and processed {count} transactions from {len(frames)} files.',
+            'files': reports,
+            'skipped': skipped,
+        }
+        return Response(self.with_warmup(response_data, user, version), status=status.HTTP_201_CREATED)
+
+    def with_warmup(self, response_data, user, version):
+        if getattr(settings, 'PREWARM_AFTER_UPLOAD', True):
+            # Precompute the dashboard in the background; progress at /api/rfm/warmup/
+            schedule_warmup(user, version)
+            response_data['warmup'] = {'state': 'queued', 'version': version, 'status_url': '/api/rfm/warmup/'}
+        return response_data
+
+
+def replace_transactions(user, shard, valid):
+    """
+    Replaces the user's transactions with the validated rows (ingest.TRANSACTION_COLUMNS).
+    Returns (rows written, new dataset version).
+    """
+    with stage('build_objects'):
+        transactions_to_create = build_transactions(user, valid)
+
+    # The aggregates are built before any transaction opens, so no write lock waits on pandas
+    with stage('leaderboards'):
+        boards = build_leaderboards(valid)
+    with stage('cohort_rollup'):
+        cohort_rollup = encode_cohort_rollup(valid)
+    with stage('daily_rollup'):
+        daily_rollup = encode_daily_rollup(valid)
+
+    # --- Database Operation ---
+    # Transactions are written to the user's shard; the version, leaderboards and rollups
+    # live on 'default'. The shard commits first, so a version bump never precedes its data,
+    # and the short 'default' transaction doesn't hold its write lock during the bulk insert.
+    with db_transaction.atomic(using=shard):
+        with stage('bulk_insert'):
+            Transaction.objects.for_user(user).delete()
+            Transaction.objects.using(shard).bulk_create(transactions_to_create)
+    with stage('store_aggregates'), db_transaction.atomic():
+        version = bump_dataset_version(user)
+        save_leaderboards(user, boards, version)
+        save_cohort_rollup(user, cohort_rollup, version)
+        save_daily_rollup(user, daily_rollup, version)
+    return len(transactions_to_create), version
+
+
+def build_transactions(user, valid):
+    """Unsaved Transaction objects for the validated rows."""
+    return [
+        Transaction(
+            user=user,
+            customer_id=customer_id,
+            purchase_date=purchase_date,
+            amount=amount,
+            city=city,
+            product_type=product_type,
+            amount_100kg=amount_100kg,
+            price_per_kg=price_per_kg,
+            loyalty_points=loyalty_points
+        )
+        for customer_id, purchase_date, amount, city, product_type, amount_100kg, price_per_kg, loyalty_points in zip(
+            valid['customer_id'], valid['purchase_date'].dt.date, valid['amount'], valid['city'],
+            valid['product_type'], valid['amount_100kg'], valid['price_per_kg'], valid['loyalty_points'].tolist(),
+        )
+    ]
+
+
+class WarmupStatusView(views.APIView):
+    """
+    Progress of the post-upload warm-up (rfm.prewarm): overall state (queued, running, done, failed,
+    superseded), per-stage status and timings in milliseconds, and whether it is for the current dataset.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_cost = 0  # polled while the warm-up runs; a dictionary read
+
+    def get(self, request, *args, **kwargs):
+        warmup = warmup_status(request.user)
+        if warmup is None:
+            return Response({'state': 'idle', 'message': 'No warm-up has run for this user in this process.'}, status=status.HTTP_200_OK)
+        warmup['current'] = warmup['version'] == get_dataset_version(request.user)
+        return Response(warmup, status=status.HTTP_200_OK)
+
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
 
-from django.http import FileResponse
+from .exports import CONTENT_TYPES, DATASETS, ExportError, export_stream, parquet_available, parse_filters
 
 class UploadedFileListView(views.APIView):
     """
@@ -220,7 +267,7 @@ class UploadedFileListView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        files = UploadedFile.objects.filter(user=request.user).order_by('-uploaded_at')
+        files = UploadedFile.objects.for_user(request.user).order_by('-uploaded_at')
         file_list = [
             {
                 'id': f.id,
@@ -240,7 +287,7 @@ class UploadedFileDownloadView(views.APIView):
 
     def get(self, request, file_id, *args, **kwargs):
         try:
-            uploaded_file = UploadedFile.objects.get(id=file_id, user=request.user)
+            uploaded_file = UploadedFile.objects.for_user(request.user).get(id=file_id)
             response = FileResponse(uploaded_file.file.open('rb'), as_attachment=True, filename=uploaded_file.original_filename)
             return response
         except UploadedFile.DoesNotExist:
@@ -254,6 +301,8 @@ class RFMAnalysisView(views.APIView):
     """
     permission_classes = [permissions.IsAuthenticated]
 
+    @conditional_on_dataset
+    @read_from_replica
     def get(self, request, *args, **kwargs):
         print("--- RFMAnalysisView GET method entered ---") # Keep log for debugging 404
         user = request.user
@@ -261,54 +310,111 @@ class RFMAnalysisView(views.APIView):
         min_monetary = request.query_params.get('min_monetary', None)
 
         try:
-            rfm_results_df = calculate_rfm(user)
-
-            if rfm_results_df is None or rfm_results_df.empty:
+            try:
+                response_data = cached_panel(
+                    'analysis', user, segment=segment_filter or None, min_monetary=min_monetary or None,
+                    filters_applied=request.query_params.dict(),
+                )
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            if response_data is None:
                 # Check if transactions exist at all for this user
-                if not Transaction.objects.filter(user=user).exists():
+                if not Transaction.objects.for_user(user).exists():
                      return Response({"message": "No transaction data found for this user. Please upload a file."}, status=status.HTTP_404_NOT_FOUND)
                 else:
                      # Data exists but RFM calculation resulted in empty df (shouldn't normally happen)
                      return Response({"message": "Could not calculate RFM data."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-
-            # Apply filters if provided
-            filtered_df = rfm_results_df.copy()
-            if segment_filter:
-                filtered_df = filtered_df[filtered_df['segment'].str.lower() == segment_filter.lower()]
-            if min_monetary:
-                try:
-                    min_monetary_val = Decimal(min_monetary)
-                    filtered_df['monetary'] = pd.to_numeric(filtered_df['monetary'], errors='coerce')
-                    filtered_df.dropna(subset=['monetary'], inplace=True) # Drop rows where conversion failed
-                    filtered_df = filtered_df[filtered_df['monetary'] >= min_monetary_val]
-                except (InvalidOperation, ValueError):
-                    return Response({'error': 'Invalid value for min_monetary filter.'}, status=status.HTTP_400_BAD_REQUEST)
-
-            if filtered_df.empty and (segment_filter or min_monetary):
-                 # Only return this message if filters were actually applied and resulted in no matches
-                 return Response({"message": "No customers match the specified filters.", "rfm_data": [], "summary": rfmAnalysis.summary if rfmAnalysis else {}}, status=status.HTTP_200_OK)
-
-
-            results_list = filtered_df.to_dict('records')
-            serializer = RFMScoreSerializer(results_list, many=True)
-
-            # Prepare summary statistics based on the *original* unfiltered data
-            original_segment_counts = rfm_results_df['segment'].value_counts().to_dict()
-            total_customers_unfiltered = len(rfm_results_df)
-
-            response_data = {
-                'rfm_data': serializer.data,
-                'summary': {
-                    'total_customers': total_customers_unfiltered,
-                    'segment_counts': original_segment_counts,
-                    'filters_applied': request.query_params,
-                    'filtered_results_count': len(results_list)
-                }
-            }
-
             return Response(response_data, status=status.HTTP_200_OK)
 
         except Exception as e:
             print(f"Error during RFM analysis for user {user.id}: {e}")
             return Response({'error': f'An error occurred during RFM analysis: {e}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ExportView(views.APIView):
+    """
+    Streams the user's RFM table, customer totals or raw transactions as a file:
+    /api/rfm/export/<rfm|customers|transactions>.<csv|xlsx|parquet>
+    Optional ?segment=<name> and ?min_monetary=<amount> keep only the matching customers (by RFM
+    segment and total spend) in any of the three datasets.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_cost = 5
+
+    @read_from_replica
+    def get(self, request, dataset, file_format, *args, **kwargs):
+        if dataset not in DATASETS:
+            return Response({'error': f'Unknown export {dataset!r}. Available: {", ".join(DATASETS)}.'}, status=status.HTTP_404_NOT_FOUND)
+        if file_format not in CONTENT_TYPES:
+            return Response({'error': f'Unsupported format {file_format!r}. Use one of: {", ".join(CONTENT_TYPES)}.'}, status=status.HTTP_400_BAD_REQUEST)
+        user = request.user
+        if not Transaction.objects.for_user(user).exists():
+            return Response({"message": "No transaction data found for this user. Please upload a file."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            segment, min_monetary = parse_filters(request.query_params)
+            if file_format == 'parquet' and not parquet_available():
+                return Response({'error': 'Parquet export requires pyarrow, which is not installed on this server.'}, status=status.HTTP_501_NOT_IMPLEMENTED)
+            stream = export_stream(user, dataset, file_format, segment=segment, min_monetary=min_monetary)
+        except ExportError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(stream, content_type=CONTENT_TYPES[file_format])
+        filename = f'{dataset}_{timezone.now().date().isoformat()}.{file_format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+from .rfm_analysis import SEGMENT_MAP
+from .segment_rules import SegmentRuleError, delete_rule_set, save_rule_set
+from .models import SegmentRuleSet
+
+class SegmentRulesView(views.APIView):
+    """
+    The user's own RFM segmentation rules (rfm.segment_rules).
+    GET returns the saved rule set (or the built-in segment names), PUT replaces it with
+    {"rules": [...], "default_segment": "Other"} and DELETE goes back to the built-in segments.
+    Saving or deleting starts a new dataset version, so cached RFM results and ETags refresh.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        rule_set = SegmentRuleSet.objects.filter(user=request.user).first()
+        if rule_set is None:
+            builtin = list(dict.fromkeys([*SEGMENT_MAP.values(), 'Other']))
+            return Response({'custom': False, 'rules': [], 'builtin_segments': builtin}, status=status.HTTP_200_OK)
+        return Response({
+            'custom': True, 'rules': rule_set.rules, 'default_segment': rule_set.default_segment,
+            'updated_at': rule_set.updated_at,
+        }, status=status.HTTP_200_OK)
+
+    def put(self, request, *args, **kwargs):
+        try:
+            rule_set = save_rule_set(request.user, request.data)
+        except SegmentRuleError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'custom': True, **rule_set, 'dataset_version': get_dataset_version(request.user)}, status=status.HTTP_200_OK)
+
+    def delete(self, request, *args, **kwargs):
+        if not delete_rule_set(request.user):
+            return Response({'error': 'No custom segment rules to delete.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+from .memprofile import recent_profiles, sample_rate
+
+class MemoryProfileView(views.APIView):
+    """
+    Recent memory profiles from this process (rfm.memprofile), newest first: per stage the wall time,
+    RSS before/after and peak, peak traced Python memory and top allocators. ?limit=<n> (default 20).
+    Staff only; profiles are only recorded while MEMORY_PROFILE_SAMPLE_RATE is above 0.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    throttle_cost = 0
+
+    def get(self, request, *args, **kwargs):
+        limit = request.query_params.get('limit') or '20'
+        if not limit.isdigit() or int(limit) < 1:
+            return Response({'error': 'Invalid value for limit. It must be a positive integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'sample_rate': sample_rate(), 'profiles': recent_profiles(int(limit))}, status=status.HTTP_200_OK)